@@ -0,0 +1,118 @@
+"""
+Benchmark of the payload codecs (JsonPayload.CODECS): size on the wire and CPU time.
+
+The data points are the rows of the CSV logs of the machines (stored_data.csv of the examples by default:
+VarName, VarValue and Timestamp), published one per message (single) and in batches of --batch points
+(batch, the MQTT sink with "batch": true). For each codec:
+    - single_bytes: mean payload size of one data point
+    - batch_bytes: mean payload size per data point in the batches
+    - encode_us, batch_encode_us: CPU time to encode one data point, alone and in a batch
+    - decode_us: CPU time to decode one data point of the batches
+    - ratio: batch size relative to the json batches
+
+Usage: python benchmarks/bench_codec.py [--csv stored_data.csv ...] [--batch 50] [--repeat 5] [--json results.json]
+"""
+import argparse
+import csv
+import glob
+import json
+import os
+import sys
+import time
+
+# Runs from a checkout without pip install -e .: fablab_lib is in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fablab_lib.Broker.JsonPayload.function import CODECS
+
+SAMPLES = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'example', '*', 'home', 'pi', '**', 'stored_data.csv')
+
+
+def _value(text):
+    for kind in (int, float):
+        try:
+            return kind(text)
+        except ValueError:
+            pass
+    return text
+
+
+def load_records(paths):
+    records = []
+    for path in paths:
+        with open(path, newline='', encoding='utf-8') as file:
+            for row in csv.DictReader(file):
+                records.append((row['VarName'], _value(row['VarValue']), row['Timestamp']))
+    return records
+
+
+def _best(func, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.process_time()
+        func()
+        elapsed = time.process_time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def bench_codec(codec, records, batchSize, repeat):
+    batches = [records[i:i + batchSize] for i in range(0, len(records), batchSize)]
+    singles = [codec.encode(*record) for record in records]
+    payloads = [payload for batch in batches for payload in codec.encode_batch(batch)]
+
+    # the decoded points are the same as the encoded ones (the compact codecs keep milliseconds)
+    decoded = [point for payload in payloads for point in codec.decode(payload)]
+    assert [(p['name'], p['value']) for p in decoded] == [(r[0], r[1]) for r in records]
+
+    def encode():
+        for record in records:
+            codec.encode(*record)
+
+    def encode_batches():
+        for batch in batches:
+            codec.encode_batch(batch)
+
+    def decode():
+        for payload in payloads:
+            codec.decode(payload)
+
+    count = len(records)
+    return {'codec': codec.name,
+            'single_bytes': sum(map(len, singles)) / count,
+            'batch_bytes': sum(map(len, payloads)) / count,
+            'encode_us': _best(encode, repeat) / count * 1e6,
+            'batch_encode_us': _best(encode_batches, repeat) / count * 1e6,
+            'decode_us': _best(decode, repeat) / count * 1e6}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--csv', nargs='*', help='CSV logs of LogFileCSV (default: the stored_data.csv of the examples)')
+    parser.add_argument('--batch', type=int, default=50, help='data points per batch')
+    parser.add_argument('--repeat', type=int, default=5, help='runs of each measure, the best one is kept')
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+
+    paths = args.csv or sorted(glob.glob(SAMPLES, recursive=True))
+    records = load_records(paths)
+    if not records:
+        parser.error('No data points in the CSV files.')
+    print(f'{len(records)} data points from {len(paths)} files, batches of {args.batch}')
+
+    results = [bench_codec(codec, records, args.batch, args.repeat) for codec in CODECS.values()]
+    reference = results[0]['batch_bytes']
+    print('{:<20} {:>9} {:>9} {:>7} {:>10} {:>10} {:>10}'.format(
+        'codec', 'single B', 'batch B', 'ratio', 'enc us', 'batch us', 'dec us'))
+    for r in results:
+        r['ratio'] = r['batch_bytes'] / reference
+        print('{:<20} {:>9.1f} {:>9.1f} {:>7.2f} {:>10.2f} {:>10.2f} {:>10.2f}'.format(
+            r['codec'], r['single_bytes'], r['batch_bytes'], r['ratio'], r['encode_us'], r['batch_encode_us'], r['decode_us']))
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump({'files': paths, 'records': len(records), 'batch': args.batch, 'results': results}, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
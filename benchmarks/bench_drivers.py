@@ -0,0 +1,327 @@
+"""
+End-to-end benchmark of the PLC drivers and of the scan sinks against local simulators.
+
+Each driver wrapper (fablab_lib.PLC_*) is connected to its simulator (benchmarks/simulators.py), started
+in a separate process so the CPU time measured here is only the one of the driver and of the scan engine.
+The tags are scanned back to back with ScanEngine.scan(), so the change detection is included, for
+--duration seconds. The sinks are measured the same way with one driver (--sink-driver) and each sink
+added to the engine: the MQTT sink publishes to the broker stand-in one message per value (mqtt) or one
+message per scan cycle (mqtt-batch), the CSV sink writes to a temporary file (it needs pandas, like LogFileCSV).
+
+Measured for each run:
+    - tags_per_s: tags read per second
+    - cycle_p50_ms, cycle_p99_ms: duration of one scan cycle (read, change detection and sinks)
+    - bytes_per_cycle: application bytes on the wire per cycle, both directions, counted by the simulator
+      (TCP/IP headers excluded; None for s7, the snap7 server has no counters)
+    - cpu_us_per_tag: CPU time of this process per tag read
+    - changes, messages: changed values sent to the sinks and messages received by the broker stand-in
+    - rtt_p50_ms, rtt_p99_ms: round trip of each driver request, with --instrument only (the driver
+      instrumentation of fablab_lib.Metrics adds its own overhead to the CPU time)
+
+The results are printed as a table and written as JSON with --json. With --baseline, the results are
+compared to a previous JSON file and the script exits with status 1 when a run is slower than the
+baseline by more than --tolerance (tags_per_s, cycle_p99_ms or cpu_us_per_tag).
+
+Usage: python benchmarks/bench_drivers.py [--drivers mc,fins,eip,s7] [--sinks callback,mqtt,mqtt-batch,csv]
+       [--tags 100] [--duration 5] [--latency 0.002] [--jitter 0.0005] [--json results.json]
+       [--baseline previous.json --tolerance 0.1] [--instrument]
+"""
+import argparse
+import contextlib
+from datetime import datetime
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import socket
+import sys
+import tempfile
+import time
+
+# Runs from a checkout without pip install -e .: fablab_lib is in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fablab_lib.Metrics.function import Histogram, metrics, enable_instrumentation, disable_instrumentation
+from fablab_lib.Scan.function import ScanEngine, TagGroup, ScanTag, MQTTSink, CSVSink, CallbackSink
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import simulators
+
+HOST = '127.0.0.1'
+PERIOD = 1.0                # key of the scanned group, the cycles run back to back
+S7_MAX_TAGS = 50            # DB1 of the snap7 server is 100 bytes
+
+
+def _free_port(kind=socket.SOCK_STREAM):
+    with socket.socket(socket.AF_INET, kind) as sock:
+        sock.bind((HOST, 0))
+        return sock.getsockname()[1]
+
+
+def _mc(port, count):
+    from fablab_lib.PLC.Mitsubishi.mcprotocol.Ethernet.function import PLC
+    plc = PLC(HOST, port)
+    plc.connect()
+    return plc, [ScanTag(f'D{100 + i}', f'D{100 + i}', 'h') for i in range(count)]
+
+
+def _fins(port, count):
+    from fablab_lib.PLC.Omron.fins.Ethernet.function import PLC
+    plc = PLC(HOST, 0, 0, port=port, bind_port=0)
+    plc.connect()
+    return plc, [ScanTag(f'D{100 + i}', (100 + i).to_bytes(2, 'big') + b'\x00', 'WORD') for i in range(count)]
+
+
+def _eip(port, count):
+    from fablab_lib.PLC.Rockwell_AB.logix.Ethernet.function import PLC
+    plc = PLC(HOST, port)
+    plc.connect()
+    return plc, [ScanTag(f'Tag_{i}', f'Tag_{i}') for i in range(count)]
+
+
+def _s7(port, count):
+    from fablab_lib.PLC.Siemens.snap7.Ethernet.function import PLC
+    plc = PLC(HOST, port=port)
+    plc.connect()
+    return plc, [ScanTag(f'VW{2 * i}', f'VW{2 * i}') for i in range(min(count, S7_MAX_TAGS))]
+
+
+# driver -> (simulator, socket type, connect function, instrumented vendor)
+DRIVERS = {
+    'mc': ('mc', socket.SOCK_STREAM, _mc, 'mitsubishi'),
+    'fins': ('fins', socket.SOCK_DGRAM, _fins, 'omron'),
+    'eip': ('eip', socket.SOCK_STREAM, _eip, 'logix'),
+    's7': ('s7', socket.SOCK_STREAM, _s7, 's7'),
+}
+
+
+class SimulatorProcess:
+    """
+    Runs a simulator in a separate process, returns its counters when stopped
+    """
+
+    def __init__(self, kind, sockType=socket.SOCK_STREAM, **kwargs):
+        self.port = _free_port(sockType)
+        self._ready = multiprocessing.Event()
+        self._stop = multiprocessing.Event()
+        self._stats = multiprocessing.Queue()
+        self._process = multiprocessing.Process(target=simulators.serve, args=(kind, self.port),
+                                                kwargs=dict(kwargs, ready=self._ready, stats=self._stats, stop=self._stop),
+                                                daemon=True)
+
+    def __enter__(self):
+        self._process.start()
+        deadline = time.monotonic() + 10
+        while not self._ready.wait(0.1):
+            if not self._process.is_alive() or time.monotonic() > deadline:
+                raise RuntimeError('The simulator did not start.')
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def stop(self):
+        if not self._process.is_alive():
+            return {}
+        self._stop.set()
+        try:
+            stats = self._stats.get(timeout=5)
+        except Exception:
+            stats = {}
+        self._process.join(5)
+        return stats
+
+
+def _make_sink(name, brokerPort, tmpDir):
+    if name == 'callback':
+        return CallbackSink(lambda kind, tagName, addr, value, timestamp: None), None
+    if name in ('mqtt', 'mqtt-batch'):
+        from fablab_lib.Broker.MQTT.function import MQTT
+        client = MQTT(HOST, brokerPort)
+        client.standardTopic = 'bench/'
+        if not client.connect():
+            raise ConnectionError('MQTT broker stand-in not reachable.')
+        return MQTTSink(client, batch=name == 'mqtt-batch'), client.disconnect
+    if name == 'csv':
+        from fablab_lib.LogData.function import LogFileCSV
+        return CSVSink(LogFileCSV(tmpDir + os.sep, 'bench.csv')), None
+    raise ValueError(f'Unknown sink {name}')
+
+
+def run_scan(plc, tags, duration, sink=None, instrument=None):
+    """
+    Scans the tags back to back for duration seconds.
+
+    Returns:
+        dict: cycles, tags, seconds, cpu, changes, the cycle histogram and the driver round trips.
+    """
+    engine = ScanEngine(plc)
+    engine.add_group(TagGroup('bench', PERIOD, tags))
+    if sink is not None:
+        engine.add_sink(sink)
+    # first scan: connection, tag type discovery, initial values
+    engine.scan(PERIOD)
+    changes = engine.stats()[PERIOD]['changes']
+
+    if instrument is not None:
+        metrics.reset()
+        enable_instrumentation([instrument])
+    histogram = Histogram()
+    cycles = 0
+    cpu = time.process_time()
+    start = now = time.perf_counter()
+    deadline = start + duration
+    try:
+        while now < deadline:
+            engine.scan(PERIOD)
+            end = time.perf_counter()
+            histogram.record(end - now)
+            now = end
+            cycles += 1
+    finally:
+        cpu = time.process_time() - cpu
+        if instrument is not None:
+            disable_instrumentation()
+
+    return {'cycles': cycles,
+            'tags': cycles * len(tags),
+            'seconds': now - start,
+            'cpu': cpu,
+            'changes': engine.stats()[PERIOD]['changes'] - changes,
+            'cycle': histogram,
+            'rtt': metrics.histogram(f'plc.{instrument}.rtt') if instrument is not None else None}
+
+
+def _result(name, driver, sink, run, simStats, brokerStats=None):
+    cycles = max(run['cycles'], 1)
+    # the simulator also counted the connection and the first scan
+    wire = simStats.get('bytes_received', 0) + simStats.get('bytes_sent', 0) if simStats else None
+    result = {'name': name,
+              'driver': driver,
+              'sink': sink,
+              'tags': run['tags'] // cycles,
+              'cycles': run['cycles'],
+              'tags_per_s': run['tags'] / run['seconds'] if run['seconds'] else 0.0,
+              'cycle_p50_ms': run['cycle'].percentile(50) * 1e3,
+              'cycle_p99_ms': run['cycle'].percentile(99) * 1e3,
+              'bytes_per_cycle': wire / (run['cycles'] + 1) if wire is not None else None,
+              'cpu_us_per_tag': run['cpu'] / max(run['tags'], 1) * 1e6,
+              'changes': run['changes'],
+              'messages': brokerStats.get('messages') if brokerStats else None}
+    if run['rtt'] is not None:
+        result['rtt_p50_ms'] = run['rtt'].percentile(50) * 1e3
+        result['rtt_p99_ms'] = run['rtt'].percentile(99) * 1e3
+    return result
+
+
+def bench_driver(driver, args, sinkName=None):
+    """
+    Runs one driver, alone or with a sink, against its simulator
+    """
+    kind, sockType, connect, vendor = DRIVERS[driver]
+    simArgs = {} if kind == 's7' else dict(latency=args.latency, jitter=args.jitter, changes=args.changes)
+    name = f'sink.{sinkName}' if sinkName else f'driver.{driver}'
+    broker = SimulatorProcess('mqtt', latency=args.latency, jitter=args.jitter) if sinkName in ('mqtt', 'mqtt-batch') else None
+
+    with tempfile.TemporaryDirectory() as tmpDir, SimulatorProcess(kind, sockType, **simArgs) as simulator, \
+            broker if broker is not None else contextlib.nullcontext():
+        sink, stop = _make_sink(sinkName, broker.port if broker else None, tmpDir) if sinkName else (None, None)
+        plc, tags = connect(simulator.port, args.tags)
+        run = run_scan(plc, tags, args.duration, sink, vendor if args.instrument else None)
+        if stop is not None:
+            stop()
+        brokerStats = broker.stop() if broker is not None else None
+        simStats = simulator.stop()
+    return _result(name, driver, sinkName, run, simStats if kind != 's7' else None, brokerStats)
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compares the results to a baseline, returns the list of regressions
+    """
+    previous = {result['name']: result for result in baseline.get('results', []) if 'skipped' not in result}
+    regressions = []
+    for result in results:
+        old = previous.get(result['name'])
+        if old is None or 'skipped' in result:
+            continue
+        if result['tags_per_s'] < old['tags_per_s'] * (1 - tolerance):
+            regressions.append(f"{result['name']}: tags_per_s {old['tags_per_s']:.0f} -> {result['tags_per_s']:.0f}")
+        for key in ('cycle_p99_ms', 'cpu_us_per_tag'):
+            if result[key] > old[key] * (1 + tolerance):
+                regressions.append(f"{result['name']}: {key} {old[key]:.3f} -> {result[key]:.3f}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--drivers', default='mc,fins,eip,s7', help='comma separated drivers among ' + ','.join(DRIVERS))
+    parser.add_argument('--sinks', default='callback,mqtt,mqtt-batch,csv',
+                        help='comma separated sinks among callback,mqtt,mqtt-batch,csv, or none')
+    parser.add_argument('--sink-driver', default='mc', help='driver used to benchmark the sinks')
+    parser.add_argument('--tags', type=int, default=100, help='tags read per scan cycle')
+    parser.add_argument('--duration', type=float, default=5.0, help='seconds of scanning per run')
+    parser.add_argument('--latency', type=float, default=0.0, help='mean answer delay of the simulators in seconds')
+    parser.add_argument('--jitter', type=float, default=0.0, help='uniform jitter of the answer delay in seconds')
+    parser.add_argument('--changes', type=int, default=simulators.CHANGES, help='values changed by the simulators every tick')
+    parser.add_argument('--instrument', action='store_true', help='measure the driver round trips (adds overhead)')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--baseline', help='previous results to compare to')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='allowed relative regression (default 0.1)')
+    args = parser.parse_args()
+
+    # the drivers log every connection, keep the output readable
+    logging.disable(logging.INFO)
+
+    runs = [(driver, None) for driver in args.drivers.split(',') if driver]
+    if args.sinks != 'none':
+        runs += [(args.sink_driver, sink) for sink in args.sinks.split(',') if sink]
+
+    results = []
+    for driver, sink in runs:
+        name = f'sink.{sink}' if sink else f'driver.{driver}'
+        try:
+            result = bench_driver(driver, args, sink)
+        except Exception as e:
+            # e.g. libsnap7 or pandas not installed
+            result = {'name': name, 'driver': driver, 'sink': sink, 'skipped': f'{type(e).__name__}: {e}'}
+        results.append(result)
+
+    print('{:<16} {:>6} {:>10} {:>9} {:>9} {:>11} {:>9} {:>8}'.format(
+        'run', 'tags', 'tags/s', 'p50 ms', 'p99 ms', 'bytes/cyc', 'cpu us/t', 'changes'))
+    for r in results:
+        if 'skipped' in r:
+            print('{:<16} skipped ({})'.format(r['name'], r['skipped']))
+            continue
+        print('{:<16} {:>6} {:>10.0f} {:>9.3f} {:>9.3f} {:>11} {:>9.1f} {:>8}'.format(
+            r['name'], r['tags'], r['tags_per_s'], r['cycle_p50_ms'], r['cycle_p99_ms'],
+            '-' if r['bytes_per_cycle'] is None else '{:.0f}'.format(r['bytes_per_cycle']),
+            r['cpu_us_per_tag'], r['changes']))
+
+    report = {'metadata': {'timestamp': datetime.now().isoformat(timespec='seconds'),
+                           'python': platform.python_version(),
+                           'platform': platform.platform(),
+                           'cpu_count': os.cpu_count(),
+                           'tags': args.tags,
+                           'duration': args.duration,
+                           'latency': args.latency,
+                           'jitter': args.jitter,
+                           'changes': args.changes,
+                           'instrument': args.instrument},
+              'results': results}
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(report, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        for regression in regressions:
+            print('REGRESSION ' + regression)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
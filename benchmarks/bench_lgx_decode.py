@@ -0,0 +1,99 @@
+"""
+Benchmark of the pylogix multi-service reply decoding.
+
+Decodes a 4000-byte CIP Multiple Service Packet reply (the size of a Large Forward Open
+connection) holding DINT, REAL and bit-of-word replies, with the current parser
+(memoryview + precompiled structs) and with the previous slicing parser as reference.
+
+Usage: python benchmarks/bench_lgx_decode.py [--repeat N]
+"""
+import argparse
+import os
+import struct
+import sys
+import timeit
+
+# Runs from a checkout without pip install -e .: fablab_lib is in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fablab_lib.PLC.Rockwell_AB.logix.Ethernet.pylogix.eip import PLC, bit_of_word, bit_of_word_state
+from fablab_lib.PLC.Rockwell_AB.logix.Ethernet.pylogix.lgx_response import Response
+import fablab_lib.PLC.Rockwell_AB.logix.Ethernet.pylogix.eip as eip
+
+REPLY_SIZE = 4000
+
+
+def build_reply(size=REPLY_SIZE):
+    """
+    Build a multi-service reply of about size bytes, returns (tags, reply)
+    """
+    tags = []
+    replies = []
+    # 50 bytes of EIP/CIP header, service count, one offset and one reply per tag
+    used = 50 + 2
+    i = 0
+    while True:
+        kind = i % 3
+        if kind == 0:
+            tag, reply = 'Counter_{}'.format(i), struct.pack('<BBBBBBi', 0xcc, 0, 0, 0, 0xc4, 0, i)
+        elif kind == 1:
+            tag, reply = 'Setting_{}'.format(i), struct.pack('<BBBBBBf', 0xcc, 0, 0, 0, 0xca, 0, i / 10)
+        else:
+            tag, reply = 'Alarm_{}.{}'.format(i, i % 32), struct.pack('<BBBBBBi', 0xcc, 0, 0, 0, 0xc4, 0, i)
+        if used + 2 + len(reply) > size:
+            break
+        used += 2 + len(reply)
+        tags.append(tag)
+        replies.append(reply)
+        i += 1
+
+    offset = 2 + 2 * len(replies)
+    offsets = b''
+    for reply in replies:
+        offsets += struct.pack('<H', offset)
+        offset += len(reply)
+    data = bytes(46) + struct.pack('<BBBB', 0x8a, 0, 0, 0) + struct.pack('<H', len(replies)) + offsets + b''.join(replies)
+    return tags, data
+
+
+def reference_parse_multi_read(plc, tags, data):
+    """
+    The previous parser: copies the packet and unpacks field by field with format strings
+    """
+    stripped = data[50:]
+    reply = []
+    for i, tag in enumerate(tags):
+        offset = struct.unpack_from('<H', stripped, 2 + (i * 2))[0]
+        status = struct.unpack_from('<b', stripped, offset + 2)[0]
+        data_type = struct.unpack_from('<B', stripped, offset + 4)[0]
+        tag_name, base_tag, index = eip._parse_tag_name(tag)
+        plc.KnownTags[base_tag] = (data_type, 0)
+        type_fmt = plc.CIPTypes[data_type][2]
+        val = struct.unpack_from(type_fmt, stripped, offset + 6)[0]
+        if bit_of_word(tag):
+            val = bit_of_word_state(tag, val)
+        reply.append(Response(tag, val, status))
+    return reply
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=2000, help='number of decodes per run')
+    args = parser.parse_args()
+
+    plc = PLC()
+    tags, data = build_reply()
+
+    current = plc._parse_multi_read(tags, data)
+    reference = reference_parse_multi_read(plc, tags, data)
+    assert [r.Value for r in current] == [r.Value for r in reference]
+
+    print('Reply: {} bytes, {} tags'.format(len(data), len(tags)))
+    for name, func in (('reference', lambda: reference_parse_multi_read(plc, tags, data)),
+                       ('current', lambda: plc._parse_multi_read(tags, data))):
+        seconds = min(timeit.repeat(func, number=args.repeat, repeat=5)) / args.repeat
+        print('{:<10} {:8.1f} us/reply {:10.0f} tags/s'.format(name, seconds * 1e6, len(tags) / seconds))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""
+Benchmark of the logic equation evaluation used by PLC.checkLogicBits.
+
+Compares the previous implementation (str.replace + eval on every call) with LogicExpr
+(parsed once, evaluated as closures) on the machine status equations of task_machineStatus_process,
+and checks that both give the same result for every combination of the status bits.
+
+Usage: python benchmarks/bench_logic_expr.py [--repeat N]
+"""
+import argparse
+import itertools
+import os
+import sys
+import timeit
+
+# Runs from a checkout without pip install -e .: fablab_lib is in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fablab_lib.Logic.function import LogicExpr
+
+# Machine status equations of the WB_P1_MNC example, over 5 status bits
+EQUATIONS = {
+    'Run': 'a.d.(/c).(/e)',
+    'Idle': 'e.(/d).(/c)',
+    'Alarm': 'c',
+    'Setup': 'b.d.(/c).(/e)',
+    'PowerOn': 'f',
+    'Mixed': '/a|(b.c)|d',
+}
+
+
+def get_variables_from_equation(equation):
+    return sorted(set(char for char in equation if char.isalpha()))
+
+
+def reference_convert_logic_equation(bits, equation):
+    """
+    The previous implementation of convert_logic_equation (without its logging)
+    """
+    lsVariables = get_variables_from_equation(equation)
+    for chr_ in lsVariables:
+        if chr_.isalpha() and chr_.lower() in 'abcdefghijklmnopqrstuvwxyz':
+            equation = equation.replace(chr_, str(int(bits[ord(chr_) - 97])))
+    equation = equation.replace('.', ' and ')
+    equation = equation.replace('|', ' or ')
+    equation = equation.replace('/', ' not ')
+    equation = ' '.join(equation.split())
+    return bool(eval(equation))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=100000, help='number of evaluations per run')
+    args = parser.parse_args()
+
+    for bits in itertools.product((False, True), repeat=6):
+        for equation in EQUATIONS.values():
+            assert LogicExpr.compile(equation)(bits) == reference_convert_logic_equation(bits, equation), equation
+
+    bits = [True, False, False, True, False, True]
+    print('{:<8} {:>14} {:>14} {:>14}'.format('', 'eval (us)', 'compile (us)', 'compiled (us)'))
+    for name, equation in EQUATIONS.items():
+        expr = LogicExpr.compile(equation)
+        results = []
+        for func in (lambda: reference_convert_logic_equation(bits, equation),
+                     lambda: LogicExpr.compile(equation)(bits),
+                     lambda: expr(bits)):
+            results.append(min(timeit.repeat(func, number=args.repeat, repeat=5)) / args.repeat * 1e6)
+        print('{:<8} {:>14.3f} {:>14.3f} {:>14.3f}'.format(name, *results))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""
+Benchmark of the publish policies of the MQTT wrapper (MQTT.PUBLISH_PRESETS) and of the paho inflight window.
+
+Publishes --messages data points of --tags tags with MQTT.publish_data() to the broker stand-in
+(benchmarks/simulators.py), started in a separate process with an acknowledgement delay of --latency seconds
+(the round trip to the broker). The tags have the kinds of a machine: 70% Counter, 20% Alarm, 10% Setting,
+and a machineStatus. Each preset is run with each inflight window of --inflight.
+
+Measured for each run:
+    - msg_per_s: data points published per second, until paho holds no message waiting for its PUBACK
+      (the QoS 0 messages don't wait, the broker stand-in counts them in delivered)
+    - publish_us: time of one publish_data() call in the publishing thread
+    - qos1, retained: share of the messages sent with QoS 1 and with the retain flag
+    - delivered: messages received by the broker stand-in
+
+Usage: python benchmarks/bench_mqtt_policy.py [--messages 10000] [--tags 200] [--latency 0.005]
+       [--presets retained,telemetry,best_effort] [--inflight 20,100] [--json results.json]
+"""
+import argparse
+from datetime import datetime
+import json
+import logging
+import os
+import platform
+import sys
+import time
+
+# Runs from a checkout without pip install -e .: fablab_lib is in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fablab_lib.Broker.MQTT.function import MQTT, PUBLISH_PRESETS
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_drivers import SimulatorProcess, HOST
+
+KINDS = ['Counter'] * 7 + ['Alarm'] * 2 + ['Setting']
+TIMEOUT = 120.0             # seconds to wait for the last PUBACK of a run
+
+
+def build_points(tags):
+    points = [('machineStatus', 'MachineStatus')]
+    points += [(f'{KINDS[i % len(KINDS)]}_{i}', KINDS[i % len(KINDS)]) for i in range(tags - 1)]
+    return points
+
+
+def bench_policy(preset, inflight, args):
+    points = build_points(args.tags)
+    with SimulatorProcess('mqtt', latency=args.latency) as broker:
+        client = MQTT(HOST, broker.port, policies=preset, max_inflight=inflight)
+        client.standardTopic = 'bench/'
+        if not client.connect():
+            raise ConnectionError('MQTT broker stand-in not reachable.')
+        qos1 = retained = 0
+        for name, kind in points:
+            qos, retain = client.policy(name, kind)
+            qos1 += qos > 0
+            retained += retain
+
+        stamp = datetime.now().isoformat(timespec='microseconds')
+        start = time.perf_counter()
+        for i in range(args.messages):
+            name, kind = points[i % len(points)]
+            client.publish_data(name, i, timestamp=stamp, kind=kind)
+        published = time.perf_counter()
+        deadline = time.monotonic() + TIMEOUT
+        while client.pending() and time.monotonic() < deadline:
+            time.sleep(0.001)
+        elapsed = time.perf_counter() - start
+        client.disconnect()
+        stats = broker.stop()
+
+    return {'name': f'{preset}/{inflight}',
+            'preset': preset,
+            'inflight': inflight,
+            'msg_per_s': args.messages / elapsed,
+            'publish_us': (published - start) / args.messages * 1e6,
+            'qos1': qos1 / len(points),
+            'retained': retained / len(points),
+            'delivered': stats.get('messages')}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=10000, help='data points published per run')
+    parser.add_argument('--tags', type=int, default=200, help='number of tags (topics)')
+    parser.add_argument('--latency', type=float, default=0.005, help='acknowledgement delay of the broker in seconds')
+    parser.add_argument('--presets', default=','.join(PUBLISH_PRESETS), help='comma separated presets of MQTT.PUBLISH_PRESETS')
+    parser.add_argument('--inflight', default='20,100', help='comma separated paho inflight windows')
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+
+    # publish_data logs every message
+    logging.disable(logging.INFO)
+
+    results = []
+    for preset in args.presets.split(','):
+        for inflight in args.inflight.split(','):
+            results.append(bench_policy(preset, int(inflight), args))
+
+    print('{:<22} {:>10} {:>11} {:>6} {:>9} {:>10}'.format('run', 'msg/s', 'publish us', 'qos1', 'retained', 'delivered'))
+    for r in results:
+        print('{:<22} {:>10.0f} {:>11.1f} {:>6.0%} {:>9.0%} {:>10}'.format(
+            r['name'], r['msg_per_s'], r['publish_us'], r['qos1'], r['retained'], r['delivered']))
+
+    if args.json:
+        report = {'metadata': {'timestamp': datetime.now().isoformat(timespec='seconds'),
+                               'python': platform.python_version(),
+                               'platform': platform.platform(),
+                               'messages': args.messages,
+                               'tags': args.tags,
+                               'latency': args.latency},
+                  'results': results}
+        with open(args.json, 'w') as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
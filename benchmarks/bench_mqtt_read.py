@@ -0,0 +1,208 @@
+"""
+Benchmark of the packet reader of the vendored paho client with a flood of retained messages.
+
+The broker stand-in (benchmarks/simulators.py, started in a separate process) answers the SUBSCRIBE of
+the client with --messages retained messages (QoS 0, json payloads of about 80 bytes), as a broker does
+with the retained values of a machine at subscribe time. The paho client runs its network thread
+(loop_start) and counts the messages in on_message, with:
+    - reference: the previous _packet_read, one recv() for the command byte, one per byte of the
+      remaining length, then one or more for the body of each packet
+    - buffered: the buffered reader, one recv_into() of up to READ_BUFFER_SIZE bytes per wakeup,
+      all the complete packets of the buffer handled at once
+
+Measured for each reader (the best of --repeat runs):
+    - msg_per_s: retained messages received per second, from the SUBSCRIBE to the last message
+    - cpu_us: CPU time of the process per message (both threads)
+    - recv_per_msg: socket receive calls per message
+
+Usage: python benchmarks/bench_mqtt_read.py [--messages 10000] [--repeat 3] [--json results.json]
+"""
+import argparse
+from datetime import datetime
+import json
+import os
+import platform
+import struct
+import sys
+import threading
+import time
+
+# Runs from a checkout without pip install -e .: fablab_lib is in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fablab_lib.Broker.MQTT.paho.mqtt.client as mqtt
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_drivers import SimulatorProcess, HOST
+
+TIMEOUT = 60.0              # seconds to wait for the connection or for the last message
+
+
+class BufferedClient(mqtt.Client):
+    """
+    The paho client, counting its receive calls
+    """
+    recv_calls = 0
+
+    def _sock_recv(self, bufsize):
+        self.recv_calls += 1
+        return super()._sock_recv(bufsize)
+
+    def _sock_recv_into(self, buffer):
+        self.recv_calls += 1
+        return super()._sock_recv_into(buffer)
+
+
+class ReferenceClient(BufferedClient):
+    """
+    The paho client with the previous _packet_read
+    """
+
+    def _packet_read(self):
+        if self._in_packet['command'] == 0:
+            try:
+                command = self._sock_recv(1)
+            except BlockingIOError:
+                return mqtt.MQTT_ERR_AGAIN
+            except ConnectionError:
+                return mqtt.MQTT_ERR_CONN_LOST
+            else:
+                if len(command) == 0:
+                    return mqtt.MQTT_ERR_CONN_LOST
+                command, = struct.unpack("!B", command)
+                self._in_packet['command'] = command
+
+        if self._in_packet['have_remaining'] == 0:
+            while True:
+                try:
+                    byte = self._sock_recv(1)
+                except BlockingIOError:
+                    return mqtt.MQTT_ERR_AGAIN
+                except ConnectionError:
+                    return mqtt.MQTT_ERR_CONN_LOST
+                else:
+                    if len(byte) == 0:
+                        return mqtt.MQTT_ERR_CONN_LOST
+                    byte, = struct.unpack("!B", byte)
+                    self._in_packet['remaining_count'].append(byte)
+                    if len(self._in_packet['remaining_count']) > 4:
+                        return mqtt.MQTT_ERR_PROTOCOL
+
+                    self._in_packet['remaining_length'] += (
+                        byte & 127) * self._in_packet['remaining_mult']
+                    self._in_packet['remaining_mult'] = self._in_packet['remaining_mult'] * 128
+
+                if (byte & 128) == 0:
+                    break
+
+            self._in_packet['have_remaining'] = 1
+            self._in_packet['to_process'] = self._in_packet['remaining_length']
+
+        count = 100
+        while self._in_packet['to_process'] > 0:
+            try:
+                data = self._sock_recv(self._in_packet['to_process'])
+            except BlockingIOError:
+                return mqtt.MQTT_ERR_AGAIN
+            except ConnectionError:
+                return mqtt.MQTT_ERR_CONN_LOST
+            else:
+                if len(data) == 0:
+                    return mqtt.MQTT_ERR_CONN_LOST
+                self._in_packet['to_process'] -= len(data)
+                self._in_packet['packet'] += data
+            count -= 1
+            if count == 0:
+                with self._msgtime_mutex:
+                    self._last_msg_in = mqtt.time_func()
+                return mqtt.MQTT_ERR_AGAIN
+
+        self._in_packet['pos'] = 0
+        rc = self._packet_handle()
+
+        self._in_packet = {
+            'command': 0,
+            'have_remaining': 0,
+            'remaining_count': [],
+            'remaining_mult': 1,
+            'remaining_length': 0,
+            'packet': bytearray(b""),
+            'to_process': 0,
+            'pos': 0}
+
+        with self._msgtime_mutex:
+            self._last_msg_in = mqtt.time_func()
+        return rc
+
+
+READERS = {'reference': ReferenceClient, 'buffered': BufferedClient}
+
+
+def bench_reader(name, args):
+    with SimulatorProcess('mqtt', retained=args.messages) as broker:
+        client = READERS[name]()
+        received = [0]
+        done = threading.Event()
+
+        def on_message(client, userdata, message):
+            received[0] += 1
+            if received[0] == args.messages:
+                done.set()
+
+        client.on_message = on_message
+        client.connect(HOST, broker.port)
+        client.loop_start()
+        deadline = time.monotonic() + TIMEOUT
+        while not client.is_connected() and time.monotonic() < deadline:
+            time.sleep(0.001)
+        if not client.is_connected():
+            raise ConnectionError('MQTT broker stand-in not reachable.')
+
+        calls = client.recv_calls
+        cpu = time.process_time()
+        start = time.perf_counter()
+        client.subscribe('bench/#')
+        if not done.wait(TIMEOUT):
+            raise TimeoutError(f'{received[0]} of {args.messages} retained messages received.')
+        elapsed = time.perf_counter() - start
+        cpu = time.process_time() - cpu
+        calls = client.recv_calls - calls
+        client.disconnect()
+        client.loop_stop()
+        broker.stop()
+
+    return {'reader': name,
+            'msg_per_s': args.messages / elapsed,
+            'cpu_us': cpu / args.messages * 1e6,
+            'recv_per_msg': calls / args.messages}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=10000, help='retained messages sent at subscribe time')
+    parser.add_argument('--repeat', type=int, default=3, help='runs of each reader, the best one is kept')
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+
+    results = []
+    for name in READERS:
+        runs = [bench_reader(name, args) for _ in range(args.repeat)]
+        results.append(max(runs, key=lambda r: r['msg_per_s']))
+
+    print('{:<10} {:>10} {:>8} {:>13}'.format('reader', 'msg/s', 'cpu us', 'recv per msg'))
+    for r in results:
+        print('{:<10} {:>10.0f} {:>8.1f} {:>13.3f}'.format(r['reader'], r['msg_per_s'], r['cpu_us'], r['recv_per_msg']))
+
+    if args.json:
+        report = {'metadata': {'timestamp': datetime.now().isoformat(timespec='seconds'),
+                               'python': platform.python_version(),
+                               'platform': platform.platform(),
+                               'messages': args.messages,
+                               'read_buffer_size': mqtt.READ_BUFFER_SIZE},
+                  'results': results}
+        with open(args.json, 'w') as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""
+Benchmark of the MQTT v5 mode of the MQTT wrapper: bytes on the wire per message with topic aliases,
+and the subscriptions sent again at the reconnections.
+
+Publishes --messages data points of --tags tags (topics of the standard topic Test/WB-MNC/Data/) with
+MQTT.publish_data() to the broker stand-in (benchmarks/simulators.py), started in a separate process.
+The runs:
+    - 3.1.1: the MQTT 3.1.1 client (the default)
+    - 5: MQTT v5 to a broker without topic alias (TopicAliasMaximum 0)
+    - 5+alias: MQTT v5 to a broker with a TopicAliasMaximum of --aliases
+
+After the data points, the client subscribes to its standard topic and the connection is cut --reconnects
+times (the socket is shut down, paho reconnects by itself).
+
+Measured for each run:
+    - wire_bytes: bytes received by the broker per data point (PUBLISH packets, with the CONNECT,
+      SUBSCRIBE and PINGREQ packets of the run)
+    - payload_bytes: payload bytes per data point
+    - aliased: share of the PUBLISH packets sent with a topic alias and without topic
+    - alias_errors: PUBLISH packets with an unknown topic alias (must be 0)
+    - subscribes: SUBSCRIBE packets received (1 + one per reconnection without session)
+    - msg_per_s: data points published per second
+
+Usage: python benchmarks/bench_mqtt_v5.py [--messages 10000] [--tags 200] [--aliases 200] [--codec json]
+       [--reconnects 3] [--json results.json]
+"""
+import argparse
+from datetime import datetime
+import json
+import logging
+import os
+import platform
+import socket
+import sys
+import threading
+import time
+
+# Runs from a checkout without pip install -e .: fablab_lib is in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fablab_lib.Broker.MQTT.function import MQTT
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_drivers import SimulatorProcess, HOST
+
+TOPIC = 'Test/WB-MNC/Data/'
+TIMEOUT = 60.0              # seconds to wait for the last PUBACK or for a reconnection
+RUNS = {
+    # name: (protocol, alias maximum of the broker, None for --aliases)
+    '3.1.1': ('3.1.1', 0),
+    '5': ('5', 0),
+    '5+alias': ('5', None),
+}
+
+
+def _wait(condition):
+    deadline = time.monotonic() + TIMEOUT
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.001)
+    return condition()
+
+
+def bench_run(name, args):
+    protocol, aliases = RUNS[name]
+    names = [f'S8_MINIMUN_HEIGHT_VALUE_TR{i}' for i in range(args.tags)]
+    with SimulatorProcess('mqtt', topic_aliases=args.aliases if aliases is None else aliases) as broker:
+        client = MQTT(HOST, broker.port, protocol=protocol, codec=args.codec)
+        client.standardTopic = TOPIC
+        if not client.connect():
+            raise ConnectionError('MQTT broker stand-in not reachable.')
+
+        stamp = datetime.now().isoformat(timespec='microseconds')
+        start = time.perf_counter()
+        for i in range(args.messages):
+            client.publish_data(names[i % len(names)], i, timestamp=stamp)
+        _wait(lambda: not client.pending())
+        elapsed = time.perf_counter() - start
+
+        client.subscribe(TOPIC + '#')
+        client.en_subscribe = True
+        time.sleep(0.2)
+        connected = threading.Event()
+        client.on_connect = lambda client, rc: connected.set()
+        for _ in range(args.reconnects):
+            connected.clear()
+            client._mqtt.socket().shutdown(socket.SHUT_RDWR)
+            if not connected.wait(TIMEOUT):
+                raise ConnectionError('The client did not reconnect.')
+            # the SUBSCRIBE of on_connect is sent after the callback
+            time.sleep(0.1)
+        client.disconnect()
+        stats = broker.stop()
+
+    return {'name': name,
+            'wire_bytes': stats.get('bytes_received', 0) / args.messages,
+            'payload_bytes': stats.get('payload_bytes', 0) / args.messages,
+            'aliased': stats.get('aliased', 0) / max(stats.get('messages', 0), 1),
+            'alias_errors': stats.get('alias_errors'),
+            'subscribes': stats.get('subscribes'),
+            'msg_per_s': args.messages / elapsed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=10000, help='data points published per run')
+    parser.add_argument('--tags', type=int, default=200, help='number of tags (topics)')
+    parser.add_argument('--aliases', type=int, default=200, help='TopicAliasMaximum of the broker of the 5+alias run')
+    parser.add_argument('--codec', default='json', help='payload codec (JsonPayload.CODECS)')
+    parser.add_argument('--reconnects', type=int, default=3, help='connections cut after the data points')
+    parser.add_argument('--runs', default=','.join(RUNS), help='comma separated runs')
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+
+    # publish_data logs every message
+    logging.disable(logging.INFO)
+
+    results = [bench_run(name, args) for name in args.runs.split(',')]
+    print('{:<10} {:>11} {:>14} {:>8} {:>13} {:>11} {:>10}'.format(
+        'run', 'wire B/msg', 'payload B/msg', 'aliased', 'alias errors', 'subscribes', 'msg/s'))
+    for r in results:
+        print('{:<10} {:>11.1f} {:>14.1f} {:>8.0%} {:>13} {:>11} {:>10.0f}'.format(
+            r['name'], r['wire_bytes'], r['payload_bytes'], r['aliased'], r['alias_errors'], r['subscribes'], r['msg_per_s']))
+
+    if args.json:
+        report = {'metadata': {'timestamp': datetime.now().isoformat(timespec='seconds'),
+                               'python': platform.python_version(),
+                               'platform': platform.platform(),
+                               'messages': args.messages,
+                               'tags': args.tags,
+                               'aliases': args.aliases,
+                               'codec': args.codec},
+                  'results': results}
+        with open(args.json, 'w') as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
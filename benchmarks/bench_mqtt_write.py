@@ -0,0 +1,142 @@
+"""
+Benchmark of the outbound path of the vendored paho client: write coalescing and TCP_NODELAY.
+
+Publishes --messages data points of --tags tags with MQTT.publish_data(), with QoS 0 and with QoS 1
+(not retained), to the broker stand-in (benchmarks/simulators.py) started in a separate process with an
+acknowledgement delay of --latency seconds. paho runs its network thread (loop_start), the publishing
+thread only queues the packets. Each QoS is run with:
+    - per-packet: one send() per packet (write_budget 1, the previous _packet_write)
+    - coalesced: the queued packets gathered into one sendmsg() up to MQTT.WRITE_BUDGET bytes
+and each of them with the Nagle algorithm enabled (the system default) and disabled (tcp_nodelay).
+The best of --repeat runs is kept.
+
+Measured for each run:
+    - msg_per_s: data points published per second, until paho has sent every QoS 0 packet or
+      received every PUBACK
+    - cpu_us: CPU time of the process per data point (the publishing and the network threads)
+    - sends_per_msg: send system calls of paho per data point
+    - delivered: messages received by the broker stand-in
+
+Usage: python benchmarks/bench_mqtt_write.py [--messages 10000] [--tags 200] [--latency 0.0]
+       [--qos 0,1] [--repeat 3] [--json results.json]
+"""
+import argparse
+from datetime import datetime
+import json
+import logging
+import os
+import platform
+import sys
+import time
+
+# Runs from a checkout without pip install -e .: fablab_lib is in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fablab_lib.Broker.MQTT.function import MQTT, WRITE_BUDGET
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_drivers import SimulatorProcess, HOST
+
+TIMEOUT = 120.0             # seconds to wait for the last packet of a run
+WRITERS = {'per-packet': 1, 'coalesced': WRITE_BUDGET}
+
+
+def _count_sends(client):
+    """
+    Counts the send system calls of the paho client of an MQTT wrapper
+    """
+    paho = client._mqtt
+    counter = [0]
+    sendmsg = paho._sock_sendmsg
+    send = paho._sock_send
+
+    def counted_sendmsg(buffers):
+        if len(buffers) > 1:
+            counter[0] += 1
+        return sendmsg(buffers)
+
+    def counted_send(buf):
+        counter[0] += 1
+        return send(buf)
+
+    paho._sock_sendmsg = counted_sendmsg
+    paho._sock_send = counted_send
+    return counter
+
+
+def bench_write(qos, writer, nodelay, args):
+    names = [f'S8_COUNTER_VALUE_TR{i}' for i in range(args.tags)]
+    with SimulatorProcess('mqtt', latency=args.latency) as broker:
+        client = MQTT(HOST, broker.port, policies={'*': (qos, False)}, max_inflight=args.inflight,
+                      tcp_nodelay=nodelay, write_budget=WRITERS[writer])
+        client.standardTopic = 'bench/'
+        if not client.connect():
+            raise ConnectionError('MQTT broker stand-in not reachable.')
+        sends = _count_sends(client)
+
+        stamp = datetime.now().isoformat(timespec='microseconds')
+        cpu = time.process_time()
+        start = time.perf_counter()
+        for i in range(args.messages):
+            client.publish_data(names[i % len(names)], i, timestamp=stamp)
+        deadline = time.monotonic() + TIMEOUT
+        while (client.pending() or client._mqtt._out_packet) and time.monotonic() < deadline:
+            time.sleep(0.0005)
+        elapsed = time.perf_counter() - start
+        cpu = time.process_time() - cpu
+        count = sends[0]
+        client.disconnect()
+        stats = broker.stop()
+
+    return {'name': f"qos{qos}/{writer}/{'nodelay' if nodelay else 'nagle'}",
+            'qos': qos,
+            'writer': writer,
+            'tcp_nodelay': nodelay,
+            'msg_per_s': args.messages / elapsed,
+            'cpu_us': cpu / args.messages * 1e6,
+            'sends_per_msg': count / args.messages,
+            'delivered': stats.get('messages')}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=10000, help='data points published per run')
+    parser.add_argument('--tags', type=int, default=200, help='number of tags (topics)')
+    parser.add_argument('--latency', type=float, default=0.0, help='acknowledgement delay of the broker in seconds')
+    parser.add_argument('--inflight', type=int, default=100, help='paho inflight window of the QoS 1 runs')
+    parser.add_argument('--qos', default='0,1', help='comma separated QoS')
+    parser.add_argument('--repeat', type=int, default=3, help='runs of each configuration, the best one is kept')
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+
+    # publish_data logs every message
+    logging.disable(logging.INFO)
+
+    results = []
+    for qos in args.qos.split(','):
+        for writer in WRITERS:
+            for nodelay in (False, True):
+                runs = [bench_write(int(qos), writer, nodelay, args) for _ in range(args.repeat)]
+                results.append(max(runs, key=lambda r: r['msg_per_s']))
+
+    print('{:<28} {:>10} {:>8} {:>14} {:>10}'.format('run', 'msg/s', 'cpu us', 'sends per msg', 'delivered'))
+    for r in results:
+        print('{:<28} {:>10.0f} {:>8.1f} {:>14.3f} {:>10}'.format(
+            r['name'], r['msg_per_s'], r['cpu_us'], r['sends_per_msg'], r['delivered']))
+
+    if args.json:
+        report = {'metadata': {'timestamp': datetime.now().isoformat(timespec='seconds'),
+                               'python': platform.python_version(),
+                               'platform': platform.platform(),
+                               'messages': args.messages,
+                               'tags': args.tags,
+                               'latency': args.latency,
+                               'inflight': args.inflight,
+                               'repeat': args.repeat},
+                  'results': results}
+        with open(args.json, 'w') as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+Benchmark of the payload encoding of the published data points.
+
+Encodes data points of 200 tags (int, float, bool and str values) with the previous generate_data
+(list, dict, datetime.now().isoformat() and json.dumps, then str() in MQTT.publish_data) as reference,
+and with the PayloadEncoder: with its own cached-second timestamp, and with the timestamp of a scan
+cycle, encoded once for the MQTT sink and reused by the CSV log. Prints the CPU load of each one at
+--rate points per second (10k points/s is the target of a Raspberry Pi gateway).
+
+Usage: python benchmarks/bench_payload.py [--repeat N] [--rate POINTS_PER_S]
+"""
+import argparse
+from datetime import datetime
+import json
+import os
+import sys
+import timeit
+
+# Runs from a checkout without pip install -e .: fablab_lib is in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fablab_lib.Broker.JsonPayload.function import PayloadEncoder
+
+TAGS = 200
+
+
+def reference_generate_data(data_name, data_value):
+    """
+    The previous generate_data
+    """
+    data = [{
+        'name': str(data_name),
+        'value': data_value,
+        'timestamp': datetime.now().isoformat(timespec='microseconds')
+    }]
+    return json.dumps(data)
+
+
+def build_points(count=TAGS):
+    points = []
+    for i in range(count):
+        kind = i % 4
+        if kind == 0:
+            points.append((f'S8_COUNTER_VALUE_TR{i}', i * 7))
+        elif kind == 1:
+            points.append((f'S8_MINIMUN_HEIGHT_VALUE_TR{i}', i / 3))
+        elif kind == 2:
+            points.append((f'S8_ALARM_{i}', bool(i % 3)))
+        else:
+            points.append((f'S8_RECIPE_{i}', f'RECIPE-{i}'))
+    return points
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=50, help='number of passes over the tags per run')
+    parser.add_argument('--rate', type=int, default=10000, help='points per second used for the CPU load')
+    args = parser.parse_args()
+
+    points = build_points()
+    encoder = PayloadEncoder()
+    timestamp = datetime.now().isoformat(timespec='microseconds')
+
+    # Same payloads as the reference, except the timestamp
+    for name, value in points:
+        expected = json.loads(reference_generate_data(name, value))
+        expected[0]['timestamp'] = timestamp
+        assert encoder.encode(name, value, timestamp) == json.dumps(expected).encode()
+
+    def reference():
+        for name, value in points:
+            str(reference_generate_data(name, value))
+
+    def encode_now():
+        for name, value in points:
+            encoder.encode(name, value)
+
+    def encode_scan():
+        # a new scan cycle: new timestamp, each value encoded for MQTT then for the CSV log
+        stamp = datetime.now().isoformat(timespec='microseconds')
+        for name, value in points:
+            encoder.encode(name, value, stamp)
+            encoder.encode(name, value, stamp)
+
+    for label, func, perCall in (('reference', reference, len(points)),
+                                 ('encoder', encode_now, len(points)),
+                                 ('encoder+log', encode_scan, len(points))):
+        seconds = min(timeit.repeat(func, number=args.repeat, repeat=5)) / (args.repeat * perCall)
+        print('{:<12} {:6.2f} us/point {:10.0f} points/s {:6.1f}% CPU at {} points/s'.format(
+            label, seconds * 1e6, 1 / seconds, seconds * args.rate * 100, args.rate))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,914 @@
+"""
+Local stand-ins of the PLCs and of the MQTT broker for the end-to-end benchmarks.
+
+Each simulator answers the requests the fablab_lib drivers send, from an in-memory image, after a
+configurable latency and jitter (the network and PLC scan time of a real device). A background ticker
+changes some of the values the clients read every tick, so the change detection and the sinks have
+work to do. Every simulator counts the requests and the bytes it received and sent.
+
+Simulators:
+    - mc: Mitsubishi MC protocol, binary 3E and 4E frames over TCP (batch read/write of words and bits)
+    - fins: Omron FINS over UDP, or over TCP with --transport tcp (memory area read/write, echo test)
+    - eip: Rockwell EtherNet/IP (register session, Forward Open, CIP Read/Write Tag and Multiple Service
+      Packet); every tag is a DINT created on first access
+    - mqtt: MQTT 3.1.1 and 5 broker stand-in, acknowledges CONNECT, PUBLISH (QoS 0/1/2), SUBSCRIBE,
+      UNSUBSCRIBE and PINGREQ and counts the messages; it doesn't route messages to subscribers, but
+      checks the v5 topic aliases and resumes the sessions of the clients connecting without clean start;
+      with --retained N, it answers each SUBSCRIBE with N retained messages (a flood at subscribe time)
+    - s7: the snap7 server bundled with python-snap7 (snap7.server.mainloop), needs the libsnap7 library;
+      it has no latency, jitter or counters
+
+Usage: python benchmarks/simulators.py {mc,fins,eip,mqtt,s7} [--port PORT] [--latency S] [--jitter S]
+       [--changes N] [--tick S] [--transport {udp,tcp}] [--topic-aliases N]
+       [--retained N]
+"""
+import argparse
+import collections
+import os
+import random
+import socket
+import struct
+import sys
+import threading
+import time
+
+DEFAULT_PORTS = {'mc': 5007, 'fins': 9600, 'eip': 44818, 'mqtt': 1883, 's7': 1102}
+TICK = 0.1                  # seconds between two changes of the memory image
+CHANGES = 10                # values changed every tick
+TOPIC_ALIASES = 10          # TopicAliasMaximum of the MQTT broker stand-in (the default of mosquitto)
+
+_FINS_READ = b'\x01\x01'
+_FINS_WRITE = b'\x01\x02'
+_FINS_ECHO = b'\x08\x01'
+_CIP_TYPE_DINT = 0xC4
+# sizes of the integer MQTT v5 properties
+_MQTT_PROPERTY_SIZES = {0x01: 1, 0x02: 4, 0x11: 4, 0x17: 1, 0x18: 4, 0x19: 1, 0x21: 2, 0x22: 2, 0x23: 2, 0x24: 1,
+                        0x25: 1, 0x27: 4, 0x28: 1, 0x29: 1, 0x2A: 1}
+
+
+def _recv_exactly(sock, size):
+    """
+    Receives exactly size bytes, returns None if the peer closed the connection
+    """
+    buf = bytearray(size)
+    view = memoryview(buf)
+    pos = 0
+    while pos < size:
+        n = sock.recv_into(view[pos:], size - pos)
+        if not n:
+            return None
+        pos += n
+    return bytes(buf)
+
+
+class Simulator:
+    """
+    Base class: latency, counters, mutation ticker and the TCP accept loop.
+
+    Args:
+        host (str): The address to listen on.
+        port (int): The port to listen on, 0 picks a free port (see self.port after start()).
+        latency (float): The mean delay before each answer in seconds.
+        jitter (float): The answers are delayed by latency +/- a uniform random jitter in seconds.
+        changes (int): The number of values changed every tick.
+        tick (float): The period of the changes in seconds.
+    """
+    kind = 'tcp'
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, jitter=0.0, changes=CHANGES, tick=TICK):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.changes = changes
+        self.tick = tick
+
+        self.requests = 0
+        self.bytes_received = 0
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sock = None
+        self._threads = []
+
+    def stats(self):
+        with self._lock:
+            return {'requests': self.requests, 'bytes_received': self.bytes_received, 'bytes_sent': self.bytes_sent}
+
+    def _count(self, received, sent):
+        with self._lock:
+            self.requests += 1
+            self.bytes_received += received
+            self.bytes_sent += sent
+
+    def _delay(self):
+        delay = self.latency
+        if self.jitter:
+            delay += random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+    def mutate(self):
+        """
+        Changes self.changes values of the memory image, called every tick
+        """
+
+    def _ticker(self):
+        while not self._stop.wait(self.tick):
+            self.mutate()
+
+    def _spawn(self, target, *args):
+        thread = threading.Thread(target=target, args=args, daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def _bind(self):
+        if self.kind == 'udp':
+            self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        else:
+            self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind((self.host, self.port))
+        self.port = self._sock.getsockname()[1]
+        if self.kind != 'udp':
+            self._sock.listen(16)
+
+    def _accept(self):
+        while not self._stop.is_set():
+            try:
+                conn, _ = self._sock.accept()
+            except OSError:
+                return
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self._spawn(self._serve_connection, conn)
+
+    def _serve_connection(self, conn):
+        try:
+            with conn:
+                self.handle(conn)
+        except OSError:
+            pass
+
+    def handle(self, conn):
+        """
+        Serves one TCP connection until the peer closes it
+        """
+        raise NotImplementedError
+
+    def start(self):
+        """
+        Starts listening and serving in background threads, returns the port
+        """
+        self._bind()
+        self._spawn(self._accept if self.kind != 'udp' else self._serve_datagrams)
+        if self.changes and self.tick:
+            self._spawn(self._ticker)
+        return self.port
+
+    def stop(self):
+        self._stop.set()
+        try:
+            self._sock.close()
+        except OSError:
+            pass
+
+    def serve_forever(self):
+        self.start()
+        print('{} listening on {}:{}'.format(type(self).__name__, self.host, self.port), flush=True)
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            self.stop()
+
+
+class MCSimulator(Simulator):
+    """
+    Mitsubishi MC protocol binary 3E/4E server.
+
+    Word devices and bit devices have separate images of 65536 points per device code. Both the Q/L
+    (3-byte device number, 1-byte code) and the iQ-R (4-byte number, 2-byte code) device formats are
+    decoded from the subcommand.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.words = {}         # device code -> bytearray, 2 bytes per point
+        self.bits = {}          # device code -> bytearray, 1 byte per point
+        self.read_ranges = {}   # (is_bit, code, number) -> points, the values changed by the ticker
+
+    def _words(self, code):
+        image = self.words.get(code)
+        if image is None:
+            image = self.words[code] = bytearray(2 * 65536)
+        return image
+
+    def _bits(self, code):
+        image = self.bits.get(code)
+        if image is None:
+            image = self.bits[code] = bytearray(65536)
+        return image
+
+    def mutate(self):
+        ranges = list(self.read_ranges.items())
+        if not ranges:
+            return
+        for _ in range(self.changes):
+            (is_bit, code, number), points = random.choice(ranges)
+            point = number + random.randrange(points)
+            if is_bit:
+                self._bits(code)[point] ^= 1
+            else:
+                image = self._words(code)
+                struct.pack_into('<H', image, 2 * point, (struct.unpack_from('<H', image, 2 * point)[0] + 1) & 0xFFFF)
+
+    def execute(self, command, subcommand, body):
+        """
+        Executes one request, returns (end code, response data)
+        """
+        if command not in (0x0401, 0x1401):
+            return 0xC059, b''
+        if subcommand in (2, 3):
+            number, code = struct.unpack_from('<IH', body, 0)
+            pos = 6
+        else:
+            number = int.from_bytes(body[0:3], 'little')
+            code = body[3]
+            pos = 4
+        points = struct.unpack_from('<H', body, pos)[0]
+        data = body[pos + 2:]
+        is_bit = subcommand in (1, 3)
+        if number + points > 65536:
+            return 0xC056, b''
+
+        if command == 0x0401:
+            if points:
+                self.read_ranges[(is_bit, code, number)] = points
+            if is_bit:
+                image = self._bits(code)
+                out = bytearray((points + 1) // 2)
+                for i in range(points):
+                    if image[number + i]:
+                        out[i // 2] |= 0x10 if i % 2 == 0 else 0x01
+                return 0, bytes(out)
+            image = self._words(code)
+            return 0, bytes(image[2 * number:2 * (number + points)])
+
+        if is_bit:
+            image = self._bits(code)
+            for i in range(points):
+                image[number + i] = (data[i // 2] >> (4 if i % 2 == 0 else 0)) & 1
+        else:
+            self._words(code)[2 * number:2 * (number + points)] = data[:2 * points]
+        return 0, b''
+
+    def handle(self, conn):
+        while True:
+            subheader = _recv_exactly(conn, 2)
+            if subheader is None:
+                return
+            serial = b''
+            if subheader == b'\x54\x00':
+                serial = _recv_exactly(conn, 4)
+            elif subheader != b'\x50\x00':
+                return
+            header = _recv_exactly(conn, 7)
+            if header is None:
+                return
+            size = struct.unpack_from('<H', header, 5)[0]
+            request = _recv_exactly(conn, size)
+            if request is None:
+                return
+            command, subcommand = struct.unpack_from('<HH', request, 2)
+            end_code, data = self.execute(command, subcommand, request[6:])
+
+            if serial:
+                response = b'\xd4\x00' + serial[0:2] + b'\x00\x00'
+            else:
+                response = b'\xd0\x00'
+            response += header[0:5] + struct.pack('<HH', 2 + len(data), end_code) + data
+            self._delay()
+            conn.sendall(response)
+            self._count(2 + len(serial) + 7 + size, len(response))
+
+
+class FinsSimulator(Simulator):
+    """
+    Omron FINS server over UDP or TCP.
+
+    Memory area codes with the high bit set (0x82 DM, 0xB0 CIO, ...) are word areas, 2 bytes per item,
+    the other ones are bit areas, 1 byte per item. Each area code has its own image.
+
+    Args:
+        transport (str): 'udp' or 'tcp'.
+    """
+
+    def __init__(self, *args, transport='udp', **kwargs):
+        super().__init__(*args, **kwargs)
+        self.kind = transport
+        self.areas = {}         # area code -> bytearray
+        self.read_ranges = {}   # (area code, start) -> size, the values changed by the ticker
+        self._node = 0xEF       # node address given to the FINS/TCP clients
+
+    def _area(self, code):
+        image = self.areas.get(code)
+        if image is None:
+            size = 2 * 65536 if code & 0x80 else 65536
+            image = self.areas[code] = bytearray(size)
+        return image
+
+    def mutate(self):
+        ranges = list(self.read_ranges.items())
+        if not ranges:
+            return
+        for _ in range(self.changes):
+            (code, start), size = random.choice(ranges)
+            image = self._area(code)
+            if code & 0x80:
+                pos = start + 2 * random.randrange(size // 2)
+                struct.pack_into('>H', image, pos, (struct.unpack_from('>H', image, pos)[0] + 1) & 0xFFFF)
+            else:
+                image[start + random.randrange(size)] ^= 1
+
+    def execute(self, frame):
+        """
+        Executes one FINS command frame, returns the response frame
+        """
+        header = frame[0:10]
+        command = frame[10:12]
+        text = frame[12:]
+        end_code = b'\x00\x00'
+        data = b''
+        if command in (_FINS_READ, _FINS_WRITE):
+            code = text[0]
+            address, bit, count = struct.unpack_from('>HBH', text, 1)
+            image = self._area(code)
+            if code & 0x80:
+                start, size = 2 * address, 2 * count
+            else:
+                start, size = address * 16 + bit, count
+            if start + size > len(image):
+                end_code = b'\x11\x03'
+            elif command == _FINS_READ:
+                if size:
+                    self.read_ranges[(code, start)] = size
+                data = bytes(image[start:start + size])
+            else:
+                image[start:start + size] = text[6:6 + size]
+        elif command == _FINS_ECHO:
+            data = text
+        else:
+            end_code = b'\x04\x01'
+        response_header = bytes([0xC0, 0x00, 0x02,
+                                 header[6], header[7], header[8],
+                                 header[3], header[4], header[5],
+                                 header[9]])
+        return response_header + command + end_code + data
+
+    def _serve_datagrams(self):
+        while not self._stop.is_set():
+            try:
+                frame, address = self._sock.recvfrom(4096)
+            except OSError:
+                return
+            if len(frame) < 12:
+                continue
+            response = self.execute(frame)
+            self._delay()
+            self._sock.sendto(response, address)
+            self._count(len(frame), len(response))
+
+    def handle(self, conn):
+        while True:
+            header = _recv_exactly(conn, 16)
+            if header is None or header[0:4] != b'FINS':
+                return
+            length, command = struct.unpack_from('>II', header, 4)
+            data = _recv_exactly(conn, length - 8) if length > 8 else b''
+            if data is None:
+                return
+            if command == 0:
+                # node address data send: answer the client and the server node addresses
+                reply_command, reply = 1, struct.pack('>II', self._node, 1)
+            elif command == 2:
+                reply_command, reply = 2, self.execute(data)
+                self._delay()
+            else:
+                return
+            message = struct.pack('>4sIII', b'FINS', 8 + len(reply), reply_command, 0) + reply
+            conn.sendall(message)
+            self._count(len(header) + len(data), len(message))
+
+
+class EIPSimulator(Simulator):
+    """
+    Rockwell Logix EtherNet/IP server.
+
+    Every tag is a DINT created with the value 0 on first access, arrays of DINT are read and written
+    element by element with the same name and an index.
+
+    Args:
+        large_forward_open (bool): Accepts the Large Forward Open (4002 byte connections), rejects it
+        with "service not supported" otherwise so the drivers fall back to the 504 byte Forward Open.
+    """
+
+    def __init__(self, *args, large_forward_open=True, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.large_forward_open = large_forward_open
+        self.tags = {}          # tag key -> DINT value
+        self._session = 0
+
+    def mutate(self):
+        if not self.tags:
+            return
+        keys = list(self.tags)
+        for _ in range(self.changes):
+            key = random.choice(keys)
+            self.tags[key] = (self.tags[key] + 1) & 0x7FFFFFFF
+
+    @staticmethod
+    def _parse_path(path):
+        """
+        Decodes the symbolic segments and element indexes of a request path, returns (key, index)
+        """
+        names = []
+        index = 0
+        pos = 0
+        while pos < len(path):
+            segment = path[pos]
+            if segment == 0x91:
+                size = path[pos + 1]
+                names.append(path[pos + 2:pos + 2 + size].decode('utf-8', 'replace'))
+                pos += 2 + size + (size % 2)
+            elif segment == 0x28:
+                index = path[pos + 1]
+                pos += 2
+            elif segment == 0x29:
+                index = struct.unpack_from('<H', path, pos + 2)[0]
+                pos += 4
+            elif segment == 0x2A:
+                index = struct.unpack_from('<I', path, pos + 2)[0]
+                pos += 6
+            else:
+                break
+        return '.'.join(names), index
+
+    def service(self, request):
+        """
+        Executes one CIP service, returns the reply
+        """
+        code = request[0]
+        path_size = request[1] * 2
+        path = request[2:2 + path_size]
+        body = request[2 + path_size:]
+
+        if code == 0x0A:
+            count = struct.unpack_from('<H', body, 0)[0]
+            offsets = [struct.unpack_from('<H', body, 2 + 2 * i)[0] for i in range(count)] + [len(body)]
+            replies = [self.service(body[offsets[i]:offsets[i + 1]]) for i in range(count)]
+            status = 0x1E if any(reply[2] for reply in replies) else 0
+            table = b''
+            offset = 2 + 2 * count
+            for reply in replies:
+                table += struct.pack('<H', offset)
+                offset += len(reply)
+            return struct.pack('<BBBBH', 0x8A, 0, status, 0, count) + table + b''.join(replies)
+
+        if code in (0x4C, 0x4D):
+            name, index = self._parse_path(path)
+            elements = struct.unpack_from('<H', body, 0 if code == 0x4C else 2)[0]
+            if code == 0x4C:
+                values = [self.tags.setdefault(f'{name}[{index + i}]' if elements > 1 or index else name, 0)
+                          for i in range(elements)]
+                return struct.pack('<BBBBH', 0xCC, 0, 0, 0, _CIP_TYPE_DINT) + struct.pack(f'<{elements}i', *values)
+            values = struct.unpack_from(f'<{elements}i', body, 4)
+            for i, value in enumerate(values):
+                self.tags[f'{name}[{index + i}]' if elements > 1 or index else name] = value
+            return struct.pack('<BBBB', 0xCD, 0, 0, 0)
+
+        # Service not supported
+        return struct.pack('<BBBB', code | 0x80, 0, 0x08, 0)
+
+    def _forward_open(self, request):
+        code = request[0]
+        if code == 0x5B and not self.large_forward_open:
+            return struct.pack('<BBBB', 0xDB, 0, 0x08, 0)
+        if code in (0x54, 0x5B):
+            # O->T and T->O connection IDs, connection serial, vendor, originator serial, APIs
+            to_id, serial, vendor, originator = struct.unpack_from('<IHHI', request, 12)
+            return struct.pack('<BBBBIIHHIIIBB', code | 0x80, 0, 0, 0, 0x10000 + self._session, to_id,
+                               serial, vendor, originator, 0, 0, 0, 0)
+        if code == 0x4E:
+            return struct.pack('<BBBBHHIBB', 0xCE, 0, 0, 0, 0, 0, 0, 0, 0)
+        return struct.pack('<BBBB', code | 0x80, 0, 0x08, 0)
+
+    def handle(self, conn):
+        session = 0
+        while True:
+            header = _recv_exactly(conn, 24)
+            if header is None:
+                return
+            command, length = struct.unpack_from('<HH', header, 0)
+            data = _recv_exactly(conn, length) if length else b''
+            if data is None:
+                return
+
+            if command == 0x65:
+                with self._lock:
+                    self._session += 1
+                    session = self._session
+                reply = data
+            elif command == 0x66:
+                self._count(24 + length, 0)
+                return
+            elif command == 0x6F:
+                # interface handle, timeout, item count, null address item, unconnected data item
+                cip = self._forward_open(data[16:])
+                reply = struct.pack('<IHHHHHH', 0, 0, 2, 0, 0, 0xB2, len(cip)) + cip
+            elif command == 0x70:
+                # interface handle, timeout, item count, connected address item, connected data item + sequence
+                connection_id = struct.unpack_from('<I', data, 12)[0]
+                sequence = data[20:22]
+                cip = self.service(data[22:])
+                reply = struct.pack('<IHHHHIHH', 0, 0, 2, 0xA1, 4, connection_id, 0xB1, len(cip) + 2) + sequence + cip
+            else:
+                return
+
+            response = struct.pack('<HHII', command, len(reply), session, 0) + header[12:24] + reply
+            if command == 0x70:
+                self._delay()
+            conn.sendall(response)
+            self._count(24 + length, len(response))
+
+
+class MQTTBroker(Simulator):
+    """
+    MQTT 3.1.1 and 5 broker stand-in, acknowledges the packets of the publishing clients.
+
+    The latency delays each acknowledgement without holding the next packets (a network round trip,
+    a broker answers the packets in a pipeline), so the inflight window of the clients matters.
+
+    Args:
+        topic_aliases (int): The TopicAliasMaximum sent to the v5 clients, 0 for no topic alias.
+        retained (int): The retained messages sent after each SUBACK, on the topics <filter>retained/<i>
+            (the filter without its '#'), with a json payload {name, value, timestamp}.
+
+    Attributes:
+        messages (int): The number of PUBLISH packets received.
+        payload_bytes (int): The total size of their payloads.
+        aliased (int): The PUBLISH packets received with a topic alias and without topic.
+        alias_errors (int): The PUBLISH packets with an unknown or out of range topic alias.
+        subscribes (int): The SUBSCRIBE packets received.
+        retained_sent (int): The retained messages sent.
+        sessions_resumed (int): The connections that resumed a session (session present).
+    """
+
+    def __init__(self, *args, topic_aliases=TOPIC_ALIASES, retained=0, **kwargs):
+        kwargs.setdefault('changes', 0)
+        super().__init__(*args, **kwargs)
+        self.topic_aliases = topic_aliases
+        self.retained = retained
+        self.retained_sent = 0
+        self.messages = 0
+        self.payload_bytes = 0
+        self.aliased = 0
+        self.alias_errors = 0
+        self.subscribes = 0
+        self.sessions_resumed = 0
+        self._sessions = set()      # client ids of the kept sessions
+
+    def stats(self):
+        result = super().stats()
+        with self._lock:
+            result.update(messages=self.messages, payload_bytes=self.payload_bytes, aliased=self.aliased,
+                          alias_errors=self.alias_errors, subscribes=self.subscribes, retained_sent=self.retained_sent,
+                          sessions_resumed=self.sessions_resumed)
+        return result
+
+    @staticmethod
+    def _read_packet(conn):
+        first = _recv_exactly(conn, 1)
+        if first is None:
+            return None, None, 0
+        length, multiplier, header_size = 0, 1, 1
+        while True:
+            byte = _recv_exactly(conn, 1)
+            if byte is None:
+                return None, None, 0
+            header_size += 1
+            length += (byte[0] & 0x7F) * multiplier
+            multiplier *= 128
+            if not byte[0] & 0x80:
+                break
+        body = _recv_exactly(conn, length) if length else b''
+        return first[0], body, header_size + length
+
+    @staticmethod
+    def _skip_properties(body, pos):
+        length, multiplier = 0, 1
+        while True:
+            byte = body[pos]
+            pos += 1
+            length += (byte & 0x7F) * multiplier
+            multiplier *= 128
+            if not byte & 0x80:
+                return pos + length
+
+    @staticmethod
+    def _property(body, pos, end, identifier):
+        """
+        Returns the value of an integer property of the v5 properties at pos (their length) to end,
+        None if missing
+        """
+        while body[pos] & 0x80:
+            pos += 1
+        pos += 1
+        while pos < end:
+            current = body[pos]
+            pos += 1
+            size = _MQTT_PROPERTY_SIZES.get(current)
+            if current == identifier:
+                return int.from_bytes(body[pos:pos + size], 'big')
+            if size is not None:
+                pos += size
+            elif current == 0x26:
+                pos += 2 + struct.unpack_from('>H', body, pos)[0]
+                pos += 2 + struct.unpack_from('>H', body, pos)[0]
+            elif current == 0x0B:
+                # SubscriptionIdentifier, a variable byte integer
+                while body[pos] & 0x80:
+                    pos += 1
+                pos += 1
+            else:
+                # a string or binary data
+                pos += 2 + struct.unpack_from('>H', body, pos)[0]
+        return None
+
+    def _retained_messages(self, prefix, version):
+        """
+        Returns the PUBLISH packets of the retained messages under a topic prefix
+        """
+        packets = []
+        for i in range(self.retained):
+            topic = prefix + b'retained/%d' % i
+            payload = b'[{"name": "retained_%d", "value": %d, "timestamp": "2024-01-01T00:00:00.000000"}]' % (i, i)
+            body = struct.pack('>H', len(topic)) + topic + (b'\x00' if version == 5 else b'') + payload
+            length = len(body)
+            header = bytearray([0x31])
+            while True:
+                byte = length % 128
+                length //= 128
+                header.append(byte | 0x80 if length else byte)
+                if not length:
+                    break
+            packets.append(bytes(header) + body)
+        return b''.join(packets)
+
+    def _sender(self, conn, pending, cond):
+        """
+        Sends the delayed acknowledgements of a connection in order, when they are due
+        """
+        while True:
+            with cond:
+                while not pending:
+                    cond.wait()
+                due, response = pending.popleft()
+            if response is None:
+                return
+            delay = due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            try:
+                conn.sendall(response)
+            except OSError:
+                return
+
+    def handle(self, conn):
+        state = {'version': 4, 'aliases': {}}
+        pending, cond = collections.deque(), threading.Condition()
+        last_due = 0.0
+        if self.latency or self.jitter:
+            threading.Thread(target=self._sender, args=(conn, pending, cond), daemon=True).start()
+        try:
+            while True:
+                first, body, size = self._read_packet(conn)
+                if first is None:
+                    return
+                response = self._answer(first, body, state)
+                if response is None:
+                    self._count(size, 0)
+                    return
+                if response:
+                    if self.latency or self.jitter:
+                        delay = self.latency + (random.uniform(-self.jitter, self.jitter) if self.jitter else 0)
+                        last_due = max(last_due, time.monotonic() + delay)
+                        with cond:
+                            pending.append((last_due, response))
+                            cond.notify()
+                    else:
+                        conn.sendall(response)
+                self._count(size, len(response))
+        finally:
+            with cond:
+                pending.append((0, None))
+                cond.notify()
+
+    def _answer(self, first, body, state):
+        """
+        Returns the answer to a packet, b'' for none, None when the client disconnects. state holds
+        the protocol version and the topic aliases of the connection.
+        """
+        packet_type = first >> 4
+        version = state['version']
+        response = b''
+        if packet_type == 1:
+            name_size = struct.unpack_from('>H', body, 0)[0]
+            pos = 2 + name_size
+            version = state['version'] = body[pos]
+            clean = body[pos + 1] & 0x02
+            pos += 4
+            # MQTT 3.1.1 keeps the session without clean session, v5 while the session expiry interval
+            keep = not clean
+            if version == 5:
+                end = self._skip_properties(body, pos)
+                keep = bool(self._property(body, pos, end, 0x11))
+                pos = end
+            client_id = body[pos + 2:pos + 2 + struct.unpack_from('>H', body, pos)[0]]
+            with self._lock:
+                present = bool(client_id) and not clean and client_id in self._sessions
+                self.sessions_resumed += present
+                if keep and client_id:
+                    self._sessions.add(client_id)
+                else:
+                    self._sessions.discard(client_id)
+            if version == 5:
+                properties = b'\x03\x22' + struct.pack('>H', self.topic_aliases) if self.topic_aliases else b'\x00'
+                payload = bytes([present, 0]) + properties
+                response = bytes([0x20, len(payload)]) + payload
+            else:
+                response = bytes([0x20, 2, present, 0])
+        elif packet_type == 3:
+            qos = (first >> 1) & 3
+            topic_size = struct.unpack_from('>H', body, 0)[0]
+            pos = 2 + topic_size
+            packet_id = body[pos:pos + 2]
+            if qos:
+                pos += 2
+            alias_error = aliased = False
+            if version == 5:
+                end = self._skip_properties(body, pos)
+                alias = self._property(body, pos, end, 0x23)
+                pos = end
+                if alias is not None:
+                    aliases = state['aliases']
+                    if not 0 < alias <= self.topic_aliases:
+                        alias_error = True
+                    elif topic_size:
+                        aliases[alias] = body[2:2 + topic_size]
+                    else:
+                        aliased = True
+                        alias_error = alias not in aliases
+                elif not topic_size:
+                    alias_error = True
+            with self._lock:
+                self.messages += 1
+                self.payload_bytes += len(body) - pos
+                self.aliased += aliased
+                self.alias_errors += alias_error
+            if qos == 1:
+                response = b'\x40\x02' + packet_id
+            elif qos == 2:
+                response = b'\x50\x02' + packet_id
+        elif packet_type == 6:
+            response = b'\x70\x02' + body[0:2]
+        elif packet_type in (8, 10):
+            if packet_type == 8:
+                with self._lock:
+                    self.subscribes += 1
+            packet_id = body[0:2]
+            pos = 2
+            if version == 5:
+                pos = self._skip_properties(body, pos)
+            codes = b''
+            topics = []
+            while pos < len(body):
+                topic_size = struct.unpack_from('>H', body, pos)[0]
+                topics.append(body[pos + 2:pos + 2 + topic_size])
+                pos += 2 + topic_size
+                if packet_type == 8:
+                    codes += bytes([body[pos] & 3])
+                    pos += 1
+                else:
+                    codes += b'\x00'
+            if version == 5:
+                codes = b'\x00' + codes
+            elif packet_type == 10:
+                codes = b''
+            payload = packet_id + codes
+            response = bytes([0x90 if packet_type == 8 else 0xB0, len(payload)]) + payload
+            if packet_type == 8 and self.retained:
+                for topic in topics:
+                    response += self._retained_messages(topic.rstrip(b'#'), version)
+                with self._lock:
+                    self.retained_sent += self.retained * len(topics)
+        elif packet_type == 12:
+            response = b'\xd0\x00'
+        elif packet_type == 14:
+            return None
+        return response
+
+
+def serve_s7(port=DEFAULT_PORTS['s7']):
+    """
+    Runs the snap7 server bundled with python-snap7 (DB1 of 100 bytes, V memory of the S7-200 SMART)
+    """
+    # Runs from a checkout without pip install -e .: fablab_lib is in the repository root
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from fablab_lib.PLC.Siemens.snap7.Ethernet.snap7 import server
+    server.mainloop(tcpport=port)
+
+
+SIMULATORS = {
+    'mc': MCSimulator,
+    'fins': FinsSimulator,
+    'eip': EIPSimulator,
+    'mqtt': MQTTBroker,
+}
+
+
+def create(kind, **kwargs):
+    """
+    Creates a simulator by name (see SIMULATORS)
+    """
+    if kind not in SIMULATORS:
+        raise ValueError(f'Unknown simulator {kind}, expected one of {sorted(SIMULATORS)}')
+    return SIMULATORS[kind](**kwargs)
+
+
+def serve(kind, port, ready=None, stats=None, stop=None, **kwargs):
+    """
+    Runs a simulator until stop is set, entry point of the simulator processes of the benchmarks.
+
+    Args:
+        kind (str): The simulator name, or 's7'.
+        port (int): The port to listen on.
+        ready (multiprocessing.Event, optional): Set once the simulator listens.
+        stats (multiprocessing.Queue, optional): Receives the final stats() dict.
+        stop (multiprocessing.Event, optional): Stops the simulator when set.
+        **kwargs: The other simulator arguments.
+    """
+    if kind == 's7':
+        thread = threading.Thread(target=serve_s7, args=(port,), daemon=True)
+        thread.start()
+        time.sleep(0.5)
+        if not thread.is_alive():
+            return
+        if ready is not None:
+            ready.set()
+        if stop is not None:
+            stop.wait()
+        if stats is not None:
+            stats.put({})
+        return
+
+    simulator = create(kind, port=port, **kwargs)
+    simulator.start()
+    if ready is not None:
+        ready.set()
+    if stop is not None:
+        stop.wait()
+    simulator.stop()
+    if stats is not None:
+        stats.put(simulator.stats())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('kind', choices=sorted(DEFAULT_PORTS), help='simulator to run')
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on')
+    parser.add_argument('--port', type=int, default=None, help='port to listen on (default: the standard port)')
+    parser.add_argument('--latency', type=float, default=0.0, help='mean answer delay in seconds')
+    parser.add_argument('--jitter', type=float, default=0.0, help='uniform jitter of the delay in seconds')
+    parser.add_argument('--changes', type=int, default=CHANGES, help='values changed every tick')
+    parser.add_argument('--tick', type=float, default=TICK, help='seconds between two changes')
+    parser.add_argument('--transport', choices=('udp', 'tcp'), default='udp', help='FINS transport')
+    parser.add_argument('--topic-aliases', type=int, default=TOPIC_ALIASES, help='TopicAliasMaximum of the MQTT broker')
+    parser.add_argument('--retained', type=int, default=0, help='retained messages sent by the MQTT broker after a SUBACK')
+    args = parser.parse_args()
+
+    port = args.port if args.port is not None else DEFAULT_PORTS[args.kind]
+    if args.kind == 's7':
+        serve_s7(port)
+        return
+    kwargs = dict(host=args.host, port=port, latency=args.latency, jitter=args.jitter,
+                  changes=args.changes, tick=args.tick)
+    if args.kind == 'fins':
+        kwargs['transport'] = args.transport
+    if args.kind == 'mqtt':
+        kwargs['topic_aliases'] = args.topic_aliases
+        kwargs['retained'] = args.retained
+    create(args.kind, **kwargs).serve_forever()
+
+
+if __name__ == '__main__':
+    main()
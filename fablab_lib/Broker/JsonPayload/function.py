@@ -4,10 +4,157 @@ This file contains the functions to generate the json payload for the data to be
 Library: json
 Installation: pip install json
 Information: This library supports json format.
+
+The payloads of the data points are built by a PayloadEncoder (the module level encoder is shared by the
+MQTT wrapper and the CSV log): the name fragment of each tag is escaped once and cached, the timestamp
+is formatted once per second, and the payload is assembled as bytes. The encoder output is the same
+as json.dumps([{'name': ..., 'value': ..., 'timestamp': ...}]).
+
+The MQTT wrapper encodes the payloads with a codec (get_codec), json by default. The compact codecs are
+for metered links:
+	- msgpack: a MessagePack array of maps {"n": name, "v": value, "t": epoch milliseconds}
+	- msgpack-delta: the batches are a map of columns {"t": first epoch ms, "n": [names], "v": [values],
+	  "d": [milliseconds since the previous point]}, the single points are the same as msgpack
+	- json-zlib, msgpack-zlib, msgpack-delta-zlib: the batches are compressed with zlib
+The codec of a payload is given by the topic suffix of the codec (/msgpack, ... none for json) or by
+the MQTT v5 content type property (application/json, application/msgpack, ...). A compressed payload
+starts with the zlib header 0x78, a json payload with '[' and a MessagePack payload with a map or an array.
 """
 
+from abc import ABC, abstractmethod
 from datetime import datetime   
 import json
+import math
+import struct
+import time
+import zlib
+
+MAX_CACHED_NAMES = 4096		# names cached by a PayloadEncoder before the cache is cleared
+ZLIB_LEVEL = 6				# compression level of the zlib codecs
+
+
+class PayloadEncoder:
+	"""
+	Encodes data points as json payloads [{"name": ..., "value": ..., "timestamp": ...}].
+
+	The last payload of each name is kept, so encoding the same (name, value, timestamp) again, e.g. in
+	the MQTT sink and in the CSV log of the same scan, returns the same bytes without encoding twice.
+
+	Example:
+		>>> encoder.encode('Counter_1', 125, '2024-05-06T08:00:00.000000')
+		b'[{"name": "Counter_1", "value": 125, "timestamp": "2024-05-06T08:00:00.000000"}]'
+	"""
+
+	def __init__(self):
+		self._names = {}		# name -> b'{"name": "...", "value": '
+		self._last = {}			# name -> (value, timestamp, record)
+		self._second = None		# the second of the cached timestamp prefix
+		self._prefix = b''		# b'YYYY-MM-DDTHH:MM:SS.'
+		self._timestamp = None	# the last timestamp string and its json fragment
+		self._timestampBytes = b''
+
+	def now(self) -> bytes:
+		"""
+		The current local time in the format of datetime.now().isoformat(timespec='microseconds'), as bytes.
+		"""
+		t = time.time()
+		second = int(t)
+		if second != self._second:
+			self._prefix = datetime.fromtimestamp(second).strftime('%Y-%m-%dT%H:%M:%S.').encode()
+			self._second = second
+		return self._prefix + b'%06d' % int((t - second) * 1e6)
+
+	@staticmethod
+	def encode_value(value) -> bytes:
+		"""
+		Encodes a value as json, with fast paths for the types read from the PLCs.
+		"""
+		kind = type(value)
+		if kind is int:
+			return b'%d' % value
+		if kind is bool:
+			return b'true' if value else b'false'
+		if kind is float and math.isfinite(value):
+			return repr(value).encode()
+		if value is None:
+			return b'null'
+		return json.dumps(value).encode()
+
+	def encode_record(self, name, value, timestamp=None) -> bytes:
+		"""
+		Encodes one data point as a json object {"name": ..., "value": ..., "timestamp": ...}.
+
+		Args:
+			name: The name of the data.
+			value: The value of the data.
+			timestamp (str, optional): The ISO 8601 timestamp of the value. Defaults to None (now).
+
+		Returns:
+			bytes: The json object.
+		"""
+		if timestamp is not None:
+			last = self._last.get(name)
+			if last is not None and last[1] == timestamp and type(last[0]) is type(value) and last[0] == value:
+				return last[2]
+			if timestamp != self._timestamp:
+				self._timestampBytes = json.dumps(timestamp).encode()
+				self._timestamp = timestamp
+			timestampBytes = self._timestampBytes
+		else:
+			timestampBytes = b'"' + self.now() + b'"'
+
+		head = self._names.get(name)
+		if head is None:
+			if len(self._names) >= MAX_CACHED_NAMES:
+				self._names.clear()
+				self._last.clear()
+			head = self._names[name] = b'{"name": ' + json.dumps(str(name)).encode() + b', "value": '
+		record = head + self.encode_value(value) + b', "timestamp": ' + timestampBytes + b'}'
+		if timestamp is not None:
+			self._last[name] = (value, timestamp, record)
+		return record
+
+	def encode(self, name, value, timestamp=None) -> bytes:
+		"""
+		Encodes one data point as the payload of generate_data, a json array of one object.
+
+		Returns:
+			bytes: The json payload.
+		"""
+		return b'[' + self.encode_record(name, value, timestamp) + b']'
+
+	def encode_batch(self, records, max_bytes=None) -> list:
+		"""
+		Encodes several data points as json arrays, see generate_batch_data.
+
+		Returns:
+			list: The json payloads (bytes).
+		"""
+		now = None
+		payloads = []
+		parts = []
+		size = 2
+		for record in records:
+			timestamp = record[2] if len(record) > 2 else None
+			if timestamp is None:
+				# the records without timestamp get the same one
+				if now is None:
+					now = self.now().decode()
+				timestamp = now
+			part = self.encode_record(record[0], record[1], timestamp)
+			# json.dumps separates the items of a list with ', '
+			if parts and max_bytes is not None and size + 2 + len(part) > max_bytes:
+				payloads.append(b'[' + b', '.join(parts) + b']')
+				parts = []
+				size = 2
+			size += len(part) + (2 if parts else 0)
+			parts.append(part)
+		if parts:
+			payloads.append(b'[' + b', '.join(parts) + b']')
+		return payloads
+
+
+encoder = PayloadEncoder()	# the encoder shared by the MQTT wrapper and the CSV log
 
 
 def generate_data_status(state, value):
@@ -26,18 +173,462 @@ def generate_data(data_name, data_value):
 	"""
 	Generate the json payload for the machine data.
 	"""
-	data = [{
-                'name': str(data_name),
-                'value': data_value,
-                'timestamp': datetime.now().isoformat(timespec='microseconds')
-	}]
-	return (json.dumps(data))
+	return encoder.encode(data_name, data_value).decode()
 
 
 def generate_general_data(data_name, data_value, timestamp):
-	data = [{
-                'name': str(data_name),
-                'value': data_value,
-                'timestamp': timestamp
-	}]
-	return (json.dumps(data))
+	return encoder.encode(data_name, data_value, timestamp).decode()
+
+
+def parse_data(payload):
+	"""
+	Parse a json payload of data points: an array of {name, value, timestamp} objects (the format of
+	generate_data and generate_batch_data) or a single object.
+
+	Args:
+		payload (bytes or str): The payload, bytes are decoded by json.loads without a copy to str.
+
+	Returns:
+		list: The data points (dict), in the order of the payload.
+
+	Raises:
+		ValueError: If the payload is not json, or not objects.
+	"""
+	data = json.loads(payload)
+	if isinstance(data, dict):
+		return [data]
+	if isinstance(data, list) and all(isinstance(record, dict) for record in data):
+		return data
+	raise ValueError('The payload is not a json object or an array of json objects.')
+
+
+def generate_batch_data(records, max_bytes=None):
+	"""
+	Generate the json payloads of several data points, in the format of generate_data.
+
+	Args:
+		records (list): Tuples (name, value) or (name, value, timestamp), timestamp an ISO 8601 string.
+		The current time is used when the timestamp is missing or None.
+		max_bytes (int, optional): The maximum size of a payload, the records are split into as many
+		payloads as needed. A record larger than max_bytes gets a payload of its own. Defaults to None (one payload).
+
+	Returns:
+		list: The json payloads (str), the records keep their order.
+	"""
+	return [payload.decode() for payload in encoder.encode_batch(records, max_bytes)]
+
+
+def _pack(value, out: bytearray) -> None:
+	"""
+	Appends the MessagePack encoding of a value (None, bool, int, float, str, bytes, list, tuple, dict).
+	"""
+	kind = type(value)
+	if kind is int:
+		if 0 <= value < 0x80:
+			out.append(value)
+		elif -32 <= value < 0:
+			out.append(value & 0xFF)
+		elif 0 <= value <= 0xFFFFFFFF:
+			if value <= 0xFF:
+				out += b'\xcc' + struct.pack('>B', value)
+			elif value <= 0xFFFF:
+				out += b'\xcd' + struct.pack('>H', value)
+			else:
+				out += b'\xce' + struct.pack('>I', value)
+		elif 0 <= value <= 0xFFFFFFFFFFFFFFFF:
+			out += b'\xcf' + struct.pack('>Q', value)
+		elif -0x80000000 <= value < 0:
+			out += b'\xd2' + struct.pack('>i', value)
+		elif -0x8000000000000000 <= value < 0:
+			out += b'\xd3' + struct.pack('>q', value)
+		else:
+			raise ValueError(f'Integer out of the MessagePack range: {value}')
+	elif kind is float:
+		out += b'\xcb' + struct.pack('>d', value)
+	elif kind is str:
+		data = value.encode()
+		size = len(data)
+		if size < 32:
+			out.append(0xA0 | size)
+		elif size <= 0xFF:
+			out += b'\xd9' + struct.pack('>B', size)
+		elif size <= 0xFFFF:
+			out += b'\xda' + struct.pack('>H', size)
+		else:
+			out += b'\xdb' + struct.pack('>I', size)
+		out += data
+	elif value is None:
+		out.append(0xC0)
+	elif kind is bool:
+		out.append(0xC3 if value else 0xC2)
+	elif kind in (list, tuple):
+		size = len(value)
+		if size < 16:
+			out.append(0x90 | size)
+		elif size <= 0xFFFF:
+			out += b'\xdc' + struct.pack('>H', size)
+		else:
+			out += b'\xdd' + struct.pack('>I', size)
+		for item in value:
+			_pack(item, out)
+	elif kind is dict:
+		size = len(value)
+		if size < 16:
+			out.append(0x80 | size)
+		elif size <= 0xFFFF:
+			out += b'\xde' + struct.pack('>H', size)
+		else:
+			out += b'\xdf' + struct.pack('>I', size)
+		for key, item in value.items():
+			_pack(key, out)
+			_pack(item, out)
+	elif kind in (bytes, bytearray):
+		size = len(value)
+		if size <= 0xFF:
+			out += b'\xc4' + struct.pack('>B', size)
+		elif size <= 0xFFFF:
+			out += b'\xc5' + struct.pack('>H', size)
+		else:
+			out += b'\xc6' + struct.pack('>I', size)
+		out += value
+	elif isinstance(value, bool):
+		out.append(0xC3 if value else 0xC2)
+	elif isinstance(value, (int, float, str)):
+		# subclasses, e.g. IntEnum
+		_pack(int(value) if isinstance(value, int) else float(value) if isinstance(value, float) else str(value), out)
+	else:
+		raise TypeError(f'Object of type {kind.__name__} is not MessagePack serializable')
+
+
+# MessagePack formats with a fixed size: code -> (struct format, size)
+_FIXED = {0xCA: ('>f', 4), 0xCB: ('>d', 8), 0xCC: ('>B', 1), 0xCD: ('>H', 2), 0xCE: ('>I', 4), 0xCF: ('>Q', 8),
+		  0xD0: ('>b', 1), 0xD1: ('>h', 2), 0xD2: ('>i', 4), 0xD3: ('>q', 8)}
+# code -> (struct format of the length, size) of str, bin, array and map
+_SIZED = {0xD9: ('>B', 1), 0xDA: ('>H', 2), 0xDB: ('>I', 4), 0xC4: ('>B', 1), 0xC5: ('>H', 2), 0xC6: ('>I', 4),
+		  0xDC: ('>H', 2), 0xDD: ('>I', 4), 0xDE: ('>H', 2), 0xDF: ('>I', 4)}
+
+
+def _unpack(data: bytes, pos: int) -> tuple:
+	"""
+	Decodes the MessagePack value at pos, returns (value, next position).
+	"""
+	code = data[pos]
+	pos += 1
+	if code < 0x80:
+		return code, pos
+	if code >= 0xE0:
+		return code - 0x100, pos
+	if 0xA0 <= code <= 0xBF:
+		end = pos + (code & 0x1F)
+		return data[pos:end].decode(), end
+	if 0x90 <= code <= 0x9F or 0x80 <= code <= 0x8F:
+		size, container = code & 0x0F, code & 0xF0
+	elif code == 0xC0:
+		return None, pos
+	elif code in (0xC2, 0xC3):
+		return code == 0xC3, pos
+	elif code in _FIXED:
+		fmt, size = _FIXED[code]
+		return struct.unpack_from(fmt, data, pos)[0], pos + size
+	elif code in _SIZED:
+		fmt, width = _SIZED[code]
+		size = struct.unpack_from(fmt, data, pos)[0]
+		pos += width
+		if code in (0xD9, 0xDA, 0xDB):
+			return data[pos:pos + size].decode(), pos + size
+		if code in (0xC4, 0xC5, 0xC6):
+			return bytes(data[pos:pos + size]), pos + size
+		container = 0x90 if code in (0xDC, 0xDD) else 0x80
+	else:
+		raise ValueError(f'Unsupported MessagePack type 0x{code:02x}')
+	if container == 0x90:
+		items = []
+		for _ in range(size):
+			item, pos = _unpack(data, pos)
+			items.append(item)
+		return items, pos
+	result = {}
+	for _ in range(size):
+		key, pos = _unpack(data, pos)
+		result[key], pos = _unpack(data, pos)
+	return result, pos
+
+
+def packb(value) -> bytes:
+	"""
+	Encodes a value as MessagePack.
+	"""
+	out = bytearray()
+	_pack(value, out)
+	return bytes(out)
+
+
+def unpackb(data: bytes):
+	"""
+	Decodes a MessagePack value.
+
+	Raises:
+		ValueError: If the data is not MessagePack or has extra bytes.
+	"""
+	try:
+		value, pos = _unpack(data, 0)
+	except (IndexError, struct.error, UnicodeDecodeError) as e:
+		raise ValueError(f'The payload is not MessagePack: {e}')
+	if pos != len(data):
+		raise ValueError('The payload has extra bytes after the MessagePack value.')
+	return value
+
+
+class Codec(ABC):
+	"""
+	Base class of the payload codecs, a codec implements encode(), _encode_batch() and _decode().
+
+	Attributes:
+		name (str): The name of the codec in CODECS.
+		content_type (str): The MQTT v5 content type of its payloads.
+		suffix (str): The topic suffix of its payloads, '' for json.
+		compress (bool): The batches are compressed with zlib.
+	"""
+	name = None
+	content_type = None
+
+	def __init__(self, compress: bool = False):
+		self.compress = compress
+
+	@property
+	def suffix(self) -> str:
+		return '/' + self.name
+
+	@abstractmethod
+	def encode(self, name, value, timestamp=None) -> bytes:
+		"""
+		Encodes one data point.
+
+		Args:
+			name: The name of the data.
+			value: The value of the data.
+			timestamp (str, optional): The ISO 8601 timestamp of the value. Defaults to None (now).
+		"""
+
+	@abstractmethod
+	def _encode_batch(self, records, max_bytes) -> list:
+		"""
+		Encodes several data points in payloads of at most max_bytes, not compressed.
+		"""
+
+	def encode_batch(self, records, max_bytes=None) -> list:
+		"""
+		Encodes several data points in payloads of at most max_bytes (before compression).
+
+		Args:
+			records (list): Tuples (name, value) or (name, value, timestamp).
+			max_bytes (int, optional): The maximum size of a payload. Defaults to None (one payload).
+
+		Returns:
+			list: The payloads (bytes).
+		"""
+		payloads = self._encode_batch(records, max_bytes)
+		if self.compress:
+			return [zlib.compress(payload, ZLIB_LEVEL) for payload in payloads]
+		return payloads
+
+	@abstractmethod
+	def _decode(self, payload) -> list:
+		"""
+		Decodes a payload of this codec, not compressed.
+		"""
+
+	def decode(self, payload) -> list:
+		"""
+		Decodes a payload of this codec.
+
+		Returns:
+			list: The data points, dicts {name, value, timestamp} with an ISO 8601 timestamp.
+
+		Raises:
+			ValueError: If the payload is not in the format of the codec.
+		"""
+		if payload[:1] == b'\x78':
+			try:
+				payload = zlib.decompress(payload)
+			except zlib.error as e:
+				raise ValueError(f'The payload is not zlib compressed: {e}')
+		return self._decode(payload)
+
+
+class JsonCodec(Codec):
+	"""
+	The json payloads of generate_data (encoded by the shared PayloadEncoder).
+	"""
+	content_type = 'application/json'
+
+	def __init__(self, compress: bool = False):
+		super().__init__(compress)
+		self.name = 'json-zlib' if compress else 'json'
+		if compress:
+			self.content_type = 'application/json-zlib'
+
+	@property
+	def suffix(self) -> str:
+		return '/' + self.name if self.compress else ''
+
+	def encode(self, name, value, timestamp=None) -> bytes:
+		return encoder.encode(name, value, timestamp)
+
+	def _encode_batch(self, records, max_bytes) -> list:
+		return encoder.encode_batch(records, max_bytes)
+
+	def _decode(self, payload) -> list:
+		return parse_data(payload)
+
+
+class MsgPackCodec(Codec):
+	"""
+	MessagePack payloads with short keys and epoch millisecond timestamps, see the module documentation.
+
+	Args:
+		delta (bool, optional): The batches are columns with the timestamps as differences. Defaults to False.
+		compress (bool, optional): The batches are compressed with zlib. Defaults to False.
+	"""
+
+	def __init__(self, delta: bool = False, compress: bool = False):
+		super().__init__(compress)
+		self.delta = delta
+		self.name = 'msgpack' + ('-delta' if delta else '') + ('-zlib' if compress else '')
+		self.content_type = 'application/' + self.name
+		self._heads = {}		# name -> b'\x83\xa1n<name>\xa1v'
+		self._timestamp = None	# the last ISO timestamp and its epoch milliseconds
+		self._millis = 0
+
+	def millis(self, timestamp=None) -> int:
+		"""
+		Returns the epoch milliseconds of an ISO 8601 local timestamp (the last one is cached), or of now.
+		"""
+		if timestamp is None:
+			return int(time.time() * 1000)
+		if timestamp != self._timestamp:
+			self._millis = int(round(datetime.fromisoformat(timestamp).timestamp() * 1000))
+			self._timestamp = timestamp
+		return self._millis
+
+	def _record(self, name, value, millis: int) -> bytes:
+		head = self._heads.get(name)
+		if head is None:
+			if len(self._heads) >= MAX_CACHED_NAMES:
+				self._heads.clear()
+			out = bytearray(b'\x83\xa1n')
+			_pack(str(name), out)
+			head = self._heads[name] = bytes(out + b'\xa1v')
+		out = bytearray(head)
+		_pack(value, out)
+		out += b'\xa1t'
+		_pack(millis, out)
+		return bytes(out)
+
+	def encode(self, name, value, timestamp=None) -> bytes:
+		return b'\x91' + self._record(name, value, self.millis(timestamp))
+
+	def _encode_batch(self, records, max_bytes) -> list:
+		now = self.millis()
+		if self.delta:
+			return self._encode_columns(records, max_bytes, now)
+		payloads = []
+		parts = []
+		size = 5
+		for record in records:
+			timestamp = record[2] if len(record) > 2 else None
+			part = self._record(record[0], record[1], now if timestamp is None else self.millis(timestamp))
+			if parts and max_bytes is not None and size + len(part) > max_bytes:
+				payloads.append(self._array(parts))
+				parts = []
+				size = 5
+			size += len(part)
+			parts.append(part)
+		if parts:
+			payloads.append(self._array(parts))
+		return payloads
+
+	@staticmethod
+	def _array(parts) -> bytes:
+		out = bytearray()
+		size = len(parts)
+		if size < 16:
+			out.append(0x90 | size)
+		elif size <= 0xFFFF:
+			out += b'\xdc' + struct.pack('>H', size)
+		else:
+			out += b'\xdd' + struct.pack('>I', size)
+		return bytes(out) + b''.join(parts)
+
+	def _encode_columns(self, records, max_bytes, now) -> list:
+		payloads = []
+		columns = None
+		for record in records:
+			timestamp = record[2] if len(record) > 2 else None
+			millis = now if timestamp is None else self.millis(timestamp)
+			name = str(record[0])
+			if columns is None:
+				columns = {'t': millis, 'n': [], 'v': [], 'd': []}
+				previous = millis
+				size = 32
+			# the size of the packed columns is estimated from the packed items
+			item = len(name) + 9 + len(packb(record[1]))
+			if columns['n'] and max_bytes is not None and size + item > max_bytes:
+				payloads.append(packb(columns))
+				columns = {'t': millis, 'n': [], 'v': [], 'd': []}
+				previous = millis
+				size = 32
+			columns['n'].append(name)
+			columns['v'].append(record[1])
+			columns['d'].append(millis - previous)
+			previous = millis
+			size += item
+		if columns is not None:
+			payloads.append(packb(columns))
+		return payloads
+
+	def _decode(self, payload) -> list:
+		data = unpackb(payload)
+		if isinstance(data, dict) and 'd' in data:
+			millis = data['t']
+			records = []
+			for name, value, delta in zip(data['n'], data['v'], data['d']):
+				millis += delta
+				records.append({'name': name, 'value': value, 'timestamp': _iso(millis)})
+			return records
+		if isinstance(data, dict):
+			data = [data]
+		if not isinstance(data, list) or not all(isinstance(record, dict) for record in data):
+			raise ValueError('The payload is not a MessagePack map or an array of maps.')
+		return [{'name': record.get('n'), 'value': record.get('v'),
+				 'timestamp': _iso(record['t']) if 't' in record else None} for record in data]
+
+
+def _iso(millis: int) -> str:
+	return datetime.fromtimestamp(millis / 1000).isoformat(timespec='milliseconds')
+
+
+CODECS = {codec.name: codec for codec in (JsonCodec(), JsonCodec(compress=True), MsgPackCodec(),
+		  MsgPackCodec(compress=True), MsgPackCodec(delta=True), MsgPackCodec(delta=True, compress=True))}
+
+
+def get_codec(name: str) -> Codec:
+	"""
+	Returns a codec of CODECS by its name or its content type.
+
+	Raises:
+		ValueError: If the codec is unknown.
+	"""
+	for codec in CODECS.values():
+		if name == codec.name or name == codec.content_type:
+			return codec
+	raise ValueError(f'Unknown payload codec: {name}, expected one of {sorted(CODECS)}')
+
+
+def codec_of_topic(topic: str) -> Codec:
+	"""
+	Returns the codec of a topic from its suffix, json for a topic without codec suffix.
+	"""
+	suffix = topic[topic.rfind('/'):]
+	codec = CODECS.get(suffix[1:])
+	return codec if codec is not None and codec.suffix == suffix else CODECS['json']
@@ -5,17 +5,23 @@ Library: paho-mqtt
 Installation: pip install paho-mqtt
 Information: https://pypi.org/project/paho-mqtt/
 
-This module contains the MQTT class, which is responsible for connecting to an MQTT broker and publishing/subscribing to topics.
+This module contains the MQTT class, which is responsible for connecting to an MQTT broker and publishing/subscribing to topics,
+the BatchPublisher class, which groups the data points published within a linger time into one message,
+the StoreForward class, which stores the messages in a DiskQueue while disconnected and replays them,
+and the PublishQueue class, a bounded queue between the scan threads and the network.
 """
 
-from fablab_lib.Broker.JsonPayload.function import generate_data
+from fablab_lib.Broker.JsonPayload.function import generate_data, encoder, get_codec, codec_of_topic
+from fablab_lib.Metrics.function import metrics
 import fablab_lib.Broker.MQTT.paho.mqtt.client as mqtt
+from fablab_lib.Broker.MQTT.paho.mqtt.properties import Properties
+from fablab_lib.Broker.MQTT.paho.mqtt.packettypes import PacketTypes
+from collections import deque
+from datetime import datetime
 import time
 import logging
-import json
 import threading
-
-lock = threading.Lock()
+import uuid
 
 # Application logger
 logger = logging.getLogger("MQTT")
@@ -24,6 +30,73 @@ _log_handle = logging.StreamHandler()
 _log_handle.setFormatter(logging.Formatter('%(asctime)s %(name)s %(levelname)s | %(message)s'))
 logger.addHandler(_log_handle)
 
+BATCH_TOPIC = 'batch'           # topic of the batched data points, under the standard topic
+MAX_BATCH_BYTES = 16384         # default maximum size of a batch payload
+LINGER_TIME = 0.05              # default seconds a data point waits for others in the BatchPublisher
+MAX_BATCH_RECORDS = 500         # data points that make the BatchPublisher publish without waiting
+REPLAY_WINDOW = 20              # replayed messages waiting for their PUBACK (the inflight window of paho)
+REPLAY_RATE = 100               # default replayed messages per second (0: no limit)
+ACK_POLL = 0.005                # seconds between two checks of the PUBACK when the replay window is full
+QUEUE_SIZE = 1000               # default messages held by a PublishQueue
+MAX_PENDING = 100               # messages of a PublishQueue held by paho until their PUBACK
+POLICIES = ('block', 'drop_oldest', 'coalesce', 'spill')    # overflow policies of a PublishQueue
+QUEUE_POLICY = 'drop_oldest'    # default overflow policy of a PublishQueue, never blocks the scans
+RECONNECT_POLL = 1.0            # seconds between two checks of the connection of a PublishQueue while disconnected
+MAX_INFLIGHT = 20               # default QoS 1 and 2 messages sent by paho before their PUBACK
+MAX_QUEUED = 0                  # default messages queued by paho behind the inflight ones (0: no limit)
+WRITE_BUDGET = mqtt.WRITE_BUDGET    # default bytes of queued packets paho sends with one system call
+SESSION_EXPIRY = 3600           # default seconds the broker keeps the session of an MQTT v5 client after a disconnection
+ALIAS_AFTER = 2                 # publish of a topic that gives it a topic alias (MQTT v5)
+
+# MQTT protocol versions of the MQTT class
+PROTOCOLS = {'3.1': mqtt.MQTTv31, '3.1.1': mqtt.MQTTv311, '5': mqtt.MQTTv5}
+
+# (qos, retain) of publish_data() by name or kind of data (lower case), '*' for the others
+PUBLISH_PRESETS = {
+    # every data point acknowledged and retained (the behaviour of the previous versions)
+    'retained': {'*': (1, True)},
+    # the last status and settings retained, the alarms acknowledged, the counters sent once
+    'telemetry': {'*': (1, False), 'machinestatus': (1, True), 'status': (1, True), 'setting': (1, True),
+                  'alarm': (1, False), 'counter': (0, False), 'counting': (0, False)},
+    # only the machine status acknowledged and retained
+    'best_effort': {'*': (0, False), 'machinestatus': (1, True), 'status': (1, True)},
+}
+
+
+class _LogText:
+    """
+    Decodes a payload for a log line only when the line is written.
+    """
+    __slots__ = ('payload',)
+
+    def __init__(self, payload):
+        self.payload = payload
+
+    def __str__(self):
+        if isinstance(self.payload, (bytes, bytearray)):
+            return self.payload.decode('utf-8', 'replace')
+        return str(self.payload)
+
+
+class _PublishProperties(Properties):
+    """
+    MQTT v5 PUBLISH properties packed once. paho packs the properties of a message at each send, the
+    instances are shared by the messages with the same properties and never changed.
+    """
+
+    def __init__(self, contentType: str = None, expiry: int = None, alias: int = None):
+        super().__init__(PacketTypes.PUBLISH)
+        if contentType:
+            self.ContentType = contentType
+        if expiry:
+            self.MessageExpiryInterval = expiry
+        if alias:
+            self.TopicAlias = alias
+        object.__setattr__(self, '_packed', super().pack())
+
+    def pack(self):
+        return self._packed
+
 
 # Variables to store machine states
 class ST:
@@ -55,6 +128,25 @@ class MQTT:
         tls_cert_path (str, optional): The path to the client certificate. Defaults to "".
         tls_key_path (str, optional): The path to the client key. Defaults to "".
         timeout (int, optional): The connection timeout in seconds. Defaults to 5.
+        policies (str or dict, optional): The QoS and retain flag of publish_data(), a name of PUBLISH_PRESETS
+            or a dict {name or kind: (qos, retain)}. Defaults to 'retained'.
+        max_inflight (int, optional): The QoS 1 and 2 messages sent before their PUBACK. Defaults to MAX_INFLIGHT.
+        max_queued (int, optional): The messages queued by paho behind them, 0 for no limit. Defaults to MAX_QUEUED.
+        codec (str or Codec, optional): The payload codec of publish_data() and publish_batch(), a name of
+            JsonPayload.CODECS (e.g. 'msgpack-delta-zlib'), whose suffix is added to the topics (MQTT 3.1.1) or
+            whose content type is sent as the ContentType property (MQTT v5). Defaults to 'json'.
+        protocol (str, optional): The MQTT version, a key of PROTOCOLS. Defaults to '3.1.1'.
+        client_id (str, optional): The client id, a random one when empty (MQTT v5, the session needs an id). Defaults to "".
+        session_expiry (int, optional): The seconds the broker keeps the session (subscriptions, QoS 1 messages)
+            after a disconnection, MQTT v5 only. Defaults to SESSION_EXPIRY.
+        message_expiry (int, optional): The seconds the broker keeps a non-retained data point for a subscriber
+            that is offline, then drops it as stale, MQTT v5 only. Defaults to None (no expiry).
+        tcp_nodelay (bool, optional): True disables the Nagle algorithm of the socket, False enables it.
+            Defaults to None (the system default, Nagle enabled).
+        send_buffer (int, optional): The socket send buffer size in bytes. Defaults to None (the system default).
+        receive_buffer (int, optional): The socket receive buffer size in bytes. Defaults to None (the system default).
+        write_budget (int, optional): The bytes of queued packets paho sends with one system call, 1 to send
+            each packet on its own. Defaults to WRITE_BUDGET.
 
     Raises:
         ValueError: If standard topic is not set.
@@ -70,7 +162,19 @@ class MQTT:
             tls_ca_path="",
             tls_cert_path="",
             tls_key_path="",
-            timeout=5
+            timeout=5,
+            policies='retained',
+            max_inflight=MAX_INFLIGHT,
+            max_queued=MAX_QUEUED,
+            codec='json',
+            protocol='3.1.1',
+            client_id="",
+            session_expiry=SESSION_EXPIRY,
+            message_expiry=None,
+            tcp_nodelay=None,
+            send_buffer=None,
+            receive_buffer=None,
+            write_budget=WRITE_BUDGET
             ):
 
         self.host = host
@@ -83,6 +187,29 @@ class MQTT:
         self.tls_cert_path = tls_cert_path
         self.tls_key_path = tls_key_path
         self.timeout = timeout
+        self.max_inflight = max_inflight
+        self.max_queued = max_queued
+        self.codec = get_codec(codec) if isinstance(codec, str) else codec
+        self.set_policies(policies)
+
+        if protocol not in PROTOCOLS:
+            raise ValueError(f'Unknown MQTT protocol: {protocol}, expected one of {sorted(PROTOCOLS)}')
+        self.protocol = PROTOCOLS[protocol]
+        self.v5 = self.protocol == mqtt.MQTTv5
+        self.client_id = client_id or (uuid.uuid4().hex if self.v5 else "")
+        self.session_expiry = session_expiry
+        self.message_expiry = message_expiry
+        self.tcp_nodelay = tcp_nodelay
+        self.send_buffer = send_buffer
+        self.receive_buffer = receive_buffer
+        self.write_budget = write_budget
+
+        # Topic aliases of MQTT v5, assigned again at each connection
+        self._alias_max = 0         # TopicAliasMaximum of the broker, 0 when it doesn't accept aliases
+        self._aliases = {}          # topic: [alias, qos of the message that set it]
+        self._counts = {}           # topic: publishes before its alias
+        self._properties = {}       # (content type, expiry, alias): _PublishProperties
+        self._alias_lock = threading.Lock()
 
         self.standardTopic = None
         self._mqtt = None # Mqtt client object
@@ -98,7 +225,7 @@ class MQTT:
         self.topicSub = None        # Topic to subscribe to
 
 
-    def _on_connect(self, client, userdata, flags, rc):
+    def _on_connect(self, client, userdata, flags, rc, properties=None):
         """
         Callback function when the MQTT _mqtt is connected to the broker.
 
@@ -107,10 +234,17 @@ class MQTT:
             userdata: The user data.
             flags: The connection flags.
             rc: The result code.
+            properties: The CONNACK properties (MQTT v5).
         """
         logger.info('Connected to MQTT broker with result code ' + str(rc))
 
-        if self.en_subscribe:
+        if self.v5:
+            self._reset_aliases(getattr(properties, 'TopicAliasMaximum', 0))
+
+        if self.v5 and flags.get('session present'):
+            # The broker kept the session: the subscriptions are still there
+            logger.info('MQTT session resumed, subscriptions kept by the broker')
+        elif self.en_subscribe:
             # Subscribe to standard topic
             topic = self.standardTopic
             if self.topicSub is not None:
@@ -132,7 +266,7 @@ class MQTT:
             self.on_connect(self, rc)
 
 
-    def _on_disconnect(self, client, userdata, rc):
+    def _on_disconnect(self, client, userdata, rc, properties=None):
         """
         Callback function when the MQTT _mqtt is disconnected from the broker.
 
@@ -140,6 +274,7 @@ class MQTT:
             _mqtt: The MQTT _mqtt instance.
             userdata: The user data.
             rc: The result code.
+            properties: The DISCONNECT properties (MQTT v5).
         """
         if rc != 0:
             logger.error('Unexpected disconnection from MQTT broker')
@@ -153,29 +288,38 @@ class MQTT:
         """
         Callback function when a message is received.
 
+        The payload is an array of {name, value, timestamp} objects or a single object, in the codec
+        of its ContentType property (MQTT v5) or of the topic suffix (json without suffix), on_message
+        is called once for each data point.
+
         Args:
             _mqtt: The MQTT _mqtt instance.
             userdata: The user data.
             message: The received message.
         """
-        logger.info('Message received: ' + message.payload.decode())
-        with lock:
-            try:
-                dataPayload = json.loads(message.payload.decode('utf-8').replace("[","").replace("]",""))
-            except:
-                try:
-                    dataPayload = json.loads(message.payload.decode('utf-8'))
-                except:
-                    logger.error('Message is not JSON format')
-                    return
-            
-            mqttName = dataPayload['name']
-            mqttValue = dataPayload['value']
-            mqttTimestamp = dataPayload['timestamp']
+        payload = message.payload
+        logger.info('Message received: %s', _LogText(payload))
+        # The payload is decoded once: a message is only seen by the network thread, no lock is needed
+        # A message of MQTT 3.1.1 has no properties attribute
+        contentType = getattr(getattr(message, 'properties', None), 'ContentType', None)
+        try:
+            codec = get_codec(contentType) if contentType else codec_of_topic(message.topic)
+        except ValueError:
+            logger.error(f'Message has an unknown content type: {contentType}')
+            return
+        try:
+            records = codec.decode(payload)
+        except ValueError:
+            logger.error(f'Message is not in {codec.name} format')
+            return
 
-        # If on_message callback is set, call it with the received data
+        # If on_message callback is set, call it with each received data point
         if self.on_message is not None:
-            self.on_message(self, dataPayload, mqttName, mqttValue, mqttTimestamp)
+            for dataPayload in records:
+                if 'name' not in dataPayload or 'value' not in dataPayload:
+                    logger.error('Message has no name or value: %s', _LogText(payload))
+                    continue
+                self.on_message(self, dataPayload, dataPayload['name'], dataPayload['value'], dataPayload.get('timestamp'))
 
 
     def connect(self):
@@ -192,7 +336,11 @@ class MQTT:
 
         # MQTT Client configuration
         if self._mqtt is None:
-            self._mqtt = mqtt.Client(userdata=self)
+            self._mqtt = mqtt.Client(client_id=self.client_id, userdata=self, protocol=self.protocol)
+            self._mqtt.max_inflight_messages_set(self.max_inflight)
+            self._mqtt.max_queued_messages_set(self.max_queued)
+            self._mqtt.write_budget_set(self.write_budget)
+            self._mqtt.socket_options_set(self.tcp_nodelay, self.send_buffer, self.receive_buffer)
 
         self._mqtt.on_connect = self._on_connect
         self._mqtt.on_disconnect = self._on_disconnect
@@ -230,7 +378,14 @@ class MQTT:
         # MQTT Connect
         logger.info('Trying to connect MQTT broker %s:%d' % (self.host, self.port))
         try:
-            self._mqtt.connect(self.host, self.port, self.keepalive)
+            if self.v5:
+                # A new session at the first connection, the broker keeps it for the reconnections
+                properties = Properties(PacketTypes.CONNECT)
+                properties.SessionExpiryInterval = self.session_expiry
+                self._mqtt.connect(self.host, self.port, self.keepalive,
+                                   clean_start=mqtt.MQTT_CLEAN_START_FIRST_ONLY, properties=properties)
+            else:
+                self._mqtt.connect(self.host, self.port, self.keepalive)
         except Exception as e:
             logger.warning('Error connecting to MQTT broker: ' + str(e))
             # return False
@@ -256,24 +411,246 @@ class MQTT:
             return self._mqtt.is_connected()
 
 
-    def publish_data(self, Name: str, Value, is_payload=False):
+    def set_policies(self, policies) -> None:
+        """
+        Set the QoS and retain flag of publish_data() by name or kind of data.
+
+        Args:
+            policies (str or dict): A name of PUBLISH_PRESETS, or a dict {name or kind: (qos, retain)},
+            '*' for the data without policy (QoS 1 and retained if missing).
+
+        Raises:
+            ValueError: If the preset is unknown.
+        """
+        if isinstance(policies, str):
+            if policies not in PUBLISH_PRESETS:
+                raise ValueError(f'Unknown publish preset: {policies}, expected one of {sorted(PUBLISH_PRESETS)}')
+            policies = PUBLISH_PRESETS[policies]
+        self._policies = {'*': (1, True)}
+        for name, (qos, retain) in policies.items():
+            self.set_policy(name, qos, retain)
+
+
+    def set_policy(self, Name: str, qos: int, retain: bool) -> None:
         """
-        Publish data to a topic.
+        Set the QoS and retain flag of publish_data() for a name or a kind of data.
+
+        Args:
+            Name (str): The name of the data, its kind (e.g. 'Alarm', the kind of a scan group), or '*' for all the others.
+            qos (int): The QoS, 0, 1 or 2.
+            retain (bool): Specifies whether the broker retains the last message of the topic.
+        """
+        self._policies[Name.lower()] = (int(qos), bool(retain))
+
+
+    def policy(self, Name: str, kind: str = None) -> tuple:
+        """
+        Returns the (qos, retain) of a data point: the policy of its name, else of its kind, else '*'.
+        """
+        policies = self._policies
+        policy = policies.get(Name.lower())
+        if policy is None and kind is not None:
+            policy = policies.get(kind.lower())
+        return policy if policy is not None else policies['*']
+
+
+    def max_inflight_messages_set(self, inflight: int) -> None:
+        """
+        Set the QoS 1 and 2 messages paho sends before receiving their PUBACK (20 by default), a larger
+        window keeps the link busy when the round trip to the broker is long.
+        """
+        self.max_inflight = inflight
+        if self._mqtt is not None:
+            self._mqtt.max_inflight_messages_set(inflight)
+
+
+    def max_queued_messages_set(self, queue_size: int) -> None:
+        """
+        Set the messages paho queues behind the inflight ones, 0 for no limit. The messages published
+        when the queue is full are dropped (and logged).
+        """
+        self.max_queued = queue_size
+        if self._mqtt is not None:
+            self._mqtt.max_queued_messages_set(queue_size)
+
+
+    def publish_data(self, Name: str, Value, is_payload=False, timestamp: str = None, kind: str = None):
+        """
+        Publish data to a topic, with the QoS and retain flag of its policy (see set_policies()).
 
         Args:
             Name (str): The name of the data.
             Value: The value of the data.
             is_payload (bool, optional): Specifies whether to publish the data as a payload. Defaults to False.
+            timestamp (str, optional): The ISO 8601 timestamp of the value. Defaults to None (now).
+            kind (str, optional): The kind of data (e.g. 'Alarm', 'Counter'), for its policy. Defaults to None.
+
+        Returns:
+            The published payload (bytes when encoded here), can be passed to LogFileCSV.log_data so the
+            value is not encoded twice.
         """
-        topic = self.standardTopic + Name
+        qos, retain = self.policy(Name, kind)
         if is_payload:
+            topic = self.standardTopic + Name
             payload = str(Value)
+            codec = None
         else:
-            payload = str(generate_data(Name, Value))
-        logger.info(f'Publishing data to topic {topic}: \n{payload}')
-        # print(str(payload))
-        # with lock:
-        self._mqtt.publish(topic, payload, 1, 1)
+            topic = self.standardTopic + Name
+            payload = self.codec.encode(Name, Value, timestamp)
+            codec = self.codec
+        logger.info('Publishing data to topic %s: \n%s', topic, _LogText(payload))
+        info = self._publish(topic, payload, qos, retain, codec, None if retain else self.message_expiry)
+        if info.rc == mqtt.MQTT_ERR_QUEUE_SIZE:
+            logger.warning(f'The paho queue is full, message to topic {topic} dropped.')
+        return payload
+
+
+    def _publish(self, topic: str, payload, qos: int, retain: bool, codec=None, expiry: int = None):
+        """
+        Publish a payload with paho, in the codec format (None for a payload not encoded here).
+
+        With MQTT 3.1.1, the codec suffix is added to the topic. With MQTT v5, the codec is sent as the
+        ContentType property (none for json), the expiry as the MessageExpiryInterval, and the topic is
+        replaced by its alias once the broker knows it.
+        """
+        if not self.v5:
+            if codec is not None:
+                topic += codec.suffix
+            return self._mqtt.publish(topic, payload, qos, retain)
+
+        contentType = codec.content_type if codec is not None and codec.suffix else None
+        alias = None
+        added = False
+        setter = None               # qos of the message that set the alias, replaced by a QoS 0 message
+        with self._alias_lock:
+            entry = self._aliases.get(topic)
+            if entry is not None:
+                alias = entry[0]
+                if qos == 0 and entry[1] > 0:
+                    # A QoS 0 message is sent at once, before the queued QoS 1 message that sets the alias
+                    setter = entry[1]
+                    entry[1] = 0
+                else:
+                    topic = ''
+            elif len(self._aliases) < self._alias_max:
+                count = self._counts.get(topic, 0) + 1
+                if count >= ALIAS_AFTER:
+                    # Sent with the topic, the broker learns the alias
+                    entry = self._aliases[topic] = [len(self._aliases) + 1, qos]
+                    alias = entry[0]
+                    added = True
+                else:
+                    self._counts[topic] = count
+            properties = self._publish_properties(contentType, expiry or None, alias)
+            # Published under the lock: a message without topic is queued before _reset_aliases()
+            info = self._mqtt.publish(topic, payload, qos, retain, properties)
+            if info.rc != mqtt.MQTT_ERR_SUCCESS:
+                # Not sent (the paho queue is full, or QoS 0 while disconnected): the broker doesn't learn the alias
+                if added:
+                    del self._aliases[topic]
+                elif setter is not None:
+                    entry[1] = setter
+            elif added:
+                self._counts.pop(topic, None)
+            return info
+
+
+    def _publish_properties(self, contentType: str, expiry: int, alias: int):
+        """
+        Returns the shared _PublishProperties of a PUBLISH packet.
+        """
+        key = (contentType, expiry, alias)
+        properties = self._properties.get(key)
+        if properties is None:
+            properties = self._properties[key] = _PublishProperties(contentType, expiry, alias)
+        return properties
+
+
+    def _reset_aliases(self, aliasMax: int) -> None:
+        """
+        Forget the topic aliases of the previous connection (called at each connection).
+
+        The messages without topic that paho sends again get their topic back, and no message sent
+        again sets an alias, the aliases are assigned again from the new connection.
+        """
+        with self._alias_lock:
+            topics = {entry[0]: topic for topic, entry in self._aliases.items()}
+            self._aliases = {}
+            self._counts = {}
+            self._alias_max = aliasMax
+            with self._mqtt._out_message_mutex:
+                for message in self._mqtt._out_messages.values():
+                    properties = message.properties
+                    alias = getattr(properties, 'TopicAlias', None)
+                    if alias is None:
+                        continue
+                    if not message.topic:
+                        message.topic = topics[alias].encode('utf-8')
+                    message.properties = self._publish_properties(getattr(properties, 'ContentType', None),
+                                                                  getattr(properties, 'MessageExpiryInterval', None), None)
+        if aliasMax:
+            logger.info(f'The broker accepts {aliasMax} topic aliases')
+
+
+    def publish(self, Name: str, payload, qos: int = 1, retain: bool = False):
+        """
+        Publish an encoded payload to a topic.
+
+        Args:
+            Name (str): The topic under the standard topic, with the topic suffix of its codec for
+                a payload encoded by a codec other than json (e.g. the messages of a DiskQueue).
+            payload (bytes or str): The payload.
+            qos (int, optional): The QoS of the message. Defaults to 1.
+            retain (bool, optional): Specifies whether the broker retains the message. Defaults to False.
+
+        Returns:
+            MQTTMessageInfo: The paho message info, is_published() is True when the broker has acknowledged
+            the message (QoS 1 and 2).
+        """
+        codec = codec_of_topic(Name)
+        if codec.suffix:
+            # a payload stored with the topic suffix of its codec
+            Name = Name[:-len(codec.suffix)]
+        topic = self.standardTopic + Name
+        logger.debug('Publishing payload to topic %s: %s', topic, _LogText(payload))
+        return self._publish(topic, payload, qos, retain, codec)
+
+
+    def publish_batch(self, records: list, max_bytes: int = MAX_BATCH_BYTES, Name: str = BATCH_TOPIC, qos: int = 1) -> int:
+        """
+        Publish several data points in as few messages as possible.
+
+        The data points are packed, in order, in json arrays of {name, value, timestamp} (the payload format of 
+        publish_data, or the batches of the codec) of at most max_bytes, published to the standard topic + Name.
+        The batches are not retained, a retained batch would only keep the values of the last batch.
+
+        Args:
+            records (list): Tuples (name, value) or (name, value, timestamp), timestamp an ISO 8601 string.
+            The current time is used when the timestamp is missing or None.
+            max_bytes (int, optional): The maximum size of a payload. Defaults to MAX_BATCH_BYTES.
+            Name (str, optional): The topic of the batches under the standard topic. Defaults to BATCH_TOPIC.
+            qos (int, optional): The QoS of the messages. Defaults to 1.
+
+        Returns:
+            int: The number of messages published.
+        """
+        if not records:
+            return 0
+        topic = self.standardTopic + Name
+        payloads = self.codec.encode_batch(records, max_bytes)
+        for payload in payloads:
+            self._publish(topic, payload, qos, False, self.codec, self.message_expiry)
+        logger.info(f'Published {len(records)} data points in {len(payloads)} messages to topic {topic}.')
+        return len(payloads)
+
+
+    def pending(self) -> int:
+        """
+        Returns the number of QoS 1 and 2 messages held by paho until their PUBACK (inflight and queued).
+        """
+        if self._mqtt is None:
+            return 0
+        return len(self._mqtt._out_messages)
 
 
     def subscribe(self, topic: str):
@@ -294,3 +671,580 @@ class MQTT:
         self._mqtt.loop_stop()
         self._mqtt.disconnect()
         logger.info('Disconnected from MQTT broker')
+
+
+class BatchPublisher:
+    """
+    Collects data points and publishes them in batches with MQTT.publish_batch().
+
+    A batch is published linger seconds after its first data point, so the points changed in the same
+    scan cycle (or in the cycles of several groups) leave in one message, or as soon as it holds 
+    max_records points.
+
+    Args:
+        client (MQTT): The connected MQTT client.
+        linger (float, optional): The time a data point waits for others in seconds. Defaults to LINGER_TIME.
+        max_bytes (int, optional): The maximum size of a payload. Defaults to MAX_BATCH_BYTES.
+        max_records (int, optional): The number of data points published without waiting. Defaults to MAX_BATCH_RECORDS.
+        Name (str, optional): The topic of the batches under the standard topic. Defaults to BATCH_TOPIC.
+        qos (int, optional): The QoS of the messages. Defaults to 1.
+
+    Example:
+        >>> batcher = BatchPublisher(client, linger=0.1)
+        >>> batcher.start()
+        >>> batcher.add('Counter_1', 125)
+        >>> batcher.stop()     # publishes the pending data points
+    """
+
+    def __init__(self, client, linger: float = LINGER_TIME, max_bytes: int = MAX_BATCH_BYTES, 
+            max_records: int = MAX_BATCH_RECORDS, Name: str = BATCH_TOPIC, qos: int = 1):
+        self.client = client
+        self.linger = linger
+        self.max_bytes = max_bytes
+        self.max_records = max_records
+        self.Name = Name
+        self.qos = qos
+
+        self._records = []
+        self._first = None          # monotonic time of the first data point of the batch
+        self._cond = threading.Condition()
+        self._stop = False
+        self._thread = None
+
+
+    def add(self, Name: str, Value, timestamp: str = None) -> None:
+        """
+        Add a data point to the batch.
+
+        Args:
+            Name (str): The name of the data.
+            Value: The value of the data.
+            timestamp (str, optional): The ISO 8601 timestamp of the value. Defaults to None (now).
+        """
+        if timestamp is None:
+            timestamp = datetime.now().isoformat(timespec='microseconds')
+        with self._cond:
+            if not self._records:
+                self._first = time.monotonic()
+            self._records.append((Name, Value, timestamp))
+            if len(self._records) == 1 or len(self._records) >= self.max_records:
+                self._cond.notify()
+
+
+    def flush(self) -> int:
+        """
+        Publish the pending data points now.
+
+        Returns:
+            int: The number of messages published.
+        """
+        with self._cond:
+            records, self._records = self._records, []
+        return self.client.publish_batch(records, self.max_bytes, self.Name, self.qos)
+
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._stop:
+                    if self._records:
+                        remaining = self._first + self.linger - time.monotonic()
+                        if remaining <= 0 or len(self._records) >= self.max_records:
+                            break
+                        self._cond.wait(remaining)
+                    else:
+                        self._cond.wait()
+                if self._stop:
+                    return
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f'Error publishing a batch: {e}')
+
+
+    def start(self) -> None:
+        """
+        Start publishing the batches from a background thread.
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop = False
+        self._thread = threading.Thread(target=self._run, name='MQTT-batch', daemon=True)
+        self._thread.start()
+
+
+    def stop(self) -> None:
+        """
+        Stop the background thread and publish the pending data points.
+        """
+        with self._cond:
+            self._stop = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+
+class StoreForward:
+    """
+    Publishes with an MQTT client while it is connected, and stores the messages in a DiskQueue
+    (fablab_lib.Store) while it is disconnected, to replay them when the connection is back.
+
+    The replay runs on a background thread, in order, with at most window messages waiting for their
+    PUBACK and at most rate messages per second, so a long disconnection doesn't flood paho and the broker.
+    The acknowledged cursor of the queue advances only when the PUBACK of a message and of all the messages
+    before it are received: after a crash or a power cut, the replay restarts at the first message not
+    acknowledged. While the queue holds messages, the new ones are stored behind them to keep the order.
+
+    The replayed messages are not retained: an old value must not replace the retained value of a topic.
+    StoreForward has the publish_data() and publish_batch() methods of MQTT, so it can be used instead
+    of the client, e.g. in a ScanEngine MQTTSink.
+
+    Args:
+        client (MQTT): The MQTT client.
+        queue (DiskQueue): The queue of the stored messages.
+        window (int, optional): The replayed messages waiting for their PUBACK. Defaults to REPLAY_WINDOW.
+        rate (float, optional): The replayed messages per second, 0 for no limit. Defaults to REPLAY_RATE.
+        qos (int, optional): The QoS of the replayed messages, 1 or 2. Defaults to 1.
+
+    Raises:
+        ValueError: If qos is 0 (a message without PUBACK can't be acknowledged).
+
+    Example:
+        >>> forward = StoreForward(client, DiskQueue('/home/pi/WB/store/'))
+        >>> forward.start()
+        >>> forward.publish_data('Counter_1', 125)
+        >>> forward.stop()
+    """
+
+    def __init__(self, client, queue, window: int = REPLAY_WINDOW, rate: float = REPLAY_RATE, qos: int = 1):
+        if qos not in (1, 2):
+            raise ValueError('The replayed messages are acknowledged by their PUBACK, qos must be 1 or 2.')
+        self.client = client
+        self.queue = queue
+        self.window = window
+        self.rate = rate
+        self.qos = qos
+
+        self.stored = 0             # messages stored in the queue
+        self.replayed = 0           # messages published from the queue (again after a rewind)
+
+        self._inflight = deque()    # (message info, position) of the replayed messages, in order
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+
+    def _online(self) -> bool:
+        return self.client.is_connected() and self.queue.empty()
+
+
+    def store(self, Name: str, payload) -> None:
+        """
+        Store a message in the queue, to be replayed.
+
+        Args:
+            Name (str): The topic under the standard topic.
+            payload (bytes or str): The payload.
+        """
+        self.queue.append(Name, payload)
+        self.stored += 1
+        self._wake.set()
+
+
+    def publish_data(self, Name: str, Value, is_payload=False, timestamp: str = None, kind: str = None):
+        """
+        Publish data with MQTT.publish_data(), or store it while disconnected.
+
+        Args:
+            Name (str): The name of the data.
+            Value: The value of the data.
+            is_payload (bool, optional): Specifies whether to publish the data as a payload. Defaults to False.
+            timestamp (str, optional): The ISO 8601 timestamp of the value. Defaults to None (now).
+            kind (str, optional): The kind of data, for the policy of the client. Defaults to None.
+
+        Returns:
+            The payload.
+        """
+        if self._online():
+            return self.client.publish_data(Name, Value, is_payload, timestamp, kind)
+        if is_payload:
+            payload = str(Value)
+            self.store(Name, payload)
+        else:
+            payload = self.client.codec.encode(Name, Value, timestamp)
+            self.store(Name + self.client.codec.suffix, payload)
+        return payload
+
+
+    def publish_batch(self, records: list, max_bytes: int = MAX_BATCH_BYTES, Name: str = BATCH_TOPIC, qos: int = 1) -> int:
+        """
+        Publish data points with MQTT.publish_batch(), or store the batches while disconnected.
+
+        Returns:
+            int: The number of messages published or stored.
+        """
+        if self._online():
+            return self.client.publish_batch(records, max_bytes, Name, qos)
+        payloads = self.client.codec.encode_batch(records, max_bytes) if records else []
+        for payload in payloads:
+            self.store(Name + self.client.codec.suffix, payload)
+        return len(payloads)
+
+
+    def _collect(self) -> None:
+        """
+        Acknowledges the replayed messages published in order.
+        """
+        position = None
+        failed = False
+        while self._inflight:
+            info, nextPosition = self._inflight[0]
+            if info.rc not in (mqtt.MQTT_ERR_SUCCESS, mqtt.MQTT_ERR_NO_CONN):
+                # Not queued by paho (e.g. its queue is full): sent again from the first message not acknowledged
+                logger.error(f'Error replaying a stored message: {mqtt.error_string(info.rc)}')
+                failed = True
+                break
+            if not info.is_published():
+                break
+            position = nextPosition
+            self._inflight.popleft()
+        if position is not None:
+            self.queue.ack(position)
+        if failed:
+            self._inflight.clear()
+            self.queue.rewind()
+
+
+    def _run(self) -> None:
+        tokens = float(self.window)
+        last = time.monotonic()
+        # the queue is synced from here, so the messages stored in a burst don't wait for the next append
+        poll = min(1.0, self.queue.sync_interval) or 1.0
+        while not self._stop.is_set():
+            self._collect()
+            self.queue.sync_if_due()
+            if not self.client.is_connected():
+                # paho keeps the inflight messages and sends them again after the reconnection
+                self._stop.wait(poll)
+                continue
+            free = self.window - len(self._inflight)
+            if self.rate:
+                now = time.monotonic()
+                tokens = min(float(self.window), tokens + (now - last) * self.rate)
+                last = now
+                free = min(free, int(tokens))
+            if free <= 0:
+                self._stop.wait(ACK_POLL)
+                continue
+            self._wake.clear()
+            records = self.queue.read(free)
+            if not records:
+                if self._inflight:
+                    self._stop.wait(ACK_POLL)
+                else:
+                    self._wake.wait(poll)
+                continue
+            for position, Name, payload in records:
+                info = self.client.publish(Name, payload, self.qos, False)
+                self._inflight.append((info, position))
+            tokens -= len(records)
+            self.replayed += len(records)
+        self._collect()
+
+
+    def stats(self) -> dict:
+        """
+        Returns the counters of the store and forward.
+
+        Returns:
+            dict: stored, replayed, inflight (replayed messages waiting for their PUBACK) and
+            pending_bytes (size of the messages not acknowledged).
+        """
+        return {'stored': self.stored, 'replayed': self.replayed, 'inflight': len(self._inflight),
+                'pending_bytes': self.queue.pending_bytes()}
+
+
+    def start(self) -> None:
+        """
+        Start replaying the stored messages from a background thread.
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='MQTT-replay', daemon=True)
+        self._thread.start()
+
+
+    def stop(self) -> None:
+        """
+        Stop the replay and sync the queue. The messages not acknowledged are replayed at the next start.
+        """
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._inflight.clear()
+        self.queue.rewind()
+        self.queue.sync()
+
+
+class PublishQueue:
+    """
+    Bounded queue between the threads publishing data (e.g. the scan engine) and an MQTT client.
+
+    publish_data() and publish_batch() only queue the data points, stamped with the current time, so the
+    scan timing doesn't depend on the broker link; a background thread encodes and publishes them while
+    the client is connected and paho holds less than max_pending messages waiting for their PUBACK. When
+    the link degrades, the data points wait here instead of in the unbounded queue of paho, and when the
+    queue holds maxsize messages, the policy applies:
+
+        - 'block': the publisher waits until there is room, at most timeout seconds, then the new message is dropped.
+          Without timeout, a long outage stalls the publisher (e.g. the scans of a ScanEngine).
+        - 'drop_oldest': the oldest message is dropped (the default).
+        - 'coalesce': the new value replaces the queued value of the same name (the latest value is kept),
+          or the oldest message is dropped if the name is not queued.
+        - 'spill': the new message is stored in the DiskQueue of a StoreForward, replayed later.
+
+    With a publisher (e.g. the StoreForward of the client), the queued messages are published through it
+    instead of the client, so the live data stays behind the stored messages; the client still gives the
+    back pressure, and while it is disconnected, the queue drains into the publisher, which stores them.
+
+    The queue depth is the gauge <name>.depth of fablab_lib.metrics, and the counters <name>.dropped,
+    .coalesced, .spilled and .blocked count the overflows (also in stats()).
+
+    Args:
+        client (MQTT): The MQTT client.
+        maxsize (int, optional): The messages held by the queue. Defaults to QUEUE_SIZE.
+        policy (str, optional): The overflow policy, one of POLICIES. Defaults to QUEUE_POLICY ('drop_oldest').
+        store (StoreForward, optional): Stores the overflow with the 'spill' policy. Defaults to None.
+        timeout (float, optional): The maximum wait of the 'block' policy in seconds. Defaults to None (no limit).
+        max_pending (int, optional): The messages left in paho until their PUBACK. Defaults to MAX_PENDING.
+        name (str, optional): The prefix of the metrics. Defaults to 'mqtt.queue'.
+        publisher (StoreForward, optional): Publishes the queued messages instead of the client. Defaults to None.
+
+    Raises:
+        ValueError: If the policy is unknown, or 'spill' without store.
+
+    Example:
+        >>> publisher = PublishQueue(client, policy='coalesce')
+        >>> publisher.start()
+        >>> engine.add_sink(MQTTSink(publisher))
+        >>> publisher = PublishQueue(client, publisher=StoreForward(client, DiskQueue('/home/pi/WB/store/')))
+    """
+
+    def __init__(self, client, maxsize: int = QUEUE_SIZE, policy: str = QUEUE_POLICY, store=None, timeout: float = None,
+            max_pending: int = MAX_PENDING, name: str = 'mqtt.queue', publisher=None):
+        if policy not in POLICIES:
+            raise ValueError(f'Unknown overflow policy: {policy}, expected one of {POLICIES}')
+        if policy == 'spill' and store is None:
+            raise ValueError("The 'spill' policy needs a StoreForward store.")
+        self.client = client
+        self.publisher = client if publisher is None else publisher
+        self.maxsize = maxsize
+        self.policy = policy
+        self.store = store
+        self.timeout = timeout
+        self.max_pending = max_pending
+        self.name = name
+
+        self.published = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.spilled = 0
+        self.blocked = 0
+
+        self._queue = deque()       # entries [Name, Value, timestamp, batch, kind], batch: None, 'payload' or (max_bytes, qos)
+        self._latest = {}           # Name: queued entry of a data point, for the 'coalesce' policy
+        self._cond = threading.Condition()
+        self._stop = False
+        self._thread = None
+        metrics.gauge(name + '.depth', self.depth)
+
+
+    def depth(self) -> int:
+        """
+        Returns the number of queued messages.
+        """
+        return len(self._queue)
+
+
+    def _count(self, counter: str, value: int = 1) -> None:
+        setattr(self, counter, getattr(self, counter) + value)
+        metrics.count(f'{self.name}.{counter}', value)
+
+
+    def _forget(self, entry: list) -> None:
+        if entry[3] is None and self._latest.get(entry[0]) is entry:
+            del self._latest[entry[0]]
+
+
+    def _put(self, entry: list) -> None:
+        with self._cond:
+            if len(self._queue) >= self.maxsize:
+                if self.policy == 'block':
+                    self._count('blocked')
+                    if not self._cond.wait_for(lambda: len(self._queue) < self.maxsize or self._stop, self.timeout):
+                        self._count('dropped')
+                        return
+                elif self.policy == 'coalesce' and entry[3] is None and entry[0] in self._latest:
+                    self._latest[entry[0]][1:3] = entry[1:3]
+                    self._count('coalesced')
+                    return
+                elif self.policy != 'spill':
+                    self._forget(self._queue.popleft())
+                    self._count('dropped')
+            if self.policy != 'spill' or len(self._queue) < self.maxsize:
+                self._queue.append(entry)
+                if self.policy == 'coalesce' and entry[3] is None:
+                    self._latest[entry[0]] = entry
+                self._cond.notify_all()
+                return
+        # Stored outside the lock, the disk is slower than the queue
+        self._spill([entry])
+
+
+    def _spill(self, entries: list) -> None:
+        codec = self.client.codec
+        for Name, Value, timestamp, batch, _ in entries:
+            if batch is None:
+                self.store.store(Name + codec.suffix, codec.encode(Name, Value, timestamp))
+            elif batch == 'payload':
+                self.store.store(Name, str(Value))
+            else:
+                for payload in codec.encode_batch(Value, batch[0]):
+                    self.store.store(Name + codec.suffix, payload)
+        self._count('spilled', len(entries))
+
+
+    def publish_data(self, Name: str, Value, is_payload=False, timestamp: str = None, kind: str = None) -> None:
+        """
+        Queue data for MQTT.publish_data().
+
+        Args:
+            Name (str): The name of the data.
+            Value: The value of the data.
+            is_payload (bool, optional): Specifies whether Value is an encoded payload. Defaults to False.
+            timestamp (str, optional): The ISO 8601 timestamp of the value. Defaults to None (now).
+            kind (str, optional): The kind of data, for the policy of the client. Defaults to None.
+        """
+        if is_payload:
+            # an encoded payload (e.g. a status message) is sent as it is, and never coalesced
+            self._put([Name, Value, None, 'payload', kind])
+            return
+        if timestamp is None:
+            timestamp = encoder.now().decode()
+        self._put([Name, Value, timestamp, None, kind])
+
+
+    def publish_batch(self, records: list, max_bytes: int = MAX_BATCH_BYTES, Name: str = BATCH_TOPIC, qos: int = 1) -> None:
+        """
+        Queue data points for MQTT.publish_batch(), the batch is one message of the queue.
+        """
+        if not records:
+            return
+        now = None
+        stamped = []
+        for record in records:
+            if len(record) < 3 or record[2] is None:
+                if now is None:
+                    now = encoder.now().decode()
+                record = (record[0], record[1], now)
+            stamped.append(record)
+        self._put([Name, stamped, None, (max_bytes, qos), None])
+
+
+    def _publish(self, entry: list) -> None:
+        Name, Value, timestamp, batch, kind = entry
+        if batch is None:
+            self.publisher.publish_data(Name, Value, timestamp=timestamp, kind=kind)
+        elif batch == 'payload':
+            self.publisher.publish_data(Name, Value, is_payload=True, kind=kind)
+        else:
+            self.publisher.publish_batch(Value, batch[0], Name, batch[1])
+
+
+    def _free(self) -> int:
+        """
+        Returns the number of messages to publish now.
+        """
+        if self.client.is_connected():
+            return self.max_pending - self.client.pending()
+        # a publisher other than the client stores the messages while it is disconnected
+        return len(self._queue) if self.publisher is not self.client else 0
+
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._queue and not self._stop:
+                    self._cond.wait()
+                if not self._queue or (self._stop and not self.client.is_connected() and self.publisher is self.client):
+                    return
+            # Back pressure: the messages wait here while paho can't send them
+            free = self._free()
+            if free <= 0:
+                # paho is full: its PUBACK come soon; disconnected: the reconnection takes seconds
+                poll = ACK_POLL if self.client.is_connected() else RECONNECT_POLL
+                with self._cond:
+                    self._cond.wait_for(lambda: self._stop, poll)
+                continue
+            with self._cond:
+                entries = [self._queue.popleft() for _ in range(min(free, len(self._queue)))]
+                for entry in entries:
+                    self._forget(entry)
+                self._cond.notify_all()
+            for entry in entries:
+                try:
+                    self._publish(entry)
+                except Exception as e:
+                    logger.error(f'Error publishing a queued message: {e}')
+            self.published += len(entries)
+
+
+    def stats(self) -> dict:
+        """
+        Returns the counters of the queue.
+
+        Returns:
+            dict: depth, published, dropped, coalesced, spilled and blocked.
+        """
+        return {'depth': len(self._queue), 'published': self.published, 'dropped': self.dropped,
+                'coalesced': self.coalesced, 'spilled': self.spilled, 'blocked': self.blocked}
+
+
+    def start(self) -> None:
+        """
+        Start publishing the queued messages from a background thread.
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop = False
+        self._thread = threading.Thread(target=self._run, name='MQTT-queue', daemon=True)
+        self._thread.start()
+
+
+    def stop(self) -> None:
+        """
+        Stop the background thread after publishing the queued messages, or while disconnected, spill
+        them to the store ('spill' policy) or drop them.
+        """
+        with self._cond:
+            self._stop = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        with self._cond:
+            entries = list(self._queue)
+            self._queue.clear()
+            self._latest.clear()
+        if not entries:
+            return
+        if self.store is not None:
+            self._spill(entries)
+        else:
+            logger.warning(f'Dropped {len(entries)} queued messages, the client is disconnected.')
+            self._count('dropped', len(entries))
@@ -181,6 +181,13 @@ MQTT_CLEAN_START_FIRST_ONLY = 3
 
 sockpair_data = b"0"
 
+# Bytes the packet reader receives from the socket at once, the buffer grows for a larger packet
+READ_BUFFER_SIZE = 65536
+# Bytes of queued packets the packet writer gathers into one send
+WRITE_BUDGET = 65536
+# Maximum number of buffers of one sendmsg() call (the IOV_MAX of Linux)
+_IOV_MAX = 1024
+
 
 class WebsocketConnectionError(ValueError):
     pass
@@ -570,6 +577,9 @@ class Client(object):
             "packet": bytearray(b""),
             "to_process": 0,
             "pos": 0}
+        self._in_buffer = bytearray(READ_BUFFER_SIZE)
+        self._in_start = 0
+        self._in_end = 0
         self._out_packet = collections.deque()
         self._last_msg_in = time_func()
         self._last_msg_out = time_func()
@@ -585,6 +595,10 @@ class Client(object):
         self._max_inflight_messages = 20
         self._inflight_messages = 0
         self._max_queued_messages = 0
+        self._write_budget = WRITE_BUDGET
+        self._tcp_nodelay = None
+        self._send_buffer = None
+        self._receive_buffer = None
         self._connect_properties = None
         self._will_properties = None
         self._will = False
@@ -644,6 +658,15 @@ class Client(object):
             self._call_socket_register_write()
             raise BlockingIOError
 
+    def _sock_recv_into(self, buffer):
+        try:
+            return self._sock.recv_into(buffer)
+        except ssl.SSLWantReadError:
+            raise BlockingIOError
+        except ssl.SSLWantWriteError:
+            self._call_socket_register_write()
+            raise BlockingIOError
+
     def _sock_send(self, buf):
         try:
             return self._sock.send(buf)
@@ -656,6 +679,21 @@ class Client(object):
             self._call_socket_register_write()
             raise BlockingIOError
 
+    def _sock_sendmsg(self, buffers):
+        # Sends several buffers with one system call: sendmsg() (writev) on a
+        # plain socket, a single send() of the joined buffers with TLS (one
+        # record) and websockets (one frame), which have no sendmsg().
+        if len(buffers) == 1:
+            return self._sock_send(buffers[0])
+        sock = self._sock
+        if hasattr(sock, 'sendmsg') and not (ssl is not None and isinstance(sock, ssl.SSLSocket)):
+            try:
+                return sock.sendmsg(buffers)
+            except BlockingIOError:
+                self._call_socket_register_write()
+                raise BlockingIOError
+        return self._sock_send(b''.join(buffers))
+
     def _sock_close(self):
         """Close the connection to the server."""
         if not self._sock:
@@ -1026,6 +1064,9 @@ class Client(object):
             "packet": bytearray(b""),
             "to_process": 0,
             "pos": 0}
+        self._in_buffer = bytearray(READ_BUFFER_SIZE)
+        self._in_start = 0
+        self._in_end = 0
 
         self._out_packet = collections.deque()
 
@@ -1042,6 +1083,7 @@ class Client(object):
         self._messages_reconnect_reset()
 
         sock = self._create_socket_connection()
+        self._socket_options_apply(sock)
 
         if self._ssl:
             # SSL is only supported when SSLContext is available (implies Python >= 2.7.9 or >= 3.2)
@@ -1642,6 +1684,41 @@ class Client(object):
         self._max_queued_messages = queue_size
         return self
 
+    def write_budget_set(self, budget):
+        """Set the maximum number of bytes of queued packets gathered into
+        a single send (one sendmsg() call, or one send() of the joined
+        packets with TLS and websockets). Defaults to WRITE_BUDGET.
+        Set to 1 to send each packet on its own."""
+        if not isinstance(budget, int):
+            raise ValueError('Invalid type of write budget.')
+        if budget < 1:
+            raise ValueError('Invalid write budget.')
+        self._write_budget = budget
+        return self
+
+    def socket_options_set(self, tcp_nodelay=None, send_buffer=None, receive_buffer=None):
+        """Set the options of the sockets of the next connections. None
+        keeps the default of the system.
+
+        tcp_nodelay: True disables the Nagle algorithm (TCP_NODELAY), the
+        packets are sent without waiting for the acknowledgement of the
+        previous segment.
+        send_buffer, receive_buffer: the socket buffer sizes in bytes
+        (SO_SNDBUF, SO_RCVBUF). They are set once the socket is connected,
+        the receive buffer doesn't change the TCP window scale any more."""
+        self._tcp_nodelay = tcp_nodelay
+        self._send_buffer = send_buffer
+        self._receive_buffer = receive_buffer
+        return self
+
+    def _socket_options_apply(self, sock):
+        if self._tcp_nodelay is not None and sock.family in (socket.AF_INET, socket.AF_INET6):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, int(self._tcp_nodelay))
+        if self._send_buffer is not None:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self._send_buffer)
+        if self._receive_buffer is not None:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self._receive_buffer)
+
     def message_retry_set(self, retry):
         """No longer used, remove in version 2.0"""
         pass
@@ -2353,163 +2430,179 @@ class Client(object):
 
     def _packet_read(self):
         # This gets called if pselect() indicates that there is network data
-        # available - ie. at least one byte.  What we do depends on what data we
-        # already have.
-        # If we've not got a command, attempt to read one and save it. This should
-        # always work because it's only a single byte.
-        # Then try to read the remaining length. This may fail because it is may
-        # be more than one byte - will need to save data pending next read if it
-        # does fail.
-        # Then try to read the remaining payload, where 'payload' here means the
-        # combined variable header and actual payload. This is the most likely to
-        # fail due to longer length, so save current data and current position.
-        # After all data is read, send to _mqtt_handle_packet() to deal with.
-        # Finally, free the memory and reset everything to starting conditions.
-        if self._in_packet['command'] == 0:
-            try:
-                command = self._sock_recv(1)
-            except BlockingIOError:
-                return MQTT_ERR_AGAIN
-            except ConnectionError as err:
-                self._easy_log(
-                    MQTT_LOG_ERR, 'failed to receive on socket: %s', err)
-                return MQTT_ERR_CONN_LOST
-            else:
-                if len(command) == 0:
-                    return MQTT_ERR_CONN_LOST
-                command, = struct.unpack("!B", command)
-                self._in_packet['command'] = command
-
-        if self._in_packet['have_remaining'] == 0:
-            # Read remaining
-            # Algorithm for decoding taken from pseudo code at
+        # available - ie. at least one byte.
+        # The data is received into the input buffer with a single recv_into(),
+        # as much as its free space holds, then every complete packet of the
+        # buffer is sent to _mqtt_handle_packet() to deal with. A burst of small
+        # packets (retained messages at subscribe time, acknowledgements) costs
+        # one system call instead of three or more per packet.
+        # A partial packet stays in the buffer until the next read. The buffer
+        # grows when a packet doesn't fit in it.
+        buf = self._in_buffer
+        end = self._in_end
+        free = len(buf) - end
+        try:
+            count = self._sock_recv_into(memoryview(buf)[end:])
+        except BlockingIOError:
+            return MQTT_ERR_AGAIN
+        except ConnectionError as err:
+            self._easy_log(
+                MQTT_LOG_ERR, 'failed to receive on socket: %s', err)
+            return MQTT_ERR_CONN_LOST
+        if count == 0:
+            return MQTT_ERR_CONN_LOST
+        self._in_end = end + count
+        rc = self._packet_parse()
+        if rc == MQTT_ERR_SUCCESS and count < free:
+            # The socket held less than the free space: nothing left to read
+            return MQTT_ERR_AGAIN
+        return rc
+
+    def _packet_parse(self):
+        # Handles the complete packets of the input buffer, from _in_start to
+        # _in_end, then moves the partial packet left to the start of the buffer.
+        buf = self._in_buffer
+        rc = MQTT_ERR_SUCCESS
+        needed = 0
+        handled = False
+        while self._in_start < self._in_end:
+            start = self._in_start
+            end = self._in_end
+
+            # Fixed header: the command, then the remaining length on 1 to 4
+            # bytes. Algorithm for decoding taken from pseudo code at
             # http://publib.boulder.ibm.com/infocenter/wmbhelp/v6r0m0/topic/com.ibm.etools.mft.doc/ac10870_.htm
+            remaining_length = 0
+            remaining_mult = 1
+            pos = start + 1
             while True:
-                try:
-                    byte = self._sock_recv(1)
-                except BlockingIOError:
-                    return MQTT_ERR_AGAIN
-                except ConnectionError as err:
-                    self._easy_log(
-                        MQTT_LOG_ERR, 'failed to receive on socket: %s', err)
-                    return MQTT_ERR_CONN_LOST
-                else:
-                    if len(byte) == 0:
-                        return MQTT_ERR_CONN_LOST
-                    byte, = struct.unpack("!B", byte)
-                    self._in_packet['remaining_count'].append(byte)
-                    # Max 4 bytes length for remaining length as defined by protocol.
-                    # Anything more likely means a broken/malicious client.
-                    if len(self._in_packet['remaining_count']) > 4:
-                        return MQTT_ERR_PROTOCOL
-
-                    self._in_packet['remaining_length'] += (
-                        byte & 127) * self._in_packet['remaining_mult']
-                    self._in_packet['remaining_mult'] = self._in_packet['remaining_mult'] * 128
-
+                if pos == end:
+                    needed = pos - start + 1
+                    break
+                byte = buf[pos]
+                pos += 1
+                remaining_length += (byte & 127) * remaining_mult
+                remaining_mult *= 128
                 if (byte & 128) == 0:
+                    needed = pos - start + remaining_length
                     break
+                # Max 4 bytes length for remaining length as defined by protocol.
+                # Anything more likely means a broken/malicious client.
+                if pos - start > 4:
+                    return MQTT_ERR_PROTOCOL
+            if start + needed > end:
+                break
 
-            self._in_packet['have_remaining'] = 1
-            self._in_packet['to_process'] = self._in_packet['remaining_length']
-
-        count = 100 # Don't get stuck in this loop if we have a huge message.
-        while self._in_packet['to_process'] > 0:
-            try:
-                data = self._sock_recv(self._in_packet['to_process'])
-            except BlockingIOError:
-                return MQTT_ERR_AGAIN
-            except ConnectionError as err:
-                self._easy_log(
-                    MQTT_LOG_ERR, 'failed to receive on socket: %s', err)
-                return MQTT_ERR_CONN_LOST
-            else:
-                if len(data) == 0:
-                    return MQTT_ERR_CONN_LOST
-                self._in_packet['to_process'] -= len(data)
-                self._in_packet['packet'] += data
-            count -= 1
-            if count == 0:
-                with self._msgtime_mutex:
-                    self._last_msg_in = time_func()
-                return MQTT_ERR_AGAIN
-
-        # All data for this packet is read.
-        self._in_packet['pos'] = 0
-        rc = self._packet_handle()
-
-        # Free data and reset values
-        self._in_packet = {
-            'command': 0,
-            'have_remaining': 0,
-            'remaining_count': [],
-            'remaining_mult': 1,
-            'remaining_length': 0,
-            'packet': bytearray(b""),
-            'to_process': 0,
-            'pos': 0}
+            self._in_packet['command'] = buf[start]
+            self._in_packet['remaining_length'] = remaining_length
+            self._in_packet['packet'] = buf[pos:pos + remaining_length]
+            self._in_packet['pos'] = 0
+            self._in_start = pos + remaining_length
+            needed = 0
+            handled = True
+            rc = self._packet_handle()
+            if rc != MQTT_ERR_SUCCESS or self._sock is None or self._in_buffer is not buf:
+                # A callback closed the connection, or reconnected with a new buffer
+                break
 
-        with self._msgtime_mutex:
-            self._last_msg_in = time_func()
+        if handled:
+            with self._msgtime_mutex:
+                self._last_msg_in = time_func()
+            self._in_packet['packet'] = bytearray(b"")
+
+        if self._in_buffer is buf:
+            start = self._in_start
+            end = self._in_end
+            if start == end:
+                self._in_start = self._in_end = 0
+                if len(buf) > READ_BUFFER_SIZE:
+                    self._in_buffer = bytearray(READ_BUFFER_SIZE)
+            elif start > 0:
+                buf[:end - start] = buf[start:end]
+                self._in_start = 0
+                self._in_end = end - start
+            if needed > len(buf):
+                buf.extend(bytes(needed - len(buf)))
         return rc
 
     def _packet_write(self):
+        # The queued packets are gathered, up to the write budget, into a
+        # single send: a burst of small packets (a replay after a reconnection,
+        # the changes of a scan cycle) costs one system call and leaves in as
+        # few TCP segments as possible, instead of one of each per packet.
         while True:
-            try:
-                packet = self._out_packet.popleft()
-            except IndexError:
+            packets = []
+            size = 0
+            while size < self._write_budget and len(packets) < _IOV_MAX:
+                try:
+                    packet = self._out_packet.popleft()
+                except IndexError:
+                    break
+                packets.append(packet)
+                size += packet['to_process']
+                if (packet['command'] & 0xF0) == DISCONNECT:
+                    # Nothing is sent after a DISCONNECT, the socket is closed
+                    break
+            if not packets:
                 return MQTT_ERR_SUCCESS
 
             try:
-                write_length = self._sock_send(
-                    packet['packet'][packet['pos']:])
+                write_length = self._sock_sendmsg(
+                    [memoryview(packet['packet'])[packet['pos']:] for packet in packets])
             except (AttributeError, ValueError):
-                self._out_packet.appendleft(packet)
+                self._out_packet.extendleft(reversed(packets))
                 return MQTT_ERR_SUCCESS
             except BlockingIOError:
-                self._out_packet.appendleft(packet)
+                self._out_packet.extendleft(reversed(packets))
                 return MQTT_ERR_AGAIN
             except ConnectionError as err:
-                self._out_packet.appendleft(packet)
+                self._out_packet.extendleft(reversed(packets))
                 self._easy_log(
                     MQTT_LOG_ERR, 'failed to receive on socket: %s', err)
                 return MQTT_ERR_CONN_LOST
 
-            if write_length > 0:
-                packet['to_process'] -= write_length
-                packet['pos'] += write_length
-
-                if packet['to_process'] == 0:
-                    if (packet['command'] & 0xF0) == PUBLISH and packet['qos'] == 0:
-                        with self._callback_mutex:
-                            on_publish = self.on_publish
-
-                        if on_publish:
-                            with self._in_callback_mutex:
-                                try:
-                                    on_publish(
-                                        self, self._userdata, packet['mid'])
-                                except Exception as err:
-                                    self._easy_log(
-                                        MQTT_LOG_ERR, 'Caught exception in on_publish: %s', err)
-                                    if not self.suppress_exceptions:
-                                        raise
-
-                        packet['info']._set_as_published()
-
-                    if (packet['command'] & 0xF0) == DISCONNECT:
-                        with self._msgtime_mutex:
-                            self._last_msg_out = time_func()
-
-                        self._do_on_disconnect(MQTT_ERR_SUCCESS)
-                        self._sock_close()
-                        return MQTT_ERR_SUCCESS
+            if write_length <= 0:
+                self._out_packet.extendleft(reversed(packets))
+                break
 
-                else:
+            for index, packet in enumerate(packets):
+                if write_length < packet['to_process']:
                     # We haven't finished with this packet
-                    self._out_packet.appendleft(packet)
-            else:
-                break
+                    packet['to_process'] -= write_length
+                    packet['pos'] += write_length
+                    self._out_packet.extendleft(reversed(packets[index:]))
+                    break
+
+                write_length -= packet['to_process']
+                packet['pos'] += packet['to_process']
+                packet['to_process'] = 0
+
+                if (packet['command'] & 0xF0) == PUBLISH and packet['qos'] == 0:
+                    with self._callback_mutex:
+                        on_publish = self.on_publish
+
+                    if on_publish:
+                        with self._in_callback_mutex:
+                            try:
+                                on_publish(
+                                    self, self._userdata, packet['mid'])
+                            except Exception as err:
+                                self._easy_log(
+                                    MQTT_LOG_ERR, 'Caught exception in on_publish: %s', err)
+                                if not self.suppress_exceptions:
+                                    self._out_packet.extendleft(reversed(packets[index + 1:]))
+                                    raise
+
+                    packet['info']._set_as_published()
+
+                if (packet['command'] & 0xF0) == DISCONNECT:
+                    self._out_packet.extendleft(reversed(packets[index + 1:]))
+                    with self._msgtime_mutex:
+                        self._last_msg_out = time_func()
+
+                    self._do_on_disconnect(MQTT_ERR_SUCCESS)
+                    self._sock_close()
+                    return MQTT_ERR_SUCCESS
 
         with self._msgtime_mutex:
             self._last_msg_out = time_func()
@@ -3961,6 +4054,11 @@ class WebsocketWrapper(object):
     def recv(self, length):
         return self._recv_impl(length)
 
+    def recv_into(self, buffer):
+        data = self._recv_impl(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
     def read(self, length):
         return self._recv_impl(length)
 
@@ -0,0 +1,407 @@
+"""
+This file contains the AsyncPLCDriver interface, a common asyncio interface to the PLCs of all vendors,
+and its implementations for the PLC wrappers of fablab_lib (Mitsubishi MC, Omron FINS, Siemens S7 snap7,
+Siemens OPC UA and Rockwell Logix).
+
+The wrappers are blocking, so each driver runs the calls of its PLC in its own worker thread
+(run_in_executor) and one event loop can poll a whole line of different machines concurrently,
+instead of one thread per machine and per task.
+
+The variables are given as in the read_tags() / write_tags() methods of the wrapper:
+    - Mitsubishi: (address, type) to read, (address, value, type) to write
+    - Omron: address or (address, type) to read, (address, value) or (address, value, type) to write
+    - Siemens S7 snap7: address to read, (address, value) to write
+    - Siemens OPC UA: node id to read, (node id, value, type) to write
+    - Rockwell Logix: tag name to read, (tag name, value) or (tag name, value, type) to write
+
+Example:
+    >>> async def main():
+    ...     line = [MitsubishiDriver(PLC_Mitsu.PLC(host='192.168.3.39', port=5007)),
+    ...             OmronDriver(PLC_Omron.PLC(host='192.168.250.1', dest_node_add=1, srce_node_add=25))]
+    ...     for driver in line:
+    ...         await driver.connect()
+    ...     results = await asyncio.gather(line[0].read_tags([('D100', DT.SWORD)]), line[1].read_tags(['D100']))
+    ...     subscription = await line[1].subscribe(['CIO-0-5'], lambda addr, value, timestamp: print(addr, value), period=0.1)
+    >>> asyncio.run(main())
+"""
+
+from abc import ABC, abstractmethod
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import logging
+import time
+
+from fablab_lib.Network.function import PLCUnavailable
+
+# Application logger
+logger = logging.getLogger("AsyncPLCDriver")
+logger.setLevel(logging.DEBUG)
+_log_handle = logging.StreamHandler()
+_log_handle.setFormatter(logging.Formatter('%(asctime)s %(name)s %(levelname)s | %(message)s'))
+logger.addHandler(_log_handle)
+
+SUBSCRIBE_PERIOD = 1.0          # default polling period of subscribe() in seconds
+
+
+def _now() -> str:
+    return datetime.now().isoformat(timespec='microseconds')
+
+
+class Subscription:
+    """
+    A subscription returned by AsyncPLCDriver.subscribe(), cancel() stops it.
+    """
+
+    def __init__(self, tags: list, callback, period: float):
+        self.tags = list(tags)
+        self.callback = callback
+        self.period = period
+        self._task = None
+        self._cancel = None
+
+
+    def cancel(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+        if self._cancel is not None:
+            self._cancel()
+
+
+class AsyncPLCDriver(ABC):
+    """
+    Common asyncio interface of the PLC drivers.
+
+    Attributes:
+        vendor (str): The name of the PLC family, e.g. 'mitsubishi'.
+    """
+
+    vendor = None
+
+    @abstractmethod
+    async def connect(self) -> None:
+        """
+        Connects to the PLC.
+        """
+
+
+    @abstractmethod
+    async def close(self) -> None:
+        """
+        Disconnects from the PLC and releases the worker of the driver.
+        """
+
+
+    @abstractmethod
+    async def read_tags(self, tags: list) -> list:
+        """
+        Reads multiple variables.
+
+        Args:
+            tags (list): The variables, in the format of the vendor.
+
+        Returns:
+            list: A list of tuples (variable, value), in the order of tags.
+        """
+
+
+    @abstractmethod
+    async def write_tags(self, tags: list) -> list:
+        """
+        Writes multiple variables.
+
+        Args:
+            tags (list): Tuples (variable, value) or (variable, value, type), in the format of the vendor.
+
+        Returns:
+            list: A list of booleans, True if the corresponding variable was written successfully.
+        """
+
+
+    @abstractmethod
+    async def subscribe(self, tags: list, callback, period: float = SUBSCRIBE_PERIOD) -> Subscription:
+        """
+        Calls callback(variable, value, timestamp) each time the value of a variable changes.
+
+        Args:
+            tags (list): The variables, in the format of read_tags().
+            callback (callable): The function called on each change, from the event loop.
+            period (float, optional): The sampling period in seconds. Defaults to SUBSCRIBE_PERIOD.
+
+        Returns:
+            Subscription: The subscription, call cancel() to stop it.
+        """
+
+
+    @abstractmethod
+    async def health(self) -> dict:
+        """
+        Returns the state of the driver: connected, reads, writes, errors, last_error, last_latency, max_latency.
+        """
+
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+
+class ThreadedPLCDriver(AsyncPLCDriver):
+    """
+    AsyncPLCDriver of a blocking PLC wrapper of fablab_lib.
+
+    The calls to the wrapper are run one at a time in a worker thread owned by the driver, so the
+    socket of the PLC is never used by two threads at once and the event loop is never blocked.
+    subscribe() polls the variables with read_tags() and calls back only the changed values.
+
+    Args:
+        plc: The PLC wrapper, with read_tags() and write_tags(). It can also be the driver of a
+        ConnectionSupervisor, the reads then fail with PLCUnavailable while the PLC reconnects.
+        executor (Executor, optional): The executor running the blocking calls. Defaults to a
+        single thread executor owned by the driver.
+    """
+
+    def __init__(self, plc, executor=None):
+        self.plc = plc
+        self._own_executor = executor is None
+        self._executor = executor if executor is not None else \
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'{self.vendor or "PLC"}-{getattr(plc, "host", "")}')
+        self._subscriptions = []
+
+        self.connected = False
+        self._stats = {'reads': 0, 'writes': 0, 'errors': 0, 'unavailable': 0}
+        self.last_error = None
+        self.last_latency = 0.0
+        self.max_latency = 0.0
+
+
+    async def _run(self, func, *args):
+        """
+        Runs a blocking call of the wrapper in the worker of the driver.
+        """
+        start = time.monotonic()
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+        except PLCUnavailable:
+            self._stats['unavailable'] += 1
+            raise
+        except Exception as e:
+            self._stats['errors'] += 1
+            self.last_error = f'{type(e).__name__}: {e}'
+            raise
+        self.last_latency = time.monotonic() - start
+        self.max_latency = max(self.max_latency, self.last_latency)
+        return result
+
+
+    async def connect(self) -> None:
+        await self._run(self.plc.connect)
+        self.connected = True
+
+
+    async def close(self) -> None:
+        for subscription in self._subscriptions:
+            subscription.cancel()
+        self._subscriptions = []
+        if self.connected and hasattr(self.plc, 'disconnect'):
+            try:
+                await self._run(self.plc.disconnect)
+            except Exception as e:
+                logger.error(f"Error disconnecting from PLC: {e}")
+        self.connected = False
+        if self._own_executor:
+            self._executor.shutdown(wait=False)
+
+
+    async def read_tags(self, tags: list) -> list:
+        result = await self._run(self.plc.read_tags, list(tags))
+        self._stats['reads'] += 1
+        return result
+
+
+    async def write_tags(self, tags: list) -> list:
+        result = await self._run(self.plc.write_tags, list(tags))
+        self._stats['writes'] += 1
+        return result
+
+
+    async def _poll(self, subscription: Subscription) -> None:
+        """
+        Polls the variables of a subscription at its period, without drifting with the read time.
+        """
+        loop = asyncio.get_running_loop()
+        last = {}
+        deadline = loop.time()
+        while True:
+            try:
+                ls_result = await self.read_tags(subscription.tags)
+            except PLCUnavailable:
+                ls_result = []
+            except Exception as e:
+                logger.error(f"Error reading subscribed variables: {e}")
+                ls_result = []
+
+            timestamp = _now()
+            for n, (_, value) in enumerate(ls_result):
+                if value is not None and (n not in last or last[n] != value):
+                    last[n] = value
+                    try:
+                        subscription.callback(subscription.tags[n], value, timestamp)
+                    except Exception as e:
+                        logger.error(f"Error in subscription callback: {e}")
+
+            deadline += subscription.period
+            now = loop.time()
+            if deadline < now:
+                deadline = now
+            await asyncio.sleep(deadline - now)
+
+
+    async def subscribe(self, tags: list, callback, period: float = SUBSCRIBE_PERIOD) -> Subscription:
+        subscription = Subscription(tags, callback, period)
+        subscription._task = asyncio.get_running_loop().create_task(self._poll(subscription))
+        self._subscriptions.append(subscription)
+        return subscription
+
+
+    async def health(self) -> dict:
+        return dict(self._stats,
+                    vendor=self.vendor,
+                    host=getattr(self.plc, 'host', None),
+                    connected=self.connected,
+                    last_error=self.last_error,
+                    last_latency=self.last_latency,
+                    max_latency=self.max_latency)
+
+
+class MitsubishiDriver(ThreadedPLCDriver):
+    """
+    AsyncPLCDriver of fablab_lib.PLC.Mitsubishi.mcprotocol.Ethernet.function.PLC (MC protocol 3E).
+    """
+
+    vendor = 'mitsubishi'
+
+
+class OmronDriver(ThreadedPLCDriver):
+    """
+    AsyncPLCDriver of fablab_lib.PLC.Omron.fins.Ethernet.function.PLC (FINS/UDP).
+    """
+
+    vendor = 'omron'
+
+
+class S7Driver(ThreadedPLCDriver):
+    """
+    AsyncPLCDriver of fablab_lib.PLC.Siemens.snap7.Ethernet.function.PLC (S7-200 SMART).
+    """
+
+    vendor = 's7'
+
+
+class LogixDriver(ThreadedPLCDriver):
+    """
+    AsyncPLCDriver of fablab_lib.PLC.Rockwell_AB.logix.Ethernet.function.PLC (EtherNet/IP).
+    """
+
+    vendor = 'logix'
+
+
+class _DataChangeHandler:
+    """
+    OPC UA subscription handler forwarding the data changes to the event loop.
+    """
+
+    def __init__(self, loop, callback, ls_node: dict):
+        self.loop = loop
+        self.callback = callback
+        self.ls_node = ls_node              # nodeid -> node id string given to subscribe()
+
+
+    def _notify(self, node_id, value, timestamp):
+        try:
+            self.callback(node_id, value, timestamp)
+        except Exception as e:
+            logger.error(f"Error in subscription callback: {e}")
+
+
+    def datachange_notification(self, node, val, data):
+        node_id = self.ls_node.get(node.nodeid, str(node.nodeid))
+        self.loop.call_soon_threadsafe(self._notify, node_id, val, _now())
+
+
+    def event_notification(self, event):
+        pass
+
+
+    def status_change_notification(self, status):
+        logger.warning(f"Subscription status changed: {status}")
+
+
+class OPCUADriver(ThreadedPLCDriver):
+    """
+    AsyncPLCDriver of fablab_lib.PLC.Siemens.opcua.Ethernet.function.PLC (S7-1200/1500 OPC UA server).
+
+    subscribe() uses an OPC UA subscription: the server pushes the changes at the publishing
+    interval (period) instead of being polled.
+    """
+
+    vendor = 'opcua'
+
+    def _create_subscription(self, loop, subscription: Subscription):
+        client = self.plc.plc
+        ls_node = {}
+        nodes = []
+        for node_id in subscription.tags:
+            node = client.get_node(node_id)
+            ls_node[node.nodeid] = node_id
+            nodes.append(node)
+
+        handler = _DataChangeHandler(loop, subscription.callback, ls_node)
+        opcua_subscription = client.create_subscription(int(subscription.period * 1000), handler)
+        opcua_subscription.subscribe_data_change(nodes)
+        return opcua_subscription
+
+
+    async def subscribe(self, tags: list, callback, period: float = SUBSCRIBE_PERIOD) -> Subscription:
+        subscription = Subscription(tags, callback, period)
+        opcua_subscription = await self._run(self._create_subscription, asyncio.get_running_loop(), subscription)
+
+        def cancel():
+            try:
+                self._executor.submit(opcua_subscription.delete)
+            except RuntimeError:
+                pass                        # executor already shut down
+        subscription._cancel = cancel
+        self._subscriptions.append(subscription)
+        return subscription
+
+
+DRIVERS = {
+    MitsubishiDriver.vendor: MitsubishiDriver,
+    OmronDriver.vendor: OmronDriver,
+    S7Driver.vendor: S7Driver,
+    OPCUADriver.vendor: OPCUADriver,
+    LogixDriver.vendor: LogixDriver,
+}
+
+
+def create_driver(vendor: str, plc, executor=None) -> AsyncPLCDriver:
+    """
+    Creates the AsyncPLCDriver of a PLC wrapper.
+
+    Args:
+        vendor (str): 'mitsubishi', 'omron', 's7', 'opcua' or 'logix'.
+        plc: The PLC wrapper.
+        executor (Executor, optional): The executor running the blocking calls. Defaults to None.
+
+    Returns:
+        AsyncPLCDriver: The driver.
+    """
+    try:
+        driver_class = DRIVERS[vendor.lower()]
+    except KeyError:
+        raise ValueError(f"Unknown PLC vendor: {vendor}") from None
+    return driver_class(plc, executor)
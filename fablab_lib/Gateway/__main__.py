@@ -0,0 +1,4 @@
+from fablab_lib.Gateway.function import main
+
+if __name__ == '__main__':
+    main()
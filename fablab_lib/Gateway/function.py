@@ -0,0 +1,520 @@
+"""
+This file contains the implementation of the Gateway class, which runs the scan engines of several PLCs
+on one computer, each PLC in its own worker.
+
+The devices are described in a JSON file:
+
+    {
+        "report_interval": 10,
+        "devices": [
+            {
+                "name": "WB_P1_MNC",
+                "vendor": "mitsubishi",
+                "host": "192.168.3.39",
+                "params": {"port": 5007, "plc_type": "Q"},
+                "worker": "thread",
+                "check_tag": ["SM400", "BIT"],
+                "groups": [
+                    {"kind": "Alarm", "period": 0.1, "csv": "/home/pi/WB/alarm.csv"},
+                    {"kind": "Counter", "period": 0.5, "heartbeat": 60,
+                     "tags": [["Counter_1", "D100", "SWORD", 1, 0], ["Speed", "D102", "SWORD", 0.01, 0.5]]}
+                ],
+                "sinks": [
+                    {"type": "mqtt", "host": "broker.local", "port": 1883, "topic": "Fablab/WB/P1/MNC/"},
+                    {"type": "csv", "path": "/home/pi/WB/", "file": "stored_data.csv"}
+                ]
+            }
+        ]
+    }
+
+    - vendor: 'mitsubishi', 'omron', 's7' (snap7), 'opcua' or 'logix', params are the arguments of the PLC wrapper.
+    - worker: 'thread' (default) for the I/O bound drivers, 'process' for the drivers with a heavy decode.
+    - check_tag: a variable read after each reconnection to check the PLC answers (optional).
+    - groups: the tags are [name, address, type, scale, deadband], or read from a CSV tag table with the
+      columns ID (address), Name, Type and optionally Scale and Deadband.
+    - sinks: an mqtt sink with "batch": true publishes the changes of each scan cycle as one message on
+      the topic + 'batch' (MQTT.publish_batch). With "store": "/home/pi/WB/store/", the messages are stored
+      in this directory while the broker is unreachable and replayed when it is back (StoreForward); the
+      csv sink then doesn't store them a second time. With "queue": {"size": 1000, "policy": "coalesce"},
+      the scans only queue the changes, published by a background thread (PublishQueue, the policies are
+      'drop_oldest' (the default), 'coalesce', 'block' with a "timeout" in seconds, and 'spill', which
+      needs "store"; with "store", the queue publishes through the StoreForward, so the live data never
+      overtakes the replay). "policies" sets the QoS and retain flag by name or kind of data, a preset
+      ('retained', 'telemetry', 'best_effort') or {"Alarm": [1, false], "Counter": [0, false], "*": [1, true]};
+      "max_inflight" and "max_queued" set the paho windows (MQTT.PUBLISH_PRESETS, MQTT.max_inflight_messages_set).
+      "codec" selects the payload encoding, e.g. "msgpack-delta-zlib" (JsonPayload.CODECS). "protocol": "5" connects with
+      MQTT v5: topic aliases, a session kept "session_expiry" seconds by the broker, and the data points
+      dropped by the broker after "message_expiry" seconds for the offline subscribers. "tcp_nodelay",
+      "send_buffer" and "receive_buffer" set the socket options, "write_budget" the bytes of queued
+      packets sent with one system call.
+
+Each worker runs a ConnectionSupervisor and a ScanEngine. A worker that crashes is restarted alone,
+with an exponential delay, and every worker reports its scan counters so the gateway logs the
+throughput of each PLC (tags/s, scans/s, changes/s and CPU for the process workers).
+
+Usage: python -m fablab_lib.Gateway devices.json [--report report.json]
+"""
+
+import argparse
+import csv
+import importlib
+import json
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+
+# Application logger
+logger = logging.getLogger("Gateway")
+logger.setLevel(logging.DEBUG)
+_log_handle = logging.StreamHandler()
+_log_handle.setFormatter(logging.Formatter('%(asctime)s %(name)s %(levelname)s | %(message)s'))
+logger.addHandler(_log_handle)
+
+REPORT_INTERVAL = 10.0          # seconds between two throughput reports
+SUPERVISE_INTERVAL = 1.0        # seconds between two checks of the workers
+RESTART_DELAY_MIN = 1.0         # first restart delay of a crashed worker
+RESTART_DELAY_MAX = 60.0        # maximum restart delay of a worker that keeps crashing
+STABLE_RUN_TIME = 60.0          # a worker running this long is restarted again after RESTART_DELAY_MIN
+
+PLC_MODULES = {
+    'mitsubishi': 'fablab_lib.PLC.Mitsubishi.mcprotocol.Ethernet.function',
+    'omron': 'fablab_lib.PLC.Omron.fins.Ethernet.function',
+    's7': 'fablab_lib.PLC.Siemens.snap7.Ethernet.function',
+    'opcua': 'fablab_lib.PLC.Siemens.opcua.Ethernet.function',
+    'logix': 'fablab_lib.PLC.Rockwell_AB.logix.Ethernet.function',
+}
+
+# Drivers whose read_tags() takes (address, type), the others take the address only
+_TYPED_VENDORS = ('mitsubishi', 'omron')
+
+
+def load_tag_table(filePath: str) -> list:
+    """
+    Reads a CSV tag table, with the header convention of LogFileCSV.get_info_variable_from_csv().
+
+    Args:
+        filePath (str): The path of the CSV file.
+
+    Returns:
+        list: A list of [name, address, type, scale, deadband].
+    """
+    with open(filePath, newline='') as csv_file:
+        rows = list(csv.DictReader(csv_file))
+
+    columns = {}
+    for header in (rows[0].keys() if rows else []):
+        if 'ID' in header:
+            columns['addr'] = header
+        elif 'Type' in header:
+            columns['type'] = header
+        elif 'Name' in header:
+            columns['name'] = header
+        elif 'Scale' in header:
+            columns['scale'] = header
+        elif 'Deadband' in header:
+            columns['deadband'] = header
+
+    tags = []
+    for row in rows:
+        tags.append([row[columns['name']].strip(),
+                     row[columns['addr']].strip(),
+                     row[columns['type']].strip() if 'type' in columns and row[columns['type']] else None,
+                     float(row[columns['scale']]) if 'scale' in columns and row[columns['scale']] else 1,
+                     float(row[columns['deadband']]) if 'deadband' in columns and row[columns['deadband']] else 0])
+    return tags
+
+
+def _build_plc(device: dict):
+    """
+    Creates the PLC wrapper and its ConnectionSupervisor.
+    """
+    from fablab_lib.Network.function import ConnectionSupervisor
+
+    vendor = device['vendor'].lower()
+    module = importlib.import_module(PLC_MODULES[vendor])
+    plc = module.PLC(device['host'], nameStation=device.get('name'), **device.get('params', {}))
+
+    check = None
+    if device.get('check_tag') is not None:
+        check_tag = device['check_tag']
+        check_tag = tuple(check_tag) if isinstance(check_tag, list) else check_tag
+        check = lambda plc: plc.read_tags([check_tag])[0][1]
+
+    supervisor = ConnectionSupervisor(plc, check=check)
+    supervisor.add_recovery_hook(lambda plc: logger.info(f"{device['name']}: PLC reconnected."))
+    return module, plc, supervisor
+
+
+def _build_groups(device: dict, module) -> list:
+    from fablab_lib.Scan.function import ScanTag, TagGroup
+
+    vendor = device['vendor'].lower()
+    groups = []
+    for group in device.get('groups', []):
+        rows = load_tag_table(group['csv']) if 'csv' in group else group.get('tags', [])
+        tags = []
+        for row in rows:
+            # the missing columns of a short row take their defaults: no type, scale 1, deadband 0
+            name, addr, varType, scale, deadband = list(row) + [None, None, None, 1, 0][len(row):]
+            if vendor not in _TYPED_VENDORS:
+                varType = None
+            elif vendor == 'mitsubishi' and varType is not None:
+                varType = getattr(module.DT, varType.upper(), varType)
+            tags.append(ScanTag(name, addr, varType, scale, deadband))
+        groups.append(TagGroup(group['kind'], group['period'], tags, group.get('heartbeat', 0)))
+    return groups
+
+
+def _build_sinks(device: dict, stages: list) -> list:
+    """
+    Returns the sinks of a device. The MQTT clients and the publishing stages are appended to stages as soon
+    as they are created, so the worker closes them in reverse order even if a later sink can't be built.
+    """
+    from fablab_lib.Scan.function import MQTTSink, CSVSink
+
+    sinks = []
+    mqtt_client = None
+    forward = None
+    for sink in device.get('sinks', []):
+        if sink['type'] == 'mqtt':
+            from fablab_lib.Broker.MQTT.function import MQTT, StoreForward, PublishQueue, QUEUE_SIZE, QUEUE_POLICY, \
+                MAX_INFLIGHT, MAX_QUEUED, SESSION_EXPIRY, WRITE_BUDGET
+            mqtt_client = MQTT(sink['host'], sink.get('port', 1883), user=sink.get('user', ''),
+                               password=sink.get('password', ''), use_tls=sink.get('use_tls', False),
+                               policies=sink.get('policies', 'retained'),
+                               max_inflight=sink.get('max_inflight', MAX_INFLIGHT),
+                               max_queued=sink.get('max_queued', MAX_QUEUED), codec=sink.get('codec', 'json'),
+                               protocol=sink.get('protocol', '3.1.1'), client_id=sink.get('client_id', ''),
+                               session_expiry=sink.get('session_expiry', SESSION_EXPIRY),
+                               message_expiry=sink.get('message_expiry'), tcp_nodelay=sink.get('tcp_nodelay'),
+                               send_buffer=sink.get('send_buffer'), receive_buffer=sink.get('receive_buffer'),
+                               write_budget=sink.get('write_budget', WRITE_BUDGET))
+            mqtt_client.standardTopic = sink['topic']
+            stages.append(mqtt_client)
+            mqtt_client.connect()
+            publisher = mqtt_client
+            if 'store' in sink:
+                from fablab_lib.Store.function import DiskQueue
+                store_queue = DiskQueue(sink['store'])
+                stages.append(store_queue)
+                forward = StoreForward(mqtt_client, store_queue)
+                stages.append(forward)
+                forward.start()
+                publisher = forward
+            if 'queue' in sink:
+                options = sink['queue']
+                publisher = PublishQueue(mqtt_client, options.get('size', QUEUE_SIZE), options.get('policy', QUEUE_POLICY),
+                                         forward, options.get('timeout'), name=f"mqtt.{device['name']}.queue",
+                                         publisher=forward)
+                stages.append(publisher)
+                publisher.start()
+            sinks.append(MQTTSink(publisher, sink.get('batch', False)))
+        elif sink['type'] == 'csv':
+            from fablab_lib.LogData.function import LogFileCSV
+            is_connected = mqtt_client.is_connected if mqtt_client is not None else None
+            log = LogFileCSV(sink['path'], sink['file'], store=False if forward is not None else None)
+            sinks.append(CSVSink(log, is_connected))
+        else:
+            raise ValueError(f"Unknown sink type: {sink['type']}")
+    return sinks
+
+
+def _close_stage(device: dict, stage) -> None:
+    """
+    Stops a publishing stage (PublishQueue, StoreForward), closes a DiskQueue or disconnects an MQTT client.
+    """
+    try:
+        if hasattr(stage, 'stop'):
+            stage.stop()
+        elif hasattr(stage, 'disconnect'):
+            stage.disconnect()
+        else:
+            stage.close()
+    except Exception as e:
+        logger.error(f"{device['name']}: Error closing {type(stage).__name__}: {e}")
+
+
+def _snapshot(engine, cpu: bool) -> dict:
+    """
+    Sums the scan counters of all the periods of an engine.
+    """
+    snapshot = {'time': time.monotonic(), 'tags': 0, 'scans': 0, 'changes': 0, 'late': 0, 'unavailable': 0,
+                'cpu': time.process_time() if cpu else None}
+    for stats in engine.stats().values():
+        snapshot['tags'] += stats['tags'] * (stats['cycles'] - stats['unavailable_cycles'])
+        snapshot['scans'] += stats['cycles']
+        snapshot['changes'] += stats['changes']
+        snapshot['late'] += stats['late_cycles']
+        snapshot['unavailable'] += stats['unavailable_cycles']
+    return snapshot
+
+
+def run_device(device: dict, stop, reports, isProcess: bool = False, reportInterval: float = REPORT_INTERVAL) -> None:
+    """
+    Runs the scan engine of one PLC until stop is set. This is the target of the workers.
+
+    Args:
+        device (dict): The description of the device.
+        stop (Event): Set to stop the worker.
+        reports (Queue): The queue receiving the (name, snapshot) reports.
+        isProcess (bool, optional): True in a worker process, the CPU time is then reported. Defaults to False.
+        reportInterval (float, optional): Seconds between two reports. Defaults to REPORT_INTERVAL.
+    """
+    from fablab_lib.Scan.function import ScanEngine
+
+    plc = supervisor = engine = None
+    stages = []
+    try:
+        module, plc, supervisor = _build_plc(device)
+        try:
+            plc.connect()
+        except Exception as e:
+            supervisor.trip(e)
+        supervisor.start()
+
+        engine = ScanEngine(supervisor.driver)
+        for group in _build_groups(device, module):
+            engine.add_group(group)
+        for sink in _build_sinks(device, stages):
+            engine.add_sink(sink)
+
+        engine.start()
+        while not stop.wait(reportInterval):
+            reports.put((device['name'], _snapshot(engine, isProcess)))
+    finally:
+        # whatever was built, also when the setup failed: a restarted worker opens everything again
+        if engine is not None:
+            engine.stop()
+        if supervisor is not None:
+            supervisor.stop()
+        for stage in reversed(stages):
+            _close_stage(device, stage)
+        if plc is not None:
+            try:
+                plc.disconnect()
+            except Exception as e:
+                logger.error(f"{device['name']}: Error disconnecting from PLC: {e}")
+
+
+def _run_thread(device: dict, stop, reports, reportInterval: float) -> None:
+    try:
+        run_device(device, stop, reports, False, reportInterval)
+    except Exception as e:
+        logger.exception(f"{device['name']}: Worker crashed: {e}")
+
+
+class _Worker:
+    """
+    The thread or process running one device, with its restart state.
+    """
+
+    def __init__(self, device: dict):
+        self.device = device
+        self.name = device['name']
+        self.kind = device.get('worker', 'thread')
+        if self.kind not in ('thread', 'process'):
+            raise ValueError(f"Unknown worker kind for {self.name}: {self.kind}")
+        self.handle = None
+        self.stop = None
+        self.started = 0.0
+        self.restarts = 0
+        self.crashes = 0                # crashes in a row, for the restart delay
+        self.restart_at = None
+        self.last = None                # last snapshot
+        self.rates = {}
+
+
+    def start(self, reports, context, reportInterval: float) -> None:
+        if self.kind == 'process':
+            self.stop = context.Event()
+            self.handle = context.Process(target=run_device, name=self.name, daemon=True,
+                                          args=(self.device, self.stop, reports, True, reportInterval))
+        else:
+            self.stop = threading.Event()
+            self.handle = threading.Thread(target=_run_thread, name=self.name, daemon=True,
+                                           args=(self.device, self.stop, reports, reportInterval))
+        self.handle.start()
+        self.started = time.monotonic()
+        self.restart_at = None
+        self.last = None
+
+
+    def is_alive(self) -> bool:
+        return self.handle is not None and self.handle.is_alive()
+
+
+    def join(self, timeout: float) -> None:
+        if self.handle is None:
+            return
+        self.stop.set()
+        self.handle.join(timeout)
+        if self.kind == 'process' and self.handle.is_alive():
+            logger.warning(f"{self.name}: Worker did not stop, terminating it.")
+            self.handle.terminate()
+            self.handle.join(timeout)
+
+
+    def update(self, snapshot: dict) -> None:
+        """
+        Computes the rates since the previous report of the worker.
+        """
+        last, self.last = self.last, snapshot
+        if last is None:
+            return
+        elapsed = snapshot['time'] - last['time']
+        if elapsed <= 0:
+            return
+        self.rates = {
+            'tags_per_s': (snapshot['tags'] - last['tags']) / elapsed,
+            'scans_per_s': (snapshot['scans'] - last['scans']) / elapsed,
+            'changes_per_s': (snapshot['changes'] - last['changes']) / elapsed,
+            'late': snapshot['late'],
+            'unavailable': snapshot['unavailable'],
+            'cpu': (snapshot['cpu'] - last['cpu']) / elapsed if snapshot['cpu'] is not None else None,
+        }
+
+
+class Gateway:
+    """
+    Runs the scan engines of several PLCs, one worker per PLC, and restarts the workers that crash.
+
+    Args:
+        devices (list): The descriptions of the devices (see the format of the JSON file above).
+        reportInterval (float, optional): Seconds between two throughput reports. Defaults to REPORT_INTERVAL.
+        reportPath (str, optional): A JSON file rewritten with the report after each interval. Defaults to None.
+
+    Examples:
+        >>> gateway = Gateway.from_file('devices.json')
+        >>> gateway.run()
+    """
+
+    def __init__(self, devices: list, reportInterval: float = REPORT_INTERVAL, reportPath: str = None):
+        names = [device['name'] for device in devices]
+        if len(set(names)) != len(names):
+            raise ValueError('The names of the devices must be unique.')
+
+        self.reportInterval = reportInterval
+        self.reportPath = reportPath
+        self._workers = {device['name']: _Worker(device) for device in devices}
+        self._context = multiprocessing.get_context('spawn')
+        self._reports = self._context.Queue() if any(worker.kind == 'process' for worker in self._workers.values()) \
+            else queue.Queue()
+        self._stop = threading.Event()
+
+
+    @classmethod
+    def from_file(cls, filePath: str, reportPath: str = None) -> 'Gateway':
+        """
+        Creates a gateway from a JSON file.
+        """
+        with open(filePath) as config_file:
+            config = json.load(config_file)
+        return cls(config['devices'], config.get('report_interval', REPORT_INTERVAL), reportPath)
+
+
+    def report(self) -> dict:
+        """
+        Returns the state and the throughput of each device.
+
+        Returns:
+            dict: {name: {'alive', 'worker', 'restarts', 'tags_per_s', 'scans_per_s', 'changes_per_s', 'late', 'unavailable', 'cpu'}}
+        """
+        return {name: dict(worker.rates, alive=worker.is_alive(), worker=worker.kind, restarts=worker.restarts)
+                for name, worker in self._workers.items()}
+
+
+    def _log_report(self) -> None:
+        report = self.report()
+        total = 0.0
+        for name, state in report.items():
+            total += state.get('tags_per_s', 0)
+            cpu = f", cpu {state['cpu'] * 100:.1f}%" if state.get('cpu') is not None else ''
+            logger.info(f"{name}: {'running' if state['alive'] else 'stopped'}, {state.get('tags_per_s', 0):.1f} tags/s, "
+                        f"{state.get('scans_per_s', 0):.1f} scans/s, {state.get('changes_per_s', 0):.1f} changes/s, "
+                        f"{state['restarts']} restarts{cpu}")
+        logger.info(f"Total: {total:.1f} tags/s on {len(report)} devices.")
+
+        if self.reportPath is not None:
+            with open(self.reportPath, 'w') as report_file:
+                json.dump(report, report_file, indent=2)
+
+
+    def _supervise(self, now: float) -> None:
+        """
+        Schedules the restart of the workers that stopped, and restarts the ones that are due.
+        """
+        for worker in self._workers.values():
+            if worker.is_alive():
+                continue
+            if worker.restart_at is None:
+                worker.crashes = worker.crashes + 1 if now - worker.started < STABLE_RUN_TIME else 1
+                delay = min(RESTART_DELAY_MIN * 2 ** (worker.crashes - 1), RESTART_DELAY_MAX)
+                worker.restart_at = now + delay
+                logger.error(f"{worker.name}: Worker stopped, restarting in {delay:.0f}s.")
+            elif now >= worker.restart_at:
+                worker.restarts += 1
+                worker.start(self._reports, self._context, self.reportInterval)
+
+
+    def start(self) -> None:
+        """
+        Starts the workers of all the devices.
+        """
+        self._stop.clear()
+        for worker in self._workers.values():
+            worker.start(self._reports, self._context, self.reportInterval)
+            logger.info(f"{worker.name}: Started {worker.kind} worker for {worker.device['vendor']} PLC {worker.device['host']}.")
+
+
+    def run(self) -> None:
+        """
+        Starts the workers and supervises them until stop() is called or the program is interrupted.
+        """
+        self.start()
+        next_report = time.monotonic() + self.reportInterval
+        try:
+            while not self._stop.is_set():
+                try:
+                    name, snapshot = self._reports.get(timeout=SUPERVISE_INTERVAL)
+                    self._workers[name].update(snapshot)
+                except queue.Empty:
+                    pass
+
+                now = time.monotonic()
+                self._supervise(now)
+                if now >= next_report:
+                    self._log_report()
+                    next_report = now + self.reportInterval
+        except KeyboardInterrupt:
+            logger.info('Interrupted, stopping the workers...')
+        finally:
+            self.shutdown()
+
+
+    def stop(self) -> None:
+        """
+        Stops the supervision loop of run().
+        """
+        self._stop.set()
+
+
+    def shutdown(self, timeout: float = 10) -> None:
+        """
+        Stops all the workers.
+        """
+        for worker in self._workers.values():
+            if worker.stop is not None:
+                worker.stop.set()
+        for worker in self._workers.values():
+            worker.join(timeout)
+
+
+def main(argv: list = None) -> None:
+    parser = argparse.ArgumentParser(description='Runs the scan engines of several PLCs described in a JSON file.')
+    parser.add_argument('config', help='the JSON file describing the devices')
+    parser.add_argument('--report', default=None, help='a JSON file rewritten with the throughput of each device')
+    args = parser.parse_args(argv)
+
+    Gateway.from_file(args.config, args.report).run()
@@ -3,7 +3,7 @@ This file contains the implementation of the LogFileCSV class, which is responsi
 """
 
 from fablab_lib.Broker.JsonPayload.function import*
-from datetime import datetime
+from fablab_lib.Store.function import DiskQueue
 import logging
 import os
 import threading
@@ -18,15 +18,31 @@ _log_handle = logging.StreamHandler()
 _log_handle.setFormatter(logging.Formatter('%(asctime)s %(name)s %(levelname)s | %(message)s'))
 logger.addHandler(_log_handle)
 
+STORE_DIR = 'stored_disconnectWifi'                     # directory of the DiskQueue of the messages logged while disconnected
+LEGACY_STORE_FILE = 'stored_disconnectWifi_data.txt'    # text file of the stored messages of the previous versions
+
+_stores = {}        # DiskQueue of each directory, shared by the LogFileCSV objects of the same filePath
+
+
+def _open_store(path: str) -> DiskQueue:
+    path = os.path.abspath(path)
+    with lock:
+        if path not in _stores:
+            _stores[path] = DiskQueue(path)
+        return _stores[path]
+
 
 class LogFileCSV:
-    def __init__(self, filePath: str, fileName: str):
+    def __init__(self, filePath: str, fileName: str, store=None):
         """
         Initializes a LogFileCSV object.
 
         Args:
             filePath (str): The path to the directory where the log file will be stored.
             fileName (str): The name of the log file.
+            store (DiskQueue, optional): The queue of the messages logged while disconnected from Wi-Fi, replayed
+                by fablab_lib.StoreForward. Defaults to None (a DiskQueue in filePath + STORE_DIR), False to not
+                store them.
 
         Raises:
             FileNotFoundError: If the specified log file does not exist, it will be created.
@@ -34,6 +50,9 @@ class LogFileCSV:
         self.filePath = filePath
         self.fileName = fileName
         self.No = 0
+        self.store = _open_store(os.path.join(filePath, STORE_DIR)) if store is None else store
+        if self.store:
+            self._import_legacy_store()
         try:
             with open(self.filePath + self.fileName) as store_data:
                 pass
@@ -82,7 +101,9 @@ class LogFileCSV:
             VarAddr: str, 
             VarValue, 
             KindOfData: str, #'setting', 'counting', 'checking', 'alarm'
-            is_ConnectedWifi: bool=True
+            is_ConnectedWifi: bool=True,
+            Timestamp: str=None,
+            payload=None
             ):
         """
         Logs data to the CSV file.
@@ -93,8 +114,12 @@ class LogFileCSV:
             VarValue: The value of the variable.
             KindOfData (str): The kind of data. Can be 'setting', 'counting', 'checking', or 'alarm'.
             is_ConnectedWifi (bool, optional): Indicates whether the device is connected to Wi-Fi. Defaults to True.
+            Timestamp (str, optional): The ISO 8601 timestamp of the value. Defaults to None (now).
+            payload (optional): The json payload of the value already encoded by MQTT.publish_data(), stored when
+                the device is disconnected instead of encoding the value again. Defaults to None.
         """
-        Timestamp = datetime.now().isoformat(timespec='microseconds')
+        if Timestamp is None:
+            Timestamp = encoder.now().decode()
         with lock:
             with open(self.filePath + self.fileName, 'a+') as store_data:
                 store_data.write('{0},{1},{2},{3},{4},{5},{6}\n'.format(self.No, 
@@ -105,44 +130,62 @@ class LogFileCSV:
                                                                     KindOfData, 
                                                                     int(is_ConnectedWifi)))
             
-        if not is_ConnectedWifi: # Store data when the device is disconnected from Wi-Fi
-            data = generate_data(VarName, VarValue)
-            with lock:
-                with open(self.filePath + 'stored_disconnectWifi_data.txt', 'a+') as file:
-                    file.write(str(data) + '\n')
-            logger.info(f'Disconnected Wifi -> Log: {data}')
+        if not is_ConnectedWifi and self.store: # Store data when the device is disconnected from Wi-Fi
+            # Same encoding (and same bytes, cached by the encoder) as the MQTT payload of this value
+            data = payload if payload is not None else encoder.encode(VarName, VarValue, Timestamp)
+            self.store.append(VarName, data)
+            logger.info('Disconnected Wifi -> Log: %s', data.decode() if isinstance(data, bytes) else data)
         self.No += 1
 
 
+    def _import_legacy_store(self):
+        """
+        Moves the messages of the text file of the previous versions into the store.
+        """
+        legacy = self.filePath + LEGACY_STORE_FILE
+        if not os.path.isfile(legacy):
+            return
+        count = 0
+        with lock:
+            with open(legacy) as file:
+                for message in file.read().splitlines():
+                    message = message.replace('\\', '')
+                    try:
+                        name = parse_data(message.encode())[0]['name']
+                    except (ValueError, IndexError, KeyError):
+                        logger.error(f'Invalid stored message: {message}')
+                        continue
+                    self.store.append(name, message)
+                    count += 1
+            self.store.sync()
+            os.remove(legacy)
+        logger.info(f'Moved {count} stored messages of {LEGACY_STORE_FILE} to the store.')
+
+
     def get_data_disconnected_wifi(self):
         """
-        Retrieves the stored messages from the file when the device is disconnected from Wi-Fi.
+        Retrieves and removes all the messages stored when the device was disconnected from Wi-Fi.
+
+        The messages are removed from the store when they are read, before they are published: use
+        fablab_lib.StoreForward to replay them with their PUBACK.
 
         Returns:
             tuple: A tuple containing two lists: lsName (list of names) and lsPayload (list of payloads).
         """
         ls_name = []
         ls_payload = []
-        try:
-            with lock:
-                with open(self.filePath + 'stored_disconnectWifi_data.txt') as file:
-                    messages = file.read().splitlines()
-
-            for message in messages:
-                _message = json.loads(message.replace('\\','').replace('[','').replace(']',''))
-                ls_name.append(_message['name'])
-                ls_payload.append(message.replace('\\',''))
-
+        if not self.store:
+            return ls_name, ls_payload
+        records = self.store.read(1000)
+        while records:
+            for position, name, payload in records:
+                ls_name.append(name)
+                ls_payload.append(payload.decode())
+            self.store.ack(position)
+            records = self.store.read(1000)
+
+        if ls_name:
             logger.info('Completed reading stored messages!')
-            # Clear the file
-            myfile = self.filePath + 'stored_disconnectWifi_data.txt'
-            if os.path.isfile(myfile):
-                os.remove(myfile)
-                logger.info('Cleared stored messages!')
-
-        except FileNotFoundError:
+        else:
             logger.info('No stored messages!')
-
         return ls_name, ls_payload
-
-
@@ -0,0 +1,374 @@
+"""
+This file contains the implementation of the LogicExpr class, which compiles the logic equations used
+to check the status bits of a machine (see PLC.checkLogicBits) into Python closures, and of the
+StateClassifier class, which turns an ordered list of state equations into a lookup table.
+
+Grammar of the equations:
+    - variables are the lower case letters 'a' to 'z', 'a' is bits[0], 'b' is bits[1], ...
+    - '0' and '1' are the constants False and True
+    - '/' is "not", '.' is "and", '|' is "or", with the precedence / > . > |
+    - parentheses group sub-equations, spaces are ignored
+
+The bits are tested for truth, so the raw values of the drivers can be passed as they are: booleans,
+integers (any non zero value is True) or None for a bit that could not be read (False).
+
+Example:
+    >>> expr = LogicExpr.compile('/a|(b.c)|d')
+    >>> expr([True, False, True, True, False])
+    True
+    >>> expr.variables
+    ['a', 'b', 'c', 'd']
+"""
+
+from datetime import datetime
+from itertools import compress
+from operator import itemgetter, truth
+import threading
+
+lock = threading.Lock()
+
+MAX_CACHE_SIZE = 1024           # compiled equations kept by LogicExpr.compile()
+
+_WEIGHTS = [1 << i for i in range(32)]
+
+
+def _const(value: bool):
+    return lambda bits: value
+
+
+def _not(f):
+    return lambda bits: not f(bits)
+
+
+def _and(f, g):
+    return lambda bits: f(bits) and g(bits)
+
+
+def _or(f, g):
+    return lambda bits: f(bits) or g(bits)
+
+
+def _literal(index: int, value: bool):
+    getter = itemgetter(index)
+    return getter if value else _not(getter)
+
+
+def _all_match(literals: list):
+    """
+    True if bits[index] == value for every (index, value) of literals
+    """
+    if len(literals) == 1:
+        return _literal(*literals[0])
+    getter = itemgetter(*[index for index, _ in literals])
+    expected = tuple(value for _, value in literals)
+    return lambda bits: tuple(map(truth, getter(bits))) == expected
+
+
+def _any_match(literals: list):
+    """
+    True if bits[index] == value for at least one (index, value) of literals
+    """
+    if len(literals) == 1:
+        return _literal(*literals[0])
+    getter = itemgetter(*[index for index, _ in literals])
+    unexpected = tuple(not value for _, value in literals)
+    return lambda bits: tuple(map(truth, getter(bits))) != unexpected
+
+
+class _Parser:
+    """
+    Recursive descent parser of the equations, builds a tree of tuples:
+    ('var', index), ('const', value), ('not', node), ('and', [nodes]), ('or', [nodes])
+    """
+
+    def __init__(self, equation: str):
+        self.equation = equation
+        self.tokens = [char for char in equation if not char.isspace()]
+        self.pos = 0
+
+
+    def error(self, message: str):
+        raise ValueError(f'Invalid logic equation {self.equation!r}: {message}')
+
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+
+    def parse(self):
+        if not self.tokens:
+            self.error('empty equation')
+        node = self.parse_or()
+        if self.pos != len(self.tokens):
+            self.error(f'unexpected {self.tokens[self.pos]!r}')
+        return node
+
+
+    def parse_or(self):
+        nodes = [self.parse_and()]
+        while self.peek() == '|':
+            self.pos += 1
+            nodes.append(self.parse_and())
+        return nodes[0] if len(nodes) == 1 else ('or', nodes)
+
+
+    def parse_and(self):
+        nodes = [self.parse_not()]
+        while self.peek() == '.':
+            self.pos += 1
+            nodes.append(self.parse_not())
+        return nodes[0] if len(nodes) == 1 else ('and', nodes)
+
+
+    def parse_not(self):
+        token = self.peek()
+        if token == '/':
+            self.pos += 1
+            return ('not', self.parse_not())
+        if token == '(':
+            self.pos += 1
+            node = self.parse_or()
+            if self.peek() != ')':
+                self.error('missing ")"')
+            self.pos += 1
+            return node
+        if token is not None and 'a' <= token <= 'z':
+            self.pos += 1
+            return ('var', ord(token) - 97)
+        if token in ('0', '1'):
+            self.pos += 1
+            return ('const', token == '1')
+        self.error('unexpected end of equation' if token is None else f'unexpected {token!r}')
+
+
+def _build(node):
+    """
+    Converts a tree of the parser into a closure bits -> truth value.
+
+    The variables and negated variables of an "and" or an "or" are tested together by comparing
+    a single itemgetter tuple with the expected bits, the other operands are chained with
+    short-circuit closures.
+    """
+    kind, arg = node
+    if kind == 'var':
+        return itemgetter(arg)
+    if kind == 'const':
+        return _const(arg)
+    if kind == 'not':
+        return _not(_build(arg))
+
+    literals = []
+    others = []
+    for n in arg:
+        if n[0] == 'var':
+            literals.append((n[1], True))
+        elif n[0] == 'not' and n[1][0] == 'var':
+            literals.append((n[1][1], False))
+        else:
+            others.append(_build(n))
+
+    if kind == 'and':
+        funcs = ([_all_match(literals)] if literals else []) + others
+        combine = _and
+    else:
+        funcs = ([_any_match(literals)] if literals else []) + others
+        combine = _or
+
+    func = funcs[-1]
+    for f in reversed(funcs[:-1]):
+        func = combine(f, func)
+    return func
+
+
+class LogicExpr:
+    """
+    A logic equation compiled once into a closure, evaluated without eval.
+
+    Use LogicExpr.compile() to get the compiled equation, the result is cached by equation string.
+
+    Attributes:
+        equation (str): The source equation.
+        variables (list): The sorted variables used by the equation.
+    """
+
+    _cache = {}
+
+    def __init__(self, equation: str):
+        self.equation = equation
+        self.variables = sorted(set(char for char in equation if 'a' <= char <= 'z'))
+        self._func = _build(_Parser(equation).parse())
+
+
+    @classmethod
+    def compile(cls, equation: str) -> 'LogicExpr':
+        """
+        Compiles a logic equation, or returns the already compiled one.
+
+        Args:
+            equation (str): The logic equation, e.g. '/a|(b.c)|d'.
+
+        Returns:
+            LogicExpr: The compiled equation.
+
+        Raises:
+            ValueError: If the equation is not valid.
+        """
+        expr = cls._cache.get(equation)
+        if expr is None:
+            expr = cls(equation)
+            with lock:
+                if len(cls._cache) >= MAX_CACHE_SIZE:
+                    cls._cache.clear()
+                cls._cache[equation] = expr
+        return expr
+
+
+    def __call__(self, bits) -> bool:
+        """
+        Evaluates the equation.
+
+        Args:
+            bits (list): The values of the variables, bits[0] for 'a', bits[1] for 'b', ...
+
+        Returns:
+            bool: The result of the equation.
+        """
+        return bool(self._func(bits))
+
+
+    evaluate = __call__
+
+
+    def __repr__(self):
+        return f'LogicExpr({self.equation!r})'
+
+
+def pack_bits(bits) -> int:
+    """
+    Packs a list of bits into an integer, bits[0] is the least significant bit.
+
+    Examples:
+        >>> pack_bits([True, False, True])
+        5
+    """
+    return sum(compress(_WEIGHTS, bits)) if len(bits) <= len(_WEIGHTS) else \
+        sum(1 << i for i, bit in enumerate(bits) if bit)
+
+
+class StateClassifier:
+    """
+    Classifies the state of a machine from its status bits with a precomputed truth table.
+
+    The rules are checked in order, the first one whose equation is true gives the state. They are
+    evaluated once for every combination of the status bits when the classifier is created (2^7 = 128
+    entries for 7 bits), so classifying a state is one integer pack and one list index.
+
+    Args:
+        rules (list): The ordered rules, tuples (state, equation) or (state, equation, blockedFrom)
+        where blockedFrom is a collection of previous states from which the rule can't be entered.
+        guards (list, optional): Equations that must all be true for any rule to apply (e.g. power on). Defaults to ().
+        nbits (int, optional): The number of status bits. Defaults to the highest variable of the equations.
+        default (optional): The state returned when no rule applies, None to keep the current state. Defaults to None.
+
+    Attributes:
+        state: The current state, None before the first update().
+        timestamp (str): The time of the last transition.
+        on_transition (callable): Called as on_transition(old_state, new_state, timestamp) on each change of state.
+
+    Examples:
+        >>> classifier = StateClassifier([(ST.Run, 'a.d.(/c).(/e)'),
+        ...                               (ST.Idle, 'e.(/d).(/c)', (ST.Setup, ST.On)),
+        ...                               (ST.Alarm, 'c'),
+        ...                               (ST.Setup, 'b.d.(/c).(/e)')],
+        ...                              guards=['f'])
+        >>> classifier.on_transition = lambda old, new, timestamp: publish_data('machineStatus', new, new, 'MachineStatus')
+        >>> classifier.update(plc.read_multiple_incoherent_bits(list_status_addr))
+    """
+
+    MAX_BITS = 16
+
+    def __init__(self, rules: list, guards: list = (), nbits: int = None, default=None):
+        self.rules = [(rule[0], LogicExpr.compile(rule[1]), frozenset(rule[2]) if len(rule) > 2 else frozenset())
+                      for rule in rules]
+        self.guards = [LogicExpr.compile(guard) for guard in guards]
+        self.default = default
+
+        if nbits is None:
+            variables = [var for _, expr, _ in self.rules for var in expr.variables]
+            variables += [var for expr in self.guards for var in expr.variables]
+            nbits = ord(max(variables)) - 96 if variables else 0
+        if nbits > self.MAX_BITS:
+            raise ValueError(f'A state classifier supports at most {self.MAX_BITS} status bits, got {nbits}.')
+        self.nbits = nbits
+
+        # Previous states that change the result of a rule get their own table
+        self._contexts = frozenset().union(*[blockedFrom for _, _, blockedFrom in self.rules])
+        self._tables = {}
+
+        self.state = None
+        self.timestamp = None
+        self.on_transition = None
+
+
+    def _build_table(self, previous) -> list:
+        """
+        Evaluates the rules for every combination of the status bits.
+        """
+        table = []
+        for packed in range(1 << self.nbits):
+            bits = [(packed >> i) & 1 for i in range(self.nbits)]
+            state = self.default
+            if all(guard(bits) for guard in self.guards):
+                for rule_state, expr, blockedFrom in self.rules:
+                    if previous not in blockedFrom and expr(bits):
+                        state = rule_state
+                        break
+            table.append(state)
+        return table
+
+
+    def _table(self, previous) -> list:
+        key = previous if previous in self._contexts else None
+        table = self._tables.get(key)
+        if table is None:
+            table = self._tables[key] = self._build_table(key)
+        return table
+
+
+    def classify(self, bits, previous=None):
+        """
+        Classifies the state from the status bits.
+
+        Args:
+            bits (list or int): The status bits, bits[0] for 'a', ..., or the bits already packed into an integer.
+            previous (optional): The previous state, used by the rules with blockedFrom. Defaults to None.
+
+        Returns:
+            The state of the first rule that applies, or default.
+        """
+        if not isinstance(bits, int):
+            bits = sum(compress(_WEIGHTS, bits[:self.nbits]))
+        return self._table(previous)[bits]
+
+
+    def update(self, bits, timestamp: str = None):
+        """
+        Classifies the state from the status bits and calls on_transition if the state changed.
+
+        Args:
+            bits (list or int): The status bits, or the bits already packed into an integer.
+            timestamp (str, optional): The time of the status bits. Defaults to now.
+
+        Returns:
+            The current state.
+        """
+        state = self.classify(bits, self.state)
+        if state is None or state == self.state:
+            return self.state
+
+        old_state = self.state
+        self.state = state
+        self.timestamp = timestamp if timestamp is not None else datetime.now().isoformat(timespec='microseconds')
+        if self.on_transition is not None:
+            self.on_transition(old_state, state, self.timestamp)
+        return state
@@ -0,0 +1,468 @@
+"""
+This file contains the instrumentation of the PLC drivers and of the scan engine: latency histograms,
+request and byte counters, queryable in the program and dumpable as a JSON metrics message.
+
+The drivers are instrumented by wrapping their lowest level request method when enable_instrumentation()
+is called, and unwrapped by disable_instrumentation(). Nothing is wrapped while the instrumentation is
+disabled, so it costs nothing; the scan engine only checks metrics.enabled once per scan.
+
+Instrumented calls:
+    - Mitsubishi MC protocol: Type3E._send / Type3E._recv (round trip of each frame, also Type4E)
+    - Omron FINS: UDPFinsConnection.execute_fins_command_frame and TCPFinsConnection.execute_fins_command_frame
+    - Siemens S7 snap7: Client.db_read, db_write, read_area, write_area, read_multi_vars, write_multi_vars
+    - Siemens OPC UA: UASocketClient.send_request (each service call, by request type)
+    - Rockwell Logix: pylogix Connection._get_bytes (each EtherNet/IP request sent by conn.send)
+
+Metric names:
+    - plc.<vendor>.rtt (histogram), plc.<vendor>.requests, .errors, .bytes_sent, .bytes_received (counters)
+    - plc.<vendor>.<call>.rtt for the snap7 calls and the OPC UA services
+    - scan.<period>s.cycle, scan.<period>s.read, sink.<sink class> (histograms), scan.<period>s.overruns (counter)
+    - mqtt.queue.depth (gauge), mqtt.queue.dropped, .coalesced, .spilled, .blocked (counters) of a PublishQueue
+
+Example:
+    >>> enable_instrumentation()
+    >>> metrics.start_reporting(lambda payload: client.publish_data('metrics', payload, is_payload=True), interval=60)
+    >>> metrics.histogram('plc.mitsubishi.rtt').percentile(99)
+    0.0123
+"""
+
+from array import array
+from datetime import datetime
+import json
+import logging
+import threading
+import time
+
+# Application logger
+logger = logging.getLogger("Metrics")
+logger.setLevel(logging.DEBUG)
+_log_handle = logging.StreamHandler()
+_log_handle.setFormatter(logging.Formatter('%(asctime)s %(name)s %(levelname)s | %(message)s'))
+logger.addHandler(_log_handle)
+
+REPORT_INTERVAL = 60.0          # default seconds between two metrics messages
+PERCENTILES = (50, 90, 99, 99.9)
+
+_SUB_BITS = 7                   # 128 sub-buckets per power of 2: values within 1/64 (1.6%)
+_SUB_COUNT = 1 << _SUB_BITS
+_HALF_COUNT = _SUB_COUNT >> 1
+
+
+class Histogram:
+    """
+    Latency histogram with log-linear buckets (HDR histogram layout).
+
+    The values are counted in integer units (microseconds by default) in buckets whose width doubles
+    every 64 buckets, so the relative error is below 1/64 at any scale with a few kilobytes of memory
+    and no allocation when recording.
+
+    Args:
+        unit (float, optional): The resolution in seconds. Defaults to 1e-6.
+    """
+
+    def __init__(self, unit: float = 1e-6):
+        self.unit = unit
+        self._scale = 1 / unit
+        self._counts = array('Q', bytes(8 * _SUB_COUNT))
+        self._lock = threading.Lock()
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+
+    @staticmethod
+    def _index(value: int) -> int:
+        if value < _SUB_COUNT:
+            return value
+        shift = value.bit_length() - _SUB_BITS
+        return shift * _HALF_COUNT + (value >> shift)
+
+
+    @staticmethod
+    def _value(index: int) -> int:
+        """
+        Middle of the range of values counted in a bucket.
+        """
+        if index < _SUB_COUNT:
+            return index
+        shift = index // _HALF_COUNT - 1
+        return ((index - shift * _HALF_COUNT) << shift) + (1 << (shift - 1))
+
+
+    def record(self, seconds: float) -> None:
+        """
+        Records a value in seconds.
+        """
+        value = int(seconds * self._scale)
+        if value < 0:
+            value = 0
+        index = self._index(value)
+        with self._lock:
+            if index >= len(self._counts):
+                self._counts.extend(array('Q', bytes(8 * (index + 1 - len(self._counts)))))
+            self._counts[index] += 1
+            self.count += 1
+            self.total += value
+            if self.min is None or value < self.min:
+                self.min = value
+            if value > self.max:
+                self.max = value
+
+
+    def percentile(self, percent: float) -> float:
+        """
+        Returns the value in seconds below which percent % of the values are.
+        """
+        if not self.count:
+            return 0.0
+        target = max(1, self.count * percent / 100)
+        seen = 0
+        for index, count in enumerate(self._counts):
+            seen += count
+            if seen >= target:
+                return min(self._value(index), self.max) * self.unit
+        return self.max * self.unit
+
+
+    def snapshot(self) -> dict:
+        """
+        Returns count, min, mean, max and the PERCENTILES (p50, p90, p99, p99.9), in seconds.
+        """
+        with self._lock:
+            if not self.count:
+                return {'count': 0}
+            result = {'count': self.count,
+                      'min': self.min * self.unit,
+                      'mean': self.total / self.count * self.unit,
+                      'max': self.max * self.unit}
+            for percent in PERCENTILES:
+                result[f'p{percent:g}'] = self.percentile(percent)
+        return result
+
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counts = array('Q', bytes(8 * _SUB_COUNT))
+            self.count = 0
+            self.total = 0
+            self.min = None
+            self.max = 0
+
+
+class Metrics:
+    """
+    Registry of the histograms and counters.
+
+    Attributes:
+        enabled (bool): True while the instrumentation is enabled.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self._histograms = {}
+        self._counters = {}
+        self._gauges = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+
+    def histogram(self, name: str) -> Histogram:
+        """
+        Returns the histogram of a name, created on first use.
+        """
+        histogram = self._histograms.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(name, Histogram())
+        return histogram
+
+
+    def record(self, name: str, seconds: float) -> None:
+        self.histogram(name).record(seconds)
+
+
+    def count(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+
+    def counter(self, name: str) -> int:
+        return self._counters.get(name, 0)
+
+
+    def gauge(self, name: str, func=None) -> None:
+        """
+        Registers a function returning the current value of a gauge (e.g. a queue depth), read by snapshot().
+
+        Args:
+            name (str): The name of the gauge.
+            func (callable, optional): Returns the value. Defaults to None (removes the gauge).
+        """
+        with self._lock:
+            if func is None:
+                self._gauges.pop(name, None)
+            else:
+                self._gauges[name] = func
+
+
+    def snapshot(self, reset: bool = False) -> dict:
+        """
+        Returns all the metrics.
+
+        Args:
+            reset (bool, optional): Resets the metrics after reading them, so each snapshot covers
+            one interval. Defaults to False.
+
+        Returns:
+            dict: {'timestamp', 'counters': {name: value}, 'gauges': {name: value},
+            'histograms': {name: Histogram.snapshot()}}
+        """
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = list(self._gauges.items())
+            histograms = list(self._histograms.items())
+            if reset:
+                self._counters.clear()
+        result = {'timestamp': datetime.now().isoformat(timespec='milliseconds'),
+                  'counters': counters,
+                  'gauges': {name: func() for name, func in gauges},
+                  'histograms': {name: histogram.snapshot() for name, histogram in histograms}}
+        if reset:
+            for _, histogram in histograms:
+                histogram.reset()
+        return result
+
+
+    def to_json(self, reset: bool = False) -> str:
+        return json.dumps(self.snapshot(reset))
+
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+
+    def start_reporting(self, callback, interval: float = REPORT_INTERVAL, reset: bool = True) -> None:
+        """
+        Calls callback(json_message) every interval seconds from a background thread.
+
+        Args:
+            callback (callable): Receives the JSON metrics message, e.g. to publish it with MQTT.
+            interval (float, optional): Seconds between two messages. Defaults to REPORT_INTERVAL.
+            reset (bool, optional): Each message covers only the last interval. Defaults to True.
+        """
+        self.stop_reporting()
+        self._stop.clear()
+
+        def report():
+            while not self._stop.wait(interval):
+                try:
+                    callback(self.to_json(reset))
+                except Exception as e:
+                    logger.error(f"Error sending the metrics: {e}")
+
+        self._thread = threading.Thread(target=report, name='MetricsReporter', daemon=True)
+        self._thread.start()
+
+
+    def stop_reporting(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+metrics = Metrics()
+
+_installed = []                 # (owner, name, original) of the wrapped methods
+
+
+def _record_call(vendor: str, start: float, sent: int, received: int, failed: bool, call: str = None) -> None:
+    elapsed = time.perf_counter() - start
+    prefix = 'plc.' + vendor
+    metrics.record(prefix + '.rtt', elapsed)
+    if call is not None:
+        metrics.record(f'{prefix}.{call}.rtt', elapsed)
+    metrics.count(prefix + '.requests')
+    if sent:
+        metrics.count(prefix + '.bytes_sent', sent)
+    if received:
+        metrics.count(prefix + '.bytes_received', received)
+    if failed:
+        metrics.count(prefix + '.errors')
+
+
+def _wrap(owner, name: str, wrapper) -> None:
+    original = owner.__dict__.get(name)
+    if original is None:
+        raise AttributeError(f'{owner.__name__} has no method {name}')
+    setattr(owner, name, wrapper(original))
+    _installed.append((owner, name, original))
+
+
+def _unwrap(count: int = 0) -> None:
+    """
+    Restores the original methods wrapped after the first count ones, the last wrapped first.
+    """
+    while len(_installed) > count:
+        owner, name, original = _installed.pop()
+        setattr(owner, name, original)
+
+
+def _instrument_mitsubishi() -> None:
+    from fablab_lib.PLC.Mitsubishi.mcprotocol.Ethernet.pymelsec.type3e import Type3E
+
+    def send(original):
+        def _send(self, send_data):
+            self._metrics_start = time.perf_counter()
+            self._metrics_sent = len(send_data)
+            return original(self, send_data)
+        return _send
+
+    def recv(original):
+        def _recv(self):
+            start = getattr(self, '_metrics_start', None)
+            try:
+                recv_data = original(self)
+            except Exception:
+                if start is not None:
+                    _record_call('mitsubishi', start, self._metrics_sent, 0, True)
+                    self._metrics_start = None
+                raise
+            if start is not None:
+                _record_call('mitsubishi', start, self._metrics_sent, len(recv_data), False)
+                self._metrics_start = None
+            return recv_data
+        return _recv
+
+    _wrap(Type3E, '_send', send)
+    _wrap(Type3E, '_recv', recv)
+
+
+def _instrument_omron() -> None:
+    from fablab_lib.PLC.Omron.fins.Ethernet.fins.tcp import TCPFinsConnection
+    from fablab_lib.PLC.Omron.fins.Ethernet.fins.udp import UDPFinsConnection
+
+    def execute(original):
+        def execute_fins_command_frame(self, fins_command_frame):
+            start = time.perf_counter()
+            try:
+                response = original(self, fins_command_frame)
+            except Exception:
+                _record_call('omron', start, len(fins_command_frame), 0, True)
+                raise
+            _record_call('omron', start, len(fins_command_frame), len(response), False)
+            return response
+        return execute_fins_command_frame
+
+    _wrap(UDPFinsConnection, 'execute_fins_command_frame', execute)
+    _wrap(TCPFinsConnection, 'execute_fins_command_frame', execute)
+
+
+def _instrument_s7() -> None:
+    from fablab_lib.PLC.Siemens.snap7.Ethernet.snap7.client import Client
+
+    def call(original):
+        call_name = original.__name__
+        def wrapper(self, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                result = original(self, *args, **kwargs)
+            except Exception:
+                _record_call('s7', start, 0, 0, True, call_name)
+                raise
+            size = len(result) if isinstance(result, (bytes, bytearray)) else 0
+            _record_call('s7', start, 0, size, False, call_name)
+            return result
+        wrapper.__name__ = original.__name__
+        return wrapper
+
+    for name in ('db_read', 'db_write', 'read_area', 'write_area', 'read_multi_vars', 'write_multi_vars'):
+        _wrap(Client, name, call)
+
+
+def _instrument_opcua() -> None:
+    from opcua.client.ua_client import UASocketClient
+
+    def send(original):
+        def send_request(self, request, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                data = original(self, request, *args, **kwargs)
+            except Exception:
+                _record_call('opcua', start, 0, 0, True, type(request).__name__)
+                raise
+            size = len(data) if isinstance(data, (bytes, bytearray)) else 0
+            _record_call('opcua', start, 0, size, False, type(request).__name__)
+            return data
+        return send_request
+
+    _wrap(UASocketClient, 'send_request', send)
+
+
+def _instrument_logix() -> None:
+    from fablab_lib.PLC.Rockwell_AB.logix.Ethernet.pylogix.lgx_comm import Connection
+
+    def get_bytes(original):
+        def _get_bytes(self, data, connected):
+            start = time.perf_counter()
+            status, ret_data = original(self, data, connected)
+            _record_call('logix', start, len(data), len(ret_data) if ret_data else 0, ret_data is None)
+            return status, ret_data
+        return _get_bytes
+
+    _wrap(Connection, '_get_bytes', get_bytes)
+
+
+_INSTRUMENTS = {
+    'mitsubishi': _instrument_mitsubishi,
+    'omron': _instrument_omron,
+    's7': _instrument_s7,
+    'opcua': _instrument_opcua,
+    'logix': _instrument_logix,
+}
+
+
+def enable_instrumentation(vendors: list = None) -> None:
+    """
+    Wraps the request methods of the drivers and enables the scan engine metrics.
+
+    Args:
+        vendors (list, optional): The drivers to instrument among 'mitsubishi', 'omron', 's7', 'opcua'
+        and 'logix'. Defaults to None (all the drivers whose library is installed).
+
+    Raises:
+        ValueError: If a driver of vendors is unknown.
+        ImportError: If the library of a driver of vendors is not installed, nothing stays wrapped.
+    """
+    if metrics.enabled:
+        return
+    unknown = [vendor for vendor in vendors or () if vendor not in _INSTRUMENTS]
+    if unknown:
+        raise ValueError(f"Unknown drivers {unknown}, expected some of {sorted(_INSTRUMENTS)}")
+    for vendor in (vendors if vendors is not None else _INSTRUMENTS):
+        count = len(_installed)
+        try:
+            _INSTRUMENTS[vendor]()
+        except (ImportError, AttributeError) as e:
+            # a driver is wrapped entirely or not at all, and a failed call leaves nothing wrapped:
+            # the next call would wrap the wrappers again
+            if vendors is not None:
+                _unwrap()
+                raise
+            _unwrap(count)
+            logger.debug(f"Driver {vendor} not instrumented: {e}")
+    metrics.enabled = True
+    logger.info(f"Instrumentation enabled.")
+
+
+def disable_instrumentation() -> None:
+    """
+    Restores the original request methods of the drivers.
+    """
+    _unwrap()
+    metrics.enabled = False
+    logger.info(f"Instrumentation disabled.")
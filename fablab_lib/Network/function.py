@@ -0,0 +1,735 @@
+"""
+This file contains the link probes used to check the connection to the PLCs, the LinkMonitor class,
+which watches the links to several PLCs from a single thread, and the ConnectionSupervisor class,
+which reconnects a PLC wrapper in the background while its calls fail fast.
+
+The probes talk to the service the driver uses instead of pinging the host: a TCP connect to the
+PLC port (Mitsubishi SLMP 5007, Siemens S7 102, Rockwell EtherNet/IP 44818, OPC UA 4840), or a FINS
+internode echo over UDP for the Omron PLCs. No process is spawned, so a check costs one socket.
+
+A refused TCP connection counts as a link down: the host answered, but the service the driver needs
+is closed. The FINS echo is sent from the local port the driver binds (9600 by default), as some PLCs
+only answer to this port.
+
+Example:
+    >>> monitor = LinkMonitor()
+    >>> monitor.add_host('192.168.0.1', 4840)
+    >>> monitor.add_host('192.168.250.1', 9600, protocol='fins', dest_node=1, srce_node=25, bind_port=9600)
+    >>> monitor.on_change = lambda host, port, is_up: print(host, is_up)
+    >>> monitor.start()
+    >>> monitor.wait_until_up('192.168.0.1', 4840)
+"""
+
+import errno
+import logging
+import os
+import random
+import selectors
+import socket
+import threading
+import time
+
+# Application logger
+logger = logging.getLogger("LinkMonitor")
+logger.setLevel(logging.DEBUG)
+_log_handle = logging.StreamHandler()
+_log_handle.setFormatter(logging.Formatter('%(asctime)s %(name)s %(levelname)s | %(message)s'))
+logger.addHandler(_log_handle)
+
+# Default service port of each PLC family
+PORT_MITSUBISHI = 5007
+PORT_S7 = 102
+PORT_ETHERNET_IP = 44818
+PORT_OPCUA = 4840
+PORT_FINS = 9600
+
+PROBE_TIMEOUT = 1.0             # seconds to wait for the answer of a probe
+UP_INTERVAL = 2.0               # seconds between two probes of a link that is up
+DOWN_INTERVAL_MIN = 1.0         # first retry delay of a link that is down
+DOWN_INTERVAL_MAX = 30.0        # maximum retry delay of a link that is down
+
+_FINS_ECHO = b'\x08\x01'        # FINS internode echo test command (MRC 08, SRC 01)
+
+
+def build_fins_echo(dest_node: int, srce_node: int, sid: int) -> bytes:
+    """
+    Builds a FINS internode echo test frame.
+
+    Args:
+        dest_node (int): The FINS node address of the PLC.
+        srce_node (int): The FINS node address of this device.
+        sid (int): The service ID, echoed back by the PLC.
+
+    Returns:
+        bytes: The FINS frame.
+    """
+    header = bytes([0x80, 0x00, 0x02, 0x00, dest_node & 0xFF, 0x00, 0x00, srce_node & 0xFF, 0x00, sid & 0xFF])
+    return header + _FINS_ECHO + b'FABLAB'
+
+
+def is_fins_echo_reply(data: bytes, sid: int) -> bool:
+    """
+    Checks that data is the answer to the echo frame with the service ID sid.
+    """
+    return len(data) >= 14 and data[9] == (sid & 0xFF) and data[10:12] == _FINS_ECHO
+
+
+def _fins_socket(bind_port: int) -> socket.socket:
+    """
+    Returns a UDP socket bound to bind_port, or to an ephemeral port if bind_port is used (e.g. by the
+    driver of another PLC).
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    if bind_port:
+        try:
+            sock.bind(('', bind_port))
+        except OSError as e:
+            logger.debug(f'FINS probe sent from an ephemeral port, port {bind_port} is used: {e}')
+    return sock
+
+
+def probe_tcp(host: str, port: int, timeout: float = PROBE_TIMEOUT) -> bool:
+    """
+    Checks that the service of a PLC accepts TCP connections.
+
+    Args:
+        host (str): The IP address of the PLC.
+        port (int): The TCP port of the service.
+        timeout (float, optional): The connect timeout in seconds. Defaults to PROBE_TIMEOUT.
+
+    Returns:
+        bool: True if the PLC accepted the connection, False if it refused it, timed out or is unreachable.
+    """
+    try:
+        with socket.create_connection((host, port), timeout=timeout):
+            return True
+    except OSError:
+        return False
+
+
+def probe_fins_udp(host: str, port: int = PORT_FINS, dest_node: int = 0, srce_node: int = 0,
+                   timeout: float = PROBE_TIMEOUT, bind_port: int = 0) -> bool:
+    """
+    Checks that an Omron PLC answers a FINS internode echo test over UDP.
+
+    The probe is sent from bind_port, the port the driver binds: a PLC that only answers to port 9600
+    or to the port of its FINS node table passes the probe as it accepts the driver. If bind_port is
+    used, or 0, the probe is sent from an ephemeral port.
+
+    Args:
+        host (str): The IP address of the PLC.
+        port (int, optional): The FINS UDP port. Defaults to PORT_FINS.
+        dest_node (int, optional): The FINS node address of the PLC. Defaults to 0.
+        srce_node (int, optional): The FINS node address of this device. Defaults to 0.
+        timeout (float, optional): The time to wait for the answer in seconds. Defaults to PROBE_TIMEOUT.
+        bind_port (int, optional): The local UDP port of the probe. Defaults to 0 (an ephemeral port).
+
+    Returns:
+        bool: True if the PLC answered, False otherwise.
+    """
+    sid = os.getpid() & 0xFF
+    try:
+        with _fins_socket(bind_port) as sock:
+            sock.settimeout(timeout)
+            sock.sendto(build_fins_echo(dest_node, srce_node, sid), (host, port))
+            deadline = time.monotonic() + timeout
+            while True:
+                data, _ = sock.recvfrom(2048)
+                if is_fins_echo_reply(data, sid):
+                    return True
+                if time.monotonic() > deadline:
+                    return False
+    except OSError:
+        return False
+
+
+class _Link:
+    """
+    The state of the link to one PLC service.
+    """
+
+    def __init__(self, host: str, port: int, protocol: str, dest_node: int, srce_node: int, bind_port: int):
+        self.host = host
+        self.port = port
+        self.protocol = protocol
+        self.dest_node = dest_node
+        self.srce_node = srce_node
+        self.bind_port = bind_port
+
+        self.is_up = None               # unknown until the first probe
+        self.up = threading.Event()
+        self.down = threading.Event()
+        self.next_probe = 0.0
+        self.delay = DOWN_INTERVAL_MIN
+        self.failures = 0
+
+        self.sock = None                # socket of the probe in progress
+        self.deadline = 0.0
+        self.sid = 0
+
+
+class LinkMonitor:
+    """
+    Monitors the links to several PLCs from a single thread.
+
+    All the probes are non-blocking sockets multiplexed with a selector, so one slow or dead PLC
+    doesn't delay the others. A link that is up is probed every upInterval seconds, a link that is
+    down is retried with an exponential backoff from DOWN_INTERVAL_MIN to maxDownInterval seconds.
+
+    The state of each link is exposed as events: is_up(), wait_until_up(), wait_until_down(),
+    and the on_change callback.
+
+    Args:
+        upInterval (float, optional): Seconds between two probes of a link that is up. Defaults to UP_INTERVAL.
+        maxDownInterval (float, optional): Maximum retry delay of a link that is down. Defaults to DOWN_INTERVAL_MAX.
+        timeout (float, optional): Seconds to wait for the answer of a probe. Defaults to PROBE_TIMEOUT.
+        failuresToDown (int, optional): Number of failed probes in a row before a link that was up is
+        reported down. Defaults to 1.
+
+    Attributes:
+        on_change (callable): Called as on_change(host, port, is_up) from the monitor thread when the
+        state of a link changes.
+    """
+
+    def __init__(self, upInterval: float = UP_INTERVAL, maxDownInterval: float = DOWN_INTERVAL_MAX,
+                 timeout: float = PROBE_TIMEOUT, failuresToDown: int = 1):
+        self.upInterval = upInterval
+        self.maxDownInterval = maxDownInterval
+        self.timeout = timeout
+        self.failuresToDown = failuresToDown
+
+        self.on_change = None
+
+        self._links = {}                # (host, port) -> _Link
+        self._removed = []              # links removed while a probe was in progress
+        self._selector = selectors.DefaultSelector()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self._wakeup_r, self._wakeup_w = socket.socketpair()
+        self._wakeup_r.setblocking(False)
+        self._selector.register(self._wakeup_r, selectors.EVENT_READ, None)
+        self._sid = 0
+
+
+    def add_host(self, host: str, port: int, protocol: str = 'tcp', dest_node: int = 0, srce_node: int = 0,
+                 bind_port: int = 0) -> None:
+        """
+        Adds a PLC service to monitor.
+
+        Args:
+            host (str): The IP address of the PLC.
+            port (int): The port of the service.
+            protocol (str, optional): 'tcp' for a TCP connect probe, 'fins' for a FINS/UDP echo. Defaults to 'tcp'.
+            dest_node (int, optional): The FINS node address of the PLC. Defaults to 0.
+            srce_node (int, optional): The FINS node address of this device. Defaults to 0.
+            bind_port (int, optional): The local UDP port of the FINS echo. Defaults to 0 (an ephemeral port).
+        """
+        if protocol not in ('tcp', 'fins'):
+            raise ValueError(f'Unknown probe protocol: {protocol}')
+        with self._lock:
+            if (host, port) not in self._links:
+                self._links[(host, port)] = _Link(host, port, protocol, dest_node, srce_node, bind_port)
+        self._wakeup()
+
+
+    def remove_host(self, host: str, port: int) -> None:
+        """
+        Stops monitoring a PLC service.
+        """
+        with self._lock:
+            link = self._links.pop((host, port), None)
+            if link is not None:
+                self._removed.append(link)
+        self._wakeup()
+
+
+    def _get_link(self, host: str, port: int) -> _Link:
+        link = self._links.get((host, port))
+        if link is None:
+            raise KeyError(f'{host}:{port} is not monitored')
+        return link
+
+
+    def is_up(self, host: str, port: int) -> bool:
+        """
+        Returns the last known state of a link, False until the first probe.
+        """
+        return self._get_link(host, port).up.is_set()
+
+
+    def wait_until_up(self, host: str, port: int, timeout: float = None) -> bool:
+        """
+        Waits until a link is up.
+
+        Args:
+            timeout (float, optional): The maximum time to wait in seconds. Defaults to None (no limit).
+
+        Returns:
+            bool: True if the link is up, False on timeout.
+        """
+        return self._get_link(host, port).up.wait(timeout)
+
+
+    def wait_until_down(self, host: str, port: int, timeout: float = None) -> bool:
+        """
+        Waits until a link is down.
+
+        Args:
+            timeout (float, optional): The maximum time to wait in seconds. Defaults to None (no limit).
+
+        Returns:
+            bool: True if the link is down, False on timeout.
+        """
+        return self._get_link(host, port).down.wait(timeout)
+
+
+    def _wakeup(self) -> None:
+        try:
+            self._wakeup_w.send(b'\x00')
+        except OSError:
+            pass
+
+
+    def _start_probe(self, link: _Link, now: float) -> None:
+        """
+        Starts a non-blocking probe of a link.
+        """
+        try:
+            if link.protocol == 'tcp':
+                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                sock.setblocking(False)
+                err = sock.connect_ex((link.host, link.port))
+                if err not in (errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY):
+                    sock.close()
+                    self._set_state(link, err == 0, now)
+                    return
+                self._selector.register(sock, selectors.EVENT_WRITE, link)
+            else:
+                sock = _fins_socket(link.bind_port)
+                sock.setblocking(False)
+                self._sid = (self._sid + 1) & 0xFF
+                link.sid = self._sid
+                sock.sendto(build_fins_echo(link.dest_node, link.srce_node, link.sid), (link.host, link.port))
+                self._selector.register(sock, selectors.EVENT_READ, link)
+        except OSError:
+            self._set_state(link, False, now)
+            return
+        link.sock = sock
+        link.deadline = now + self.timeout
+
+
+    def _close_probe(self, link: _Link) -> None:
+        try:
+            self._selector.unregister(link.sock)
+        except (KeyError, ValueError):
+            pass
+        link.sock.close()
+        link.sock = None
+
+
+    def _finish_probe(self, link: _Link, now: float) -> None:
+        """
+        Reads the result of a probe whose socket is ready.
+        """
+        if link.protocol == 'tcp':
+            is_up = link.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) == 0
+        else:
+            try:
+                data = link.sock.recv(2048)
+            except OSError:
+                data = b''
+            if data and not is_fins_echo_reply(data, link.sid):
+                return              # stale answer, keep waiting for ours
+            is_up = bool(data)
+        self._close_probe(link)
+        self._set_state(link, is_up, now)
+
+
+    def _set_state(self, link: _Link, is_up: bool, now: float) -> None:
+        """
+        Records the result of a probe, schedules the next one and reports the changes of state.
+        """
+        if is_up:
+            link.failures = 0
+            link.delay = DOWN_INTERVAL_MIN
+            link.next_probe = now + self.upInterval
+        else:
+            link.failures += 1
+            if link.is_up and link.failures < self.failuresToDown:
+                link.next_probe = now + DOWN_INTERVAL_MIN
+                return
+            link.next_probe = now + link.delay
+            link.delay = min(link.delay * 2, self.maxDownInterval)
+
+        if is_up == link.is_up:
+            return
+        link.is_up = is_up
+        if is_up:
+            link.down.clear()
+            link.up.set()
+            logger.info(f'Link to {link.host}:{link.port} is up.')
+        else:
+            link.up.clear()
+            link.down.set()
+            logger.warning(f'Link to {link.host}:{link.port} is down.')
+        if self.on_change is not None:
+            try:
+                self.on_change(link.host, link.port, is_up)
+            except Exception as e:
+                logger.error(f'Error in on_change callback: {e}')
+
+
+    def run(self) -> None:
+        """
+        Runs the monitor until stop() is called.
+        """
+        while not self._stop.is_set():
+            now = time.monotonic()
+            with self._lock:
+                links = list(self._links.values())
+                removed, self._removed = self._removed, []
+            for link in removed:
+                if link.sock is not None:
+                    self._close_probe(link)
+
+            timeout = self.upInterval
+            for link in links:
+                if link.sock is None:
+                    if now >= link.next_probe:
+                        self._start_probe(link, now)
+                    else:
+                        timeout = min(timeout, link.next_probe - now)
+                if link.sock is not None:
+                    if now >= link.deadline:
+                        self._close_probe(link)
+                        self._set_state(link, False, now)
+                    else:
+                        timeout = min(timeout, link.deadline - now)
+
+            for key, _ in self._selector.select(max(timeout, 0)):
+                if key.data is None:
+                    try:
+                        self._wakeup_r.recv(512)
+                    except OSError:
+                        pass
+                elif key.data.sock is not None:
+                    self._finish_probe(key.data, time.monotonic())
+
+        for link in list(self._links.values()):
+            if link.sock is not None:
+                self._close_probe(link)
+
+
+    def start(self) -> None:
+        """
+        Starts the monitor in a background thread.
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, name='LinkMonitor', daemon=True)
+        self._thread.start()
+
+
+    def stop(self, timeout: float = None) -> None:
+        """
+        Stops the monitor thread.
+        """
+        self._stop.set()
+        self._wakeup()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+
+CIRCUIT_CLOSED = 'closed'       # the link works, the calls go through
+CIRCUIT_OPEN = 'open'           # the link is down, the calls fail fast while the supervisor reconnects
+CIRCUIT_HALF_OPEN = 'half_open' # a reconnection attempt is in progress
+
+FAILURE_THRESHOLD = 3           # failed calls in a row before the circuit opens
+BACKOFF_JITTER = 0.5            # fraction of the retry delay that is randomized
+
+# Results of the block reads and writes of the PLC wrappers meaning the PLC didn't answer: the drivers log
+# the errors and return None values or False statuses instead of raising
+FAILED_RESULTS = {
+    'read_tags': lambda result: len(result) > 0 and all(value is None for _, value in result),
+    'write_tags': lambda result: len(result) > 0 and not any(result),
+}
+
+
+class PLCUnavailable(ConnectionError):
+    """
+    Raised by ConnectionSupervisor.call() while the connection to the PLC is being recovered.
+    """
+
+
+class _SupervisedDriver:
+    """
+    Proxy of a PLC wrapper whose methods are called through ConnectionSupervisor.call().
+    """
+
+    def __init__(self, supervisor):
+        self._supervisor = supervisor
+
+
+    def __getattr__(self, name):
+        attr = getattr(self._supervisor.plc, name)
+        if not callable(attr):
+            return attr
+        supervisor = self._supervisor
+
+        def call(*args, **kwargs):
+            return supervisor.call(attr, *args, **kwargs)
+        return call
+
+
+class ConnectionSupervisor:
+    """
+    Supervises the connection of a PLC wrapper with a circuit breaker.
+
+    The calls go through call() (or the driver proxy). A call fails when it raises, or when a block read or
+    write returns no value at all (FAILED_RESULTS, the wrappers don't raise from read_tags/write_tags). After
+    failureThreshold failed calls in a row, or after trip(), the circuit opens: the calls raise PLCUnavailable immediately instead of waiting
+    for the PLC timeouts, and a background thread reconnects with a jittered exponential backoff from
+    minDelay to maxDelay seconds (disconnect, connect, check). When the check succeeds, the recovery
+    hooks restore what the connection lost (subscriptions, monitored hosts, tag caches) and the circuit
+    closes again. The tasks using the driver only see PLCUnavailable in the meantime, they don't have to
+    be stopped and restarted.
+
+    Args:
+        plc: The PLC wrapper, e.g. a fablab_lib.PLC.Mitsubishi.mcprotocol.Ethernet.function.PLC.
+        connect (callable, optional): Opens the connection. Defaults to plc.connect.
+        disconnect (callable, optional): Closes the connection. Defaults to plc.disconnect.
+        check (callable, optional): Called as check(plc) after connect, must raise or return a false value
+        if the PLC doesn't answer (e.g. read a bit always on). Defaults to None (no check).
+        minDelay (float, optional): First retry delay in seconds. Defaults to DOWN_INTERVAL_MIN.
+        maxDelay (float, optional): Maximum retry delay in seconds. Defaults to DOWN_INTERVAL_MAX.
+        failureThreshold (int, optional): Failed calls in a row before the circuit opens. Defaults to FAILURE_THRESHOLD.
+        jitter (float, optional): Fraction of the retry delay that is randomized, so several gateways don't
+        reconnect to a PLC at the same time. Defaults to BACKOFF_JITTER.
+
+    Attributes:
+        state (str): CIRCUIT_CLOSED, CIRCUIT_OPEN or CIRCUIT_HALF_OPEN.
+        driver: Proxy of plc whose methods are called through call(), e.g. for ScanEngine(supervisor.driver).
+        on_state_change (callable): Called as on_state_change(old_state, new_state) when the state changes.
+        failedResults (dict): {function name: predicate} the results counted as failures, FAILED_RESULTS by default.
+
+    Examples:
+        >>> plc = PLC(host='192.168.3.39', port=5007)
+        >>> supervisor = ConnectionSupervisor(plc, check=lambda plc: plc.readData('SM400', DT.BIT)[1])
+        >>> supervisor.add_recovery_hook(lambda plc: logger.info('PLC back online'))
+        >>> supervisor.start()
+        >>> engine = ScanEngine(supervisor.driver)
+    """
+
+    def __init__(self, plc, connect=None, disconnect=None, check=None,
+                 minDelay: float = DOWN_INTERVAL_MIN, maxDelay: float = DOWN_INTERVAL_MAX,
+                 failureThreshold: int = FAILURE_THRESHOLD, jitter: float = BACKOFF_JITTER):
+        self.plc = plc
+        self._connect = connect if connect is not None else plc.connect
+        self._disconnect = disconnect if disconnect is not None else getattr(plc, 'disconnect', None)
+        self._check = check
+        self.minDelay = minDelay
+        self.maxDelay = maxDelay
+        self.failureThreshold = failureThreshold
+        self.jitter = jitter
+
+        self.state = CIRCUIT_CLOSED
+        self.failures = 0
+        self.on_state_change = None
+        self.driver = _SupervisedDriver(self)
+
+        self.failedResults = dict(FAILED_RESULTS)
+        self._hooks = []
+        self._lock = threading.Lock()
+        self._recover = threading.Event()
+        self._closed = threading.Event()
+        self._closed.set()
+        self._stop = threading.Event()
+        self._thread = None
+        self._stats = {'calls': 0, 'failures': 0, 'rejected': 0, 'trips': 0, 'recoveries': 0, 'attempts': 0}
+
+
+    def add_recovery_hook(self, func) -> None:
+        """
+        Adds a function called as func(plc) after each reconnection, before the circuit closes.
+        A hook that raises makes the reconnection attempt fail.
+        """
+        self._hooks.append(func)
+
+
+    def _set_state(self, state: str) -> None:
+        old_state, self.state = self.state, state
+        if state == CIRCUIT_CLOSED:
+            self._closed.set()
+        else:
+            self._closed.clear()
+        if old_state != state and self.on_state_change is not None:
+            try:
+                self.on_state_change(old_state, state)
+            except Exception as e:
+                logger.error(f"Error in on_state_change: {e}")
+
+
+    def call(self, func, *args, **kwargs):
+        """
+        Calls a function of the PLC wrapper through the circuit breaker.
+
+        Returns:
+            The result of func(*args, **kwargs). A result of failedResults is returned too, but counted as
+            a failure of the connection.
+
+        Raises:
+            PLCUnavailable: If the circuit is open.
+            Exception: The exception of func, which is counted as a failure of the connection.
+        """
+        # The counters are shared by the threads of the driver and the recovery thread, they change under the lock
+        if self.state != CIRCUIT_CLOSED:
+            with self._lock:
+                self._stats['rejected'] += 1
+            raise PLCUnavailable(f"PLC unavailable ({self.state}), reconnecting...")
+
+        with self._lock:
+            self._stats['calls'] += 1
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            self._failure(e)
+            raise
+
+        failed = self.failedResults.get(getattr(func, '__name__', None))
+        if failed is not None and failed(result):
+            self._failure(f"{func.__name__} failed for all the variables")
+        elif self.failures:
+            with self._lock:
+                self.failures = 0
+        return result
+
+
+    def _failure(self, reason) -> None:
+        """
+        Counts a failed call, opens the circuit after failureThreshold failures in a row.
+        """
+        with self._lock:
+            self._stats['failures'] += 1
+            self.failures += 1
+            trip = self.failures >= self.failureThreshold and self.state == CIRCUIT_CLOSED
+        if trip:
+            self.trip(reason)
+
+
+    def trip(self, reason=None) -> None:
+        """
+        Opens the circuit and starts the recovery, e.g. when a LinkMonitor reports the link down.
+        """
+        with self._lock:
+            if self.state != CIRCUIT_CLOSED:
+                return
+            self._stats['trips'] += 1
+            self._set_state(CIRCUIT_OPEN)
+        logger.warning(f"Connection to PLC lost ({reason}), circuit open.")
+        self._recover.set()
+
+
+    def is_available(self) -> bool:
+        """
+        Returns True if the circuit is closed.
+        """
+        return self.state == CIRCUIT_CLOSED
+
+
+    def wait_until_available(self, timeout: float = None) -> bool:
+        """
+        Waits until the circuit is closed.
+
+        Returns:
+            bool: True if the PLC is available, False on timeout.
+        """
+        return self._closed.wait(timeout)
+
+
+    def stats(self) -> dict:
+        """
+        Returns the counters of the supervisor: calls, failures, rejected calls, trips, recoveries and
+        reconnection attempts.
+        """
+        with self._lock:
+            return dict(self._stats, state=self.state)
+
+
+    def _delay(self, attempt: int) -> float:
+        """
+        Jittered exponential backoff: the delay doubles from minDelay up to maxDelay, and a random
+        fraction (up to jitter) of it is removed.
+        """
+        delay = min(self.minDelay * (2 ** min(attempt, 32)), self.maxDelay)
+        return delay * (1 - self.jitter * random.random())
+
+
+    def _reconnect(self) -> bool:
+        """
+        One reconnection attempt, returns True if the PLC answers again.
+        """
+        with self._lock:
+            self._stats['attempts'] += 1
+        if self._disconnect is not None:
+            try:
+                self._disconnect()
+            except Exception as e:
+                logger.debug(f"Error disconnecting from PLC: {e}")
+        try:
+            self._connect()
+            if self._check is not None and not self._check(self.plc):
+                raise ConnectionError("check failed")
+            for hook in self._hooks:
+                hook(self.plc)
+        except Exception as e:
+            logger.error(f"Error reconnecting to PLC: {e}")
+            return False
+        return True
+
+
+    def run(self) -> None:
+        """
+        Recovery loop of the supervisor, use start() to run it in a background thread.
+        """
+        while not self._stop.is_set():
+            self._recover.wait()
+            self._recover.clear()
+            attempt = 0
+            while not self._stop.is_set():
+                if self._stop.wait(self._delay(attempt)):
+                    return
+                self._set_state(CIRCUIT_HALF_OPEN)
+                if self._reconnect():
+                    with self._lock:
+                        self.failures = 0
+                        self._stats['recoveries'] += 1
+                        self._set_state(CIRCUIT_CLOSED)
+                    logger.info(f"Reconnected to PLC after {attempt + 1} attempts, circuit closed.")
+                    break
+                self._set_state(CIRCUIT_OPEN)
+                attempt += 1
+
+
+    def start(self) -> None:
+        """
+        Starts the recovery loop in a background thread.
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, name='ConnectionSupervisor', daemon=True)
+        self._thread.start()
+
+
+    def stop(self, timeout: float = None) -> None:
+        """
+        Stops the recovery thread.
+        """
+        self._stop.set()
+        self._recover.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
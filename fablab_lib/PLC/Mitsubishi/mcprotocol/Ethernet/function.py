@@ -7,14 +7,21 @@ Information: This library supports Mitsubishi PLCs with Type 3E frame
 or Type 4E frame (FX5U, FX5UC, iQ-R, iQ-F, Q Series)
 Another Protocol Name: SLMP (Seamless Message Protocol)
 """
-import subprocess
 import logging
 import time
 import threading
 from .pymelsec import Type3E, Type4E
-from .pymelsec.constants import DT
+from .pymelsec.constants import DT, DeviceConstants
+from .pymelsec.utility import get_device_index, get_device_type
+from fablab_lib.Logic.function import LogicExpr
+from fablab_lib.Network.function import probe_tcp, PORT_MITSUBISHI, DOWN_INTERVAL_MIN, DOWN_INTERVAL_MAX
 
-lock = threading.Lock()
+
+# Devices that can be grouped into a single batch read (see PLC.read_tags)
+_WORD_DEVICES = ('D', 'W', 'R', 'ZR', 'SD', 'SW', 'TN', 'CN', 'SN')
+_BIT_DEVICES = ('X', 'Y', 'M', 'L', 'F', 'V', 'B', 'SM', 'SB', 'TS', 'TC', 'CS', 'CC', 'SS', 'SC', 'DX', 'DY')
+_MAX_BATCH_WORDS = 960
+_MAX_BATCH_BITS = 7168
 
 # Application logger
 logger = logging.getLogger("PLC_Mitsubishi")
@@ -24,55 +31,42 @@ _log_handle.setFormatter(logging.Formatter('%(asctime)s %(name)s %(levelname)s |
 logger.addHandler(_log_handle)
 
 
-def is_ethernet_connected(host: str, is_pc: bool = False) -> bool:
+def is_ethernet_connected(host: str, is_pc: bool = False, port: int = PORT_MITSUBISHI) -> bool:
     """
-    Checks if the Ethernet connection to the specified IP address is active.
+    Checks if the PLC at the specified IP address answers on its service port (TCP connect probe).
 
     Args:
-        host (str): The IP address to ping.
-        is_pc (bool, optional): Specifies whether the IP address belongs to a Laptop. Defaults to False for Raspberry Pi connection.
+        host (str): The IP address of the PLC.
+        is_pc (bool, optional): Not used anymore, the check doesn't depend on the OS. Defaults to False.
+        port (int, optional): The TCP port of the PLC. Defaults to PORT_MITSUBISHI (5007).
 
     Returns:
         bool: True if the Ethernet connection is active, False otherwise.
     """
-    try:
-        if is_pc:
-            ping_command = ["ping", "-n", "1", host]
-        else:
-            ping_command = ["ping", "-c", "1", host]
-        ping_process = subprocess.Popen(ping_command, 
-                                        stdout=subprocess.PIPE, 
-                                        stderr=subprocess.PIPE
-                                        )
-
-        return_code = ping_process.wait()
-        if return_code == 0:
-            logger.info(f"Ethernet connection to {host} is active.")
-            return True
-        else:
-            logger.info(f"Ethernet connection to {host} is not active.")  
-            return False
-        
-    except subprocess.CalledProcessError as e:
-        # Handle subprocess errors if needed
-        logger.error(f"Error running ping command: {e}")
-        return False
+    if probe_tcp(host, port):
+        logger.info(f"Ethernet connection to {host} is active.")
+        return True
+    logger.info(f"Ethernet connection to {host} is not active.")
+    return False
 
 
-def waiting_for_connection(host: str, is_pc: bool = False): 
+def waiting_for_connection(host: str, is_pc: bool = False, port: int = PORT_MITSUBISHI): 
     """
     Waits for the Ethernet connection to be active in the first time.
+    The checks are retried with an exponential backoff, from 1 s up to 30 s.
 
     Args:
-        host (str): The IP address to ping.
-        is_pc (bool, optional): Specifies whether the IP address belongs to a Laptop. Defaults to False for Raspberry Pi connection.
+        host (str): The IP address of the PLC.
+        is_pc (bool, optional): Not used anymore, the check doesn't depend on the OS. Defaults to False.
+        port (int, optional): The TCP port of the PLC. Defaults to PORT_MITSUBISHI.
 
     Returns:
         None
     """
-    while True:
-        if is_ethernet_connected(host, is_pc):
-            return
+    delay = DOWN_INTERVAL_MIN
+    while not is_ethernet_connected(host, is_pc, port):
+        time.sleep(delay)
+        delay = min(delay * 2, DOWN_INTERVAL_MAX)
 
 
 def get_variables_from_equation(equation):
@@ -99,9 +93,13 @@ def convert_logic_equation(bits, equation, _DEBUG: bool = False):
     Args:
         bits (list): A list of bits representing the values of variables in the equation.
         equation (str): The logic equation to be evaluated.
+        _DEBUG (bool, optional): Specifies whether to log the result. Defaults to False.
         Note: The equation must be in the form of a Python logic equation. ".", "|", "/" are the logical operators 
             for "and", "or", "not" respectively. The variable names must be in lower case.
 
+    Note: The equation is compiled once by LogicExpr.compile() and cached by string,
+    the next calls with the same equation only evaluate it.
+
     Returns:
         bool: The boolean result of the evaluated logic equation.
 
@@ -109,26 +107,68 @@ def convert_logic_equation(bits, equation, _DEBUG: bool = False):
         >>> convert_logic_equation([True, False, True, True, False], '/a|(b.c)|d')
         True
     """
-    lsVariables = get_variables_from_equation(equation)
-    # Replace variable names with corresponding bits
-    for chr_ in lsVariables:
-        if chr_.isalpha() and chr_.lower() in 'abcdefghijklmnopqrstuvwxyz':
-            equation = equation.replace(chr_, str(int(bits[ord(chr_) - 97])))
-
-    # Replace the logical operators with Python syntax
-    equation = equation.replace('.', ' and ')
-    equation = equation.replace('|', ' or ')
-    equation = equation.replace('/', ' not ')
-    # Remove all extra spaces from the equation
-    equation = ' '.join(equation.split())
-
-    # Evaluate the expression using eval
-    result = bool(eval(equation))
+    result = LogicExpr.compile(equation)(bits)
     if _DEBUG:
         logger.info(f"Logic equation: {equation} = {result}")
     return result
 
 
+def _plan_batch_reads(ls_varAddr: list, plc_type: str, maxGap: int) -> list:
+    """
+    Groups variables into batch read blocks.
+
+    Only devices addressed by words (D, W, R, ...) with word data types and devices addressed
+    by bits (M, X, Y, ...) with the BIT data type are grouped, other variables get a block of
+    their own.
+
+    Args:
+        ls_varAddr (list): A list of tuples (variable address, variable type).
+        plc_type (str): The PLC type, used to get the numbering base of each device.
+        maxGap (int): The maximum number of unused points between two variables of a block.
+
+    Returns:
+        list: A list of blocks (start address, variable type, number of points, members),
+        members is a list of (position in ls_varAddr, point in the block).
+    """
+    points = {}         # (device, varType, base) -> [(index, position)]
+    blocks = []
+    for i, (varAddr, varType) in enumerate(ls_varAddr):
+        try:
+            device = get_device_type(varAddr)
+            _, base = DeviceConstants.get_binary_device_code(plc_type, device)
+            index = int(get_device_index(varAddr), base)
+            is_bit = DT.get_struct_dt(varType) == DT.BIT
+        except Exception:
+            blocks.append((varAddr, varType, 1, [(i, 0)]))
+            continue
+
+        if (is_bit and device in _BIT_DEVICES) or (not is_bit and device in _WORD_DEVICES):
+            points.setdefault((device, varType, base), []).append((index, i))
+        else:
+            blocks.append((varAddr, varType, 1, [(i, 0)]))
+
+    for (device, varType, base), members in points.items():
+        # Each point of a word data type covers dt_size // 2 words of the device
+        step = 1 if DT.get_struct_dt(varType) == DT.BIT else DT.get_dt_size(varType) // 2
+        limit = _MAX_BATCH_BITS if step == 1 and device in _BIT_DEVICES else _MAX_BATCH_WORDS // step
+        members.sort()
+
+        start = None
+        for index, i in members:
+            if start is not None and (index - start) % step == 0 \
+                    and (index - start) // step < limit \
+                    and (index - last) // step <= maxGap + 1:
+                block[3].append((i, (index - start) // step))
+                block[2] = (index - start) // step + 1
+            else:
+                start = index
+                block = [device + (format(index, 'X') if base == 16 else str(index)), varType, 1, [(i, 0)]]
+                blocks.append(block)
+            last = index
+
+    return [tuple(block) for block in blocks]
+
+
 class DictAsAttributes:
     """A class that converts a dictionary to attributes.
     
@@ -188,11 +228,13 @@ class PLC:
         self.comm_type = comm_type
         self.nameStation = nameStation
         self.is_pc = is_pc
+        # One lock per PLC: the calls of two threads never share its socket, the other PLCs are not waiting
+        self._lock = threading.Lock()
 
         if self.nameStation is not None:
             logger.name = f'PLC_Mitsubishi - {self.nameStation}'
 
-        waiting_for_connection(self.host, self.is_pc)
+        waiting_for_connection(self.host, self.is_pc, self.port)
 
 
     def connect(self) -> None:
@@ -219,7 +261,7 @@ class PLC:
             _varAddr (str): The address of the variable.
             _varValue (str): The value of the variable.
         """
-        with lock:
+        with self._lock:
             read_result = self.plc.batch_read(
                 ref_device=varAddr,
                 read_size=varSize, 
@@ -240,16 +282,16 @@ class PLC:
 
         Args:
             varAddr (str): The address of the variable.
-            varValue (any): The value of the variable.
+            varValue (any): The value of the variable, or a list of values written from varAddr on.
             varType (str): The type of the variable.
 
         Returns:
             None
         """
-        with lock:
+        with self._lock:
             self.plc.batch_write(
                 ref_device=varAddr,
-                write_value=varValue,
+                values=varValue if isinstance(varValue, list) else [varValue],
                 data_type=varType,
             )
         
@@ -269,7 +311,7 @@ class PLC:
         """
         varValue = []
         for varAddr in ls_varAddr:
-            with lock:
+            with self._lock:
                 # time.sleep(0.01)
                 read_result = self.plc.batch_read(
                     ref_device=varAddr,
@@ -283,6 +325,67 @@ class PLC:
         return varValue
 
 
+    def read_tags(self, ls_varAddr: list, maxGap: int = 8, _DEBUG: bool = False) -> list:
+        """
+        Reads multiple variables from the PLC Mitsubishi in as few requests as possible.
+
+        Variables of the same device and data type whose addresses are contiguous, or separated
+        by at most maxGap points, are read with a single batch read (e.g. 'D100', 'D101', 'D105'
+        are read as one block of 6 words). Variables that can't be grouped are read one by one.
+
+        Args:
+            ls_varAddr (list): A list of tuples (variable address, variable type).
+            maxGap (int, optional): The maximum number of unused points read between two variables
+            of the same block. Defaults to 8.
+            _DEBUG (bool, optional): Specifies whether to print debug messages. Defaults to False.
+
+        Returns:
+            list: A list of tuples (variable address, value), in the order of ls_varAddr.
+        """
+        varValue = [None] * len(ls_varAddr)
+
+        for startAddr, varType, varSize, members in _plan_batch_reads(ls_varAddr, self.plc_type, maxGap):
+            with self._lock:
+                read_result = self.plc.batch_read(
+                    ref_device=startAddr,
+                    read_size=varSize,
+                    data_type=varType,
+                )
+            for i, point in members:
+                varValue[i] = read_result[point].value
+
+        ls_result = [(varAddr, value) for (varAddr, _), value in zip(ls_varAddr, varValue)]
+
+        if _DEBUG:
+            logger.info(f"Read data from PLC: \n{ls_result}")
+        return ls_result
+
+
+    def write_tags(self, ls_varAddrValue: list, _DEBUG: bool = False) -> list:
+        """
+        Writes multiple variables to the PLC Mitsubishi.
+
+        Args:
+            ls_varAddrValue (list): A list of tuples (variable address, value, variable type).
+            _DEBUG (bool, optional): Specifies whether to print debug messages. Defaults to False.
+
+        Returns:
+            list: A list of booleans, True if the corresponding variable was written successfully.
+        """
+        ls_status = []
+        for varAddr, varValue, varType in ls_varAddrValue:
+            try:
+                self.writeData(varAddr, varValue, varType)
+                ls_status.append(True)
+            except Exception as e:
+                logger.error(f"Error writing data to PLC: {varAddr}, {e}")
+                ls_status.append(False)
+
+        if _DEBUG:
+            logger.info(f"Write data to PLC: \n{ls_varAddrValue} \n{ls_status}")
+        return ls_status
+
+
     def checkLogicBits(self, bits: list, equation: str, _DEBUG: bool = False) -> bool:
         """
         Checks the logic bits.
@@ -313,7 +416,6 @@ class PLC:
         count = 0
         case = 0
         while True:
-            print(case)
             if case == 1:
                 # connect
                 logger.info(f"Connecting to PLC...")
@@ -7,12 +7,12 @@ Protocol: FINS/TCP
 Connection: Ethernet
 Information: This library is used to communicate with Omron PLCs over Ethernet using the FINS/TCP protocol.
 """
-import subprocess
 import logging
 import time
 import threading
 import fablab_lib.PLC.Omron.fins.Ethernet.fins.udp as fins
-lock = threading.Lock() # Create a lock object
+from fablab_lib.Logic.function import LogicExpr
+from fablab_lib.Network.function import probe_fins_udp, PORT_FINS, DOWN_INTERVAL_MIN, DOWN_INTERVAL_MAX
 
 # Application logger
 logger = logging.getLogger("PLC_Omron")
@@ -21,6 +21,8 @@ _log_handle = logging.StreamHandler()
 _log_handle.setFormatter(logging.Formatter('%(asctime)s %(name)s %(levelname)s | %(message)s'))
 logger.addHandler(_log_handle)
 
+WAIT_TIMEOUT = 60.0     # maximum wait for the first FINS echo answer in the constructor
+
 
 class DT:
     """Data types for PLC memory areas."""
@@ -30,56 +32,58 @@ class DT:
     TIMER = b'\x81'
 
 
-def is_ethernet_connected(host: str, is_pc: bool = False) -> bool:
+def is_ethernet_connected(host: str, is_pc: bool = False, port: int = PORT_FINS, dest_node: int = 0, srce_node: int = 0,
+        bind_port: int = PORT_FINS) -> bool:
     """
-    Checks if the Ethernet connection to the specified IP address is active.
+    Checks if the PLC at the specified IP address answers a FINS echo test over UDP.
 
     Args:
-        host (str): The IP address to ping.
-        is_pc (bool, optional): Specifies whether the IP address belongs to a Laptop. Defaults to False for Raspberry Pi connection.
+        host (str): The IP address of the PLC.
+        is_pc (bool, optional): Not used anymore, the check doesn't depend on the OS. Defaults to False.
+        port (int, optional): The FINS UDP port of the PLC. Defaults to PORT_FINS (9600).
+        dest_node (int, optional): The FINS node address of the PLC. Defaults to 0.
+        srce_node (int, optional): The FINS node address of this device. Defaults to 0.
+        bind_port (int, optional): The local UDP port of the echo, the one of the driver. Defaults to PORT_FINS.
 
     Returns:
         bool: True if the Ethernet connection is active, False otherwise.
     """
-
-    try:
-        if is_pc:
-            ping_command = ["ping", "-n", "1", host]
-        else:
-            ping_command = ["ping", "-c", "1", host]
-        ping_process = subprocess.Popen(ping_command, 
-                                        stdout=subprocess.PIPE, 
-                                        stderr=subprocess.PIPE
-                                        )
-
-        return_code = ping_process.wait()
-        if return_code == 0:
-            logger.info(f"Ethernet connection to {host} is active.")
-            return True
-        else:
-            logger.info(f"Ethernet connection to {host} is not active.")  
-            return False
-        
-    except subprocess.CalledProcessError as e:
-        # Handle subprocess errors if needed
-        logger.error(f"Error running ping command: {e}")
-        return False
+    if probe_fins_udp(host, port, dest_node, srce_node, bind_port=bind_port):
+        logger.info(f"Ethernet connection to {host} is active.")
+        return True
+    logger.info(f"Ethernet connection to {host} is not active.")
+    return False
 
 
-def waiting_for_connection(host: str, is_pc: bool = False): 
+def waiting_for_connection(host: str, is_pc: bool = False, port: int = PORT_FINS, dest_node: int = 0, srce_node: int = 0,
+        bind_port: int = PORT_FINS, timeout: float = WAIT_TIMEOUT) -> bool:
     """
     Waits for the Ethernet connection to be active in the first time.
+    The checks are retried with an exponential backoff, from 1 s up to 30 s, for at most timeout seconds:
+    a PLC that doesn't answer the echo test (e.g. a FINS node table rejecting it) doesn't block the
+    constructor forever, the reads then report the errors.
 
     Args:
-        host (str): The IP address to ping.
-        is_pc (bool, optional): Specifies whether the IP address belongs to a Laptop. Defaults to False for Raspberry Pi connection.
+        host (str): The IP address of the PLC.
+        is_pc (bool, optional): Not used anymore, the check doesn't depend on the OS. Defaults to False.
+        port (int, optional): The FINS UDP port of the PLC. Defaults to PORT_FINS.
+        dest_node (int, optional): The FINS node address of the PLC. Defaults to 0.
+        srce_node (int, optional): The FINS node address of this device. Defaults to 0.
+        bind_port (int, optional): The local UDP port of the echo, the one of the driver. Defaults to PORT_FINS.
+        timeout (float, optional): The maximum wait in seconds, None for no limit. Defaults to WAIT_TIMEOUT.
 
     Returns:
-        None
+        bool: True if the PLC answered, False on timeout.
     """
-    while True:
-        if is_ethernet_connected(host, is_pc):
-            return
+    deadline = None if timeout is None else time.monotonic() + timeout
+    delay = DOWN_INTERVAL_MIN
+    while not is_ethernet_connected(host, is_pc, port, dest_node, srce_node, bind_port):
+        if deadline is not None and time.monotonic() + delay > deadline:
+            logger.warning(f"PLC {host} doesn't answer the FINS echo test, connecting anyway.")
+            return False
+        time.sleep(delay)
+        delay = min(delay * 2, DOWN_INTERVAL_MAX)
+    return True
 
 
 def get_variables_from_equation(equation):
@@ -99,16 +103,20 @@ def get_variables_from_equation(equation):
     return sorted_variables
 
 
-def convert_logic_equation(bits, equation):
+def convert_logic_equation(bits, equation, _DEBUG: bool = False):
     """
     Converts a logic equation into a boolean result based on the given bits.
 
     Args:
         bits (list): A list of bits representing the values of variables in the equation.
         equation (str): The logic equation to be evaluated.
+        _DEBUG (bool, optional): Specifies whether to log the result. Defaults to False.
         Note: The equation must be in the form of a Python logic equation. ".", "|", "/" are the logical operators 
             for "and", "or", "not" respectively. The variable names must be in lower case.
 
+    Note: The equation is compiled once by LogicExpr.compile() and cached by string,
+    the next calls with the same equation only evaluate it.
+
     Returns:
         bool: The boolean result of the evaluated logic equation.
 
@@ -116,25 +124,9 @@ def convert_logic_equation(bits, equation):
         >>> convert_logic_equation([True, False, True, True, False], '/a|(b.c)|d')
         True
     """
-    lsVariables = get_variables_from_equation(equation)
-    # print(lsVariables)
-
-    # Replace variable names with corresponding bits
-    for chr_ in lsVariables:
-        if chr_.isalpha() and chr_.lower() in 'abcdefghijklmnopqrstuvwxyz':
-            equation = equation.replace(chr_, str(int(bits[ord(chr_) - 97])))
-    # print(equation)
-
-    # Replace the logical operators with Python syntax
-    equation = equation.replace('.', ' and ')
-    equation = equation.replace('|', ' or ')
-    equation = equation.replace('/', ' not ')
-    # Remove all extra spaces from the equation
-    equation = ' '.join(equation.split())
-    # print(equation)
-
-    # Evaluate the expression using eval
-    result = bool(eval(equation))
+    result = LogicExpr.compile(equation)(bits)
+    if _DEBUG:
+        logger.info(f"Logic equation: {equation} = {result}")
     return result
 
 
@@ -171,11 +163,13 @@ class DictAsAttributes:
 class PLC:
     def __init__(self, 
             host: str, 
-            # port: int, 
             dest_node_add: int, 
             srce_node_add: int, 
             nameStation: str=None,
-            is_pc=False) -> None:
+            is_pc=False,
+            port: int = PORT_FINS,
+            bind_port: int = PORT_FINS,
+            wait_timeout: float = WAIT_TIMEOUT) -> None:
         """
         Initializes a PLC object.
 
@@ -185,18 +179,27 @@ class PLC:
             srce_node_add (int): The source node address.
             nameStation (str, optional): The name of the machine station. Defaults to None.
             is_pc (bool, optional): Specifies whether the IP address belongs to a Laptop. Defaults to False for Raspberry Pi connection.
+            port (int, optional): The FINS UDP port of the PLC. Defaults to PORT_FINS (9600).
+            bind_port (int, optional): The local UDP port the replies come back to. Defaults to PORT_FINS,
+                use 0 to let the OS pick one (e.g. several PLCs or a local simulator on the same host).
+            wait_timeout (float, optional): The maximum wait for the first FINS echo answer in seconds, None for
+                no limit. Defaults to WAIT_TIMEOUT.
         """
         self.host = host
-        # self.port = port
+        self.port = port
+        self.bind_port = bind_port
         self.dest_node_add = dest_node_add
         self.srce_node_add = srce_node_add
         self.nameStation = nameStation
         self.is_pc = is_pc
+        # One lock per PLC: the calls of two threads never share its socket, the other PLCs are not waiting
+        self._lock = threading.Lock()
 
         if self.nameStation is not None:
             logger.name = f'PLC_Omron - {self.nameStation}'
 
-        waiting_for_connection(self.host, self.is_pc)
+        waiting_for_connection(self.host, self.is_pc, self.port, dest_node=self.dest_node_add, srce_node=self.srce_node_add,
+                               bind_port=self.bind_port, timeout=wait_timeout)
 
 
     def connect(self) -> None:
@@ -204,7 +207,7 @@ class PLC:
         Connects to the PLC Omron.
         """
         self.plc = fins.UDPFinsConnection()
-        self.plc.connect(self.host)
+        self.plc.connect(self.host, self.port, self.bind_port)
         self.plc.dest_node_add = self.dest_node_add
         self.plc.srce_node_add = self.srce_node_add
 
@@ -244,19 +247,19 @@ class PLC:
         """
         # Check the variable type
         if varType.upper() == 'WORD':
-            with lock:
+            with self._lock:
                 mem_area = self.plc.memory_area_read(DT.WORD, varAddr)
             varValue = self.BCD_decode(mem_area[-2:],0)
         elif varType.upper() == 'COUNTER':
-            with lock:
+            with self._lock:
                 mem_area = self.plc.memory_area_read(DT.COUNTER, varAddr)
             varValue = self.BCD_decode(mem_area[-2:],0)
         elif varType.upper() == 'BOOL':
-            with lock:
+            with self._lock:
                 mem_area = self.plc.memory_area_read(DT.BIT, varAddr)
             varValue = self.BCD_decode(mem_area[-1:],0)
         elif varType.upper() == 'TIMER':
-            with lock:
+            with self._lock:
                 mem_area = self.plc.memory_area_read(DT.TIMER, varAddr)
             varValue = self.BCD_decode(mem_area[-2:],0)
         else:
@@ -296,7 +299,7 @@ class PLC:
             bit_address = 0
 
         try:
-            with lock:
+            with self._lock:
                 varValue = self.plc.read(memory_area=memory_area[area], word_address=word_address, bit_address=bit_address)
             varValue = varValue[0]
         except Exception as e:
@@ -324,16 +327,16 @@ class PLC:
         """
         # Check the variable type
         if varType.upper() == 'WORD':
-            with lock:
+            with self._lock:
                 self.plc.memory_area_write(DT.WORD, varAddr, varValue)
         elif varType.upper() == 'COUNTER':
-            with lock:
+            with self._lock:
                 self.plc.memory_area_read(DT.COUNTER, varAddr, varValue)
         elif varType.upper() == 'BOOL':
-            with lock:
+            with self._lock:
                 self.plc.memory_area_read(DT.BIT, varAddr, varValue, 1)
         elif varType.upper() == 'TIMER':
-            with lock:
+            with self._lock:
                 self.plc.memory_area_read(DT.TIMER, varAddr, varValue)
         else:
             logger.error(f"Error writing data to PLC: {varAddr}, {varValue}, {varType}")
@@ -371,7 +374,7 @@ class PLC:
             word_address = varAddr[1:]
             bit_address = 0
         try:
-            with lock:
+            with self._lock:
                 self.plc.write(value=varValue, memory_area=memory_area[area], word_address=word_address, bit_address=bit_address)
         except Exception as e:
             logger.error(f"Error writing data to PLC: {e}")
@@ -422,6 +425,60 @@ class PLC:
         return varValue
 
 
+    def read_tags(self, ls_varAddr: list, _DEBUG: bool = False) -> list:
+        """
+        Reads multiple variables from the PLC Omron.
+
+        Args:
+            ls_varAddr (list): A list of variable addresses read with readData_ver2 (e.g. 'D100', 'CIO-0-5'),
+            or tuples (variable address, variable type) read with readData_ver1.
+            _DEBUG (bool, optional): Specifies whether to print debug messages. Defaults to False.
+
+        Returns:
+            list: A list of tuples (variable address, value), in the order of ls_varAddr.
+            The value is None if the variable could not be read.
+        """
+        ls_result = []
+        for varAddr in ls_varAddr:
+            if isinstance(varAddr, tuple):
+                ls_result.append((varAddr[0], self.readData_ver1(*varAddr)[1]))
+            else:
+                ls_result.append((varAddr, self.readData_ver2(varAddr)[1]))
+
+        if _DEBUG:
+            logger.info(f"Read data from PLC: \n{ls_result}")
+        return ls_result
+
+
+    def write_tags(self, ls_varAddrValue: list, _DEBUG: bool = False) -> list:
+        """
+        Writes multiple variables to the PLC Omron.
+
+        Args:
+            ls_varAddrValue (list): A list of tuples (variable address, value) written with writeData_ver2,
+            or (variable address, value, variable type) written with writeData_ver1.
+            _DEBUG (bool, optional): Specifies whether to print debug messages. Defaults to False.
+
+        Returns:
+            list: A list of booleans, True if the corresponding variable was written successfully.
+        """
+        ls_status = []
+        for varAddrValue in ls_varAddrValue:
+            try:
+                if len(varAddrValue) > 2:
+                    self.writeData_ver1(*varAddrValue)
+                else:
+                    self.writeData_ver2(*varAddrValue)
+                ls_status.append(True)
+            except Exception as e:
+                logger.error(f"Error writing data to PLC: {varAddrValue[0]}, {e}")
+                ls_status.append(False)
+
+        if _DEBUG:
+            logger.info(f"Write data to PLC: \n{ls_varAddrValue} \n{ls_status}")
+        return ls_status
+
+
     def checkLogicBits(self, bits: list, equation: str) -> bool:
         """
         Checks the logic bits.
@@ -455,12 +512,11 @@ class PLC:
         count = 0
         case = 0
         while True:
-            print(case)
             if case == 1:
                 # connect
                 logger.info(f"Connecting to PLC...")
                 try:
-                    self.plc.connect(self.host)
+                    self.plc.connect(self.host, self.port, self.bind_port)
                     logger.info(f"Connected to PLC.")
                     case = 2
                 except Exception as e:
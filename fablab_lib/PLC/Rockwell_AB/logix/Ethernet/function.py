@@ -12,13 +12,13 @@ Functions:
 Library: pylogix
 Installation: pip install pylogix
 """
-import subprocess
 import logging
 import time
 import threading
 from . import pylogix
+from fablab_lib.Logic.function import LogicExpr
+from fablab_lib.Network.function import probe_tcp, PORT_ETHERNET_IP, DOWN_INTERVAL_MIN, DOWN_INTERVAL_MAX
 
-lock = threading.Lock()
 
 # Application logger
 logger = logging.getLogger("PLC_Rockwell_AB")
@@ -28,55 +28,42 @@ _log_handle.setFormatter(logging.Formatter('%(asctime)s %(name)s %(levelname)s |
 logger.addHandler(_log_handle)
 
 
-def is_ethernet_connected(host: str, is_pc: bool = False) -> bool:
+def is_ethernet_connected(host: str, is_pc: bool = False, port: int = PORT_ETHERNET_IP) -> bool:
     """
-    Checks if the Ethernet connection to the specified IP address is active.
+    Checks if the PLC at the specified IP address answers on its service port (TCP connect probe).
 
     Args:
-        host (str): The IP address to ping.
-        is_pc (bool, optional): Specifies whether the IP address belongs to a Laptop. Defaults to False for Raspberry Pi connection.
+        host (str): The IP address of the PLC.
+        is_pc (bool, optional): Not used anymore, the check doesn't depend on the OS. Defaults to False.
+        port (int, optional): The TCP port of the PLC. Defaults to PORT_ETHERNET_IP (44818).
 
     Returns:
         bool: True if the Ethernet connection is active, False otherwise.
     """
-    try:
-        if is_pc:
-            ping_command = ["ping", "-n", "1", host]
-        else:
-            ping_command = ["ping", "-c", "1", host]
-        ping_process = subprocess.Popen(ping_command, 
-                                        stdout=subprocess.PIPE, 
-                                        stderr=subprocess.PIPE
-                                        )
-
-        return_code = ping_process.wait()
-        if return_code == 0:
-            logger.info(f"Ethernet connection to {host} is active.")
-            return True
-        else:
-            logger.info(f"Ethernet connection to {host} is not active.")  
-            return False
-        
-    except subprocess.CalledProcessError as e:
-        # Handle subprocess errors if needed
-        logger.error(f"Error running ping command: {e}")
-        return False
+    if probe_tcp(host, port):
+        logger.info(f"Ethernet connection to {host} is active.")
+        return True
+    logger.info(f"Ethernet connection to {host} is not active.")
+    return False
 
 
-def waiting_for_connection(host: str, is_pc: bool = False): 
+def waiting_for_connection(host: str, is_pc: bool = False, port: int = PORT_ETHERNET_IP): 
     """
     Waits for the Ethernet connection to be active in the first time.
+    The checks are retried with an exponential backoff, from 1 s up to 30 s.
 
     Args:
-        host (str): The IP address to ping.
-        is_pc (bool, optional): Specifies whether the IP address belongs to a Laptop. Defaults to False for Raspberry Pi connection.
+        host (str): The IP address of the PLC.
+        is_pc (bool, optional): Not used anymore, the check doesn't depend on the OS. Defaults to False.
+        port (int, optional): The TCP port of the PLC. Defaults to PORT_ETHERNET_IP.
 
     Returns:
         None
     """
-    while True:
-        if is_ethernet_connected(host, is_pc):
-            return
+    delay = DOWN_INTERVAL_MIN
+    while not is_ethernet_connected(host, is_pc, port):
+        time.sleep(delay)
+        delay = min(delay * 2, DOWN_INTERVAL_MAX)
 
 
 def get_variables_from_equation(equation):
@@ -96,16 +83,20 @@ def get_variables_from_equation(equation):
     return sorted_variables
 
 
-def convert_logic_equation(bits, equation):
+def convert_logic_equation(bits, equation, _DEBUG: bool = False):
     """
     Converts a logic equation into a boolean result based on the given bits.
 
     Args:
         bits (list): A list of bits representing the values of variables in the equation.
         equation (str): The logic equation to be evaluated.
+        _DEBUG (bool, optional): Specifies whether to log the result. Defaults to False.
         Note: The equation must be in the form of a Python logic equation. ".", "|", "/" are the logical operators 
             for "and", "or", "not" respectively. The variable names must be in lower case.
 
+    Note: The equation is compiled once by LogicExpr.compile() and cached by string,
+    the next calls with the same equation only evaluate it.
+
     Returns:
         bool: The boolean result of the evaluated logic equation.
 
@@ -113,22 +104,9 @@ def convert_logic_equation(bits, equation):
         >>> convert_logic_equation([True, False, True, True, False], '/a|(b.c)|d')
         True
     """
-    lsVariables = get_variables_from_equation(equation)
-    # Replace variable names with corresponding bits
-    for chr_ in lsVariables:
-        if chr_.isalpha() and chr_.lower() in 'abcdefghijklmnopqrstuvwxyz':
-            equation = equation.replace(chr_, str(int(bits[ord(chr_) - 97])))
-
-    # Replace the logical operators with Python syntax
-    equation = equation.replace('.', ' and ')
-    equation = equation.replace('|', ' or ')
-    equation = equation.replace('/', ' not ')
-    # Remove all extra spaces from the equation
-    equation = ' '.join(equation.split())
-
-    # Evaluate the expression using eval
-    result = bool(eval(equation))
-    logger.info(f"Logic equation: {equation} = {result}")
+    result = LogicExpr.compile(equation)(bits)
+    if _DEBUG:
+        logger.info(f"Logic equation: {equation} = {result}")
     return result
 
 
@@ -169,7 +147,8 @@ class PLC:
             slot: int = 0,
             is_Micro800: bool = False,
             nameStation: str=None,
-            is_pc=False
+            is_pc=False,
+            cache_path: str=None
         ) -> None:
         """
         Initializes the PLC Rockwell AB.
@@ -181,6 +160,8 @@ class PLC:
             is_Micro800 (bool, optional): Specifies whether the PLC is Micro800. Defaults to False.
             nameStation (str, optional): The name of the PLC station. Defaults to None.
             is_pc (bool, optional): Specifies whether the IP address belongs to a Laptop. Defaults to False for Raspberry Pi connection.
+            cache_path (str, optional): The path of the file caching the tag data types and UDT templates between restarts. 
+                Defaults to None (no cache). The cache is loaded on the first successful connection to the PLC.
             
         Returns:
             None
@@ -191,15 +172,50 @@ class PLC:
         self.is_Micro800 = is_Micro800
         self.nameStation = nameStation
         self.is_pc = is_pc
+        # One lock per PLC: the calls of two threads never share its socket, the other PLCs are not waiting
+        self._lock = threading.Lock()
+        self.cache_path = cache_path
 
         if self.nameStation is not None:
             logger.name = f'PLC_Rockwell_AB - {self.nameStation}'
 
-        waiting_for_connection(self.host, self.is_pc)
+        waiting_for_connection(self.host, self.is_pc, self.port)
         # Connect to the PLC
         self.plc = pylogix.PLC(ip_address=self.host, slot=self.slot, Micro800=self.is_Micro800, port=self.port)
 
+        self._cached_tags = 0
+        self._cache_loaded = False
+
     
+    def connect(self) -> None:
+        """
+        Connects to the PLC Rockwell AB (register session and forward open).
+
+        Note: The connection is also opened on the first read or write, this method
+        reports the errors immediately.
+
+        Raises:
+            ConnectionError: If the connection failed.
+        """
+        with self._lock:
+            connected, status = self.plc.conn.connect()
+        if not connected:
+            raise ConnectionError(f"Error connecting to PLC {self.host}: {status}")
+
+        logger.info(f"Connected to PLC {self.host}.")
+        if self.cache_path is not None and not self._cache_loaded:
+            self.load_cache()
+
+
+    @property
+    def connection_size(self) -> int:
+        """
+        The CIP connection size negotiated with the PLC (about 4000 bytes with Large Forward Open, 
+        about 500 bytes otherwise). Multi-tag reads and writes are split into packets of this size.
+        """
+        return self.plc.ConnectionSize
+
+
     def readData(self, varTag: str, varType=None, varSize: int = 1, _DEBUG: bool = False):
         """
         Reads data from the PLC Rockwell AB.
@@ -213,8 +229,9 @@ class PLC:
         Returns:
             tuple: A tuple of variable tag and value.
         """
-        with lock:
+        with self._lock:
             read_result = self.plc.Read(tag=varTag, count=varSize, datatype=varType)
+        self._update_cache(read_result.Status == 'Success')
         
         tagName = read_result.TagName
         tagValue = read_result.Value
@@ -237,8 +254,9 @@ class PLC:
         Returns:
             None
         """
-        with lock:
-            self.plc.Write(tag=varTag, value=varValue, datatype=varType)
+        with self._lock:
+            write_result = self.plc.Write(tag=varTag, value=varValue, datatype=varType)
+        self._update_cache(write_result.Status == 'Success')
         
         if _DEBUG:
             logger.info(f"Write data to PLC: {varTag}, {varValue}")
@@ -255,16 +273,133 @@ class PLC:
         Returns:
             list: A list of boolean values corresponding to the values of the variables.
         """
-        varValue = []
-        for varTag in ls_varTag:
-            _, read_result = self.readData(varTag, varType=193)
-            varValue.append(bool(read_result))
+        varValue = [bool(tagValue) for _, tagValue in self.read_tags(ls_varTag)]
 
         if _DEBUG:
             logger.info(f"Read data from PLC: \n{ls_varTag} \n{varValue}")
         return varValue
 
 
+    def read_tags(self, ls_varTag: list, _DEBUG: bool = False) -> list:
+        """
+        Reads multiple tags from the PLC Rockwell AB in as few requests as possible.
+
+        The tags are packed into CIP Multiple Service Packets, each one filled up to
+        the negotiated connection size (ConnectionSize). Bits sharing a parent word 
+        (e.g. 'Alarm.0', 'Alarm.5') or a BOOL array (e.g. 'Alarms[3]', 'Alarms[40]') 
+        are read with a single read of the word or array.
+
+        Args:
+            ls_varTag (list): A list of variable tags to be read, or tuples (variable tag, data type) or
+            (variable tag, element count, data type).
+            _DEBUG (bool, optional): Specifies whether to print debug messages. Defaults to False.
+
+        Returns:
+            list: A list of tuples (variable tag, value), in the order of ls_varTag.
+            The value is None if the tag could not be read.
+        """
+        if not ls_varTag:
+            return []
+
+        # pylogix takes the typed tags as (tag, element count, data type)
+        ls_request = [(varTag[0], 1, varTag[1]) if isinstance(varTag, tuple) and len(varTag) == 2 else varTag
+                      for varTag in ls_varTag]
+        with self._lock:
+            read_result = self.plc.Read(ls_request)
+
+        ls_result = [(result.TagName, result.Value if result.Status == 'Success' else None) 
+                     for result in read_result]
+        self._update_cache(any(value is not None for _, value in ls_result))
+
+        if _DEBUG:
+            logger.info(f"Read data from PLC: \n{ls_result}")
+        return ls_result
+
+
+    def write_tags(self, ls_varTagValue: list, _DEBUG: bool = False) -> list:
+        """
+        Writes multiple tags to the PLC Rockwell AB in as few requests as possible.
+
+        The tags are packed into CIP Multiple Service Packets, each one filled up to
+        the negotiated connection size (ConnectionSize). Bits sharing a parent word 
+        are written with a single masked write of the word.
+
+        Args:
+            ls_varTagValue (list): A list of tuples (variable tag, value) or (variable tag, value, data type).
+            _DEBUG (bool, optional): Specifies whether to print debug messages. Defaults to False.
+
+        Returns:
+            list: A list of booleans, True if the corresponding tag was written successfully.
+        """
+        if not ls_varTagValue:
+            return []
+
+        with self._lock:
+            write_result = self.plc.Write([tuple(varTagValue) for varTagValue in ls_varTagValue])
+
+        ls_status = [result.Status == 'Success' for result in write_result]
+        self._update_cache(any(ls_status))
+
+        if _DEBUG:
+            logger.info(f"Write data to PLC: \n{ls_varTagValue} \n{ls_status}")
+        return ls_status
+
+
+    def load_cache(self) -> bool:
+        """
+        Loads the tag data types and UDT templates of this PLC from the cache file (cache_path).
+        The cache is only used if it was written by the same controller (same identity), so the
+        PLC must answer: the load is retried after the next successful connection, read or write
+        until it succeeds.
+
+        Returns:
+            bool: True if the cache was loaded.
+        """
+        with self._lock:
+            result = self.plc.LoadTagCache(self.cache_path)
+
+        if result.Status == 'Success':
+            # the tags learned before the load and missing from the file are saved on the next update
+            self._cached_tags = result.Value
+            self._cache_loaded = True
+            logger.info(f"Loaded {result.Value} cached tags from {self.cache_path}.")
+        else:
+            logger.warning(f"Error loading tag cache from {self.cache_path}: {result.Status}")
+        return self._cache_loaded
+
+
+    def save_cache(self) -> None:
+        """
+        Saves the tag data types and UDT templates learned so far to the cache file (cache_path).
+        """
+        with self._lock:
+            result = self.plc.SaveTagCache(self.cache_path)
+        self._cached_tags = len(self.plc.KnownTags)
+
+        if result.Status == 'Success':
+            logger.info(f"Saved {result.Value} cached tags to {self.cache_path}.")
+        else:
+            logger.warning(f"Error saving tag cache to {self.cache_path}: {result.Status}")
+
+
+    def _update_cache(self, success: bool) -> None:
+        """
+        Loads the cache file after the first successful request if the PLC was not reachable before, 
+        then saves it when new tags have been learned since the last save, so the cache is up to date 
+        even if the program is restarted without cleanup (restart_program).
+
+        Args:
+            success (bool): True if the request reached the PLC.
+        """
+        if self.cache_path is None:
+            return
+        if not self._cache_loaded:
+            if not success or not self.load_cache():
+                return
+        if len(self.plc.KnownTags) > self._cached_tags or self.plc.StaleTags:
+            self.save_cache()
+
+
     def checkLogicBits(self, bits: list, equation: str) -> bool:
         """
         Checks the logic bits.
@@ -295,7 +430,6 @@ class PLC:
         count = 0
         case = 0
         while True:
-            print(case)
             if case == 1:
                 # connect
                 logger.info(f"Connecting to PLC...")
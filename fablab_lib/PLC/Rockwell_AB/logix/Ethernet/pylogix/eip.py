@@ -21,22 +21,29 @@ import math
 import re
 import time
 
+from .lgx_cache import device_identity, load_cache, save_cache
 from .lgx_comm import Connection
 from .lgx_device import Device
 from .lgx_response import Response
 from .lgx_tag import Tag, UDT
 from .utils import is_micropython
 from random import randrange
-from struct import pack, unpack_from
+from struct import Struct, pack, unpack_from
 
 
 if not is_micropython():
     from datetime import datetime, timedelta
 
+# CIP statuses of a write whose data type doesn't match the tag anymore:
+# path segment error, path destination unknown, not enough data,
+# too much data, general error (extended status type mismatch)
+STALE_TYPE_STATUSES = (0x04, 0x05, 0x13, 0x15, 0xff)
+
 # noinspection PyMethodMayBeStatic
 class PLC(object):
     __slots__ = ('IPAddress', 'Port', 'ProcessorSlot', 'SocketTimeout', 'Micro800', 'Route', 'conn', 'Offset', 'UDT',
-                 'UDTByName', 'KnownTags', 'TagList', 'ProgramNames', 'StringID', 'StringEncoding', 'CIPTypes')
+                 'UDTByName', 'UDTCache', 'Identity', 'KnownTags', 'StaleTags', 'TagList', 'ProgramNames',
+                 'StringID', 'StringEncoding', 'CIPTypes')
 
     def __init__(self, ip_address="", slot=0, timeout=5.0, Micro800=False, port=44818):
         """
@@ -54,7 +61,10 @@ class PLC(object):
         self.Offset = 0
         self.UDT = {}
         self.UDTByName = {}
+        self.UDTCache = {}
+        self.Identity = None
         self.KnownTags = {}
+        self.StaleTags = set()
         self.TagList = []
         self.ProgramNames = []
         self.StringID = 0x0fce
@@ -86,10 +96,11 @@ class PLC(object):
     @property
     def ConnectionSize(self):
         """Set the ConnectionSize before initiating the first call requiring conn.connect().  The
-        default behavior is to attempt a Large followed by a Small Forward Open.  If an Explicit
-        (Unconnected) session is used, picks a sensible default.
+        default behavior is to attempt a Large followed by a Small Forward Open.  Once connected,
+        returns the size negotiated with the PLC, which multi-read/write requests are split by.
+        If an Explicit (Unconnected) session is used, picks a sensible default.
         """
-        return self.conn.ConnectionSize or 508
+        return self.conn.ConnectionSize or self.conn.NegotiatedSize or 508
 
     @ConnectionSize.setter
     def ConnectionSize(self, connection_size):
@@ -137,6 +148,8 @@ class PLC(object):
         if isinstance(tag, (list, tuple)):
             if len(tag) == 1:
                 return [self._write_tag(*tag[0])]
+            if self.Micro800:
+                return [self._write_tag(*t) for t in tag]
             else:
                 return self._batch_write(tag)
         else:
@@ -260,6 +273,48 @@ class PLC(object):
         """
         return self._get_device_properties()
 
+    def LoadTagCache(self, path):
+        """
+        Load the tag data types and UDT templates of this controller
+        from a cache file written by SaveTagCache, so the first reads
+        after a restart don't need to learn them from the controller again.
+        The cache is only used if the controller identity matches.
+
+        returns Response class (.TagName, .Value, .Status),
+            .Value is the number of cached tags loaded
+        """
+        status = self._get_identity()
+        if self.Identity is None:
+            return Response(None, 0, status)
+
+        known_tags, udts = load_cache(path, self.Identity)
+        for tag, value in known_tags.items():
+            self.KnownTags.setdefault(tag, value)
+        self.UDTCache.update(udts)
+        return Response(None, len(known_tags), 0)
+
+    def SaveTagCache(self, path):
+        """
+        Store the tag data types and UDT templates learned so far
+        for this controller in a cache file
+
+        returns Response class (.TagName, .Value, .Status),
+            .Value is the number of cached tags stored
+        """
+        status = self._get_identity()
+        if self.Identity is None:
+            return Response(None, 0, status)
+
+        udts = dict(self.UDTCache)
+        udts.update(self.UDT)
+        stale = self.StaleTags.difference(self.KnownTags)
+        try:
+            save_cache(path, self.Identity, self.KnownTags, udts, stale)
+        except OSError as e:
+            return Response(None, 0, str(e))
+        self.StaleTags.clear()
+        return Response(None, len(self.KnownTags), 0)
+
     def Close(self):
         """
         Close the connection to the PLC
@@ -281,18 +336,108 @@ class PLC(object):
         # get data types of unknown tags
         self._get_unknown_types(tags)
 
+        # bits sharing a word or a BOOL array are read only once
+        requests, plan = self._plan_bit_reads(tags)
+
         result = []
-        while len(result) < len(tags):
-            if len(result) == len(tags) - 1:
+        while len(result) < len(requests):
+            if len(result) == len(requests) - 1:
                 # single tag left over, can't use multi msg service
-                tag = tags[len(result):][0]
-                result.append(self._read_tag(tag, 1, None))
+                tag = requests[len(result):][0]
+                if isinstance(tag, (list, tuple)) and len(tag) == 3:
+                    result.append(self._read_tag(*tag))
+                else:
+                    result.append(self._read_tag(tag, 1, None))
             else:
-                result.extend(self._multi_read(tags[len(result):], False))
+                result.extend(self._multi_read(requests[len(result):], False))
+
+        return [self._extract_bit(tag, result[i], bit) for tag, (i, bit) in zip(tags, plan)]
+
+    def _plan_bit_reads(self, tags):
+        """
+        Group the bits of a word (Tag.5) and the BOOL array elements (Tag[37])
+        that share a parent word or array, so the parent is read once.
+        Returns the list of tags to read and, for each requested tag, the
+        position of its read in that list with the bit to extract from it
+        (None when the tag is read as is)
+        """
+        # word range of each BOOL array
+        arrays = {}
+        for tag in tags:
+            if isinstance(tag, (list, tuple)):
+                continue
+            tag_name, base_tag, index = parse_tag_name(tag)
+            if self.KnownTags.get(base_tag, (None,))[0] == 0xd3 and not isinstance(index, list):
+                low, high = arrays.get(base_tag, (index, index))
+                arrays[base_tag] = (min(low, index), max(high, index))
+
+        requests = []
+        parents = {}
+        plan = []
+        for tag in tags:
+            if isinstance(tag, (list, tuple)):
+                plan.append((len(requests), None))
+                requests.append(tag)
+                continue
+
+            tag_name, base_tag, index = parse_tag_name(tag)
+            data_type = self.KnownTags.get(base_tag, (None,))[0]
+            if base_tag in arrays:
+                # read the array from the first to the last word requested
+                low, high = arrays[base_tag]
+                start = low - low % 32
+                parent = (base_tag, '{}[{}]'.format(base_tag, start), high - start + 1)
+                bit = index - start
+            elif bit_of_word(tag) and data_type in self.CIPTypes and data_type not in (0x00, 0xa0):
+                parent = (re.sub(r'\.\d+$', '', tag), None, 1)
+                bit = int(tag.split('.')[-1])
+            else:
+                plan.append((len(requests), None))
+                requests.append(tag)
+                continue
+
+            if parent[0] not in parents:
+                parents[parent[0]] = len(requests)
+                requests.append((parent[1] or parent[0], parent[2], data_type))
+            plan.append((parents[parent[0]], bit))
 
-        return result
+        return requests, plan
 
-    def _read_tag(self, tag_name, elements, data_type):
+    def _extract_bit(self, tag, response, bit):
+        """
+        Build the response of a requested tag from the read of its parent
+        word or BOOL array
+        """
+        if bit is None:
+            return response
+        value = response.Value
+        if value is None:
+            return Response(tag, None, response.Status)
+        if isinstance(value, list):
+            # BOOL array, the parent read already returns the bits
+            return Response(tag, value[bit], response.Status)
+        return Response(tag, bit_value(value, bit), response.Status)
+
+    def _get_identity(self):
+        """
+        Identify the controller the tag cache belongs to, the identity
+        is only requested once per PLC instance
+        """
+        if self.Identity is not None:
+            return 0
+        device = self.GetDeviceProperties()
+        self.Identity = device_identity(device.Value)
+        return device.Status
+
+    def _forget_type(self, base_tag):
+        """
+        Drop the data type of a tag, it may come from an outdated
+        cache (program changed) and is learned again on the next access
+        """
+        if self.KnownTags.pop(base_tag, None) is not None:
+            self.StaleTags.add(base_tag)
+
+    def _read_tag(self, tag_name, elements, data_type, revalidate=True):
         """
         Processes the read request
         """
@@ -308,11 +453,11 @@ class PLC(object):
         if resp[2] != 0 and resp[2] != 6:
             return Response(tag_name, None, resp[2])
 
-        data_type = self.KnownTags[base_tag][0]
-        bit_count = self.CIPTypes[data_type][0] * 8
+        known_type = self.KnownTags[base_tag][0]
+        bit_count = self.CIPTypes[known_type][0] * 8
 
-        ioi = self._build_ioi(tag_name, data_type)
-        if data_type == 0xd3:
+        ioi = self._build_ioi(tag_name, known_type)
+        if known_type == 0xd3:
             # bool array
             words = get_word_count(index, elements, bit_count)
             request = self._add_read_service(ioi, words)
@@ -330,7 +475,7 @@ class PLC(object):
 
         # if we are handling structs (string), we have to
         # remove 2 extra bytes from the data
-        if data_type == 0xa0:
+        if known_type == 0xa0:
             pad = 4
         else:
             pad = 2
@@ -338,9 +483,21 @@ class PLC(object):
         status, ret_data = self.conn.send(request)
         if not ret_data:
             return Response(tag_name, None, status)
+        if status != 0 and status != 6:
+            # the data type may come from an outdated cache, learn it again next time
+            self._forget_type(base_tag)
+            return Response(tag_name, None, status)
+        reply_type = unpack_from('<B', ret_data, 50)[0]
+        if reply_type != known_type and reply_type in self.CIPTypes and revalidate:
+            # the cached data type is outdated (program changed), read again with the right one,
+            # marked stale so the corrected type is written by the next cache save
+            self.KnownTags[base_tag] = (reply_type, 0)
+            self.StaleTags.add(base_tag)
+            return self._read_tag(tag_name, elements, data_type, False)
+        data_type = known_type
         data = ret_data[50:]
         self.Offset += len(data) - pad
-        req = data
+        req = bytearray(data)
 
         while status == 6:
             if data_type == 0xd3:
@@ -352,7 +509,7 @@ class PLC(object):
             self.Offset += len(data)
             req += data
 
-        return_values = self._parse_reply(tag_name, elements, req)
+        return_values = self._parse_reply(tag_name, elements, bytes(req))
 
         if return_values:
             if len(return_values) == 1:
@@ -379,8 +536,15 @@ class PLC(object):
         min_tag_size = 24
         service_segment_size = 8
 
+        # size of the outgoing request: header, service count, then an
+        # offset and a read service for every tag packed in
+        request_size = len(header) + 2
+
         for tag in tags:
+            elements = 1
             if isinstance(tag, (list, tuple)):
+                if len(tag) == 3:
+                    elements = tag[1]
                 tag = tag[0]
             tag_name, base_tag, index = parse_tag_name(tag)
 
@@ -395,22 +559,37 @@ class PLC(object):
                 dt_size = self.CIPTypes[160][0]
                 data_type = None
 
+            # number of elements to request, BOOL arrays and bits of word are
+            # requested by the number of words the bits occupy
+            words = read_word_count(tag_name, index, elements, data_type, dt_size * 8)
+
             # estimate the size that the response will occupy
-            rsp_tag_size = min_tag_size + len(base_tag) + dt_size
+            rsp_tag_size = min_tag_size + len(base_tag) + dt_size * words
 
             ioi = self._build_ioi(tag_name, data_type)
-            read_service = self._add_read_service(ioi, 1)
+            read_service = self._add_read_service(ioi, words)
 
             next_request_size = service_segment_size + rsp_tag_size + 2
+            next_send_size = request_size + len(read_service) + 2
 
-            # check if request size does not exceed (ConnectionSize bytes limit)
-            if next_request_size <= self.ConnectionSize and rsp_tag_size <= self.ConnectionSize:
+            # check if neither the reply nor the request exceed (ConnectionSize bytes limit)
+            if next_request_size <= self.ConnectionSize and next_send_size <= self.ConnectionSize:
                 service_segment_size = service_segment_size + rsp_tag_size
+                request_size = next_send_size
                 service_segments.append(read_service)
                 tag_count = tag_count + 1
             else:
                 break
 
+        if tag_count < 2:
+            # the tags don't share a packet, can't use multi msg service
+            tag = tags[0]
+            if isinstance(tag, (list, tuple)):
+                if len(tag) == 3:
+                    return [self._read_tag(*tag)]
+                tag = tag[0]
+            return [self._read_tag(tag, 1, None)]
+
         tags_effective = tags[0:tag_count]
         segment_count = pack('<H', tag_count)
 
@@ -459,18 +638,145 @@ class PLC(object):
 
         self._get_unknown_types(new_tags)
 
+        # bits sharing a word or a BOOL array word are written with one masked write
+        others, groups, plan = self._plan_bit_writes(tags)
+        statuses = self._multi_mod_write(groups)
+
         result = []
-        while len(result) < len(tags):
-            if len(result) == len(tags) - 1:
+        while len(result) < len(others):
+            if len(result) == len(others) - 1:
                 # single tag left over, can't use multi msg service
-                tag = tags[len(result):][0]
+                tag = others[len(result):][0]
                 result.append(self._write_tag(*tag))
             else:
-                result.extend(self._multi_write(tags[len(result):]))
+                result.extend(self._multi_write(others[len(result):]))
+
+        replies = []
+        for t, (i, is_bit) in zip(tags, plan):
+            if is_bit:
+                replies.append(Response(t[0], t[1], statuses[i]))
+            else:
+                replies.append(result[i])
+        return replies
+
+    def _plan_bit_writes(self, tags):
+        """
+        Group the writes to bits of a word (Tag.5) and BOOL array elements (Tag[37])
+        by the word they belong to, so each word gets a single masked write.
+        Returns the writes that are not coalesced, the masked writes
+        (word tag, data type, OR mask, AND mask) and, for each requested
+        write, its position in one of the two lists
+        """
+        others = []
+        groups = []
+        words = {}
+        plan = []
+        for t in tags:
+            tag_name, value = t[0], t[1]
+            tag, base_tag, index = parse_tag_name(tag_name)
+            data_type = self.KnownTags.get(base_tag, (None,))[0]
+
+            word = None
+            if not isinstance(value, (list, tuple)):
+                if data_type == 0xd3 and not isinstance(index, list) and not bit_of_word(tag_name):
+                    word = '{}[{}]'.format(base_tag, index - index % 32)
+                    bit = index % 32
+                elif bit_of_word(tag_name) and data_type in self.CIPTypes and data_type not in (0x00, 0xa0, 0xd3):
+                    word = re.sub(r'\.\d+$', '', tag_name)
+                    bit = int(tag_name.split('.')[-1])
+                    if bit >= self.CIPTypes[data_type][0] * 8:
+                        word = None
+
+            if word is None:
+                plan.append((len(others), False))
+                others.append(t)
+                continue
+
+            if word not in words:
+                words[word] = len(groups)
+                groups.append([word, data_type, 0, -1])
+            group = groups[words[word]]
+            if value:
+                group[2] |= 1 << bit
+            else:
+                group[3] &= ~(1 << bit)
+            plan.append((words[word], True))
+
+        return others, groups, plan
+
+    def _multi_mod_write(self, groups):
+        """
+        Send the masked writes (word tag, data type, OR mask, AND mask)
+        packed in as few multiple service requests as the connection size allows.
+        Returns the status of each write
+        """
+        services = []
+        for word, data_type, or_mask, and_mask in groups:
+            bits = self.CIPTypes[data_type][0] * 8
+            fmt = self.CIPTypes[data_type][2]
+            masks = []
+            for mask in (or_mask, and_mask):
+                mask &= (1 << bits) - 1
+                if fmt[-1].islower() and mask > 2 ** (bits - 1) - 1:
+                    # signed formats need the two's complement value
+                    mask -= 1 << bits
+                masks.append(mask)
+            ioi = self._build_ioi(word, data_type)
+            services.append(self._add_mod_write_service(ioi, data_type, masks[0], masks[1]))
+
+        statuses = []
+        while len(statuses) < len(services):
+            statuses.extend(self._send_multi_service(services[len(statuses):]))
+        for (word, _, _, _), status in zip(groups, statuses):
+            if status in STALE_TYPE_STATUSES:
+                self._forget_type(parse_tag_name(word)[1])
+        return statuses
+
+    def _send_multi_service(self, services):
+        """
+        Send as many of the services as fit in one multiple service request,
+        services with a reply carrying no data (writes) only.
+        Returns the status of each service sent
+        """
+        header = self._build_multi_service_header()
+
+        # reply: header, service count, then an offset and a 4 byte
+        # reply for every service
+        request_size = len(header) + 2
+        reply_size = 6
+        count = 0
+        for service in services:
+            if count and (request_size + len(service) + 2 > self.ConnectionSize or
+                          reply_size + 6 > self.ConnectionSize):
+                break
+            request_size += len(service) + 2
+            reply_size += 6
+            count += 1
+
+        if count == 1:
+            # single service, no need for the multi msg service
+            status, ret_data = self.conn.send(services[0])
+            return [status]
+
+        offset = 2 + count * 2
+        offsets = b''
+        for service in services[:count]:
+            offsets += pack('<H', offset)
+            offset += len(service)
+        request = header + pack('<H', count) + offsets + b''.join(services[:count])
+
+        status, ret_data = self.conn.send(request)
+        if not ret_data:
+            return [status] * count
 
-        return result
+        stripped = ret_data[50:]
+        statuses = []
+        for i in range(count):
+            loc = unpack_from('<H', stripped, 2 + i * 2)[0]
+            statuses.append(unpack_from('<B', stripped, loc + 2)[0])
+        return statuses
 
-    def _write_tag(self, tag_name, value, data_type=None):
+    def _write_tag(self, tag_name, value, data_type=None, revalidate=True):
         """
         Processes the write request
         """
@@ -486,6 +792,7 @@ class PLC(object):
         if resp[2] != 0 and resp[2] != 6:
             return Response(tag_name, None, resp[2])
 
+        data_type_arg, original_value = data_type, value
         data_type = self.KnownTags[base_tag][0]
 
         # check if values passed were a list
@@ -525,6 +832,12 @@ class PLC(object):
 
                 status, ret_data = self.conn.send(request)
 
+        if ret_data and status in STALE_TYPE_STATUSES and data_type_arg is None:
+            # the data type may come from an outdated cache, learn it again and retry once
+            self._forget_type(base_tag)
+            if revalidate:
+                return self._write_tag(tag_name, original_value, None, False)
+
         if len(value) == 1:
             value = value[0]
 
@@ -544,6 +857,10 @@ class PLC(object):
 
         header = self._build_multi_service_header()
 
+        # size of the outgoing request: header, service count, then an
+        # offset and a write service for every tag packed in
+        request_size = len(header) + 2
+
         write_values = []
         for wd in write_data:
 
@@ -575,42 +892,55 @@ class PLC(object):
                 high, low, tags = mod_write_masks(tag_name, value, byte_count)
                 temp_segments = []
                 tmp_count = tag_count
+                tmp_segment_size = service_segment_size
+                tmp_request_size = request_size
                 tmp_write_values = []
                 booleans_fit = True
                 for i in range(len(high)):
                     ioi = self._build_ioi(tags[i], data_type)
                     write_service = self._add_mod_write_service(ioi, data_type, high[i], low[i])
 
-                    next_request_size = service_segment_size + rsp_tag_size + 2
-                    # check if request size does not exceed (ConnectionSize bytes limit)
-                    if next_request_size <= self.ConnectionSize and rsp_tag_size <= self.ConnectionSize:
-                        service_segment_size = service_segment_size + rsp_tag_size
+                    next_request_size = tmp_segment_size + rsp_tag_size + 2
+                    next_send_size = tmp_request_size + len(write_service) + 2
+                    # check if neither the reply nor the request exceed (ConnectionSize bytes limit)
+                    if next_request_size <= self.ConnectionSize and next_send_size <= self.ConnectionSize:
+                        tmp_segment_size = tmp_segment_size + rsp_tag_size
+                        tmp_request_size = next_send_size
                         temp_segments.append(write_service)
                         tmp_write_values.append((tags[i], value))
-                        tag_count = tag_count + 1
+                        tmp_count = tmp_count + 1
                     else:
                         # BOOLs didn't fit in the current packet, abort
-                        booleans_fit = True
-                        tag_count = tmp_count
+                        booleans_fit = False
                         break
-                if booleans_fit:
-                    # if the booleans fit in this request, append them.
-                    write_values.extend(tmp_write_values)
-                    service_segments.extend(temp_segments)
+                if not booleans_fit:
+                    break
+                # the booleans fit in this request, append them.
+                write_values.extend(tmp_write_values)
+                service_segments.extend(temp_segments)
+                service_segment_size = tmp_segment_size
+                request_size = tmp_request_size
+                tag_count = tmp_count
             else:
                 ioi = self._build_ioi(tag_name, data_type)
                 write_service = self._add_write_service(ioi, value, data_type)
-                write_values.append((wd[0], value))
                 next_request_size = service_segment_size + rsp_tag_size + 2
+                next_send_size = request_size + len(write_service) + 2
 
-                # check if request size does not exceed (ConnectionSize bytes limit)
-                if next_request_size <= self.ConnectionSize and rsp_tag_size <= self.ConnectionSize:
+                # check if neither the reply nor the request exceed (ConnectionSize bytes limit)
+                if next_request_size <= self.ConnectionSize and next_send_size <= self.ConnectionSize:
                     service_segment_size = service_segment_size + rsp_tag_size
+                    request_size = next_send_size
                     service_segments.append(write_service)
+                    write_values.append((wd[0], value))
                     tag_count = tag_count + 1
                 else:
                     break
 
+        if tag_count < 2:
+            # the tags don't share a packet, can't use multi msg service
+            return [self._write_tag(*write_data[0])]
+
         segment_count = pack('<H', tag_count)
 
         temp = len(header)
@@ -804,8 +1134,16 @@ class PLC(object):
         template = {}
         while len(unique):
             iter_template = {}
+            cached = []
             for u in unique:
-                if u.DataTypeValue not in self.UDT.keys():
+                if u.DataTypeValue in self.UDTCache and u.DataTypeValue not in self.UDT.keys():
+                    # template already known from the tag cache, no need to ask the PLC
+                    udt = self.UDTCache[u.DataTypeValue]
+                    template[u.DataTypeValue] = [0, udt.Name, len(udt.Fields)]
+                    self.UDT[udt.Type] = udt
+                    self.UDTByName[udt.Name] = udt
+                    cached.append(udt)
+                elif u.DataTypeValue not in self.UDT.keys():
                     temp = self._get_template_attribute(u.DataTypeValue)
 
                     block = temp[46:]
@@ -819,6 +1157,12 @@ class PLC(object):
                         print("Received invalid template attribute for", u.TagName)
 
             unique = []
+            for udt in cached:
+                for field in udt.Fields:
+                    if field.SymbolType not in self.CIPTypes:
+                        if field.DataTypeValue not in self.UDT:
+                            unique.append(field)
+
             for key, value in iter_template.items():
                 t = self._get_template(key, value[0])
                 member_count = value[2]
@@ -1327,6 +1671,36 @@ class PLC(object):
                 self.Offset += len(data)
                 return values
 
+        if not data_size:
+            return values
+
+        if data_type == 0xda or data_type == 0xd0:
+            if num_bytes < 2:
+                return values
+            # walk the strings in the packet instead of slicing it after each one
+            pos = 2
+            while pos < len(data):
+                if data_type == 0xd0:
+                    # special string
+                    length = unpack_from("<H", data, pos)[0]
+                    pos += 2
+                else:
+                    # Micro800 String
+                    length = data[pos]
+                    pos += 1
+
+                # grab the string
+                values.append(str(data[pos:pos + length].decode(self.StringEncoding)))
+                pos += length
+            return values
+
+        if data_type != 0xa0 and not (fmt == '?' and is_micropython()):
+            # fixed size values, unpack them all at once
+            count = max(0, (len(data) - 2) // data_size)
+            values = list(get_struct(array_format(fmt, count)).unpack_from(data, 2))
+            self.Offset += data_size * count
+            return values
+
         while True:
             index = 2 + (counter * data_size)
             if index > num_bytes:
@@ -1336,44 +1710,19 @@ class PLC(object):
                 name_len = unpack_from('<L', data, index)[0]
                 s = data[index + 4:index + 4 + name_len]
                 values.append(str(s.decode(self.StringEncoding)))
-
-            elif data_type == 0xda or data_type == 0xd0:
-                # remove the data type
-                data = data[2:]
-                while len(data) > 0:
-                    
-                    if data_type == 0xd0:
-                        # special string
-                        length = unpack_from("<H", data, 0)[0]
-                        data = data[2:]
-                    else:
-                        # Micro800 String
-                        length = unpack_from("<B", data, 0)[0]
-                        data = data[1:]
-
-                    # grab the string
-                    string_value = data[:length]
-                    values.append(str(string_value.decode(self.StringEncoding)))
-                    # remove the string from the packet
-                    data = data[length:]
-                break
             else:
                 # handling special format for micropython for bools
                 # boolean format ? doesn't exist for upy struct module
-                if fmt == '?' and is_micropython():
-                    bool_int_val = unpack_from('B', data, index)[0]
+                bool_int_val = unpack_from('B', data, index)[0]
 
-                    if bool_int_val == 255 or bool_int_val == 1:
-                        bool_val = True
-                    elif bool_int_val == 0:
-                        bool_val = False
-                    else:
-                        bool_val = None
-
-                    values.append(bool_val)
+                if bool_int_val == 255 or bool_int_val == 1:
+                    bool_val = True
+                elif bool_int_val == 0:
+                    bool_val = False
                 else:
-                    return_value = unpack_from(fmt, data, index)[0]
-                    values.append(return_value)
+                    bool_val = None
+
+                values.append(bool_val)
 
             self.Offset += data_size
             counter += 1
@@ -1492,46 +1841,55 @@ class PLC(object):
         """
         Takes multi read reply data and returns an array of the values
         """
-        # remove the beginning of the packet because we just don't care about it
-        stripped = data[50:]
+        # the reply starts at byte 50, decode in place instead of
+        # copying the beginning of the packet away
+        view = memoryview(data)
+        start = 50
+        u8 = get_struct('<B')
+        u16 = get_struct('<H')
 
         # get the offset values for each of the tags in the packet
         reply = []
         for i, tag in enumerate(tags):
+            elements = 1
             if isinstance(tag, (list, tuple)):
+                if len(tag) == 3:
+                    elements = tag[1]
                 tag = tag[0]
-            loc = 2 + (i * 2)
-            offset = unpack_from('<H', stripped, loc)[0]
-            status = unpack_from('<b', stripped, offset + 2)[0]
-            ext_status = unpack_from('<b', stripped, offset + 3)[0]
+            offset = start + u16.unpack_from(view, start + 2 + (i * 2))[0]
+            status = view[offset + 2]
+            ext_status = view[offset + 3]
 
             # successful reply, add the value to our list
             if status == 0 and ext_status == 0:
-                data_type = unpack_from('<B', stripped, offset + 4)[0]
+                data_type = view[offset + 4]
                 tag_name, base_tag, index = parse_tag_name(tag)
                 self.KnownTags[base_tag] = (data_type, 0)
+                if elements > 1 and data_type != 0xa0:
+                    # several elements were requested, return a list of values
+                    data_size = self.CIPTypes[data_type][0]
+                    words = read_word_count(tag, index, elements, data_type, data_size * 8)
+                    values = list(get_struct(array_format(self.CIPTypes[data_type][2], words)).unpack_from(
+                        view, offset + 6))
+                    if bit_of_word(tag) or data_type == 0xd3:
+                        values = self._words_to_bits(tag, values, count=elements)
+                    response = Response(tag, values, status)
                 # if a bit of word was requested
-                if bit_of_word(tag):
-                    type_fmt = self.CIPTypes[data_type][2]
-                    val = unpack_from(type_fmt, stripped, offset + 6)[0]
-                    bit_state = bit_of_word_state(tag, val)
-                    response = Response(tag, bit_state, status)
-                elif data_type == 0xd3:
-                    type_fmt = self.CIPTypes[data_type][2]
-                    val = unpack_from(type_fmt, stripped, offset + 6)[0]
+                elif bit_of_word(tag) or data_type == 0xd3:
+                    val = get_struct(self.CIPTypes[data_type][2]).unpack_from(view, offset + 6)[0]
                     bit_state = bit_of_word_state(tag, val)
                     response = Response(tag, bit_state, status)
                 elif data_type == 0xa0:
-                    strlen = unpack_from('<B', stripped, offset + 8)[0]
-                    s = stripped[offset + 12:offset + 12 + strlen]
-                    value = str(s.decode(self.StringEncoding))
+                    strlen = u8.unpack_from(view, offset + 8)[0]
+                    s = data[offset + 12:offset + 12 + strlen]
+                    value = str(s, self.StringEncoding)
                     response = Response(tag, value, status)
                 else:
                     type_fmt = self.CIPTypes[data_type][2]
                     # handling special format for micropython for bools
                     # boolean format ? doesn't exist for upy struct module
                     if type_fmt == '?' and is_micropython():
-                        value = unpack_from('B', stripped, offset + 6)[0]
+                        value = view[offset + 6]
 
                         if value == 255 or value == 1:
                             bool_val = True
@@ -1542,7 +1900,7 @@ class PLC(object):
 
                         response = Response(tag, bool_val, status)
                     else:
-                        value = unpack_from(type_fmt, stripped, offset + 6)[0]
+                        value = get_struct(type_fmt).unpack_from(view, offset + 6)[0]
                         response = Response(tag, value, status)
             else:
                 response = Response(tag, None, status)
@@ -1565,7 +1923,9 @@ class PLC(object):
         reply = []
         for i, offset in enumerate(offsets):
             status = unpack_from('<B', stripped, offset + 2)[0]
-            
+            if status in STALE_TYPE_STATUSES:
+                self._forget_type(parse_tag_name(write_data[i][0])[1])
+
             # only return value list if the original request was multiple
             if len(write_data[i][1]) == 1:
                 tag = write_data[i][0]
@@ -1659,6 +2019,20 @@ def bit_of_word_state(tag, value):
     return bit_value(value, index)
 
 
+def read_word_count(tag, index, elements, data_type, bits):
+    """
+    Get the number of elements to put in the read service of a
+    tag.  BOOL arrays and bits of a word are requested by words,
+    any other tag by the number of elements.
+    """
+    if data_type == 0xd3 and not isinstance(index, list):
+        return get_word_count(index, elements, bits)
+    elif bit_of_word(tag) and data_type:
+        bit_pos = int(tag.split('.')[-1])
+        return get_word_count(bit_pos, elements, bits)
+    return elements
+
+
 def get_word_count(start, length, bits):
     """
     Get the number of words that the requested
@@ -1673,6 +2047,35 @@ def get_word_count(start, length, bits):
     return int(total_words + 1)
 
 
+# precompiled struct per format, shared by all the parsers
+_structs = {}
+
+
+def get_struct(fmt):
+    """
+    Get the precompiled struct of a format, so the parsers don't parse
+    the format string again for every value they unpack
+    """
+    s = _structs.get(fmt)
+    if s is None:
+        s = _structs[fmt] = Struct(fmt)
+    return s
+
+
+def array_format(fmt, count):
+    """
+    Format to unpack count values of the format fmt at once
+    ex: ('<i', 3) returns '<3i'
+    """
+    if fmt[0] in '<>=!@':
+        return '{}{}{}'.format(fmt[0], count, fmt[1:])
+    return '<{}{}'.format(count, fmt)
+
+
+# tag names are parsed for every read, the same names come back every scan
+_parsed_tags = {}
+
+
 def parse_tag_name(tag):
     """
     Parse the tag name into it's base tag (remove array index and/or
@@ -1681,6 +2084,18 @@ def parse_tag_name(tag):
     ex: MyTag.Name[42] returns:
     MyTag.Name[42], MyTag.Name, 42
     """
+    parsed = _parsed_tags.get(tag)
+    if parsed is None:
+        if len(_parsed_tags) > 10000:
+            _parsed_tags.clear()
+        parsed = _parsed_tags[tag] = _parse_tag_name(tag)
+    return parsed
+
+
+def _parse_tag_name(tag):
+    """
+    Parse a tag name, see parse_tag_name
+    """
     bit_end_pattern = r'\.\d+$'
     array_pattern = r'\[\s*(0|[1-9][0-9]*)(\s*,\s*(0|[1-9][0-9]*))*\s*\]$'
 
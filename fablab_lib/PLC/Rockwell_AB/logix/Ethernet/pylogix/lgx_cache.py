@@ -0,0 +1,130 @@
+"""
+   Persistent tag type and UDT template cache.
+
+   KnownTags and the UDT templates are learned from the controller on the
+   first access to each tag, which costs an extra round trip per tag and a
+   walk of every template.  This module stores them in a local JSON file so
+   that a restarted process starts with a warm cache.
+
+   The file can hold the cache of several controllers, each one stored under
+   the identity of the controller (vendor, product code, revision, serial
+   number and product name).
+"""
+import json
+import os
+
+from .lgx_tag import Tag, UDT
+
+CACHE_VERSION = 1
+
+_TAG_FIELDS = ('TagName', 'InstanceID', 'SymbolType', 'DataTypeValue', 'DataType', 'Array', 'Struct',
+               'Size', 'AccessRight', 'Internal', 'Meta', 'Scope0', 'Scope1')
+
+
+def device_identity(device):
+    """
+    Build the cache key of a controller from its Device properties,
+    returns None if the device could not be identified
+    """
+    if device is None or device.SerialNumber is None:
+        return None
+    return '{}-{}-{}-{}-{}'.format(device.VendorID,
+                                   device.ProductCode,
+                                   device.Revision,
+                                   device.SerialNumber,
+                                   device.ProductName)
+
+
+def udt_to_dict(udt):
+    """
+    Convert a UDT and its fields to a json serializable dict
+    """
+    fields = []
+    for field in udt.Fields:
+        f = {name: getattr(field, name) for name in _TAG_FIELDS}
+        f['Bytes'] = field.Bytes.hex() if field.Bytes is not None else None
+        fields.append(f)
+    return {'Type': udt.Type, 'Name': udt.Name, 'Fields': fields}
+
+
+def udt_from_dict(data):
+    """
+    Rebuild a UDT and its fields from udt_to_dict() output
+    """
+    udt = UDT()
+    udt.Type = data['Type']
+    udt.Name = data['Name']
+    for f in data['Fields']:
+        field = Tag()
+        for name in _TAG_FIELDS:
+            setattr(field, name, f[name])
+        field.Bytes = bytes.fromhex(f['Bytes']) if f['Bytes'] is not None else None
+        field.UDT = udt
+        udt.Fields.append(field)
+        udt.FieldsByName[field.TagName] = field
+    return udt
+
+
+def read_cache_file(path):
+    """
+    Read the whole cache file, returns an empty cache if the file
+    does not exist or can't be parsed
+    """
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(data, dict) or data.get('version') != CACHE_VERSION:
+        return {}
+    return data.get('controllers', {})
+
+
+def load_cache(path, identity):
+    """
+    Load the cache of one controller.
+
+    returns (known_tags, udts), known_tags is a dict {base tag: (data type, data length)}
+    and udts is a dict {template instance: UDT}
+    """
+    entry = read_cache_file(path).get(identity)
+    if not entry:
+        return {}, {}
+
+    known_tags = {tag: tuple(value) for tag, value in entry.get('known_tags', {}).items()}
+    udts = {}
+    for u in entry.get('udt', []):
+        udt = udt_from_dict(u)
+        udts[udt.Type] = udt
+    return known_tags, udts
+
+
+def save_cache(path, identity, known_tags, udts, stale=()):
+    """
+    Store the cache of one controller, the caches of other controllers
+    in the same file are kept.  The entry of the controller is merged
+    with the one in the file, so a process that learned only part of
+    the tags doesn't drop the others; the stale tags (data type found
+    outdated) are removed.  The file is replaced atomically so a power
+    cut can't leave a half written cache behind.
+    """
+    controllers = read_cache_file(path)
+    entry = controllers.get(identity) or {}
+
+    cached_tags = entry.get('known_tags', {})
+    for tag in stale:
+        cached_tags.pop(tag, None)
+    cached_tags.update({tag: list(value) for tag, value in known_tags.items()})
+
+    cached_udts = {u['Type']: u for u in entry.get('udt', [])}
+    cached_udts.update({udt.Type: udt_to_dict(udt) for udt in udts.values()})
+
+    controllers[identity] = {'known_tags': cached_tags, 'udt': list(cached_udts.values())}
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({'version': CACHE_VERSION, 'controllers': controllers}, f)
+        # on the disk before the rename, or a power cut may leave an empty file under the new name
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
@@ -14,14 +14,15 @@
    limitations under the License.
 """
 import errno
-import pylogix
 import socket
 
 from random import randrange
 from struct import pack, unpack_from
 
-from pylogix.utils import is_micropython
+from .utils import is_micropython
 
+# size of the EIP encapsulation header, the payload length is at byte 2
+EIP_HEADER_SIZE = 24
 
 
 # noinspection PyMethodMayBeStatic
@@ -31,6 +32,7 @@ class Connection(object):
         self.parent = parent
 
         self.ConnectionSize = None  # Default to try Large, then Small Fwd Open.
+        self.NegotiatedSize = None  # Connection size accepted by the PLC on the last Fwd Open.
         self.Socket = socket.socket()
         self.SocketConnected = False
 
@@ -44,6 +46,8 @@ class Connection(object):
         self._session_handle = 0x0000
         self._sequence_counter = 1
         self._vendor_id = 0x1337
+        # receive buffer reused for every reply, grown when a reply doesn't fit
+        self._rx_buffer = bytearray(4096)
 
     def connect(self, connected=True):
         """
@@ -88,6 +92,20 @@ class Connection(object):
             else:
                 return [True, 'Success']
 
+        ret = self._open_session()
+        if not ret[0]:
+            return ret
+
+        if connected:
+            return self._negotiate_forward_open()
+
+        self.SocketConnected = True
+        return [self.SocketConnected, 'Success']
+
+    def _open_session(self):
+        """
+        Open the socket and register the EIP session
+        """
         try:
             try:
                 self.Socket.close()
@@ -118,7 +136,12 @@ class Connection(object):
                 return [False, 1]
 
         # register the session
-        self.Socket.send(self._build_register_session())
+        try:
+            self.Socket.send(self._build_register_session())
+        except OSError as e:
+            self.SocketConnected = False
+            self.Socket.close()
+            return [False, e]
         ret_data = self.receive_data()
         if ret_data:
             self._session_handle = unpack_from('<I', ret_data, 4)[0]
@@ -127,23 +150,37 @@ class Connection(object):
             self.SocketConnected = False
             return [False, 'Register session failed']
 
-        if connected:
-            if self.ConnectionSize is not None:
-                ret = self._forward_open()
-            else:
-                # try a large forward open by default
-                self.ConnectionSize = 4002
-                ret = self._forward_open()
+        return [True, 'Success']
 
-                # if large forward open fails, try a normal forward open
-                if not ret[0]:
-                    self.ConnectionSize = 504
-                    ret = self._forward_open()
+    def _negotiate_forward_open(self):
+        """
+        Open the CIP connection with the largest connection size the PLC accepts.
 
-            return ret
+        An explicitly set ConnectionSize is used as is.  Otherwise a Large Forward
+        Open (4002 bytes) is tried first, falling back to a standard Forward Open
+        (504 bytes) on controllers that reject it.  The accepted size is kept in
+        NegotiatedSize and tried first on the next connect, so reconnecting to a
+        controller without Large Forward Open doesn't cost a rejected request.
+        """
+        if self.ConnectionSize is not None:
+            return self._forward_open(self.ConnectionSize)
 
-        self.SocketConnected = True
-        return [self.SocketConnected, 'Success']
+        sizes = [4002, 504]
+        if self.NegotiatedSize in sizes:
+            sizes.remove(self.NegotiatedSize)
+            sizes.insert(0, self.NegotiatedSize)
+
+        ret = [False, 'Forward open failed']
+        for i, size in enumerate(sizes):
+            if i > 0 and not self._registered:
+                # the PLC dropped the socket on the rejected forward open
+                ret = self._open_session()
+                if not ret[0]:
+                    return ret
+            ret = self._forward_open(size)
+            if ret[0]:
+                break
+        return ret
 
     def _close_connection(self):
         """
@@ -192,10 +229,52 @@ class Connection(object):
     def receive_data(self):
         """
         When receiving data from the socket, it is possible to receive
-        incomplete data.  The initial packet that comes in contains
-        the length of the payload.  We can use that to keep calling
-        socket receive until the entire payload is received.  This only happens
-        when using LargeForwardOpen
+        incomplete data.  The EIP encapsulation header contains
+        the length of the payload.  We read the header first, then fill the
+        receive buffer in place until the entire payload is received.  This
+        only happens when using LargeForwardOpen
+
+        returns a memoryview of the receive buffer, not a copy: it is only
+        valid until the next receive, the callers unpack or copy what they
+        keep before sending the next request
+        """
+        if not hasattr(self.Socket, 'recv_into'):
+            return self._receive_data_legacy()
+
+        try:
+            view = memoryview(self._rx_buffer)
+            if not self._recv_exactly(view, 0, EIP_HEADER_SIZE):
+                return None
+            size = EIP_HEADER_SIZE + unpack_from('<H', self._rx_buffer, 2)[0]
+            if size > len(self._rx_buffer):
+                # a new buffer, keeping the header already received: a view of the
+                # previous reply still held somewhere doesn't prevent the resize
+                rx_buffer = bytearray(size)
+                rx_buffer[:EIP_HEADER_SIZE] = view[:EIP_HEADER_SIZE]
+                self._rx_buffer = rx_buffer
+                view = memoryview(rx_buffer)
+            if not self._recv_exactly(view, EIP_HEADER_SIZE, size):
+                return None
+        except (Exception, ):
+            return None
+
+        return view[:size]
+
+    def _recv_exactly(self, view, start, end):
+        """
+        Fill view[start:end] from the socket, returns False
+        if the PLC closed the connection
+        """
+        while start < end:
+            n = self.Socket.recv_into(view[start:end], end - start)
+            if not n:
+                return False
+            start += n
+        return True
+
+    def _receive_data_legacy(self):
+        """
+        Receive for sockets without recv_into (micropython)
         """
         data = b''
         try:
@@ -219,7 +298,8 @@ class Connection(object):
         eip_length = 0x0004
         eip_session_handle = self._session_handle
         eip_status = 0x0000
-        eip_context = '{:<8}'.format(pylogix.__version__).encode("utf-8")
+        from . import __version__
+        eip_context = '{:<8}'.format(__version__).encode("utf-8")
         eip_options = 0x0000
 
         eip_proto_version = 0x01
@@ -254,24 +334,29 @@ class Connection(object):
                     eip_context,
                     eip_options)
 
-    def _forward_open(self):
+    def _forward_open(self, connection_size):
         """
         ForwardOpen connection.
         """
-        self.Socket.send(self._build_forward_open_packet())
         try:
+            self.Socket.send(self._build_forward_open_packet(connection_size))
             ret_data = self.receive_data()
-        except socket.timeout as e:
+        except OSError as e:
+            self.SocketConnected = False
+            self._registered = False
             return [False, e]
         
         if not ret_data:
-            self.SoocketConnected = False
+            # the PLC closed the socket, the session has to be registered again
+            self.SocketConnected = False
+            self._registered = False
             return [False, "Forward open failed"]
             
         sts = unpack_from('<b', ret_data, 42)[0]
         if not sts:
             self._ot_connection_id = unpack_from('<I', ret_data, 44)[0]
             self._connected = True
+            self.NegotiatedSize = connection_size
         else:
             self.SocketConnected = False
             return [False, 'Forward open failed']
@@ -279,15 +364,15 @@ class Connection(object):
         self.SocketConnected = True
         return [self.SocketConnected, 'Success']
 
-    def _build_forward_open_packet(self):
+    def _build_forward_open_packet(self, connection_size):
         """
         Assemble the forward open packet
         """
-        forward_open = self._build_cip_forward_open()
+        forward_open = self._build_cip_forward_open(connection_size)
         header = self._build_rr_data_header(len(forward_open))
         return header + forward_open
 
-    def _build_cip_forward_open(self):
+    def _build_cip_forward_open(self, connection_size):
         """
         Forward Open happens after a connection is made,
         this will define the CIP connection parameters
@@ -315,14 +400,14 @@ class Connection(object):
 
         # decide whether to use the standard ForwardOpen
         # or the large format
-        if self.ConnectionSize <= 511:
+        if connection_size <= 511:
             cip_service = 0x54
-            cip_connection_parameters += self.ConnectionSize
+            cip_connection_parameters += connection_size
             pack_format = '<BBBBBBBBIIHHIIIHIHB'
         else:
             cip_service = 0x5B
             cip_connection_parameters = cip_connection_parameters << 16
-            cip_connection_parameters += self.ConnectionSize
+            cip_connection_parameters += connection_size
             pack_format = '<BBBBBBBBIIHHIIIIIIB'
 
         cip_ot_connection_parameters = cip_connection_parameters
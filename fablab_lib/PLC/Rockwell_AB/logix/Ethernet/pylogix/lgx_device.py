@@ -166,9 +166,9 @@ devices = {0x00: 'Generic Device (deprecated)',
            0x2C: 'Managed Switch',
            0x32: 'ControlNet Physical Layer Component'}
 
-from pylogix.utils import is_micropython
+from .utils import is_micropython
 
 if is_micropython():
-    from pylogix.lgx_uvendors import uvendors as vendors
+    from .lgx_uvendors import uvendors as vendors
 else:
-    from pylogix.lgx_vendors import vendors
+    from .lgx_vendors import vendors
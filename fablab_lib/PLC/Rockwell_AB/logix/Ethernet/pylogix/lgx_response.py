@@ -16,7 +16,7 @@
 
 import sys
 
-from pylogix.utils import is_python3, is_micropython, is_python2
+from .utils import is_python3, is_micropython, is_python2
 
 
 class Response(object):
@@ -91,7 +91,7 @@ class Tag(object):
 
         t = Tag()
         length = unpack_from('<H', packet, 4)[0]
-        name = packet[6:length+6].decode('utf-8')
+        name = str(packet[6:length+6], 'utf-8')
         if program_name:
             t.TagName = str(program_name + '.' + name)
         else:
@@ -1,6 +1,6 @@
 # lgx_uvendors.py/.mpy
 # Micropython proxy class for large dict vendors in lgx_vendors.py
-from pylogix.utils import is_python2
+from .utils import is_python2
 
 
 class Uvendors:
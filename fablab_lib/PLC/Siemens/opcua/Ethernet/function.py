@@ -13,13 +13,13 @@ Functions:
 
 Note: This code requires the opcua library to be installed.
 """
-import subprocess
 import logging
 import time
 import threading
 from opcua import Client, ua, Node
+from fablab_lib.Logic.function import LogicExpr
+from fablab_lib.Network.function import probe_tcp, PORT_OPCUA, DOWN_INTERVAL_MIN, DOWN_INTERVAL_MAX
 
-lock = threading.Lock()
 
 # Application logger
 logger = logging.getLogger("PLC_S7 1200")
@@ -29,56 +29,42 @@ _log_handle.setFormatter(logging.Formatter('%(asctime)s %(name)s %(levelname)s |
 logger.addHandler(_log_handle)
 
 
-def is_ethernet_connected(host: str, is_pc: bool = False) -> bool:
+def is_ethernet_connected(host: str, is_pc: bool = False, port: int = PORT_OPCUA) -> bool:
     """
-    Checks if the Ethernet connection to the specified IP address is active.
+    Checks if the PLC at the specified IP address answers on its service port (TCP connect probe).
 
     Args:
-        host (str): The IP address to ping.
-        is_pc (bool, optional): Specifies whether the IP address belongs to a Laptop. Defaults to False for Raspberry Pi connection.
+        host (str): The IP address of the PLC.
+        is_pc (bool, optional): Not used anymore, the check doesn't depend on the OS. Defaults to False.
+        port (int, optional): The TCP port of the PLC. Defaults to PORT_OPCUA (4840).
 
     Returns:
         bool: True if the Ethernet connection is active, False otherwise.
     """
-
-    try:
-        if is_pc:
-            ping_command = ["ping", "-n", "1", host]
-        else:
-            ping_command = ["ping", "-c", "1", host]
-        ping_process = subprocess.Popen(ping_command, 
-                                        stdout=subprocess.PIPE, 
-                                        stderr=subprocess.PIPE
-                                        )
-
-        return_code = ping_process.wait()
-        if return_code == 0:
-            logger.info(f"Ethernet connection to {host} is active.")
-            return True
-        else:
-            logger.warning(f"Ethernet connection to {host} is not active.")  
-            return False
-        
-    except subprocess.CalledProcessError as e:
-        # Handle subprocess errors if needed
-        logger.error(f"Error running ping command: {e}")
-        return False
+    if probe_tcp(host, port):
+        logger.info(f"Ethernet connection to {host} is active.")
+        return True
+    logger.info(f"Ethernet connection to {host} is not active.")
+    return False
 
 
-def waiting_for_connection(host: str, is_pc: bool = False): 
+def waiting_for_connection(host: str, is_pc: bool = False, port: int = PORT_OPCUA): 
     """
     Waits for the Ethernet connection to be active in the first time.
+    The checks are retried with an exponential backoff, from 1 s up to 30 s.
 
     Args:
-        host (str): The IP address to ping.
-        is_pc (bool, optional): Specifies whether the IP address belongs to a Laptop. Defaults to False for Raspberry Pi connection.
+        host (str): The IP address of the PLC.
+        is_pc (bool, optional): Not used anymore, the check doesn't depend on the OS. Defaults to False.
+        port (int, optional): The TCP port of the PLC. Defaults to PORT_OPCUA.
 
     Returns:
         None
     """
-    while True:
-        if is_ethernet_connected(host, is_pc):
-            return
+    delay = DOWN_INTERVAL_MIN
+    while not is_ethernet_connected(host, is_pc, port):
+        time.sleep(delay)
+        delay = min(delay * 2, DOWN_INTERVAL_MAX)
 
 
 def get_variables_from_equation(equation):
@@ -98,16 +84,20 @@ def get_variables_from_equation(equation):
     return sorted_variables
 
 
-def convert_logic_equation(bits, equation):
+def convert_logic_equation(bits, equation, _DEBUG: bool = False):
     """
     Converts a logic equation into a boolean result based on the given bits.
 
     Args:
         bits (list): A list of bits representing the values of variables in the equation.
         equation (str): The logic equation to be evaluated.
+        _DEBUG (bool, optional): Specifies whether to log the result. Defaults to False.
         Note: The equation must be in the form of a Python logic equation. ".", "|", "/" are the logical operators 
             for "and", "or", "not" respectively. The variable names must be in lower case.
 
+    Note: The equation is compiled once by LogicExpr.compile() and cached by string,
+    the next calls with the same equation only evaluate it.
+
     Returns:
         bool: The boolean result of the evaluated logic equation.
 
@@ -115,25 +105,9 @@ def convert_logic_equation(bits, equation):
         >>> convert_logic_equation([True, False, True, True, False], '/a|(b.c)|d')
         True
     """
-    lsVariables = get_variables_from_equation(equation)
-    # print(lsVariables)
-
-    # Replace variable names with corresponding bits
-    for chr_ in lsVariables:
-        if chr_.isalpha() and chr_.lower() in 'abcdefghijklmnopqrstuvwxyz':
-            equation = equation.replace(chr_, str(int(bits[ord(chr_) - 97])))
-    # print(equation)
-
-    # Replace the logical operators with Python syntax
-    equation = equation.replace('.', ' and ')
-    equation = equation.replace('|', ' or ')
-    equation = equation.replace('/', ' not ')
-    # Remove all extra spaces from the equation
-    equation = ' '.join(equation.split())
-    # print(equation)
-
-    # Evaluate the expression using eval
-    result = bool(eval(equation))
+    result = LogicExpr.compile(equation)(bits)
+    if _DEBUG:
+        logger.info(f"Logic equation: {equation} = {result}")
     return result
 
 
@@ -221,6 +195,8 @@ class PLC:
         self.port = port
         self.nameStation = nameStation
         self.is_pc = is_pc
+        # One lock per PLC: the calls of two threads never share its socket, the other PLCs are not waiting
+        self._lock = threading.Lock()
 
         self.url = f"opc.tcp://{self.host}:{self.port}"
 
@@ -237,7 +213,7 @@ class PLC:
         if self.nameStation is not None:
             logger.name = f'PLC_S7_1200 - {self.nameStation}'
 
-        waiting_for_connection(self.host, self.is_pc)
+        waiting_for_connection(self.host, self.is_pc, self.port)
 
 
     def opcua_client(self) -> None:
@@ -259,7 +235,6 @@ class PLC:
         self.subscription_handle_list = []
 
         while True:
-            print(case)
             if case == 1:
                 # connect
                 logger.info(f"Connecting...")
@@ -304,7 +279,7 @@ class PLC:
             elif case == 3:
                 # running => read cyclic the service level if it fails disconnect and unsubscribe => wait 5s => connect
                 try:
-                    with lock:
+                    with self._lock:
                         service_level = self.client.get_node("ns=0;i=2267").get_value()
                     if service_level >= 200:
                         case = 3
@@ -373,7 +348,7 @@ class PLC:
         
         Note: This method is not used if subscription is needed. Use opcua_client() instead.
         """
-        with lock:
+        with self._lock:
             _node = self.plc.get_node(node)
             _value = _node.get_value()
             _name = _node.get_display_name().Text
@@ -397,7 +372,7 @@ class PLC:
         Returns:
             None
         """
-        with lock:
+        with self._lock:
             _node = self.plc.get_node(node)
             if type == 'BOOL':
                 _node.set_attribute(ua.AttributeIds.value, ua.DataValue(bool(value)))
@@ -425,6 +400,58 @@ class PLC:
             logger.info(f"Write data to PLC: {node}, {value}")
 
 
+    def read_tags(self, ls_nodes: list, _DEBUG: bool = False) -> list:
+        """
+        Reads multiple nodes from the PLC S7 1200 with a single Read request.
+
+        Args:
+            ls_nodes (list): A list of node ids, e.g. 'ns=3;s="DB1"."Speed"', or tuples (node id, type) as used by
+            the other vendors. The type is ignored, the server knows the data type of its nodes.
+            _DEBUG (bool, optional): Specifies whether to print debug messages. Defaults to False.
+
+        Returns:
+            list: A list of tuples (node id, value), in the order of ls_nodes.
+
+        Note: This method is not used if subscription is needed. Use opcua_client() instead.
+        """
+        if not ls_nodes:
+            return []
+
+        ls_nodes = [node[0] if isinstance(node, tuple) else node for node in ls_nodes]
+        with self._lock:
+            ls_value = self.plc.get_values([self.plc.get_node(node) for node in ls_nodes])
+
+        ls_result = list(zip(ls_nodes, ls_value))
+        if _DEBUG:
+            logger.info(f"Read data from PLC: \n{ls_result}")
+        return ls_result
+
+
+    def write_tags(self, ls_nodeValueType: list, _DEBUG: bool = False) -> list:
+        """
+        Writes multiple nodes to the PLC S7 1200.
+
+        Args:
+            ls_nodeValueType (list): A list of tuples (node id, value, type), see writeData for the types.
+            _DEBUG (bool, optional): Specifies whether to print debug messages. Defaults to False.
+
+        Returns:
+            list: A list of booleans, True if the corresponding node was written successfully.
+        """
+        ls_status = []
+        for node, value, type in ls_nodeValueType:
+            try:
+                self.writeData(node, value, type, _DEBUG=False)
+                ls_status.append(True)
+            except Exception as e:
+                logger.error(f"Error writing data to PLC: {node}, {e}")
+                ls_status.append(False)
+
+        if _DEBUG:
+            logger.info(f"Write data to PLC: \n{ls_nodeValueType} \n{ls_status}")
+        return ls_status
+
+
     def get_node(self, node: str) -> Node:
         """
         Gets the node from the PLC S7 1200.
@@ -435,7 +462,7 @@ class PLC:
         Returns:
             Node: The node of the variable.
         """
-        with lock:
+        with self._lock:
             _node = self.plc.get_node(node)
         
         return _node
@@ -496,7 +523,6 @@ class PLC:
         case = 0
         count = 0
         while True:
-            print(case)
             if case == 1:
                 # connect
                 logger.info(f"Connecting...")
@@ -513,7 +539,7 @@ class PLC:
             elif case == 2:
                 # running => read cyclic the service level if it fails disconnect and unsubscribe => wait 5s => connect
                 try:
-                    with lock:
+                    with self._lock:
                         service_level = self.client.get_node(refNodeAddr).get_value()
                     if service_level >= 200:
                         count += 1
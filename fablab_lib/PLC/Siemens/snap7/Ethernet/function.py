@@ -19,12 +19,12 @@ Install: pip install python-snap7   or    pip3 install python-snap7
 """
 from fablab_lib.PLC.Siemens.snap7.Ethernet import snap7
 from fablab_lib.PLC.Siemens.snap7.Ethernet.snap7.util import *
-import subprocess
 import logging
 import time
 import threading
+from fablab_lib.Logic.function import LogicExpr
+from fablab_lib.Network.function import probe_tcp, PORT_S7, DOWN_INTERVAL_MIN, DOWN_INTERVAL_MAX
 
-lock = threading.Lock() # Create a lock to prevent multiple threads from accessing the same PLC at the same time
 
 # Application logger
 logger = logging.getLogger("PLC_S7-200")
@@ -48,55 +48,42 @@ class DT:
     Timer = 0x1D
 
 
-def is_ethernet_connected(host: str, is_pc: bool = False) -> bool:
+def is_ethernet_connected(host: str, is_pc: bool = False, port: int = PORT_S7) -> bool:
     """
-    Checks if the Ethernet connection to the specified IP address is active.
+    Checks if the PLC at the specified IP address answers on its service port (TCP connect probe).
 
     Args:
-        host (str): The IP address to ping.
-        is_pc (bool, optional): Specifies whether the IP address belongs to a Laptop. Defaults to False for Raspberry Pi connection.
+        host (str): The IP address of the PLC.
+        is_pc (bool, optional): Not used anymore, the check doesn't depend on the OS. Defaults to False.
+        port (int, optional): The TCP port of the PLC. Defaults to PORT_S7 (102).
 
     Returns:
         bool: True if the Ethernet connection is active, False otherwise.
     """
-    try:
-        if is_pc:
-            ping_command = ["ping", "-n", "1", host]
-        else:
-            ping_command = ["ping", "-c", "1", host]
-        ping_process = subprocess.Popen(ping_command, 
-                                        stdout=subprocess.PIPE, 
-                                        stderr=subprocess.PIPE
-                                        )
-
-        return_code = ping_process.wait()
-        if return_code == 0:
-            logger.info(f"Ethernet connection to {host} is active.")
-            return True
-        else:
-            logger.info(f"Ethernet connection to {host} is not active.")  
-            return False
-        
-    except subprocess.CalledProcessError as e:
-        # Handle subprocess errors if needed
-        logger.error(f"Error running ping command: {e}")
-        return False
+    if probe_tcp(host, port):
+        logger.info(f"Ethernet connection to {host} is active.")
+        return True
+    logger.info(f"Ethernet connection to {host} is not active.")
+    return False
 
 
-def waiting_for_connection(host: str, is_pc: bool = False): 
+def waiting_for_connection(host: str, is_pc: bool = False, port: int = PORT_S7): 
     """
     Waits for the Ethernet connection to be active in the first time.
+    The checks are retried with an exponential backoff, from 1 s up to 30 s.
 
     Args:
-        host (str): The IP address to ping.
-        is_pc (bool, optional): Specifies whether the IP address belongs to a Laptop. Defaults to False for Raspberry Pi connection.
+        host (str): The IP address of the PLC.
+        is_pc (bool, optional): Not used anymore, the check doesn't depend on the OS. Defaults to False.
+        port (int, optional): The TCP port of the PLC. Defaults to PORT_S7.
 
     Returns:
         None
     """
-    while True:
-        if is_ethernet_connected(host, is_pc):
-            return
+    delay = DOWN_INTERVAL_MIN
+    while not is_ethernet_connected(host, is_pc, port):
+        time.sleep(delay)
+        delay = min(delay * 2, DOWN_INTERVAL_MAX)
 
 
 def get_variables_from_equation(equation):
@@ -116,16 +103,20 @@ def get_variables_from_equation(equation):
     return sorted_variables
 
 
-def convert_logic_equation(bits, equation):
+def convert_logic_equation(bits, equation, _DEBUG: bool = False):
     """
     Converts a logic equation into a boolean result based on the given bits.
 
     Args:
         bits (list): A list of bits representing the values of variables in the equation.
         equation (str): The logic equation to be evaluated.
+        _DEBUG (bool, optional): Specifies whether to log the result. Defaults to False.
         Note: The equation must be in the form of a Python logic equation. ".", "|", "/" are the logical operators 
             for "and", "or", "not" respectively. The variable names must be in lower case.
 
+    Note: The equation is compiled once by LogicExpr.compile() and cached by string,
+    the next calls with the same equation only evaluate it.
+
     Returns:
         bool: The boolean result of the evaluated logic equation.
 
@@ -133,22 +124,9 @@ def convert_logic_equation(bits, equation):
         >>> convert_logic_equation([True, False, True, True, False], '/a|(b.c)|d')
         True
     """
-    lsVariables = get_variables_from_equation(equation)
-    # Replace variable names with corresponding bits
-    for chr_ in lsVariables:
-        if chr_.isalpha() and chr_.lower() in 'abcdefghijklmnopqrstuvwxyz':
-            equation = equation.replace(chr_, str(int(bits[ord(chr_) - 97])))
-
-    # Replace the logical operators with Python syntax
-    equation = equation.replace('.', ' and ')
-    equation = equation.replace('|', ' or ')
-    equation = equation.replace('/', ' not ')
-    # Remove all extra spaces from the equation
-    equation = ' '.join(equation.split())
-
-    # Evaluate the expression using eval
-    result = bool(eval(equation))
-    logger.info(f"Logic equation: {equation} = {result}")
+    result = LogicExpr.compile(equation)(bits)
+    if _DEBUG:
+        logger.info(f"Logic equation: {equation} = {result}")
     return result
 
 
@@ -190,7 +168,8 @@ class PLC:
             localtsap: int = 0x1000,
             remotetsap: int = 0x301,
             nameStation: str = None,
-            is_pc=False
+            is_pc=False,
+            port: int = PORT_S7
         ) -> None:
         """
         Represents a Siemens S7-200-SMART PLC and provides methods for connecting to the PLC and reading/writing data.
@@ -203,19 +182,23 @@ class PLC:
             remotetsap (int, optional): The remote TSAP of the PLC. Defaults to 0x301.
             nameStation (str, optional): The name of the PLC station. Defaults to None.
             is_pc (bool, optional): Specifies whether the IP address belongs to a Laptop. Defaults to False for Raspberry Pi connection.
+            port (int, optional): The ISO-on-TCP port of the PLC. Defaults to PORT_S7 (102).
         """
         self.host = host
+        self.port = port
         self.rack = rack
         self.slot = slot
         self.localtsap = localtsap
         self.remotetsap = remotetsap
         self.nameStation = nameStation
         self.is_pc = is_pc
+        # One lock per PLC: the calls of two threads never share its socket, the other PLCs are not waiting
+        self._lock = threading.Lock()
 
         if self.nameStation is not None:
             logger.name = f'PLC_S7_200_SMART - {self.nameStation}'
 
-        waiting_for_connection(self.host, self.is_pc)
+        waiting_for_connection(self.host, self.is_pc, self.port)
 
 
     def connect(self) -> None:
@@ -224,7 +207,7 @@ class PLC:
         """
         self.plc = snap7.client.Client()
         self.plc.set_connection_params(self.host, self.localtsap, self.remotetsap)
-        self.plc.connect(self.host, self.rack, self.slot)
+        self.plc.connect(self.host, self.rack, self.slot, self.port)
 
         if (self.plc.get_connected()):
             logger.info(f"Connected to PLC {self.host}.")
@@ -314,7 +297,7 @@ class PLC:
             start = int(varAddr[2:])
 
         # Read data from the PLC
-        with lock:
+        with self._lock:
             if varAddr[0].lower() == 'v':
                 mbyte = self.plc.db_read(1, start, length)
             else:
@@ -408,7 +391,7 @@ class PLC:
             start = int(varAddr[2:])
 
         # Write data to the PLC
-        with lock:
+        with self._lock:
             if varAddr[0].lower() == 'v':
                 self.plc.db_write(1, start, varValue)
             else:
@@ -438,6 +421,55 @@ class PLC:
         return varValue
 
 
+    def read_tags(self, ls_varAddr: list, _DEBUG: bool = False) -> list:
+        """
+        Reads multiple variables from the PLC S7-200-SMART.
+
+        Args:
+            ls_varAddr (list): A list of variable addresses (see readData), or tuples (variable address, variable type)
+            as used by the other vendors. The type is ignored, the address gives the size of the variable.
+            _DEBUG (bool, optional): Specifies whether to print debug messages. Defaults to False.
+
+        Returns:
+            list: A list of tuples (variable address, value), in the order of ls_varAddr.
+            The value is None if the address is not valid.
+        """
+        ls_result = []
+        for varAddr in ls_varAddr:
+            if isinstance(varAddr, tuple):
+                varAddr = varAddr[0]
+            ls_result.append((varAddr, self.readData(varAddr)[1]))
+
+        if _DEBUG:
+            logger.info(f"Read data from PLC: \n{ls_result}")
+        return ls_result
+
+
+    def write_tags(self, ls_varAddrValue: list, _DEBUG: bool = False) -> list:
+        """
+        Writes multiple variables to the PLC S7-200-SMART.
+
+        Args:
+            ls_varAddrValue (list): A list of tuples (variable address, value).
+            _DEBUG (bool, optional): Specifies whether to print debug messages. Defaults to False.
+
+        Returns:
+            list: A list of booleans, True if the corresponding variable was written successfully.
+        """
+        ls_status = []
+        for varAddr, varValue in ls_varAddrValue:
+            try:
+                self.writeData(varAddr, varValue)
+                ls_status.append(True)
+            except Exception as e:
+                logger.error(f"Error writing data to PLC: {varAddr}, {e}")
+                ls_status.append(False)
+
+        if _DEBUG:
+            logger.info(f"Write data to PLC: \n{ls_varAddrValue} \n{ls_status}")
+        return ls_status
+
+
     def checkLogicBits(self, bits: list, equation: str) -> bool:
         """
         Checks the logic bits.
@@ -471,12 +503,11 @@ class PLC:
         count = 0
         case = 0
         while True:
-            print(case)
             if case == 1:
                 # connect
                 logger.info(f"Connecting to PLC...")
                 try:
-                    self.plc.connect(self.host, self.rack, self.slot)
+                    self.plc.connect(self.host, self.rack, self.slot, self.port)
                     logger.info(f"Connected to PLC.")
                     case = 2
                 except Exception as e:
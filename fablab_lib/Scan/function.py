@@ -0,0 +1,632 @@
+"""
+This file contains the implementation of the ScanEngine class, which scans groups of PLC variables
+at fixed periods and sends the values that changed to sinks (MQTT, SparkplugB, CSV file, ...).
+
+The engine replaces the hand-written polling threads: the variables are declared in groups with
+a target period (e.g. alarms 100 ms, counters 500 ms, settings 10 s), the groups of the same period
+are read together with the block read of the PLC driver (read_tags) when it has one, and all the
+periods are run by a single deadline scheduler so the reads never compete for the PLC lock.
+
+Example:
+    >>> plc = PLC_Mitsu.PLC(host='192.168.3.39', port=5007)
+    >>> plc.connect()
+    >>> engine = ScanEngine(plc)
+    >>> engine.add_group(TagGroup('Alarm', 0.1, [ScanTag('M3', 'M3', DT.BIT)]))
+    >>> engine.add_group(TagGroup('Setting', 10, [ScanTag('SPEED', 'D100', DT.SWORD, scale=0.01)]))
+    >>> engine.add_sink(MQTTSink(client))
+    >>> engine.start()
+"""
+
+from array import array
+from datetime import datetime
+import heapq
+import logging
+import math
+import threading
+import time
+
+from fablab_lib.Metrics.function import metrics
+from fablab_lib.Network.function import PLCUnavailable
+
+# Application logger
+logger = logging.getLogger("ScanEngine")
+logger.setLevel(logging.DEBUG)
+_log_handle = logging.StreamHandler()
+_log_handle.setFormatter(logging.Formatter('%(asctime)s %(name)s %(levelname)s | %(message)s'))
+logger.addHandler(_log_handle)
+
+LATE_LOG_INTERVAL = 10          # seconds between two warnings about late cycles of the same period
+
+_NAN = float('nan')
+_MISSING = object()
+
+
+class TagState:
+    """
+    Stores the state of a block of variables in contiguous typed arrays (array.array of doubles):
+    current values, last published values, scale factors, deadbands, heartbeats and last publish times.
+
+    update() compares a whole scan block in one pass and returns the indices of the variables that must
+    be published: the value moved by more than its deadband since it was last published, or the variable
+    was not published for longer than its heartbeat (max silence).
+
+    Values that are not numbers (e.g. strings) are compared for equality in a side table.
+
+    Args:
+        size (int): The number of variables.
+        scale (list, optional): The factor applied to each raw value before comparing. Defaults to 1.
+        deadband (list, optional): The minimum change of each scaled value to be published. Defaults to 0 (any change).
+        heartbeat (list, optional): The maximum time in seconds between two publishes of each variable,
+        0 to disable. Defaults to 0.
+
+    Examples:
+        >>> state = TagState(2, deadband=[0.5, 0])
+        >>> state.update([10, 1], now=0)
+        [0, 1]
+        >>> state.update([10.2, 2], now=1)
+        [1]
+    """
+
+    def __init__(self, size: int, scale: list = None, deadband: list = None, heartbeat: list = None):
+        self.size = size
+        self.current = array('d', [_NAN]) * size
+        self.published = array('d', [_NAN]) * size
+        self.scale = array('d', scale if scale is not None else [1.0] * size)
+        self.deadband = array('d', deadband if deadband is not None else [0.0] * size)
+        self.heartbeat = array('d', heartbeat if heartbeat is not None else [0.0] * size)
+        self.last_publish = array('d', [-math.inf]) * size
+        self._objects = {}              # index -> last published value that is not a number
+
+        self._is_scaled = any(s != 1 for s in self.scale)
+        self._has_heartbeat = any(self.heartbeat)
+
+
+    def _load(self, values: list) -> list:
+        """
+        Stores the scaled values in self.current, returns the indices of values that are not numbers.
+        """
+        try:
+            current = array('d', [_NAN if v is None else v for v in values])
+            objects = []
+        except TypeError:
+            current = array('d', [_NAN]) * self.size
+            objects = []
+            for i, v in enumerate(values):
+                if isinstance(v, (int, float)):
+                    current[i] = v
+                elif v is not None:
+                    objects.append(i)
+        if self._is_scaled:
+            current = array('d', [v * s for v, s in zip(current, self.scale)])
+        self.current = current
+        return objects
+
+
+    def update(self, values: list, now: float = None) -> list:
+        """
+        Loads a scan block and marks the variables that must be published as published.
+
+        Args:
+            values (list): The raw values of the block, None for a value that could not be read.
+            now (float, optional): The time of the scan in seconds. Defaults to time.monotonic().
+
+        Returns:
+            list: The sorted indices of the variables to publish.
+        """
+        if now is None:
+            now = time.monotonic()
+        objects = self._load(values)
+        current = self.current
+
+        # NaN (not read) never compares as changed, NaN published (never published) always does
+        changed = [i for i, (c, p, d) in enumerate(zip(current, self.published, self.deadband))
+                   if c == c and not abs(c - p) <= d]
+
+        for i in objects:
+            if self._objects.get(i, _MISSING) != values[i]:
+                changed.append(i)
+
+        if self._has_heartbeat:
+            due = set(changed)
+            for i, (h, t) in enumerate(zip(self.heartbeat, self.last_publish)):
+                if h and now - t >= h and i not in due and values[i] is not None:
+                    changed.append(i)
+            changed.sort()
+        elif objects:
+            changed.sort()
+
+        for i in changed:
+            self.published[i] = current[i]
+            self.last_publish[i] = now
+            if current[i] != current[i]:
+                self._objects[i] = values[i]
+        return changed
+
+
+    def value(self, i: int, values: list):
+        """
+        Returns the scaled value of the variable i of the block given to the last update(), the raw value
+        if it is not a number or not scaled (an int stays an int).
+        """
+        value = values[i]
+        if self.scale[i] != 1 and isinstance(value, (int, float)):
+            return self.current[i]
+        return value
+
+
+class ScanTag:
+    """
+    A PLC variable scanned by the ScanEngine.
+
+    Args:
+        name (str): The name of the variable, used by the sinks (e.g. the MQTT topic).
+        addr: The address of the variable in the PLC (e.g. 'D100', 'Program:Main.Count').
+        varType (optional): The data type of the variable, as expected by the PLC driver. Defaults to None.
+        scale (float, optional): The factor applied to the raw value before it is sent. Defaults to 1.
+        deadband (float, optional): The minimum change of the scaled value to be sent. Defaults to 0 (any change).
+    """
+
+    __slots__ = ('name', 'addr', 'varType', 'scale', 'deadband')
+
+    def __init__(self, name: str, addr, varType=None, scale: float = 1, deadband: float = 0):
+        self.name = name
+        self.addr = addr
+        self.varType = varType
+        self.scale = scale
+        self.deadband = deadband
+
+
+    def __repr__(self):
+        return f'ScanTag({self.name!r}, {self.addr!r}, {self.varType!r}, {self.scale!r}, {self.deadband!r})'
+
+
+class TagGroup:
+    """
+    A group of variables scanned at the same period.
+
+    Args:
+        kind (str): The kind of data of the group (e.g. 'Setting', 'Counting', 'Alarm'), passed to the sinks.
+        period (float): The scan period in seconds.
+        tags (list): A list of ScanTag, or of tuples (name, addr[, varType[, scale[, deadband]]]).
+        heartbeat (float, optional): The maximum time in seconds without sending a variable, an unchanged
+        value is sent again after this time. Defaults to 0 (only changes are sent).
+    """
+
+    def __init__(self, kind: str, period: float, tags: list, heartbeat: float = 0):
+        if period <= 0:
+            raise ValueError('The period of a tag group must be positive.')
+        self.kind = kind
+        self.period = period
+        self.tags = [tag if isinstance(tag, ScanTag) else ScanTag(*tag) for tag in tags]
+        self.heartbeat = heartbeat
+
+
+    @classmethod
+    def from_lists(cls, kind: str, period: float, ls_name: list, ls_addr: list, ls_type: list = None, ls_scale: list = None,
+            heartbeat: float = 0):
+        """
+        Creates a group from the lists returned by LogFileCSV.get_info_variable_from_csv().
+
+        Args:
+            kind (str): The kind of data of the group.
+            period (float): The scan period in seconds.
+            ls_name (list): The names of the variables.
+            ls_addr (list): The addresses of the variables.
+            ls_type (list, optional): The data types of the variables. Defaults to None.
+            ls_scale (list, optional): The scale factors of the variables. Defaults to None.
+            heartbeat (float, optional): The maximum time in seconds without sending a variable. Defaults to 0.
+
+        Returns:
+            TagGroup: The group of variables.
+        """
+        ls_type = ls_type if ls_type is not None else [None] * len(ls_name)
+        ls_scale = ls_scale if ls_scale is not None else [1] * len(ls_name)
+        return cls(kind, period, [ScanTag(*tag) for tag in zip(ls_name, ls_addr, ls_type, ls_scale)], heartbeat)
+
+
+class _Slot:
+    """
+    The groups sharing a period, read with a single block read.
+    """
+
+    def __init__(self, period: float):
+        self.period = period
+        self.groups = []
+        self.tags = []              # (group, index in group, tag) of all the groups
+        self.state = TagState(0)
+        self.deadline = 0.0
+        self.cycles = 0
+        self.late_cycles = 0
+        self.missed_cycles = 0
+        self.unavailable_cycles = 0
+        self.changes = 0
+        self.last_duration = 0.0
+        self.max_duration = 0.0
+        self._last_late_log = 0.0
+
+
+    def add(self, group: TagGroup) -> None:
+        # new lists, a scan in progress keeps the ones it started with
+        self.groups = self.groups + [group]
+        self.tags = self.tags + [(group, i, tag) for i, tag in enumerate(group.tags)]
+        self.state = TagState(len(self.tags),
+                              scale=[tag.scale for _, _, tag in self.tags],
+                              deadband=[abs(tag.deadband) for _, _, tag in self.tags],
+                              heartbeat=[group.heartbeat for group, _, _ in self.tags])
+
+
+class Sink:
+    """
+    Base class of the destinations of the changed values.
+
+    A sink receives, after each scan, the list of changes of one group as tuples (tag, value, timestamp)
+    where timestamp is an ISO 8601 string.
+    """
+
+    def emit(self, group: TagGroup, changes: list) -> None:
+        raise NotImplementedError
+
+
+class MQTTSink(Sink):
+    """
+    Publishes the changed values with an MQTT client (fablab_lib.MQTT).
+
+    Args:
+        client (MQTT): The connected MQTT client.
+        batch (bool, optional): Publishes all the changes of a group in one scan cycle as one message
+        with client.publish_batch(), instead of one message per value. Defaults to False.
+
+    The values are published with the QoS and retain flag of their name or of the kind of their group
+    (MQTT.set_policies).
+    """
+
+    def __init__(self, client, batch: bool = False):
+        self.client = client
+        self.batch = batch
+
+
+    def emit(self, group: TagGroup, changes: list) -> None:
+        if self.batch:
+            self.client.publish_batch([(tag.name, value, timestamp) for tag, value, timestamp in changes])
+            return
+        for tag, value, timestamp in changes:
+            self.client.publish_data(tag.name, value, timestamp=timestamp, kind=group.kind)
+
+
+class SparkplugSink(Sink):
+    """
+    Publishes the changed values of a scan in a single SparkplugB DATA message (fablab_lib.spB).
+
+    Args:
+        spb (SparkplugB): The connected SparkplugB entity. The variables must be declared in its birth certificate.
+    """
+
+    def __init__(self, spb):
+        self.spb = spb
+
+
+    def emit(self, group: TagGroup, changes: list) -> None:
+        for tag, value, _ in changes:
+            self.spb.data_set_value(tag.name, value)
+        self.spb.publish_data()
+
+
+class CSVSink(Sink):
+    """
+    Logs the changed values in a CSV file (fablab_lib.LogFileCSV).
+
+    Args:
+        log (LogFileCSV): The CSV log file.
+        is_connected (callable, optional): Returns the state of the network connection,
+        logged with each value. Defaults to None (always connected).
+    """
+
+    def __init__(self, log, is_connected=None):
+        self.log = log
+        self.is_connected = is_connected
+
+
+    def emit(self, group: TagGroup, changes: list) -> None:
+        is_connected = self.is_connected() if self.is_connected is not None else True
+        for tag, value, timestamp in changes:
+            self.log.log_data(tag.name, tag.addr, value, group.kind, is_connected, timestamp)
+
+
+class CallbackSink(Sink):
+    """
+    Calls a function with each changed value.
+
+    Args:
+        callback (callable): Called as callback(kind, name, addr, value, timestamp).
+    """
+
+    def __init__(self, callback):
+        self.callback = callback
+
+
+    def emit(self, group: TagGroup, changes: list) -> None:
+        for tag, value, timestamp in changes:
+            self.callback(group.kind, tag.name, tag.addr, value, timestamp)
+
+
+class ScanEngine:
+    """
+    Scans groups of PLC variables at fixed periods and sends the changed values to sinks.
+
+    The groups are scheduled by deadline on a single thread: each period has a deadline that advances
+    by exactly one period after each scan, so the scan rate doesn't drift with the read time. A scan
+    that starts more than lateTolerance after its deadline is counted as late, and the deadlines that
+    were missed entirely are skipped instead of being run back to back.
+
+    Args:
+        plc: A connected PLC object of any vendor (fablab_lib.PLC_Mitsu.PLC, PLC_Rockwell.PLC, ...), or the
+        driver of a ConnectionSupervisor so the scans keep running while the PLC reconnects.
+        readFunc (callable, optional): The function reading one variable, called as readFunc(addr) or
+        readFunc(addr, varType) and returning (addr, value). Defaults to a read_tags() of one variable
+        when the driver has it, so the addresses are handled as in the block reads, plc.readData otherwise.
+        useBlockRead (bool, optional): Reads all the variables of a period with plc.read_tags() when the
+        driver has it. Defaults to True.
+        lateTolerance (float, optional): The fraction of the period a scan may start after its deadline
+        without being counted as late. Defaults to 0.1.
+
+    Attributes:
+        on_late (callable): Called as on_late(period, lateness, missed) when a scan is late, lateness in seconds.
+        on_error (callable): Called as on_error(period, exception) when the read of a period fails.
+    """
+
+    def __init__(self, plc, readFunc=None, useBlockRead: bool = True, lateTolerance: float = 0.1):
+        self.plc = plc
+        if readFunc is None:
+            readFunc = self._read_tag if hasattr(plc, 'read_tags') else getattr(plc, 'readData', None)
+        self.readFunc = readFunc
+        self.useBlockRead = useBlockRead and hasattr(plc, 'read_tags')
+        self.lateTolerance = lateTolerance
+
+        self.sinks = []
+        self._slots = {}            # period -> _Slot
+
+        self.on_late = None
+        self.on_error = None
+
+        self._lock = threading.Lock()
+        self._added = []            # slots not scheduled yet by the scheduler
+        self._thread = None
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+        self.running = threading.Event()
+        self.running.set()          # clear() to pause the scans, e.g. while the PLC reconnects
+
+
+    def add_group(self, group: TagGroup) -> None:
+        """
+        Adds a group of variables. Groups of the same period are read together.
+        A group added while the engine runs is scanned from the next loop of the scheduler.
+
+        Args:
+            group (TagGroup): The group of variables.
+        """
+        with self._lock:
+            slot = self._slots.get(group.period)
+            if slot is None:
+                slot = self._slots[group.period] = _Slot(group.period)
+                # scheduled by a running scheduler, or with the others when run() starts
+                self._added.append(slot)
+                self._wakeup.set()
+            slot.add(group)
+        logger.info(f'Added {len(group.tags)} {group.kind} variables, period {group.period}s.')
+
+
+    def add_sink(self, sink: Sink) -> None:
+        """
+        Adds a destination of the changed values.
+
+        Args:
+            sink (Sink): The sink.
+        """
+        self.sinks.append(sink)
+
+
+    def stats(self) -> dict:
+        """
+        Returns the scan statistics of each period.
+
+        Returns:
+            dict: {period: {'tags', 'cycles', 'late_cycles', 'missed_cycles', 'unavailable_cycles', 'changes',
+            'last_duration', 'max_duration'}}
+        """
+        return {period: {'tags': len(slot.tags),
+                         'cycles': slot.cycles,
+                         'late_cycles': slot.late_cycles,
+                         'missed_cycles': slot.missed_cycles,
+                         'unavailable_cycles': slot.unavailable_cycles,
+                         'changes': slot.changes,
+                         'last_duration': slot.last_duration,
+                         'max_duration': slot.max_duration}
+                for period, slot in self._slots.items()}
+
+
+    def _read_tag(self, addr, varType=None) -> tuple:
+        """
+        Reads one variable with the block read of the driver.
+        """
+        return self.plc.read_tags([addr if varType is None else (addr, varType)])[0]
+
+
+    def _read_slot(self, tags: list) -> list:
+        """
+        Reads all the variables of a period.
+
+        Args:
+            tags (list): The (group, index in group, tag) of the period.
+
+        Returns:
+            list: The raw values in the order of tags, None if a value could not be read.
+        """
+        if self.useBlockRead:
+            ls_varTag = [tag.addr if tag.varType is None else (tag.addr, tag.varType) for _, _, tag in tags]
+            return [value for _, value in self.plc.read_tags(ls_varTag)]
+
+        values = []
+        for _, _, tag in tags:
+            if tag.varType is None:
+                _, value = self.readFunc(tag.addr)
+            else:
+                _, value = self.readFunc(tag.addr, tag.varType)
+            values.append(value)
+        return values
+
+
+    def scan(self, period: float) -> None:
+        """
+        Reads the variables of a period once and sends the changed values to the sinks.
+
+        Args:
+            period (float): The period of the groups to scan.
+        """
+        slot = self._slots[period]
+        with self._lock:
+            # a group may be added to the period by another thread meanwhile
+            tags, state = slot.tags, slot.state
+        instrumented = metrics.enabled
+        if instrumented:
+            start = time.perf_counter()
+            values = self._read_slot(tags)
+            metrics.record(f'scan.{period}s.read', time.perf_counter() - start)
+        else:
+            values = self._read_slot(tags)
+        timestamp = datetime.now().isoformat(timespec='microseconds')
+
+        changes = {}
+        indices = state.update(values)
+        slot.changes += len(indices)
+        for n in indices:
+            group, _, tag = tags[n]
+            changes.setdefault(group, []).append((tag, state.value(n, values), timestamp))
+
+        for group, ls_change in changes.items():
+            for sink in self.sinks:
+                try:
+                    if instrumented:
+                        start = time.perf_counter()
+                        sink.emit(group, ls_change)
+                        metrics.record(f'sink.{type(sink).__name__}', time.perf_counter() - start)
+                    else:
+                        sink.emit(group, ls_change)
+                except Exception as e:
+                    logger.error(f'Error sending {group.kind} data to {type(sink).__name__}: {e}')
+
+
+    def _run_slot(self, slot: _Slot, now: float) -> None:
+        """
+        Runs the scan of a period that is due and computes its next deadline.
+        """
+        lateness = now - slot.deadline
+        if lateness > slot.period * self.lateTolerance:
+            missed = int(lateness // slot.period)
+            slot.late_cycles += 1
+            slot.missed_cycles += missed
+            if now - slot._last_late_log > LATE_LOG_INTERVAL:
+                logger.warning(f'Scan of period {slot.period}s is late by {lateness * 1000:.1f} ms '
+                               f'({slot.late_cycles} late cycles, {slot.missed_cycles} missed).')
+                slot._last_late_log = now
+            if self.on_late is not None:
+                self.on_late(slot.period, lateness, missed)
+            # Skip the deadlines that were missed entirely
+            slot.deadline += missed * slot.period
+
+        try:
+            self.scan(slot.period)
+        except PLCUnavailable:
+            # The ConnectionSupervisor is reconnecting, keep the schedule and the last values
+            slot.unavailable_cycles += 1
+        except Exception as e:
+            logger.error(f'Error scanning period {slot.period}s: {e}')
+            if self.on_error is not None:
+                self.on_error(slot.period, e)
+
+        slot.cycles += 1
+        slot.last_duration = time.monotonic() - now
+        slot.max_duration = max(slot.max_duration, slot.last_duration)
+        if metrics.enabled:
+            metrics.record(f'scan.{slot.period}s.cycle', slot.last_duration)
+            if slot.last_duration > slot.period:
+                metrics.count(f'scan.{slot.period}s.overruns')
+        slot.deadline += slot.period
+
+
+    def run(self) -> None:
+        """
+        Runs the scheduler until stop() is called.
+        """
+        start = time.monotonic()
+        with self._lock:
+            slots = list(self._slots.values())
+            self._added = []
+        queue = []
+        for n, slot in enumerate(slots):
+            slot.deadline = start
+            heapq.heappush(queue, (slot.deadline, n, slot))
+        count = len(queue)
+
+        while not self._stop.is_set():
+            if self._added:
+                with self._lock:
+                    added, self._added = self._added, []
+                now = time.monotonic()
+                for slot in added:
+                    slot.deadline = now
+                    heapq.heappush(queue, (slot.deadline, count, slot))
+                    count += 1
+            if not queue:
+                self._wakeup.wait()
+                self._wakeup.clear()
+                continue
+
+            deadline, n, slot = queue[0]
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                self._wakeup.wait(delay)
+                self._wakeup.clear()
+                continue
+            if not self.running.is_set():
+                self.running.wait(1)
+                # Restart the periods from now once the scans are resumed
+                if self.running.is_set():
+                    now = time.monotonic()
+                    queue = [(now, n, slot) for _, n, slot in queue]
+                    for _, _, slot in queue:
+                        slot.deadline = now
+                    heapq.heapify(queue)
+                continue
+
+            self._run_slot(slot, time.monotonic())
+            heapq.heapreplace(queue, (slot.deadline, n, slot))
+
+
+    def start(self) -> None:
+        """
+        Starts the scheduler in a background thread.
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._wakeup.clear()
+        self._thread = threading.Thread(target=self.run, name='ScanEngine', daemon=True)
+        self._thread.start()
+        logger.info(f'Started scanning periods {sorted(self._slots)}.')
+
+
+    def stop(self, timeout: float = None) -> None:
+        """
+        Stops the scheduler and waits for the current scan to finish.
+
+        Args:
+            timeout (float, optional): The maximum time to wait in seconds. Defaults to None (no limit).
+        """
+        self._stop.set()
+        self._wakeup.set()
+        self.running.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        logger.info('Stopped scanning.')
@@ -0,0 +1,338 @@
+"""
+This file contains the implementation of the DiskQueue class, a durable queue of MQTT messages kept on disk
+while the device is disconnected, and read again in order when the connection is back.
+
+The messages are appended to segment files (000000.seg, 000001.seg, ...) of about segment_bytes each, as
+records of a header (payload length, CRC-32, name length), the name (the topic under the standard topic)
+and the payload. A read cursor gives the next message to send, and an acknowledged cursor, saved in the
+file 'cursor', the first message the broker has not acknowledged yet. A segment is deleted when the
+acknowledged cursor leaves it.
+
+After a crash or a power cut, the queue is opened at the acknowledged cursor, so the messages sent but not
+acknowledged are sent again (at least once delivery), and the end of the last segment is checked record
+by record: a record cut by the power cut is truncated.
+
+Example:
+    >>> queue = DiskQueue('/home/pi/WB/store/')
+    >>> queue.append('Counter_1', b'[{"name": "Counter_1", "value": 125, "timestamp": "..."}]')
+    >>> for position, Name, payload in queue.read(10):
+    ...     client.publish(Name, payload)
+    >>> queue.ack(position)
+"""
+
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+
+# Application logger
+logger = logging.getLogger("DiskQueue")
+logger.setLevel(logging.DEBUG)
+_log_handle = logging.StreamHandler()
+_log_handle.setFormatter(logging.Formatter('%(asctime)s %(name)s %(levelname)s | %(message)s'))
+logger.addHandler(_log_handle)
+
+SEGMENT_BYTES = 1048576         # size of a segment file before the next one is started
+SYNC_INTERVAL = 1.0             # seconds between two fsync of the records and of the cursor (0: each write)
+CURSOR_FILE = 'cursor'          # file of the acknowledged cursor, in the queue directory
+SEGMENT_SUFFIX = '.seg'
+
+_RECORD = struct.Struct('<IIH')     # payload length, CRC-32 of name + payload, name length
+_CURSOR = struct.Struct('<QQI')     # segment, offset, CRC-32 of segment + offset
+
+
+class DiskQueue:
+    """
+    Durable FIFO queue of (name, payload) messages in segment files.
+
+    A position is a tuple (segment, offset) after a record; read() returns the position of each message,
+    ack() is called with the position of the last message acknowledged in order.
+
+    Args:
+        path (str): The directory of the queue, created if missing.
+        segment_bytes (int, optional): The size of a segment file. Defaults to SEGMENT_BYTES.
+        sync_interval (float, optional): The seconds between two fsync. The writes older than this are synced
+            by the next append() or ack(), or by sync_if_due() which the owner of the queue calls periodically
+            (StoreForward does, from its replay thread), so a burst followed by silence is synced too. A power
+            cut then loses at most the messages appended in this time, and sends again the messages acknowledged
+            in this time. Defaults to SYNC_INTERVAL.
+    """
+
+    def __init__(self, path: str, segment_bytes: int = SEGMENT_BYTES, sync_interval: float = SYNC_INTERVAL):
+        self.path = path
+        self.segment_bytes = segment_bytes
+        self.sync_interval = sync_interval
+
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+        segments = sorted(int(name[:-len(SEGMENT_SUFFIX)]) for name in os.listdir(path) if name.endswith(SEGMENT_SUFFIX))
+        if not segments:
+            segments = [0]
+            open(self._segment_path(0), 'ab').close()
+        self._sizes = {segment: os.path.getsize(self._segment_path(segment)) for segment in segments}
+
+        # Records cut by a power cut can only be at the end of the last segment
+        last = segments[-1]
+        end = self._check(last)
+        if end < self._sizes[last]:
+            logger.warning(f'Truncated {self._sizes[last] - end} bytes of an incomplete record in segment {last}.')
+            with open(self._segment_path(last), 'r+b') as file:
+                file.truncate(end)
+            self._sizes[last] = end
+        self._end = (last, end)
+
+        acked = self._load_cursor()
+        if acked is None or acked[0] < segments[0]:
+            acked = (segments[0], 0)
+        elif acked > self._end:
+            # the records were acknowledged, then lost with the power cut before their fsync
+            acked = self._end
+        self._acked = acked
+        self._read = acked
+
+        self._wfile = open(self._segment_path(last), 'ab')
+        self._rfile = None
+        self._rsegment = None
+        self._synced = time.monotonic()
+        self._cursor_synced = time.monotonic()
+        self._unsynced = False      # records written but not synced
+        self._dirty = False         # cursor moved but not saved
+
+        pending = self.pending_bytes()
+        if pending:
+            logger.info(f'Opened queue {path} with {pending} bytes of stored messages.')
+
+
+    def _segment_path(self, segment: int) -> str:
+        return os.path.join(self.path, '{:06d}{}'.format(segment, SEGMENT_SUFFIX))
+
+
+    def _check(self, segment: int) -> int:
+        """
+        Returns the offset after the last complete record of a segment.
+        """
+        end = 0
+        with open(self._segment_path(segment), 'rb') as file:
+            data = file.read()
+        while end + _RECORD.size <= len(data):
+            length, crc, nameLength = _RECORD.unpack_from(data, end)
+            start = end + _RECORD.size
+            stop = start + nameLength + length
+            if stop > len(data) or zlib.crc32(data[start:stop]) != crc:
+                break
+            end = stop
+        return end
+
+
+    def _load_cursor(self):
+        try:
+            with open(os.path.join(self.path, CURSOR_FILE), 'rb') as file:
+                data = file.read()
+        except FileNotFoundError:
+            return None
+        if len(data) != _CURSOR.size:
+            logger.error('The cursor file is damaged, the stored messages are read from the first segment.')
+            return None
+        segment, offset, crc = _CURSOR.unpack(data)
+        if zlib.crc32(data[:16]) != crc:
+            logger.error('The cursor file is damaged, the stored messages are read from the first segment.')
+            return None
+        return segment, offset
+
+
+    def _save_cursor(self) -> None:
+        """
+        Writes the acknowledged cursor in a new file that replaces the previous one, so a power cut leaves
+        the previous or the new cursor. Called with the lock held.
+        """
+        data = struct.pack('<QQ', *self._acked)
+        data += struct.pack('<I', zlib.crc32(data))
+        temp = os.path.join(self.path, CURSOR_FILE + '.tmp')
+        with open(temp, 'wb') as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp, os.path.join(self.path, CURSOR_FILE))
+        self._cursor_synced = time.monotonic()
+        self._dirty = False
+
+        # Deleted after the cursor is saved: a saved cursor never points to a deleted segment
+        for old in [s for s in self._sizes if s < self._acked[0]]:
+            os.remove(self._segment_path(old))
+            del self._sizes[old]
+            if self._rsegment == old:
+                self._rfile.close()
+                self._rfile = None
+                self._rsegment = None
+
+
+    def append(self, Name: str, payload) -> None:
+        """
+        Append a message at the end of the queue.
+
+        Args:
+            Name (str): The name of the message (the topic under the standard topic).
+            payload (bytes or str): The payload of the message.
+        """
+        if isinstance(payload, str):
+            payload = payload.encode()
+        name = Name.encode()
+        data = name + payload
+        record = _RECORD.pack(len(payload), zlib.crc32(data), len(name)) + data
+        with self._lock:
+            segment, offset = self._end
+            if offset >= self.segment_bytes:
+                # The full segment is synced before the next one is started: only the last one can be cut
+                self._wfile.flush()
+                os.fsync(self._wfile.fileno())
+                self._wfile.close()
+                segment, offset = segment + 1, 0
+                self._wfile = open(self._segment_path(segment), 'ab')
+            self._wfile.write(record)
+            self._wfile.flush()
+            offset += len(record)
+            self._sizes[segment] = offset
+            self._end = (segment, offset)
+            self._unsynced = True
+            self._sync_due(time.monotonic())
+
+
+    def read(self, count: int) -> list:
+        """
+        Read the next messages after the read cursor, and advance it.
+
+        Args:
+            count (int): The maximum number of messages.
+
+        Returns:
+            list: Tuples (position, Name, payload), payload as bytes. Empty if all the messages are read.
+        """
+        records = []
+        with self._lock:
+            while len(records) < count and self._read < self._end:
+                segment, offset = self._read
+                if offset >= self._sizes[segment]:
+                    self._read = (segment + 1, 0)
+                    continue
+                if self._rsegment != segment:
+                    if self._rfile is not None:
+                        self._rfile.close()
+                    self._rfile = open(self._segment_path(segment), 'rb')
+                    self._rsegment = segment
+                self._rfile.seek(offset)
+                header = self._rfile.read(_RECORD.size)
+                length, crc, nameLength = _RECORD.unpack(header) if len(header) == _RECORD.size else (0, None, 0)
+                data = self._rfile.read(nameLength + length)
+                if zlib.crc32(data) != crc:
+                    # A damaged sector: the rest of the segment can't be framed any more
+                    logger.error(f'Damaged record in segment {segment} at offset {offset}, skipped the rest of the segment.')
+                    self._read = (segment + 1, 0) if segment < self._end[0] else self._end
+                    continue
+                self._read = (segment, offset + _RECORD.size + nameLength + length)
+                records.append((self._read, data[:nameLength].decode(), data[nameLength:]))
+        return records
+
+
+    def ack(self, position: tuple) -> None:
+        """
+        Advance the acknowledged cursor after a message returned by read(), when it and all the messages
+        before it are acknowledged by the broker. The segments before the cursor are deleted.
+
+        Args:
+            position (tuple): The position of the message.
+        """
+        with self._lock:
+            if position <= self._acked:
+                return
+            segment, offset = position
+            while segment < self._end[0] and offset >= self._sizes[segment]:
+                segment, offset = segment + 1, 0
+            if (segment, offset) == self._end and offset > 0:
+                # All acknowledged: the next messages start a new segment, so this one is deleted now
+                self._wfile.close()
+                segment, offset = segment + 1, 0
+                self._wfile = open(self._segment_path(segment), 'ab')
+                self._sizes[segment] = 0
+                self._end = self._read = (segment, 0)
+            previous = self._acked[0]
+            self._acked = (segment, offset)
+            self._dirty = True
+            if segment > previous or self._acked == self._end:
+                self._save_cursor()
+            else:
+                self._sync_due(time.monotonic())
+
+
+    def rewind(self) -> None:
+        """
+        Move the read cursor back to the acknowledged cursor, to send again the messages not acknowledged.
+        """
+        with self._lock:
+            self._read = self._acked
+
+
+    def empty(self) -> bool:
+        """
+        Returns True when all the messages are acknowledged.
+        """
+        return self._acked == self._end
+
+
+    def pending_bytes(self) -> int:
+        """
+        Returns the size of the messages not acknowledged yet (with their headers).
+        """
+        with self._lock:
+            segment, offset = self._acked
+            return sum(size for s, size in self._sizes.items() if s >= segment) - offset
+
+
+    def _sync_due(self, now: float) -> None:
+        """
+        Syncs the records and saves the cursor if they were changed more than sync_interval ago.
+        Called with the lock held.
+        """
+        if self._unsynced and now - self._synced >= self.sync_interval:
+            os.fsync(self._wfile.fileno())
+            self._synced = now
+            self._unsynced = False
+        if self._dirty and now - self._cursor_synced >= self.sync_interval:
+            self._save_cursor()
+
+
+    def sync_if_due(self) -> None:
+        """
+        Write the appended messages and the acknowledged cursor to the disk if the last sync is older than
+        sync_interval. Call it at least every sync_interval while the queue is open.
+        """
+        with self._lock:
+            self._sync_due(time.monotonic())
+
+
+    def sync(self) -> None:
+        """
+        Write the appended messages and the acknowledged cursor to the disk now.
+        """
+        with self._lock:
+            self._wfile.flush()
+            os.fsync(self._wfile.fileno())
+            self._synced = time.monotonic()
+            self._unsynced = False
+            if self._dirty:
+                self._save_cursor()
+
+
+    def close(self) -> None:
+        """
+        Sync and close the segment files.
+        """
+        self.sync()
+        with self._lock:
+            self._wfile.close()
+            if self._rfile is not None:
+                self._rfile.close()
+                self._rfile = None
+                self._rsegment = None
@@ -7,8 +7,15 @@ from .PLC.Siemens.opcua.Ethernet import function as PLC_S7_1500
 from .PLC.Siemens.snap7.Ethernet import function as PLC_S7_200
 
 from .Broker.SparkPlugB.function import SparkplugB as spB
-from .Broker.MQTT.function import MQTT, ST
-from .Broker.JsonPayload.function import generate_data, generate_data_status, generate_general_data
+from .Broker.MQTT.function import MQTT, ST, BatchPublisher, StoreForward, PublishQueue
+from .Broker.JsonPayload.function import generate_data, generate_data_status, generate_general_data, generate_batch_data, parse_data, get_codec
 from .LogData.function import LogFileCSV
+from .Store.function import DiskQueue
 from .RaspberryPi.function import restart_program, restart_raspberry
+from .Logic.function import LogicExpr, StateClassifier
+from .Network.function import LinkMonitor, probe_tcp, probe_fins_udp, ConnectionSupervisor, PLCUnavailable
+from .Gateway.function import Gateway, load_tag_table
+from .Driver.function import AsyncPLCDriver, MitsubishiDriver, OmronDriver, S7Driver, OPCUADriver, LogixDriver, create_driver
+from .Metrics.function import metrics, enable_instrumentation, disable_instrumentation, Histogram
+from .Scan.function import ScanEngine, TagGroup, ScanTag, TagState, MQTTSink, SparkplugSink, CSVSink, CallbackSink
 from .HeatController.OM_E5CC_RX2ASM_802.function import E5CC
\ No newline at end of file
@@ -47,4 +47,7 @@ setup(
         "Operating System :: OS Independent",
     ],
     python_requires=">=3.7",
+    entry_points={
+        'console_scripts': ['fablab-gateway=fablab_lib.Gateway.function:main'],
+    },
 )
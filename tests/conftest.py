@@ -0,0 +1,7 @@
+"""
+The tests run the local stand-ins of the PLCs and of the MQTT broker of benchmarks/simulators.py.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
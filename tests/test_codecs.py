@@ -0,0 +1,231 @@
+"""
+Tests of the payload codecs: the MessagePack encoder and decoder at the size boundaries of each format,
+the delta columns, the zlib framing, the max_bytes split and the choice of the codec of a message.
+"""
+import struct
+from datetime import datetime, timedelta
+
+import pytest
+
+from fablab_lib.Broker.JsonPayload.function import (Codec, CODECS, MsgPackCodec, codec_of_topic, get_codec, packb,
+                                                    unpackb)
+from fablab_lib.Broker.MQTT.function import MQTT
+from fablab_lib.Broker.MQTT.paho.mqtt.client import MQTTMessage
+from fablab_lib.Broker.MQTT.paho.mqtt.packettypes import PacketTypes
+from fablab_lib.Broker.MQTT.paho.mqtt.properties import Properties
+
+
+@pytest.mark.parametrize('value, code', [
+    (0, 0x00), (127, 0x7F), (128, 0xCC), (255, 0xCC), (256, 0xCD), (65535, 0xCD), (65536, 0xCE),
+    (2 ** 32 - 1, 0xCE), (2 ** 32, 0xCF), (2 ** 64 - 1, 0xCF),
+    (-1, 0xFF), (-32, 0xE0), (-33, 0xD2), (-2 ** 31, 0xD2), (-2 ** 31 - 1, 0xD3), (-2 ** 63, 0xD3),
+])
+def test_integer_boundaries(value, code):
+    data = packb(value)
+    assert data[0] == code
+    assert unpackb(data) == value
+
+
+@pytest.mark.parametrize('value', [2 ** 64, -2 ** 63 - 1])
+def test_integer_out_of_range(value):
+    with pytest.raises(ValueError):
+        packb(value)
+
+
+@pytest.mark.parametrize('size, code', [(0, 0xA0), (31, 0xBF), (32, 0xD9), (255, 0xD9), (256, 0xDA),
+                                        (65535, 0xDA), (65536, 0xDB)])
+def test_string_boundaries(size, code):
+    value = 'x' * size
+    data = packb(value)
+    assert data[0] == code
+    assert unpackb(data) == value
+
+
+def test_string_size_is_counted_in_utf8_bytes():
+    value = 'é' * 16        # 32 bytes
+    data = packb(value)
+    assert data[:2] == b'\xd9\x20'
+    assert unpackb(data) == value
+
+
+@pytest.mark.parametrize('size, code', [(0, 0xC4), (255, 0xC4), (256, 0xC5), (65535, 0xC5), (65536, 0xC6)])
+def test_bin_boundaries(size, code):
+    value = bytes(range(256)) * (size // 256) + bytes(size % 256)
+    data = packb(value)
+    assert data[0] == code
+    assert unpackb(data) == value
+
+
+@pytest.mark.parametrize('size, code', [(0, 0x90), (15, 0x9F), (16, 0xDC), (65535, 0xDC), (65536, 0xDD)])
+def test_array_boundaries(size, code):
+    value = list(range(size))
+    data = packb(value)
+    assert data[0] == code
+    assert unpackb(data) == value
+
+
+@pytest.mark.parametrize('size, code', [(0, 0x80), (15, 0x8F), (16, 0xDE), (65535, 0xDE), (65536, 0xDF)])
+def test_map_boundaries(size, code):
+    value = {f'k{i}': i for i in range(size)}
+    data = packb(value)
+    assert data[0] == code
+    assert unpackb(data) == value
+
+
+def test_other_values_round_trip():
+    value = {'none': None, 'true': True, 'false': False, 'float': 1.5, 'nested': [[1, {'a': [b'\x00']}], ()]}
+    assert unpackb(packb(value)) == dict(value, nested=[[1, {'a': [b'\x00']}], []])
+    assert packb(1.5) == b'\xcb' + struct.pack('>d', 1.5)
+
+
+def test_decoder_reads_the_formats_the_encoder_doesnt_write():
+    assert unpackb(b'\xca' + struct.pack('>f', 0.5)) == 0.5
+    assert unpackb(b'\xd0\x80') == -128
+    assert unpackb(b'\xd1\x80\x00') == -32768
+
+
+@pytest.mark.parametrize('data', [b'\xcd\x01', b'\xa5abc', b'\x92\x01', b'\xc1', b'\x01\x02'])
+def test_broken_messagepack_is_rejected(data):
+    with pytest.raises(ValueError):
+        unpackb(data)
+
+
+def test_unserializable_value_is_rejected():
+    with pytest.raises(TypeError):
+        packb(object())
+
+
+def _records(count, start=datetime(2024, 5, 6, 8, 0, 0)):
+    return [(f'Tag_{i % 7}', i * 3 if i % 3 else f'state {i}', (start + timedelta(milliseconds=250 * i)).isoformat())
+            for i in range(count)]
+
+
+def _points(records):
+    return [(name, value, datetime.fromisoformat(timestamp).isoformat(timespec='milliseconds'))
+            for name, value, timestamp in records]
+
+
+def _decoded(codec, payloads):
+    return [(point['name'], point['value'], point['timestamp']) for payload in payloads
+            for point in codec.decode(payload)]
+
+
+@pytest.mark.parametrize('name', sorted(name for name in CODECS if name.startswith('msgpack')))
+def test_batches_round_trip(name):
+    codec = get_codec(name)
+    records = _records(100)
+    payloads = codec.encode_batch(records)
+    assert len(payloads) == 1
+    assert _decoded(codec, payloads) == _points(records)
+
+
+def test_delta_columns_hold_the_differences_of_the_timestamps():
+    codec = MsgPackCodec(delta=True)
+    records = _records(4)
+    columns = unpackb(codec.encode_batch(records)[0])
+    assert columns['t'] == codec.millis(records[0][2])
+    assert columns['d'] == [0, 250, 250, 250]
+    assert columns['n'] == [name for name, _, _ in records]
+    assert _decoded(codec, [packb(columns)]) == _points(records)
+
+
+def test_single_point_round_trip():
+    codec = get_codec('msgpack')
+    payload = codec.encode('Counter', 125, '2024-05-06T08:00:00.500000')
+    assert codec.decode(payload) == [{'name': 'Counter', 'value': 125, 'timestamp': '2024-05-06T08:00:00.500'}]
+
+
+@pytest.mark.parametrize('name', sorted(CODECS))
+def test_max_bytes_splits_the_batches_in_order(name):
+    codec = get_codec(name)
+    records = _records(200)
+    payloads = codec._encode_batch(records, 300)
+    assert len(payloads) > 1
+    assert all(len(payload) <= 300 for payload in payloads)
+    compressed = codec.encode_batch(records, 300)
+    assert len(compressed) == len(payloads)
+    decoded = _decoded(codec, compressed)
+    if name.startswith('json'):
+        assert [(n, v, t) for n, v, t in decoded] == records
+    else:
+        assert decoded == _points(records)
+
+
+def test_record_larger_than_max_bytes_gets_its_own_payload():
+    codec = get_codec('msgpack')
+    records = [('a', 1), ('big', 'x' * 500), ('b', 2)]
+    payloads = codec.encode_batch(records, 100)
+    assert [[point['name'] for point in codec.decode(payload)] for payload in payloads] == [['a'], ['big'], ['b']]
+
+
+def test_compressed_batches_start_with_the_zlib_header():
+    for name in ('json-zlib', 'msgpack-zlib', 'msgpack-delta-zlib'):
+        assert get_codec(name).encode_batch(_records(10))[0][:1] == b'\x78'
+
+
+def test_codec_is_found_by_name_or_content_type():
+    assert get_codec('msgpack-delta') is CODECS['msgpack-delta']
+    assert get_codec('application/msgpack-zlib') is CODECS['msgpack-zlib']
+    with pytest.raises(ValueError):
+        get_codec('application/xml')
+
+
+@pytest.mark.parametrize('topic, name', [
+    ('Test/WB-MNC/Data/Counter', 'json'),
+    ('Test/WB-MNC/Data/Counter/msgpack', 'msgpack'),
+    ('Test/WB-MNC/Data/batch/msgpack-delta-zlib', 'msgpack-delta-zlib'),
+    ('Test/WB-MNC/Data/batch/json-zlib', 'json-zlib'),
+    ('Test/WB-MNC/Data/Counter/json', 'json'),
+    ('Test/WB-MNC/Data/Counter/xml', 'json'),
+    ('Counter', 'json'),
+])
+def test_codec_of_topic(topic, name):
+    assert codec_of_topic(topic).name == name
+
+
+def test_codec_without_its_methods_cant_be_instantiated():
+    class Partial(Codec):
+        name = 'partial'
+
+        def encode(self, name, value, timestamp=None):
+            return b''
+
+    with pytest.raises(TypeError):
+        Partial()
+
+
+def _message(topic, payload, contentType=None):
+    message = MQTTMessage(topic=topic.encode())
+    message.payload = payload
+    if contentType is not None:
+        message.properties = Properties(PacketTypes.PUBLISH)
+        message.properties.ContentType = contentType
+    return message
+
+
+def _received(messages, protocol='5'):
+    client = MQTT('localhost', 1883, protocol=protocol)
+    received = []
+    client.on_message = lambda client, data, name, value, timestamp: received.append((name, value))
+    for message in messages:
+        client._on_message(None, None, message)
+    return received
+
+
+def test_v5_content_type_selects_the_codec():
+    codec = get_codec('msgpack-delta-zlib')
+    payload = codec.encode_batch([('a', 1), ('b', 2)])[0]
+    # no topic suffix with MQTT v5: the codec is given by the ContentType property
+    assert _received([_message('Test/Data/batch', payload, codec.content_type)]) == [('a', 1), ('b', 2)]
+
+
+def test_message_without_content_type_uses_the_topic_suffix():
+    payload = get_codec('msgpack').encode('a', 1)
+    assert _received([_message('Test/Data/a/msgpack', payload)], protocol='3.1.1') == [('a', 1)]
+    assert _received([_message('Test/Data/a', b'[{"name": "a", "value": 1}]')], protocol='3.1.1') == [('a', 1)]
+
+
+def test_message_of_an_unknown_content_type_or_format_is_dropped():
+    payload = get_codec('msgpack').encode('a', 1)
+    assert _received([_message('Test/Data/a', payload, 'application/xml'),
+                      _message('Test/Data/a', payload, 'application/json')]) == []
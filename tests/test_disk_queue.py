@@ -0,0 +1,119 @@
+"""
+Tests of the durable queue of the store and forward (DiskQueue): order, acknowledgements, recovery and fsync.
+"""
+import os
+import time
+
+from fablab_lib.Store import function as store
+from fablab_lib.Store.function import DiskQueue
+
+
+def _names(records):
+    return [Name for _, Name, _ in records]
+
+
+def test_messages_are_read_in_order(tmp_path):
+    queue = DiskQueue(str(tmp_path))
+    queue.append('a', b'1')
+    queue.append('b', '2')
+    records = queue.read(10)
+    assert [(Name, payload) for _, Name, payload in records] == [('a', b'1'), ('b', b'2')]
+    assert queue.read(10) == []
+    assert not queue.empty()
+    queue.ack(records[-1][0])
+    assert queue.empty()
+    assert queue.pending_bytes() == 0
+    queue.close()
+
+
+def test_rewind_reads_again_the_messages_not_acknowledged(tmp_path):
+    queue = DiskQueue(str(tmp_path))
+    for i in range(5):
+        queue.append(f'm{i}', b'x')
+    records = queue.read(5)
+    queue.ack(records[1][0])
+    queue.rewind()
+    assert _names(queue.read(10)) == ['m2', 'm3', 'm4']
+    queue.close()
+
+
+def test_reopen_starts_at_the_acknowledged_cursor(tmp_path):
+    queue = DiskQueue(str(tmp_path))
+    for i in range(4):
+        queue.append(f'm{i}', b'x')
+    records = queue.read(2)
+    queue.ack(records[-1][0])
+    queue.close()
+
+    queue = DiskQueue(str(tmp_path))
+    assert _names(queue.read(10)) == ['m2', 'm3']
+    queue.close()
+
+
+def test_incomplete_record_is_truncated(tmp_path):
+    queue = DiskQueue(str(tmp_path))
+    queue.append('a', b'1')
+    queue.append('b', b'2')
+    queue.close()
+    segment = os.path.join(str(tmp_path), '000000' + store.SEGMENT_SUFFIX)
+    with open(segment, 'r+b') as file:
+        file.truncate(os.path.getsize(segment) - 1)
+
+    queue = DiskQueue(str(tmp_path))
+    assert _names(queue.read(10)) == ['a']
+    queue.append('c', b'3')
+    assert _names(queue.read(10)) == ['c']
+    queue.close()
+
+
+def test_segments_are_deleted_once_acknowledged(tmp_path):
+    queue = DiskQueue(str(tmp_path), segment_bytes=64)
+    for i in range(20):
+        queue.append(f'm{i}', b'x' * 20)
+    segments = [name for name in os.listdir(str(tmp_path)) if name.endswith(store.SEGMENT_SUFFIX)]
+    assert len(segments) > 1
+
+    records = queue.read(20)
+    assert _names(records) == [f'm{i}' for i in range(20)]
+    queue.ack(records[-1][0])
+    segments = [name for name in os.listdir(str(tmp_path)) if name.endswith(store.SEGMENT_SUFFIX)]
+    assert len(segments) == 1
+    queue.close()
+
+
+def test_burst_is_synced_without_a_later_append(tmp_path, monkeypatch):
+    synced = []
+    fsync = os.fsync
+    monkeypatch.setattr(store.os, 'fsync', lambda fd: synced.append(fd) or fsync(fd))
+
+    queue = DiskQueue(str(tmp_path), sync_interval=0.05)
+    for i in range(10):
+        queue.append(f'm{i}', b'x')
+    assert synced == []
+    queue.sync_if_due()
+    assert synced == []
+
+    time.sleep(0.06)
+    queue.sync_if_due()
+    assert len(synced) == 1
+    queue.sync_if_due()
+    assert len(synced) == 1
+    queue.close()
+
+
+def test_acknowledged_cursor_is_saved_without_a_later_ack(tmp_path):
+    queue = DiskQueue(str(tmp_path), sync_interval=0.05)
+    for i in range(4):
+        queue.append(f'm{i}', b'x')
+    records = queue.read(4)
+    time.sleep(0.06)
+    queue.ack(records[0][0])
+    queue.ack(records[1][0])
+
+    time.sleep(0.06)
+    queue.sync_if_due()
+    # a power cut now: the queue is opened again without close()
+    reopened = DiskQueue(str(tmp_path))
+    assert _names(reopened.read(10)) == ['m2', 'm3']
+    reopened.close()
+    queue.close()
@@ -0,0 +1,110 @@
+"""
+Tests of the asyncio drivers of the PLC wrappers (ThreadedPLCDriver).
+"""
+import asyncio
+import time
+
+import pytest
+import simulators
+
+from fablab_lib.Driver.function import MitsubishiDriver, create_driver
+from fablab_lib.Network.function import PLCUnavailable
+from fablab_lib.PLC.Mitsubishi.mcprotocol.Ethernet.function import PLC, DT
+
+HOST = '127.0.0.1'
+
+
+class FakePLC:
+    """
+    A blocking wrapper returning the values given to the test, one list per read.
+    """
+    host = 'fake'
+
+    def __init__(self, reads):
+        self.reads = list(reads)
+        self.written = []
+
+    def connect(self):
+        pass
+
+    def read_tags(self, tags):
+        values = self.reads.pop(0) if self.reads else PLCUnavailable('PLC is not connected.')
+        if isinstance(values, Exception):
+            raise values
+        return list(zip(tags, values))
+
+    def write_tags(self, tags):
+        self.written.extend(tags)
+        return [True] * len(tags)
+
+
+def test_unknown_vendor_is_rejected():
+    with pytest.raises(ValueError):
+        create_driver('beckhoff', FakePLC([]))
+
+
+def test_reads_writes_and_errors_are_counted():
+    async def main():
+        driver = create_driver('mitsubishi', FakePLC([[1, 2], ValueError('bad frame'), PLCUnavailable('down')]))
+        await driver.connect()
+        assert await driver.read_tags(['D100', 'D101']) == [('D100', 1), ('D101', 2)]
+        assert await driver.write_tags([('D100', 5, DT.SWORD)]) == [True]
+        for _ in range(2):
+            with pytest.raises(Exception):
+                await driver.read_tags(['D100'])
+        health = await driver.health()
+        await driver.close()
+        return health
+
+    health = asyncio.run(main())
+    assert (health['reads'], health['writes'], health['errors'], health['unavailable']) == (1, 1, 1, 1)
+    assert health['last_error'] == 'ValueError: bad frame'
+
+
+def test_subscription_calls_back_the_changed_values_only():
+    changes = []
+
+    async def main():
+        driver = create_driver('omron', FakePLC([[1, 2], [1, 3], [None, 3], [4, 3]]))
+        await driver.connect()
+        await driver.subscribe(['A', 'B'], lambda addr, value, timestamp: changes.append((addr, value)), period=0.01)
+        await asyncio.sleep(0.1)
+        await driver.close()
+
+    asyncio.run(main())
+    assert changes == [('A', 1), ('B', 2), ('B', 3), ('A', 4)]
+
+
+def test_unresponsive_plc_does_not_stall_the_driver_of_another_plc_of_the_same_vendor():
+    healthy = simulators.MCSimulator(HOST, latency=0.001)
+    stuck = simulators.MCSimulator(HOST, latency=30)
+    healthy.start()
+    stuck.start()
+
+    async def read_until(driver, deadline):
+        reads = 0
+        while time.monotonic() < deadline:
+            await driver.read_tags([('D100', DT.SWORD)])
+            reads += 1
+        return reads
+
+    async def read_stuck(driver):
+        with pytest.raises(Exception):
+            await driver.read_tags([('D100', DT.SWORD)])
+
+    async def main():
+        drivers = [MitsubishiDriver(PLC(HOST, sim.port)) for sim in (healthy, stuck)]
+        for driver in drivers:
+            await driver.connect()
+        # the read of the stuck PLC waits for the 2 s socket timeout of the driver
+        _, reads = await asyncio.gather(read_stuck(drivers[1]), read_until(drivers[0], time.monotonic() + 1.0))
+        for driver in drivers:
+            await driver.close()
+        return reads
+
+    try:
+        reads = asyncio.run(main())
+    finally:
+        healthy.stop()
+        stuck.stop()
+    assert reads >= 20
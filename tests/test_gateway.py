@@ -0,0 +1,74 @@
+"""
+Tests of the gateway: tag tables, groups, and the workers of several PLCs of the same vendor.
+"""
+import queue
+import threading
+import time
+
+import simulators
+
+from fablab_lib.Gateway.function import load_tag_table, run_device, _build_groups
+from fablab_lib.PLC.Mitsubishi.mcprotocol.Ethernet import function as mitsubishi
+
+HOST = '127.0.0.1'
+RUN_TIME = 1.5              # seconds both workers are scanning
+
+
+def _device(name, port):
+    return {'name': name, 'vendor': 'mitsubishi', 'host': HOST, 'params': {'port': port},
+            'groups': [{'kind': 'Data', 'period': 0.05,
+                        'tags': [[f'D{100 + i}', f'D{100 + i}', 'SWORD'] for i in range(5)]}]}
+
+
+def test_tag_table_is_read_with_the_csv_headers(tmp_path):
+    path = tmp_path / 'tags.csv'
+    path.write_text('Tag ID,Tag Name,Data Type,Scale\nD100,Speed,SWORD,0.1\nD101,Count,,\n')
+    assert load_tag_table(str(path)) == [['Speed', 'D100', 'SWORD', 0.1, 0], ['Count', 'D101', None, 1, 0]]
+
+
+def test_groups_use_the_data_types_of_the_vendor():
+    groups = _build_groups(_device('M1', 0), mitsubishi)
+    assert len(groups) == 1
+    assert [tag.varType for tag in groups[0].tags] == [mitsubishi.DT.SWORD] * 5
+
+
+def test_short_tag_rows_take_the_default_scale_and_deadband():
+    device = dict(_device('M1', 0), groups=[{'kind': 'Data', 'period': 1,
+                                             'tags': [['A', 'D0'], ['B', 'D1', 'SWORD'], ['C', 'D2', 'SWORD', 0.1]]}])
+    tags = _build_groups(device, mitsubishi)[0].tags
+    assert [(tag.scale, tag.deadband) for tag in tags] == [(1, 0), (1, 0), (0.1, 0)]
+    assert tags[0].varType is None
+
+
+def test_unresponsive_plc_does_not_stall_the_other_plc_of_the_same_vendor():
+    healthy = simulators.MCSimulator(HOST, latency=0.001)
+    # answers after the socket timeout of the driver: each read of this PLC waits for it
+    stuck = simulators.MCSimulator(HOST, latency=30)
+    healthy.start()
+    stuck.start()
+    reports = queue.Queue()
+    stops = [threading.Event(), threading.Event()]
+    workers = [threading.Thread(target=run_device, args=(_device(name, sim.port), stop, reports, False, 0.25),
+                                daemon=True)
+               for name, sim, stop in (('healthy', healthy, stops[0]), ('stuck', stuck, stops[1]))]
+    try:
+        for worker in workers:
+            worker.start()
+        time.sleep(RUN_TIME)
+    finally:
+        for stop in stops:
+            stop.set()
+        for worker in workers:
+            worker.join(10)
+        healthy.stop()
+        stuck.stop()
+
+    last = {}
+    while not reports.empty():
+        name, snapshot = reports.get()
+        last[name] = snapshot
+    scanned = last['healthy']['scans'] - last['healthy']['unavailable']
+    # about RUN_TIME / 0.05 cycles: never waiting for the 2 s socket timeout of the other PLC
+    assert scanned >= 10
+    assert last['stuck']['scans'] - last['stuck']['unavailable'] == 0
+    assert not any(worker.is_alive() for worker in workers)
@@ -0,0 +1,78 @@
+"""
+Tests of the compiled logic equations (LogicExpr): grammar, precedence of the operators and values of the bits.
+"""
+from itertools import product
+
+import pytest
+
+from fablab_lib.Logic.function import LogicExpr, pack_bits
+
+EQUATIONS = ['a', '/a', 'a.b', 'a|b', '/a|(b.c)|d', 'a.d.(/c).(/e)', 'e.(/d).(/c)', 'a|b.c', '/a.b|c',
+             '//a', '/(a|b).c', '(a|/b).(c|/d)|e.f', 'a.1', 'a|0', 'a . b | / c']
+
+
+def _reference(equation: str, bits: list) -> bool:
+    """
+    Evaluates an equation with the Python operators, as the equations were evaluated before they were compiled.
+    """
+    source = equation.replace('.', ' and ').replace('|', ' or ').replace('/', ' not ')
+    names = {chr(97 + i): bool(bit) for i, bit in enumerate(bits)}
+    return bool(eval(source, {}, names))
+
+
+@pytest.mark.parametrize('equation', EQUATIONS)
+def test_compiled_equation_matches_the_python_operators(equation):
+    expr = LogicExpr.compile(equation)
+    for bits in product([False, True], repeat=6):
+        assert expr(list(bits)) == _reference(equation, bits), bits
+
+
+def test_precedence_not_and_or():
+    # 'a|b.c' is 'a|(b.c)', '/a.b' is '(/a).b'
+    assert LogicExpr.compile('a|b.c')([True, False, False]) is True
+    assert LogicExpr.compile('a|b.c')([False, True, False]) is False
+    assert LogicExpr.compile('/a.b')([False, True]) is True
+    assert LogicExpr.compile('/a.b')([True, True]) is False
+    assert LogicExpr.compile('/(a.b)')([True, False]) is True
+
+
+@pytest.mark.parametrize('equation, bits, result', [
+    ('a', [2], True),
+    ('a.b', [2, 1], True),
+    ('a.b', [None, True], False),
+    ('a|b', [None, False], False),
+    ('a|b', [None, 5], True),
+    ('a./b', [1, 0], True),
+    ('a./b', [1, None], True),
+    ('a./b', [1, 3], False),
+    ('/a|/b', [7, 7], False),
+])
+def test_bits_are_tested_for_truth(equation, bits, result):
+    assert LogicExpr.compile(equation)(bits) is result
+
+
+@pytest.mark.parametrize('equation', EQUATIONS)
+def test_integer_bits_give_the_same_result_as_booleans(equation):
+    expr = LogicExpr.compile(equation)
+    for bits in product([0, 1, 2, None], repeat=6):
+        assert expr(list(bits)) == expr([bool(bit) for bit in bits]), bits
+
+
+@pytest.mark.parametrize('equation', ['', 'a.', '.a', 'a||b', '(a', 'a)', 'A', 'a2', 'a&b', '()'])
+def test_invalid_equations(equation):
+    with pytest.raises(ValueError):
+        LogicExpr(equation)
+
+
+def test_compile_is_cached():
+    assert LogicExpr.compile('a.b|c') is LogicExpr.compile('a.b|c')
+
+
+def test_variables():
+    assert LogicExpr.compile('/d|(b.a)|d').variables == ['a', 'b', 'd']
+
+
+def test_pack_bits():
+    assert pack_bits([True, False, True]) == 5
+    assert pack_bits([1, None, 2]) == 5
+    assert pack_bits([True] * 40) == (1 << 40) - 1
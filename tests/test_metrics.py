@@ -0,0 +1,121 @@
+"""
+Tests of the metrics: the precision of the latency histograms, and the wrapping and unwrapping of the
+request methods of the drivers, against the FINS stand-in of benchmarks/simulators.py.
+"""
+import math
+import random
+
+import pytest
+import simulators
+
+from fablab_lib.Metrics import function as instrumentation
+from fablab_lib.Metrics.function import Histogram, disable_instrumentation, enable_instrumentation, metrics
+from fablab_lib.Network.function import build_fins_echo
+from fablab_lib.PLC.Mitsubishi.mcprotocol.Ethernet.pymelsec.type3e import Type3E
+from fablab_lib.PLC.Omron.fins.Ethernet.fins.tcp import TCPFinsConnection
+
+HOST = '127.0.0.1'
+
+
+@pytest.fixture(autouse=True)
+def instruments():
+    yield
+    disable_instrumentation()
+    metrics.reset()
+
+
+def _exact(values, percent):
+    return values[max(1, math.ceil(len(values) * percent / 100)) - 1]
+
+
+@pytest.mark.parametrize('percent', [0, 1, 50, 90, 99, 99.9, 100])
+def test_histogram_percentiles_are_within_1_64(percent):
+    rng = random.Random(percent)
+    # 1 us to 10 s, uniform on a log scale
+    values = sorted(int(10 ** rng.uniform(0, 7)) for _ in range(20000))
+    histogram = Histogram()
+    for value in values:
+        histogram.record(value * 1e-6)
+    exact = _exact(values, percent)
+    assert abs(histogram.percentile(percent) * 1e6 - exact) <= exact / 64 + 1e-6
+
+
+def test_histogram_small_values_are_exact():
+    histogram = Histogram()
+    for value in range(100):
+        histogram.record(value * 1e-6 + 1e-9)
+    assert histogram.percentile(50) == pytest.approx(49e-6)
+    snapshot = histogram.snapshot()
+    assert (snapshot['count'], snapshot['min'], snapshot['max']) == (100, 0, pytest.approx(99e-6))
+    histogram.reset()
+    assert histogram.snapshot() == {'count': 0}
+    assert histogram.percentile(50) == 0.0
+
+
+def test_methods_are_wrapped_then_restored():
+    send, recv = Type3E.__dict__['_send'], Type3E.__dict__['_recv']
+    enable_instrumentation(['mitsubishi'])
+    assert metrics.enabled
+    assert Type3E.__dict__['_send'] is not send and Type3E.__dict__['_recv'] is not recv
+    # enabled twice: wrapped once
+    enable_instrumentation(['mitsubishi'])
+    assert len(instrumentation._installed) == 2
+    disable_instrumentation()
+    assert not metrics.enabled
+    assert (Type3E.__dict__['_send'], Type3E.__dict__['_recv']) == (send, recv)
+
+
+def test_unknown_driver_wraps_nothing():
+    with pytest.raises(ValueError):
+        enable_instrumentation(['mitsubishi', 'modbus'])
+    assert instrumentation._installed == []
+    assert not metrics.enabled
+
+
+def test_driver_that_fails_unwraps_the_others(monkeypatch):
+    send, recv = Type3E.__dict__['_send'], Type3E.__dict__['_recv']
+
+    def broken():
+        instrumentation._wrap(TCPFinsConnection, 'execute_fins_command_frame', lambda original: original)
+        raise ImportError('No module named fins_lib')
+
+    monkeypatch.setitem(instrumentation._INSTRUMENTS, 'broken', broken)
+    with pytest.raises(ImportError):
+        enable_instrumentation(['mitsubishi', 'broken'])
+    assert instrumentation._installed == []
+    assert not metrics.enabled
+    assert Type3E.__dict__['_send'] is send
+
+    # the next call starts from the original methods
+    enable_instrumentation(['mitsubishi'])
+    assert [original for _, _, original in instrumentation._installed] == [send, recv]
+
+
+def test_driver_that_fails_is_skipped_when_all_are_instrumented(monkeypatch):
+    def broken():
+        instrumentation._wrap(TCPFinsConnection, 'execute_fins_command_frame', lambda original: original)
+        raise ImportError('No module named fins_lib')
+
+    monkeypatch.setattr(instrumentation, '_INSTRUMENTS', {'mitsubishi': instrumentation._INSTRUMENTS['mitsubishi'],
+                                                          'broken': broken})
+    enable_instrumentation()
+    assert metrics.enabled
+    assert [(owner, name) for owner, name, _ in instrumentation._installed] == [(Type3E, '_send'), (Type3E, '_recv')]
+
+
+def test_fins_over_tcp_is_instrumented():
+    sim = simulators.FinsSimulator(HOST, transport='tcp')
+    port = sim.start()
+    try:
+        enable_instrumentation(['omron'])
+        connection = TCPFinsConnection()
+        connection.connect(HOST, port)
+        frame = build_fins_echo(0, 0, 1)
+        for _ in range(5):
+            connection.execute_fins_command_frame(frame)
+        connection.fins_socket.close()
+    finally:
+        sim.stop()
+    assert metrics.counter('plc.omron.requests') == 5
+    assert metrics.counter('plc.omron.bytes_sent') == 5 * len(frame)
+    assert metrics.histogram('plc.omron.rtt').count == 5
@@ -0,0 +1,148 @@
+"""
+Tests of the link probes and of the LinkMonitor against the FINS and TCP stand-ins of benchmarks/simulators.py.
+"""
+import socket
+import threading
+import time
+
+import pytest
+import simulators
+
+from fablab_lib.Network.function import LinkMonitor, probe_tcp, probe_fins_udp, build_fins_echo
+from fablab_lib.PLC.Omron.fins.Ethernet import function as omron
+
+HOST = '127.0.0.1'
+TIMEOUT = 5.0
+
+
+def _free_port(kind=socket.SOCK_STREAM):
+    with socket.socket(socket.AF_INET, kind) as sock:
+        sock.bind((HOST, 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def tcp_plc():
+    sim = simulators.MCSimulator(HOST)
+    sim.start()
+    yield sim
+    sim.stop()
+
+
+@pytest.fixture
+def fins_plc():
+    sim = simulators.FinsSimulator(HOST, transport='udp')
+    sim.start()
+    yield sim
+    sim.stop()
+
+
+class PortFilteredFins:
+    """
+    A FINS responder answering the echo only when it comes from one source port, like a PLC
+    answering port 9600 or the ports of its FINS node table.
+    """
+
+    def __init__(self, allowed):
+        self.allowed = allowed
+        self.sources = []
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((HOST, 0))
+        self.port = self.sock.getsockname()[1]
+        self.sim = simulators.FinsSimulator()
+        self.thread = threading.Thread(target=self._serve, daemon=True)
+        self.thread.start()
+
+    def _serve(self):
+        while True:
+            try:
+                frame, address = self.sock.recvfrom(4096)
+            except OSError:
+                return
+            self.sources.append(address[1])
+            if address[1] == self.allowed:
+                self.sock.sendto(self.sim.execute(frame), address)
+
+    def close(self):
+        self.sock.close()
+
+
+def test_tcp_probe_of_a_listening_service_is_up(tcp_plc):
+    assert probe_tcp(HOST, tcp_plc.port)
+
+
+def test_tcp_probe_of_a_closed_port_is_down():
+    assert not probe_tcp(HOST, _free_port())
+
+
+def test_fins_probe_is_answered(fins_plc):
+    assert probe_fins_udp(HOST, fins_plc.port)
+
+
+def test_fins_probe_without_answer_is_down():
+    start = time.monotonic()
+    assert not probe_fins_udp(HOST, _free_port(socket.SOCK_DGRAM), timeout=0.2)
+    assert time.monotonic() - start < 1.0
+
+
+def test_fins_probe_is_sent_from_the_port_of_the_driver():
+    bind_port = _free_port(socket.SOCK_DGRAM)
+    plc = PortFilteredFins(bind_port)
+    try:
+        assert not probe_fins_udp(HOST, plc.port, timeout=0.2)
+        assert probe_fins_udp(HOST, plc.port, timeout=0.5, bind_port=bind_port)
+        assert plc.sources[-1] == bind_port
+    finally:
+        plc.close()
+
+
+def test_fins_probe_falls_back_to_an_ephemeral_port_when_the_port_is_used(fins_plc):
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as driver:
+        driver.bind(('', 0))
+        assert probe_fins_udp(HOST, fins_plc.port, bind_port=driver.getsockname()[1])
+
+
+def test_echo_frame_is_answered_with_the_service_id(fins_plc):
+    frame = build_fins_echo(1, 25, 0x42)
+    reply = fins_plc.execute(frame)
+    assert reply[9] == 0x42 and reply[10:12] == b'\x08\x01'
+
+
+def test_omron_constructor_waits_at_most_the_timeout(monkeypatch):
+    monkeypatch.setattr(omron, 'DOWN_INTERVAL_MIN', 0.05)
+    start = time.monotonic()
+    assert not omron.waiting_for_connection(HOST, port=_free_port(socket.SOCK_DGRAM), bind_port=0, timeout=0.5)
+    assert time.monotonic() - start < 2.0
+
+
+def test_omron_constructor_returns_when_the_plc_answers(fins_plc):
+    assert omron.waiting_for_connection(HOST, port=fins_plc.port, bind_port=0, timeout=5)
+
+
+def test_monitor_reports_the_state_of_each_link(tcp_plc, fins_plc):
+    closed = _free_port()
+    changes = []
+    monitor = LinkMonitor(upInterval=0.1, timeout=0.2)
+    monitor.on_change = lambda host, port, is_up: changes.append((port, is_up))
+    monitor.add_host(HOST, tcp_plc.port)
+    monitor.add_host(HOST, fins_plc.port, protocol='fins')
+    monitor.add_host(HOST, closed)
+    monitor.start()
+    try:
+        assert monitor.wait_until_up(HOST, tcp_plc.port, TIMEOUT)
+        assert monitor.wait_until_up(HOST, fins_plc.port, TIMEOUT)
+        assert monitor.wait_until_down(HOST, closed, TIMEOUT)
+        assert not monitor.is_up(HOST, closed)
+
+        # the service stops: the link goes down
+        tcp_plc.stop()
+        assert monitor.wait_until_down(HOST, tcp_plc.port, TIMEOUT)
+    finally:
+        monitor.stop()
+    assert (tcp_plc.port, True) in changes and (tcp_plc.port, False) in changes
+    assert (closed, False) in changes and (closed, True) not in changes
+
+
+def test_monitor_rejects_an_unknown_protocol():
+    with pytest.raises(ValueError):
+        LinkMonitor().add_host(HOST, 502, protocol='modbus')
@@ -0,0 +1,157 @@
+"""
+Tests of the buffered packet reader of the vendored paho client: packets split across the reads in
+every way, remaining lengths of 1 to 4 bytes, the growth of the input buffer and the callbacks that
+reconnect in the middle of a buffer.
+"""
+import random
+import struct
+
+import pytest
+import simulators
+
+import fablab_lib.Broker.MQTT.paho.mqtt.client as mqtt
+
+HOST = '127.0.0.1'
+
+
+class FragmentSocket:
+    """
+    A socket receiving the given chunks, one per recv_into(), then would block.
+    """
+
+    def __init__(self, chunks=()):
+        self.chunks = [bytes(chunk) for chunk in chunks]
+        self.closed = False
+
+    def recv_into(self, buffer):
+        if not self.chunks:
+            raise BlockingIOError
+        chunk = self.chunks.pop(0)
+        if len(chunk) > len(buffer):
+            chunk, rest = chunk[:len(buffer)], chunk[len(buffer):]
+            self.chunks.insert(0, rest)
+        buffer[:len(chunk)] = chunk
+        return len(chunk)
+
+    def fileno(self):
+        return -1
+
+    def close(self):
+        self.closed = True
+
+
+def _remaining_length(size):
+    encoded = bytearray()
+    while True:
+        byte, size = size % 128, size // 128
+        encoded.append(byte | (0x80 if size else 0))
+        if not size:
+            return bytes(encoded)
+
+
+def _publish(topic, payload):
+    body = struct.pack('!H', len(topic)) + topic.encode() + payload
+    return b'\x30' + _remaining_length(len(body)) + body
+
+
+def _client(chunks):
+    client = mqtt.Client()
+    received = []
+    client.on_message = lambda client, userdata, message: received.append((message.topic, message.payload))
+    client._sock = FragmentSocket(chunks)
+    return client, received
+
+
+def _read_all(client):
+    rc = mqtt.MQTT_ERR_SUCCESS
+    while client._sock is not None and client._sock.chunks:
+        rc = client._packet_read()
+        if rc not in (mqtt.MQTT_ERR_SUCCESS, mqtt.MQTT_ERR_AGAIN):
+            return rc
+    return rc
+
+
+def _split(data, cuts):
+    cuts = sorted(set(cuts))
+    return [data[a:b] for a, b in zip([0] + cuts, cuts + [len(data)])]
+
+
+def test_remaining_length_of_1_to_4_bytes():
+    for size, length in ((127, 1), (128, 2), (16383, 2), (16384, 3), (2097151, 3), (2097152, 4)):
+        assert len(_remaining_length(size)) == length
+        packet = _publish('t', bytes(size - 3))
+        client, received = _client([packet])
+        assert _read_all(client) in (mqtt.MQTT_ERR_SUCCESS, mqtt.MQTT_ERR_AGAIN)
+        assert received == [('t', bytes(size - 3))]
+
+
+@pytest.mark.parametrize('cut', range(1, 6))
+def test_fixed_header_split_across_reads(cut):
+    # command, 3 bytes of remaining length, then the topic
+    packet = _publish('a/b', bytes(20000))
+    client, received = _client(_split(packet, [cut]))
+    _read_all(client)
+    assert received == [('a/b', bytes(20000))]
+
+
+def test_random_fragments_of_a_stream_of_packets():
+    rng = random.Random(1234)
+    messages = [(f'tag/{i}', bytes(rng.randrange(256) for _ in range(rng.choice((0, 1, 50, 300, 20000)))))
+                for i in range(200)]
+    stream = b''.join(_publish(topic, payload) for topic, payload in messages)
+    for _ in range(5):
+        cuts = [rng.randrange(1, len(stream)) for _ in range(rng.randrange(1, 400))]
+        client, received = _client(_split(stream, cuts))
+        _read_all(client)
+        assert received == messages
+        assert client._in_start == client._in_end == 0
+
+
+def test_remaining_length_of_5_bytes_is_a_protocol_error():
+    client, received = _client([b'\x30\xff\xff\xff\xff\x01' + bytes(10)])
+    assert client._packet_read() == mqtt.MQTT_ERR_PROTOCOL
+    assert received == []
+
+
+def test_buffer_grows_for_a_large_packet_then_shrinks_back():
+    payload = bytes(range(256)) * (3 * mqtt.READ_BUFFER_SIZE // 256)
+    packet = _publish('big', payload)
+    small = _publish('small', b'1')
+    client, received = _client(_split(packet + small, [1000, mqtt.READ_BUFFER_SIZE + 10]))
+
+    client._packet_read()
+    client._packet_read()
+    # the packet is larger than the buffer: it grew to hold it
+    assert len(client._in_buffer) >= len(packet)
+    _read_all(client)
+    assert received == [('big', payload), ('small', b'1')]
+    assert len(client._in_buffer) == mqtt.READ_BUFFER_SIZE
+
+
+def test_callback_reconnecting_in_the_middle_of_a_buffer():
+    broker = simulators.MQTTBroker(HOST)
+    broker.start()
+    client = mqtt.Client()
+    received = []
+
+    def on_message(client, userdata, message):
+        received.append(message.topic)
+        if message.topic == 'first':
+            client.reconnect()
+
+    client.on_message = on_message
+    try:
+        client.connect(HOST, broker.port)
+        old = client._sock
+        fake = FragmentSocket([_publish('first', b'1') + _publish('second', b'2') + _publish('thi', b'3')[:4]])
+        client._sock = fake
+        client._packet_read()
+        old.close()
+        # the packets after the reconnection belong to the old connection
+        assert received == ['first']
+        assert fake.closed
+        assert client._sock is not fake
+        assert client._in_start == client._in_end == 0
+    finally:
+        client.disconnect()
+        broker.stop()
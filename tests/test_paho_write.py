@@ -0,0 +1,186 @@
+"""
+Tests of the coalesced writes of the vendored paho client, byte for byte against fake sockets: partial
+sends, the on_publish of the QoS 0 messages, a DISCONNECT in a batch, the joined send of TLS and
+websockets, and the registration of a full socket for writing.
+"""
+import random
+import socket
+
+import pytest
+
+import fablab_lib.Broker.MQTT.paho.mqtt.client as mqtt
+
+
+class FullSocket(socket.socket):
+    """
+    A socket whose send buffer is full.
+    """
+
+    def send(self, buf):
+        raise BlockingIOError
+
+    def sendmsg(self, buffers):
+        raise BlockingIOError
+
+
+@pytest.mark.parametrize('buffers', [[b'a'], [b'a', b'b']])
+def test_full_socket_is_registered_for_writing(buffers):
+    client = mqtt.Client()
+    registered = []
+    client.on_socket_register_write = lambda client, userdata, sock: registered.append(sock)
+    client._sock = FullSocket()
+    try:
+        with pytest.raises(BlockingIOError):
+            client._sock_sendmsg(buffers)
+        assert registered == [client._sock]
+    finally:
+        client._sock.close()
+
+
+class RecordingSocket:
+    """
+    A socket accepting at most the given number of bytes per call, recording the bytes sent and the calls.
+    Once the limits are used, it accepts everything, or would block with full=True.
+    """
+
+    def __init__(self, limits=(), full=False):
+        self.limits = list(limits)
+        self.full = full
+        self.sent = bytearray()
+        self.calls = []
+
+    def _accept(self, data):
+        if not self.limits and self.full:
+            raise BlockingIOError
+        limit = self.limits.pop(0) if self.limits else len(data)
+        self.sent += data[:limit]
+        return min(limit, len(data))
+
+    def send(self, buf):
+        self.calls.append(('send', 1))
+        return self._accept(bytes(buf))
+
+    def sendmsg(self, buffers):
+        self.calls.append(('sendmsg', len(buffers)))
+        return self._accept(b''.join(bytes(buffer) for buffer in buffers))
+
+    def fileno(self):
+        return -1
+
+    def close(self):
+        pass
+
+
+class JoinedSocket(RecordingSocket):
+    """
+    A socket without sendmsg(), like a TLS or a websocket connection.
+    """
+    sendmsg = None
+
+    def __getattribute__(self, name):
+        if name == 'sendmsg':
+            raise AttributeError(name)
+        return super().__getattribute__(name)
+
+
+def _client(sock, budget=mqtt.WRITE_BUDGET):
+    client = mqtt.Client()
+    # the packets are only queued, the test calls _packet_write()
+    client.on_socket_register_write = lambda client, userdata, sock: None
+    client.write_budget_set(budget)
+    client._sock = sock
+    published = []
+    client.on_publish = lambda client, userdata, mid: published.append(mid)
+    return client, published
+
+
+def _publish(client, count, qos=0):
+    infos = [client.publish(f'tag/{i}', f'value {i}' * (i % 5 + 1), qos) for i in range(count)]
+    expected = b''.join(bytes(packet['packet']) for packet in client._out_packet)
+    return infos, expected
+
+
+def _write_all(client):
+    for _ in range(10000):
+        if not client._out_packet or client._sock is None:
+            return
+        client._packet_write()
+    raise AssertionError('the packets were not all written')
+
+
+def test_packets_are_coalesced_into_one_sendmsg():
+    sock = RecordingSocket()
+    client, published = _client(sock)
+    infos, expected = _publish(client, 50)
+    client._packet_write()
+    assert bytes(sock.sent) == expected
+    assert sock.calls == [('sendmsg', 50)]
+    assert published == [info.mid for info in infos]
+
+
+def test_partial_sendmsg_sends_the_rest_byte_for_byte():
+    rng = random.Random(7)
+    sock = RecordingSocket(rng.randrange(1, 40) for _ in range(5000))
+    client, published = _client(sock)
+    infos, expected = _publish(client, 100)
+
+    client._packet_write()
+    first = sock.calls[0]
+    # the first call is cut in the first packets: they are sent again from where the call stopped
+    assert bytes(sock.sent) == expected[:len(sock.sent)]
+    _write_all(client)
+    assert bytes(sock.sent) == expected
+    assert first[1] > 1
+    # QoS 0: published in the order of the packets, each one once, when its last byte is sent
+    assert published == [info.mid for info in infos]
+    assert all(info.is_published() for info in infos)
+
+
+def test_qos0_is_published_only_when_its_last_byte_is_sent():
+    sock = RecordingSocket([3], full=True)
+    client, published = _client(sock)
+    infos, expected = _publish(client, 2)
+    assert client._packet_write() == mqtt.MQTT_ERR_AGAIN
+    assert published == []
+    assert not infos[0].is_published()
+    sock.full = False
+    _write_all(client)
+    assert published == [infos[0].mid, infos[1].mid]
+
+
+def test_write_budget_bounds_the_bytes_of_a_call():
+    sock = RecordingSocket()
+    client, _ = _client(sock, budget=1)
+    _, expected = _publish(client, 10)
+    client._packet_write()
+    assert bytes(sock.sent) == expected
+    assert sock.calls == [('send', 1)] * 10
+
+
+def test_disconnect_in_the_middle_of_a_batch_stops_the_write():
+    sock = RecordingSocket()
+    client, published = _client(sock)
+    disconnected = []
+    client.on_disconnect = lambda client, userdata, rc: disconnected.append(rc)
+    infos, expected = _publish(client, 3)
+    client.disconnect()
+    after = client.publish('after', b'late', 0)
+    client._packet_write()
+
+    assert bytes(sock.sent) == expected + b'\xe0\x00'
+    assert disconnected == [mqtt.MQTT_ERR_SUCCESS]
+    assert client._sock is None
+    assert published == [info.mid for info in infos]
+    # the packet queued behind the DISCONNECT is kept, not sent
+    assert [packet['mid'] for packet in client._out_packet] == [after.mid]
+
+
+def test_tls_and_websocket_connections_send_the_joined_packets():
+    sock = JoinedSocket([25])
+    client, published = _client(sock)
+    infos, expected = _publish(client, 20)
+    _write_all(client)
+    assert bytes(sock.sent) == expected
+    assert sock.calls[0] == ('send', 1)
+    assert all(call[0] == 'send' for call in sock.calls)
+    assert published == [info.mid for info in infos]
@@ -0,0 +1,132 @@
+"""
+Tests of the PublishQueue with a StoreForward publisher: the live data is published through the store
+and forward, so it never overtakes the stored messages.
+"""
+import time
+
+from fablab_lib.Broker.JsonPayload.function import get_codec
+from fablab_lib.Broker.MQTT.function import PublishQueue, StoreForward
+from fablab_lib.Store.function import DiskQueue
+
+TIMEOUT = 5.0
+
+
+class FakeClient:
+    """
+    The methods of MQTT used by PublishQueue and StoreForward, recording the published names.
+    """
+
+    def __init__(self, connected=True):
+        self.connected = connected
+        self.codec = get_codec('json')
+        self.published = []
+
+    def is_connected(self):
+        return self.connected
+
+    def pending(self):
+        return 0
+
+    def publish_data(self, Name, Value, is_payload=False, timestamp=None, kind=None):
+        self.published.append(Name)
+
+
+def _wait(condition):
+    deadline = time.monotonic() + TIMEOUT
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_queue_publishes_with_the_client_by_default():
+    client = FakeClient()
+    queue = PublishQueue(client, name='test.queue.client')
+    queue.start()
+    queue.publish_data('a', 1)
+    queue.publish_data('b', 2)
+    assert _wait(lambda: len(client.published) == 2)
+    queue.stop()
+    assert client.published == ['a', 'b']
+
+
+def test_queue_without_publisher_holds_the_messages_while_disconnected():
+    client = FakeClient(connected=False)
+    queue = PublishQueue(client, name='test.queue.hold')
+    queue.start()
+    queue.publish_data('a', 1)
+    time.sleep(0.1)
+    assert queue.depth() == 1
+    queue.stop()
+    assert queue.dropped == 1
+
+
+def test_queue_drains_into_the_store_while_disconnected(tmp_path):
+    client = FakeClient(connected=False)
+    disk = DiskQueue(str(tmp_path))
+    forward = StoreForward(client, disk)
+    queue = PublishQueue(client, name='test.queue.store', publisher=forward)
+    queue.start()
+    queue.publish_data('a', 1)
+    queue.publish_data('b', 2)
+    assert _wait(lambda: forward.stored == 2)
+    assert queue.depth() == 0
+    assert client.published == []
+
+    # back online: the live data is stored behind the messages not replayed yet
+    client.connected = True
+    queue.publish_data('c', 3)
+    assert _wait(lambda: forward.stored == 3)
+    queue.stop()
+    assert client.published == []
+    assert [Name for _, Name, _ in disk.read(10)] == ['a', 'b', 'c']
+    disk.close()
+
+
+def test_queue_stopped_while_disconnected_stores_the_messages(tmp_path):
+    client = FakeClient(connected=False)
+    disk = DiskQueue(str(tmp_path))
+    forward = StoreForward(client, disk)
+    queue = PublishQueue(client, name='test.queue.stop', publisher=forward)
+    for i in range(5):
+        queue.publish_data(f'm{i}', i)
+    queue.start()
+    queue.stop()
+    assert queue.dropped == 0
+    assert forward.stored == 5
+    disk.close()
+
+
+def test_full_queue_never_blocks_the_publisher_by_default():
+    client = FakeClient(connected=False)
+    queue = PublishQueue(client, maxsize=2, name='test.queue.default')
+    queue.start()
+    start = time.monotonic()
+    for i in range(5):
+        queue.publish_data(f'm{i}', i)
+    assert time.monotonic() - start < 0.5
+    stats = queue.stats()
+    assert (stats['depth'], stats['dropped'], stats['blocked']) == (2, 3, 0)
+    queue.stop()
+
+
+def test_blocked_publishes_are_counted():
+    client = FakeClient(connected=False)
+    queue = PublishQueue(client, maxsize=1, policy='block', timeout=0.05, name='test.queue.block')
+    queue.publish_data('a', 1)
+    queue.publish_data('b', 2)
+    assert queue.stats()['blocked'] == 1
+    assert queue.stats()['dropped'] == 1
+
+
+def test_disconnected_queue_polls_the_connection_slowly():
+    client = FakeClient(connected=False)
+    checks = []
+    client.is_connected = lambda: checks.append(1) or False
+    queue = PublishQueue(client, name='test.queue.poll')
+    queue.publish_data('a', 1)
+    queue.start()
+    time.sleep(0.3)
+    polls = len(checks)
+    queue.stop()
+    # one check a second, not one per ACK_POLL (5 ms)
+    assert polls < 10
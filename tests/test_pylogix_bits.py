@@ -0,0 +1,74 @@
+"""
+Tests of the coalescing of the Rockwell bit references (Tag.5, Tag[37]) into one read or write of their word.
+"""
+from fablab_lib.PLC.Rockwell_AB.logix.Ethernet.pylogix.eip import PLC
+from fablab_lib.PLC.Rockwell_AB.logix.Ethernet.pylogix.lgx_response import Response
+
+DINT = 0xc4
+REAL = 0xca
+BOOL_ARRAY = 0xd3
+
+
+def _plc(**known_tags):
+    plc = PLC('192.168.1.10')
+    plc.KnownTags.update({tag: (data_type, 0) for tag, data_type in known_tags.items()})
+    return plc
+
+
+def test_bits_of_a_word_are_read_once():
+    plc = _plc(Alarm=DINT, Speed=REAL)
+    requests, plan = plc._plan_bit_reads(['Alarm.0', 'Speed', 'Alarm.5'])
+    assert requests == [('Alarm', 1, DINT), 'Speed']
+    assert plan == [(0, 0), (1, None), (0, 5)]
+
+
+def test_bool_array_is_read_from_the_first_to_the_last_word():
+    plc = _plc(Bits=BOOL_ARRAY)
+    requests, plan = plc._plan_bit_reads(['Bits[40]', 'Bits[35]'])
+    assert requests == [('Bits[32]', 9, BOOL_ARRAY)]
+    assert plan == [(0, 8), (0, 3)]
+
+
+def test_unknown_and_typed_tags_are_read_as_is():
+    plc = _plc()
+    requests, plan = plc._plan_bit_reads(['Unknown.1', ('Counter', 1, DINT)])
+    assert requests == ['Unknown.1', ('Counter', 1, DINT)]
+    assert plan == [(0, None), (1, None)]
+
+
+def test_extract_bit():
+    plc = _plc()
+    word = Response('Alarm', 0b100001, 0)
+    assert plc._extract_bit('Alarm.0', word, 0).Value is True
+    assert plc._extract_bit('Alarm.1', word, 1).Value is False
+    assert plc._extract_bit('Alarm.5', word, 5).Value is True
+
+    array = Response('Bits[32]', [False, True], 0)
+    assert plc._extract_bit('Bits[33]', array, 1).Value is True
+
+    failed = Response('Alarm', None, 4)
+    result = plc._extract_bit('Alarm.5', failed, 5)
+    assert result.Value is None and result.Status == failed.Status
+
+
+def test_bits_of_a_word_are_written_with_one_masked_write():
+    plc = _plc(Alarm=DINT, Speed=REAL)
+    others, groups, plan = plc._plan_bit_writes([('Alarm.0', True), ('Speed', 1.5), ('Alarm.3', False)])
+    assert others == [('Speed', 1.5)]
+    assert groups == [['Alarm', DINT, 0b1, ~0b1000]]
+    assert plan == [(0, True), (0, False), (0, True)]
+
+
+def test_bool_array_writes_are_grouped_by_word():
+    plc = _plc(Bits=BOOL_ARRAY)
+    others, groups, plan = plc._plan_bit_writes([('Bits[1]', True), ('Bits[35]', True), ('Bits[2]', True)])
+    assert others == []
+    assert groups == [['Bits[0]', BOOL_ARRAY, 0b110, -1], ['Bits[32]', BOOL_ARRAY, 0b1000, -1]]
+    assert plan == [(0, True), (1, True), (0, True)]
+
+
+def test_bit_out_of_the_word_is_not_coalesced():
+    plc = _plc(Flags=0xc2)
+    others, groups, plan = plc._plan_bit_writes([('Flags.9', True)])
+    assert others == [('Flags.9', True)]
+    assert groups == []
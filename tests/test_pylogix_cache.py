@@ -0,0 +1,61 @@
+"""
+Tests of the tag type cache of pylogix against the EtherNet/IP stand-in of benchmarks/simulators.py: a type
+corrected by a read is saved, and the cache file is on the disk before it replaces the old one.
+"""
+import json
+
+import pytest
+import simulators
+
+from fablab_lib.PLC.Rockwell_AB.logix.Ethernet.pylogix import lgx_cache
+from fablab_lib.PLC.Rockwell_AB.logix.Ethernet.pylogix.eip import PLC
+
+HOST = '127.0.0.1'
+IDENTITY = 'simulator'
+DINT = 0xc4
+REAL = 0xca
+
+
+@pytest.fixture
+def plc():
+    sim = simulators.EIPSimulator(HOST)
+    port = sim.start()
+    plc = PLC(HOST, port=port)
+    # the simulator doesn't answer the identity request
+    plc.Identity = IDENTITY
+    yield plc
+    plc.Close()
+    sim.stop()
+
+
+def _cached_types(path):
+    with open(path) as f:
+        return {tag: value[0] for tag, value in json.load(f)['controllers'][IDENTITY]['known_tags'].items()}
+
+
+def test_type_corrected_by_a_read_is_saved(plc, tmp_path):
+    path = str(tmp_path / 'tags.json')
+    # cache of an older program where Count was a REAL
+    lgx_cache.save_cache(path, IDENTITY, {'Count': (REAL, 0), 'Speed': (REAL, 0)}, {})
+    plc.LoadTagCache(path)
+
+    response = plc.Read('Count')
+    assert response.Status == 'Success'
+    assert plc.KnownTags['Count'] == (DINT, 0)
+    # what makes the Rockwell wrapper save the cache although no tag was learned
+    assert plc.StaleTags == {'Count'}
+
+    plc.SaveTagCache(path)
+    assert _cached_types(path) == {'Count': DINT, 'Speed': REAL}
+    assert not plc.StaleTags
+
+
+def test_cache_file_is_synced_before_it_is_replaced(tmp_path, monkeypatch):
+    path = str(tmp_path / 'tags.json')
+    calls = []
+    fsync, replace = lgx_cache.os.fsync, lgx_cache.os.replace
+    monkeypatch.setattr(lgx_cache.os, 'fsync', lambda fd: calls.append('fsync') or fsync(fd))
+    monkeypatch.setattr(lgx_cache.os, 'replace', lambda src, dst: calls.append('replace') or replace(src, dst))
+    lgx_cache.save_cache(path, IDENTITY, {'Count': (DINT, 0)}, {})
+    assert calls == ['fsync', 'replace']
+    assert _cached_types(path) == {'Count': DINT}
@@ -0,0 +1,95 @@
+"""
+Tests of the receive path of pylogix: the replies are views of the reused receive buffer, read from
+fragmented streams, and decoded by the parsers without a copy.
+"""
+import random
+from struct import pack
+
+import pytest
+import simulators
+
+from fablab_lib.PLC.Rockwell_AB.logix.Ethernet.pylogix.eip import PLC
+from fablab_lib.PLC.Rockwell_AB.logix.Ethernet.pylogix.lgx_comm import EIP_HEADER_SIZE
+from fablab_lib.PLC.Rockwell_AB.logix.Ethernet.pylogix.lgx_tag import Tag
+
+HOST = '127.0.0.1'
+
+
+class FragmentSocket:
+    """
+    A socket returning the stream in random fragments of 1 to max_fragment bytes.
+    """
+
+    def __init__(self, stream, seed=0, max_fragment=7):
+        self.stream = bytes(stream)
+        self.pos = 0
+        self.rng = random.Random(seed)
+        self.max_fragment = max_fragment
+
+    def recv_into(self, buffer, nbytes):
+        n = min(nbytes, self.rng.randint(1, self.max_fragment), len(self.stream) - self.pos)
+        buffer[:n] = self.stream[self.pos:self.pos + n]
+        self.pos += n
+        return n
+
+
+def _frame(payload):
+    return pack('<HH', 0x70, len(payload)) + bytes(range(4, EIP_HEADER_SIZE)) + payload
+
+
+def _connection(stream, **kwargs):
+    plc = PLC(HOST)
+    plc.conn.Socket = FragmentSocket(stream, **kwargs)
+    return plc.conn
+
+
+def test_reply_is_a_view_of_the_receive_buffer():
+    frames = [_frame(bytes([i]) * (10 * i)) for i in range(1, 20)]
+    conn = _connection(b''.join(frames))
+    for frame in frames:
+        reply = conn.receive_data()
+        assert isinstance(reply, memoryview)
+        assert reply == frame
+        assert reply.obj is conn._rx_buffer
+
+
+def test_reply_larger_than_the_buffer_grows_it():
+    small, large = _frame(b'\x01' * 100), _frame(bytes(range(256)) * 40)
+    conn = _connection(small + large + small, max_fragment=1500)
+    first = conn.receive_data()
+    # a view of the previous reply still held doesn't prevent the resize, it is only not valid anymore
+    assert conn.receive_data() == large
+    assert len(conn._rx_buffer) == len(large)
+    assert first.obj is not conn._rx_buffer
+    assert conn.receive_data() == small
+
+
+def test_closed_connection_returns_none():
+    conn = _connection(_frame(b'\x01' * 100)[:60])
+    assert conn.receive_data() is None
+
+
+def test_tag_is_parsed_from_a_view():
+    name = 'Program:Main.Speed'.encode()
+    packet = memoryview(pack('<IH', 7, len(name)) + name + pack('<HH', 0xc4 | 0x2000, 10))
+    tag = Tag.parse(packet, None)
+    assert (tag.TagName, tag.InstanceID, tag.DataTypeValue, tag.Array, tag.Size) == ('Program:Main.Speed', 7, 0xc4, 1, 10)
+
+
+@pytest.fixture
+def plc():
+    sim = simulators.EIPSimulator(HOST)
+    port = sim.start()
+    plc = PLC(HOST, port=port)
+    yield plc
+    plc.Close()
+    sim.stop()
+
+
+def test_reads_and_writes_against_the_simulator(plc):
+    assert plc.Write('Count', 12345).Status == 'Success'
+    assert plc.Read('Count').Value == 12345
+    assert [response.Value for response in plc.Read(['Count', 'Other', 'Count'])] == [12345, 0, 12345]
+    values = list(range(1, 901))
+    assert plc.Write('Arr[0]', values).Status == 'Success'
+    assert plc.Read('Arr[0]', 900).Value == values
@@ -0,0 +1,92 @@
+"""
+Tests of the machine state classification with a precomputed truth table (StateClassifier).
+"""
+from itertools import product
+
+import pytest
+
+from fablab_lib.Logic.function import LogicExpr, StateClassifier
+
+RULES = [('Run', 'a.d.(/c).(/e)'),
+         ('Idle', 'e.(/d).(/c)', ('Setup', 'On')),
+         ('Alarm', 'c'),
+         ('Setup', 'b.d.(/c).(/e)')]
+GUARDS = ['f']
+
+
+def _reference(rules, guards, bits, previous, default=None):
+    """
+    Checks the rules in order with the compiled equations, as before the truth table.
+    """
+    if not all(LogicExpr.compile(guard)(bits) for guard in guards):
+        return default
+    for rule in rules:
+        blockedFrom = rule[2] if len(rule) > 2 else ()
+        if previous not in blockedFrom and LogicExpr.compile(rule[1])(bits):
+            return rule[0]
+    return default
+
+
+@pytest.mark.parametrize('previous', [None, 'Run', 'Idle', 'Alarm', 'Setup', 'On'])
+def test_table_matches_the_rules_in_order(previous):
+    classifier = StateClassifier(RULES, guards=GUARDS)
+    for bits in product([False, True], repeat=6):
+        assert classifier.classify(list(bits), previous) == _reference(RULES, GUARDS, bits, previous), bits
+
+
+def test_nbits_from_the_highest_variable():
+    assert StateClassifier(RULES, guards=GUARDS).nbits == 6
+    assert StateClassifier([('Run', 'c')]).nbits == 3
+
+
+def test_too_many_bits():
+    with pytest.raises(ValueError):
+        StateClassifier([('Run', 'q')])
+
+
+def test_raw_driver_values():
+    classifier = StateClassifier(RULES, guards=GUARDS)
+    assert classifier.classify([1, 0, 0, 1, 0, 1]) == 'Run'
+    assert classifier.classify([2, None, None, 5, 0, 3]) == 'Run'
+    assert classifier.classify([1, 0, 0, 1, 0, None]) is None
+
+
+def test_packed_bits():
+    classifier = StateClassifier(RULES, guards=GUARDS)
+    assert classifier.classify(0b101001) == 'Run'
+    assert classifier.classify(0b100100) == 'Alarm'
+
+
+def test_update_calls_on_transition_on_changes_only():
+    classifier = StateClassifier(RULES, guards=GUARDS)
+    transitions = []
+    classifier.on_transition = lambda old, new, timestamp: transitions.append((old, new, timestamp))
+
+    assert classifier.update([1, 0, 0, 1, 0, 1], timestamp='t1') == 'Run'
+    assert classifier.update([1, 0, 0, 1, 0, 1], timestamp='t2') == 'Run'
+    assert classifier.update([0, 0, 1, 0, 0, 1], timestamp='t3') == 'Alarm'
+    assert transitions == [(None, 'Run', 't1'), ('Run', 'Alarm', 't3')]
+    assert classifier.timestamp == 't3'
+
+
+def test_no_rule_keeps_the_current_state():
+    classifier = StateClassifier(RULES, guards=GUARDS)
+    classifier.update([1, 0, 0, 1, 0, 1])
+    # guard off, no default
+    assert classifier.update([1, 0, 0, 1, 0, 0]) == 'Run'
+
+
+def test_blocked_transition():
+    classifier = StateClassifier(RULES, guards=GUARDS)
+    idle = [0, 0, 0, 0, 1, 1]
+    classifier.update([0, 1, 0, 1, 0, 1])
+    assert classifier.state == 'Setup'
+    # Idle can't be entered from Setup
+    assert classifier.update(idle) == 'Setup'
+    classifier.update([1, 0, 0, 1, 0, 1])
+    assert classifier.update(idle) == 'Idle'
+
+
+def test_default_state():
+    classifier = StateClassifier(RULES, guards=GUARDS, default='Off')
+    assert classifier.classify([0, 0, 0, 0, 0, 0]) == 'Off'
@@ -0,0 +1,224 @@
+"""
+Tests of the ConnectionSupervisor circuit breaker with a fake PLC wrapper.
+"""
+import threading
+
+import pytest
+
+from fablab_lib.Network import function as network
+from fablab_lib.Network.function import (CIRCUIT_CLOSED, CIRCUIT_HALF_OPEN, CIRCUIT_OPEN, ConnectionSupervisor,
+                                         PLCUnavailable)
+
+TIMEOUT = 5.0
+
+
+class FakePLC:
+    """
+    A PLC wrapper whose link is switched on and off by the test, the block calls answer like the wrappers:
+    None values and False statuses when the PLC doesn't answer.
+    """
+
+    def __init__(self):
+        self.online = True
+        self.connects = 0
+        self.disconnects = 0
+        self.model = 'Q03UDE'
+
+    def connect(self):
+        self.connects += 1
+        if not self.online:
+            raise ConnectionRefusedError('PLC offline')
+
+    def disconnect(self):
+        self.disconnects += 1
+
+    def readData(self, address):
+        if not self.online:
+            raise TimeoutError('no answer')
+        return address, 1
+
+    def read_tags(self, tags):
+        return [(tag, 1 if self.online else None) for tag in tags]
+
+    def write_tags(self, tags):
+        return [self.online for _ in tags]
+
+
+@pytest.fixture
+def plc():
+    return FakePLC()
+
+
+@pytest.fixture
+def supervisor(plc):
+    supervisor = ConnectionSupervisor(plc, minDelay=0.01, maxDelay=0.05)
+    yield supervisor
+    supervisor.stop(TIMEOUT)
+
+
+def _fail(supervisor, count):
+    for _ in range(count):
+        with pytest.raises(TimeoutError):
+            supervisor.driver.readData('D0')
+
+
+def test_circuit_opens_after_failure_threshold(plc, supervisor):
+    plc.online = False
+    _fail(supervisor, supervisor.failureThreshold - 1)
+    assert supervisor.state == CIRCUIT_CLOSED
+    _fail(supervisor, 1)
+    assert supervisor.state == CIRCUIT_OPEN
+    assert not supervisor.is_available()
+    with pytest.raises(PLCUnavailable):
+        supervisor.driver.readData('D0')
+    stats = supervisor.stats()
+    assert (stats['calls'], stats['failures'], stats['rejected'], stats['trips']) == (3, 3, 1, 1)
+
+
+def test_success_resets_the_failures_in_a_row(plc, supervisor):
+    plc.online = False
+    _fail(supervisor, supervisor.failureThreshold - 1)
+    plc.online = True
+    assert supervisor.driver.readData('D0') == ('D0', 1)
+    assert supervisor.failures == 0
+    plc.online = False
+    _fail(supervisor, supervisor.failureThreshold - 1)
+    assert supervisor.state == CIRCUIT_CLOSED
+
+
+def test_failed_block_results_are_failures(plc, supervisor):
+    supervisor.failureThreshold = 1
+    plc.online = False
+    assert supervisor.driver.read_tags(['D0', 'D1']) == [('D0', None), ('D1', None)]
+    assert supervisor.state == CIRCUIT_OPEN
+
+
+def test_failed_block_writes_are_failures(plc, supervisor):
+    supervisor.failureThreshold = 1
+    plc.online = False
+    assert supervisor.driver.write_tags([('D0', 1)]) == [False]
+    assert supervisor.state == CIRCUIT_OPEN
+
+
+@pytest.mark.parametrize('name, result', [
+    ('read_tags', [('D0', None), ('D1', 5)]),
+    ('read_tags', []),
+    ('write_tags', [False, True]),
+    ('write_tags', []),
+    ('readData', None),
+])
+def test_partial_or_empty_results_are_not_failures(supervisor, name, result):
+    func = lambda: result
+    func.__name__ = name
+    supervisor.failureThreshold = 1
+    assert supervisor.call(func) == result
+    assert supervisor.state == CIRCUIT_CLOSED
+    assert supervisor.stats()['failures'] == 0
+
+
+def test_driver_proxy_returns_the_attributes(plc, supervisor):
+    assert supervisor.driver.model == 'Q03UDE'
+    supervisor.driver.readData('D0')
+    assert supervisor.stats()['calls'] == 1
+
+
+def test_half_open_recovery_closes_the_circuit(plc, supervisor):
+    states = []
+    hooks = []
+    supervisor.on_state_change = lambda old, new: states.append((old, new))
+    supervisor.add_recovery_hook(hooks.append)
+    supervisor.start()
+
+    plc.online = False
+    supervisor.trip('link down')
+    assert not supervisor.wait_until_available(0.2)
+    assert (CIRCUIT_HALF_OPEN, CIRCUIT_OPEN) in states
+    assert hooks == []
+
+    plc.online = True
+    assert supervisor.wait_until_available(TIMEOUT)
+    assert states[0] == (CIRCUIT_CLOSED, CIRCUIT_OPEN)
+    assert states[-1] == (CIRCUIT_HALF_OPEN, CIRCUIT_CLOSED)
+    assert hooks == [plc]
+    assert plc.disconnects == supervisor.stats()['attempts'] > 1
+    stats = supervisor.stats()
+    assert (stats['trips'], stats['recoveries'], stats['state']) == (1, 1, CIRCUIT_CLOSED)
+    assert supervisor.failures == 0
+    assert supervisor.driver.readData('D0') == ('D0', 1)
+
+
+def test_trip_of_an_open_circuit_is_ignored(supervisor):
+    supervisor.trip('first')
+    supervisor.trip('second')
+    assert supervisor.stats()['trips'] == 1
+
+
+def test_failed_check_keeps_the_circuit_open(plc):
+    answers = iter([False, False, True])
+    supervisor = ConnectionSupervisor(plc, check=lambda plc: next(answers), minDelay=0.01, maxDelay=0.02)
+    supervisor.start()
+    try:
+        supervisor.trip()
+        assert supervisor.wait_until_available(TIMEOUT)
+        assert supervisor.stats()['attempts'] == 3
+    finally:
+        supervisor.stop(TIMEOUT)
+
+
+def test_failing_recovery_hook_retries_the_reconnection(plc, supervisor):
+    calls = []
+
+    def hook(plc):
+        calls.append(plc)
+        if len(calls) < 2:
+            raise RuntimeError('subscription lost')
+
+    supervisor.add_recovery_hook(hook)
+    supervisor.start()
+    supervisor.trip()
+    assert supervisor.wait_until_available(TIMEOUT)
+    assert len(calls) == 2
+    assert supervisor.stats()['attempts'] == 2
+
+
+def test_backoff_doubles_up_to_max_delay(plc):
+    supervisor = ConnectionSupervisor(plc, minDelay=1.0, maxDelay=10.0, jitter=0.0)
+    assert [supervisor._delay(attempt) for attempt in range(6)] == [1.0, 2.0, 4.0, 8.0, 10.0, 10.0]
+    assert supervisor._delay(10 ** 6) == 10.0
+
+
+@pytest.mark.parametrize('attempt', [0, 1, 3, 40])
+def test_jitter_stays_within_its_bounds(plc, monkeypatch, attempt):
+    supervisor = ConnectionSupervisor(plc, minDelay=1.0, maxDelay=10.0, jitter=0.5)
+    base = min(2.0 ** attempt, 10.0)
+    monkeypatch.setattr(network.random, 'random', lambda: 0.0)
+    assert supervisor._delay(attempt) == base
+    monkeypatch.setattr(network.random, 'random', lambda: 0.999999)
+    assert base * 0.5 <= supervisor._delay(attempt) < base * 0.5 + 1e-5
+    monkeypatch.undo()
+    assert all(base * 0.5 <= supervisor._delay(attempt) <= base for _ in range(200))
+
+
+def test_counters_of_concurrent_calls_are_exact(plc, supervisor):
+    supervisor.failureThreshold = 10 ** 9
+    calls = 2000
+
+    def worker(online):
+        for i in range(calls):
+            try:
+                supervisor.driver.readData('D0') if online else supervisor.call(_raise)
+            except ValueError:
+                pass
+
+    threads = [threading.Thread(target=worker, args=(i % 2 == 0,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(TIMEOUT)
+    stats = supervisor.stats()
+    assert stats['calls'] == 8 * calls
+    assert stats['failures'] == 4 * calls
+
+
+def _raise():
+    raise ValueError('no answer')
@@ -0,0 +1,104 @@
+"""
+Tests of the change detection of the scan engine (TagState): deadbands, heartbeats and values that are not numbers.
+"""
+from fablab_lib.Scan.function import ScanEngine, ScanTag, Sink, TagGroup, TagState
+
+
+def test_first_update_publishes_every_value_read():
+    state = TagState(3)
+    assert state.update([1, 2.5, None], now=0) == [0, 1]
+
+
+def test_only_changed_values_are_published():
+    state = TagState(3)
+    state.update([1, 2, 3], now=0)
+    assert state.update([1, 5, 3], now=1) == [1]
+    assert state.update([1, 5, 3], now=2) == []
+
+
+def test_deadband_is_compared_with_the_last_published_value():
+    state = TagState(1, deadband=[0.5])
+    state.update([10.0], now=0)
+    assert state.update([10.3], now=1) == []
+    # drift below the deadband at each scan, but beyond it since the last publish
+    assert state.update([10.6], now=2) == [0]
+    assert state.update([10.2], now=3) == []
+
+
+def test_value_not_read_is_not_published_and_keeps_the_last_value():
+    state = TagState(1)
+    state.update([7], now=0)
+    assert state.update([None], now=1) == []
+    assert state.update([7], now=2) == []
+
+
+def test_heartbeat_publishes_unchanged_values():
+    state = TagState(2, heartbeat=[10, 0])
+    assert state.update([1, 1], now=0) == [0, 1]
+    assert state.update([1, 1], now=5) == []
+    assert state.update([1, 1], now=10) == [0]
+    assert state.update([1, 1], now=15) == []
+    assert state.update([None, 1], now=30) == []
+
+
+def test_values_that_are_not_numbers_are_compared_for_equality():
+    state = TagState(3)
+    assert state.update(['RUN', 1, [1, 2]], now=0) == [0, 1, 2]
+    assert state.update(['RUN', 1, [1, 2]], now=1) == []
+    assert state.update(['STOP', 2, [1, 2]], now=2) == [0, 1]
+
+
+def test_bools_are_compared_as_numbers():
+    state = TagState(2)
+    state.update([True, False], now=0)
+    assert state.update([True, True], now=1) == [1]
+
+
+def test_deadband_applies_to_the_scaled_values():
+    state = TagState(2, scale=[0.1, 1], deadband=[0.5, 0.5])
+    raw = [100, 100]
+    assert state.update(raw, now=0) == [0, 1]
+    assert list(state.current) == [10.0, 100.0]
+    # 4 raw counts are 0.4 scaled, within the deadband of the first variable only after scaling
+    assert state.update([104, 101], now=1) == [1]
+    assert state.update([106, 101], now=2) == [0]
+
+
+def test_value_is_scaled_and_raw_values_keep_their_type():
+    state = TagState(4, scale=[0.01, 1, 10, 0.5])
+    values = [1234, 7, None, 'RUN']
+    state.update(values, now=0)
+    assert state.value(0, values) == 12.34
+    assert state.value(1, values) == 7 and type(state.value(1, values)) is int
+    assert state.value(2, values) is None
+    assert state.value(3, values) == 'RUN'
+
+
+class _FakePLC:
+    def __init__(self, values):
+        self.values = values
+
+    def read_tags(self, tags):
+        return [(tag, self.values[tag]) for tag in tags]
+
+
+class _ListSink(Sink):
+    def __init__(self):
+        self.changes = []
+
+    def emit(self, group, ls_change):
+        self.changes.extend((tag.name, value) for tag, value, _ in ls_change)
+
+
+def test_engine_sends_the_scaled_values():
+    plc = _FakePLC({'D100': 1234, 'D101': 7})
+    engine = ScanEngine(plc)
+    sink = _ListSink()
+    engine.add_sink(sink)
+    engine.add_group(TagGroup('Data', 1, [ScanTag('SPEED', 'D100', scale=0.01, deadband=0.5), ScanTag('COUNT', 'D101')]))
+    engine.scan(1)
+    plc.values['D100'] = 1274
+    engine.scan(1)
+    plc.values['D100'] = 1290
+    engine.scan(1)
+    assert sink.changes == [('SPEED', 12.34), ('COUNT', 7), ('SPEED', 12.9)]
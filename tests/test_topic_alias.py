@@ -0,0 +1,63 @@
+"""
+Tests of the topic aliases of the MQTT v5 mode: an alias is kept only when paho queues the message that sets it.
+"""
+import fablab_lib.Broker.MQTT.paho.mqtt.client as mqtt
+from fablab_lib.Broker.MQTT.function import MQTT, ALIAS_AFTER
+
+
+class FakePaho:
+    """
+    The publish() of paho, returning the rc given to the test.
+    """
+
+    def __init__(self):
+        self.rc = mqtt.MQTT_ERR_SUCCESS
+        self.sent = []
+
+    def publish(self, topic, payload, qos, retain, properties):
+        self.sent.append((topic, getattr(properties, 'TopicAlias', None)))
+        info = mqtt.MQTTMessageInfo(len(self.sent))
+        info.rc = self.rc
+        return info
+
+
+def _client():
+    client = MQTT('localhost', 1883, protocol='5')
+    client._mqtt = FakePaho()
+    client._alias_max = 10
+    return client
+
+
+def _publish(client, qos=1):
+    return client._publish('T/a', b'1', qos, False)
+
+
+def test_alias_is_set_then_used():
+    client = _client()
+    for _ in range(ALIAS_AFTER + 1):
+        _publish(client)
+    assert client._mqtt.sent[-2:] == [('T/a', 1), ('', 1)]
+
+
+def test_alias_of_a_dropped_message_is_rolled_back():
+    client = _client()
+    for _ in range(ALIAS_AFTER - 1):
+        _publish(client)
+    client._mqtt.rc = mqtt.MQTT_ERR_QUEUE_SIZE
+    _publish(client)
+    assert client._aliases == {}
+
+    # the next message sets the alias again, with its topic
+    client._mqtt.rc = mqtt.MQTT_ERR_SUCCESS
+    _publish(client)
+    _publish(client)
+    assert client._mqtt.sent[-2:] == [('T/a', 1), ('', 1)]
+
+
+def test_qos0_message_not_sent_does_not_take_over_the_alias():
+    client = _client()
+    for _ in range(ALIAS_AFTER):
+        _publish(client, qos=1)
+    client._mqtt.rc = mqtt.MQTT_ERR_NO_CONN
+    _publish(client, qos=0)
+    assert client._aliases['T/a'] == [1, 1]